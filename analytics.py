@@ -0,0 +1,105 @@
+"""Retailer sales analytics shared by the retailer dashboard and its JSON API.
+
+All series are computed from two grouped queries: one over completed orders
+bucketed by completion month, and one over their order items grouped by
+product with product names and categories joined in.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import func, case
+from extensions import db
+from models import Order, OrderItem, Product
+from rollups import month_key, recent_months
+
+RETAIL_MARKUP = 0.2  # Assumed margin on top of purchase cost
+POPULAR_PRODUCT_LIMIT = 5
+
+
+def _order_series(retailer_id, month_starts, now):
+    """Sum completed orders per month plus the two rolling year windows."""
+    last_year_start = now - timedelta(days=365)
+    previous_year_start = last_year_start - timedelta(days=365)
+    window_start = min(month_starts[0], previous_year_start)
+
+    completed_month = func.strftime('%Y-%m', Order.completed_at)
+    rows = db.session.query(
+        completed_month,
+        func.sum(Order.total_amount),
+        func.sum(case((Order.completed_at >= last_year_start, Order.total_amount), else_=0)),
+        func.sum(case((Order.completed_at.between(previous_year_start, last_year_start), Order.total_amount), else_=0))
+    ).filter(
+        Order.retailer_id == retailer_id,
+        Order.status == 'completed',
+        Order.completed_at >= window_start
+    ).group_by(completed_month).all()
+
+    by_month = {}
+    last_year_sales = 0.0
+    previous_year_sales = 0.0
+    for month, total, last_year, previous_year in rows:
+        by_month[month] = total or 0.0
+        last_year_sales += last_year or 0.0
+        previous_year_sales += previous_year or 0.0
+
+    sales_data = [by_month.get(month_key(start), 0.0) for start in month_starts]
+    return sales_data, last_year_sales, previous_year_sales
+
+
+def _product_series(retailer_id):
+    """Aggregate completed order items per product in a single pass."""
+    rows = db.session.query(
+        Product.name,
+        Product.category,
+        func.sum(OrderItem.quantity),
+        func.sum(OrderItem.quantity * OrderItem.price_per_unit)
+    ).join(
+        Product, Product.id == OrderItem.product_id
+    ).join(
+        Order, OrderItem.order_id == Order.id
+    ).filter(
+        Order.retailer_id == retailer_id,
+        Order.status == 'completed'
+    ).group_by(OrderItem.product_id).all()
+
+    popular = sorted(rows, key=lambda row: row[2] or 0, reverse=True)[:POPULAR_PRODUCT_LIMIT]
+
+    categories = {}
+    for _name, category, _quantity, revenue in rows:
+        if category is not None:  # Exclude products without categories
+            categories[category] = categories.get(category, 0.0) + float(revenue or 0)
+    category_performance = sorted(categories.items(), key=lambda item: item[1], reverse=True)
+
+    return popular, category_performance
+
+
+def retailer_dashboard_stats(retailer_id, months=6, now=None):
+    """Return every chart series and headline figure for a retailer's dashboard."""
+    now = now or datetime.now()
+    month_starts = recent_months(months, now)
+
+    sales_data, last_year_sales, previous_year_sales = _order_series(retailer_id, month_starts, now)
+    popular, category_performance = _product_series(retailer_id)
+
+    total_purchases = sales_data[-1]
+    yoy_growth = ((last_year_sales - previous_year_sales) / previous_year_sales * 100) if previous_year_sales > 0 else 0
+
+    category_labels = [category for category, _revenue in category_performance]
+    category_revenues = [revenue for _category, revenue in category_performance]
+
+    # If no categories found, add a default one
+    if not category_labels:
+        category_labels = ['No Data']
+        category_revenues = [0.0]
+
+    return {
+        'total_purchases': total_purchases,
+        'total_revenue': total_purchases * (1 + RETAIL_MARKUP),
+        'sales_labels': [start.strftime('%b %Y') for start in month_starts],
+        'sales_data': sales_data,
+        'profit_data': [sales * RETAIL_MARKUP for sales in sales_data],
+        'product_labels': [name for name, _category, _quantity, _revenue in popular],
+        'product_quantities': [float(quantity) for _name, _category, quantity, _revenue in popular],
+        'product_revenues': [float(revenue) for _name, _category, _quantity, revenue in popular],
+        'yoy_growth': yoy_growth,
+        'category_labels': category_labels,
+        'category_revenues': category_revenues
+    }
@@ -1,21 +1,51 @@
-from flask import Flask, render_template, redirect, url_for, flash, session, abort, Response, request, jsonify, send_from_directory
+from flask import Flask, render_template, redirect, url_for, flash, session, abort, Response, request, jsonify, send_from_directory, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, current_user, login_required
 from flask_wtf import CSRFProtect
+from flask_wtf.csrf import generate_csrf
 from flask_migrate import Migrate
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from datetime import datetime, timedelta
+from werkzeug.wsgi import get_input_stream
+from werkzeug.exceptions import HTTPException
+from datetime import datetime, timedelta, date
 import zoneinfo  # Add this import for timezone support
 from functools import wraps
 import os
-import json
+import io
+import math
+import click
 import time
 from extensions import db, login_manager
-from models import User, Crop, Order, Product, RestockOrder, Inventory, Delivery, Cart, CartItem, InventoryItem, OrderItem
+from database import init_database, start_maintenance, run_maintenance
+from models import User, Crop, Order, Product, RestockOrder, Inventory, Delivery, Cart, CartItem, InventoryItem, OrderItem, PriceIndexDay
 from forms import LoginForm, RegistrationForm, CropForm, CreateOrderForm, PlaceOrderForm
-from sqlalchemy import func
+from analytics import retailer_dashboard_stats
+from checkout import checkout_cart, CheckoutError
+from assignment import assign_distributor
+from order_events import record_order_event, poll_events
+from pagination import keyset_paginate, InvalidCursor, count_cache
+from loading import loading_profile
+from images import image_pipeline, inspect_upload, remove_upload, render_derivatives
+from user_cache import load_cached_user, cache_user, user_cache
+from dashboard_cache import cached_widget, snapshot, dashboard_cache
+from uploads import register_upload, sweep_unreferenced, rebuild_manifest, start_upload_sweeper
+from query_counter import install_query_counter, query_budget
+from market import latest_prices, price_series, ingest_csv, PriceIngestError, SERIES_POINTS, MAX_SERIES_POINTS
+from routing import plan_deliveries, local_today
+from geo import geocode_locations
+from search import search, parse_search_args, rebuild_search_index, SearchForbidden
+from catalog import catalog_page, products_by_id, stock_summary, parse_fields, parse_ids
+from conditional import conditional, validator, rows_validator, release_token
+from price_index import price_position, region_of, update_price_index, rebuild_price_index, UNKNOWN_REGION, POSITION_DAYS
+from stock_ledger import move_stock, stock_levels, compact_stock_ledger
+from batch_updates import adjust_stock_batch, transition_orders_batch, BatchError, BatchConflict, VALID_TRANSITIONS
+from forecasting import plan_restocks, SUGGESTED as RESTOCK_SUGGESTED, HISTORY_DAYS, LEAD_TIME_DAYS, REVIEW_DAYS, SERVICE_LEVEL
+from stock_alerts import open_alerts, alert_levels, notify_low_stock, rebuild_stock_alerts, start_stock_alert_notifier, LEVEL_COLORS as STOCK_LEVEL_COLORS
+from inventory_bulk import import_inventory, export_inventory, upload_format, InventoryImportError, FORMATS as INVENTORY_FORMATS
+from rollups import farmer_monthly_series, record_order_completed, record_crop_harvested, record_harvest_adjusted, record_crop_removed, rebuild_farmer_rollups
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
 import random
-from PIL import Image
 
 app = Flask(__name__)
 
@@ -24,8 +54,13 @@ if not os.path.exists(app.instance_path):
     os.makedirs(app.instance_path)
 
 # Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(app.instance_path, "agricultural_scm.db")}'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'DATABASE_URL',
+    f'sqlite:///{os.path.join(app.instance_path, "agricultural_scm.db")}'
+)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['DATABASE_PROFILE'] = os.environ.get('DATABASE_PROFILE', 'production')  # See database.SQLITE_PROFILES
+app.config['SQLITE_MAINTENANCE_INTERVAL'] = int(os.environ.get('SQLITE_MAINTENANCE_INTERVAL', 3600))  # 0 disables
 
 # Security configuration
 app.config['SECRET_KEY'] = 'your-secret-key-here'  # Change this in production!
@@ -36,21 +71,41 @@ UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024  # 5MB max file size
+app.config['INVENTORY_IMPORT_MAX_BYTES'] = 64 * 1024 * 1024  # Streamed, so larger than MAX_CONTENT_LENGTH
+app.config['INVENTORY_IMPORT_BATCH_SIZE'] = int(os.environ.get('INVENTORY_IMPORT_BATCH_SIZE', 1000))  # Rows per transaction
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))  # Thumbnail worker processes; 0 renders inline
+app.config['UPLOAD_SWEEP_INTERVAL'] = int(os.environ.get('UPLOAD_SWEEP_INTERVAL', 3600))  # 0 disables
+app.config['STOCK_ALERT_INTERVAL'] = int(os.environ.get('STOCK_ALERT_INTERVAL', 300))  # Seconds between low-stock notifications, 0 disables
+app.config['UPLOAD_GRACE_PERIOD'] = 86400  # Unreferenced uploads are kept a day before deletion
+app.config['DISTANCE_CACHE_DIR'] = os.environ.get(
+    'DISTANCE_CACHE_DIR', os.path.join(app.instance_path, 'distance_cache'))  # Empty disables the on-disk cache
+app.config['RESPONSE_VERSION'] = os.environ.get('RESPONSE_VERSION') or release_token(app)  # Part of every ETag
 
 # Ensure upload directory exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 # Initialize extensions
 csrf = CSRFProtect(app)
-db.init_app(app)
+init_database(app)  # Binds db with the configured SQLite profile
+install_query_counter(app)  # Logs the statement count of every request
+image_pipeline.init_app(app)  # Renders upload thumbnails in worker processes
 migrate = Migrate(app, db)  # Initialize Flask-Migrate
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+@app.before_request
+def ensure_database_maintenance():
+    # Starts the periodic PRAGMA optimize / WAL checkpoint thread once per worker
+    if not app.config.get('TESTING'):
+        start_maintenance(app)
+        start_upload_sweeper(app)
+        start_stock_alert_notifier(app)
+
 # Define the user_loader function
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Served from the identity cache; see user_cache.py
+    return load_cached_user(int(user_id))
 
 def role_required(role):
     def decorator(f):
@@ -75,6 +130,7 @@ def login():
             user = User.query.filter_by(username=form.username.data).first()
             if user and user.check_password(form.password.data):
                 login_user(user, remember=form.remember.data)
+                cache_user(user)  # The next request's load_user is then a cache hit
                 flash(f'Welcome back, {user.username}!', 'success')
                 
                 # Redirect to role-specific dashboard
@@ -150,97 +206,52 @@ def farmer_dashboard():
         flash('Access denied. You must be a farmer to view this page.', 'danger')
         return redirect(url_for('dashboard'))
 
-    # Get active crops
-    active_crops = Crop.query.filter_by(
-        farmer_id=current_user.id
-    ).filter(
-        Crop.status.in_(['growing', 'ready_for_harvest'])
-    ).all()
+    # Widgets are served from the dashboard cache until this farmer's data changes
+    active_crops = cached_widget(current_user.id, 'farmer_crops', lambda: [
+        snapshot(crop, 'id', 'name', 'status', 'planting_date', 'expected_harvest_date')
+        for crop in Crop.query.filter_by(farmer_id=current_user.id).filter(
+            Crop.status.in_(['growing', 'ready_for_harvest'])
+        )
+    ])
 
     # Get harvest ready crops
     harvest_ready_crops = [crop for crop in active_crops if crop.status == 'ready_for_harvest']
 
-    # Get pending orders
-    pending_orders = Order.query.filter_by(
+    # Count pending orders
+    pending_order_count = cached_widget(current_user.id, 'farmer_pending_orders', lambda: Order.query.filter_by(
         farmer_id=current_user.id,
         status='pending'
-    ).all()
-
-    # Calculate total revenue for this month
-    start_of_month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    total_revenue = sum(
-        order.total_amount for order in Order.query.filter_by(
-            farmer_id=current_user.id,
-            status='completed'
+    ).count())
+
+    # Latest market prices come from the in-process price map
+    market_prices = {latest.commodity: latest.price for latest in latest_prices.all()}
+
+    # Get connected distributors with their order counts in one grouped query
+    connected_distributors = cached_widget(current_user.id, 'farmer_distributors', lambda: [
+        snapshot(distributor, 'username', 'location', total_orders=total_orders)
+        for distributor, total_orders in db.session.query(
+            User, func.count(Order.id)
+        ).join(
+            Order, User.id == Order.distributor_id
         ).filter(
-            Order.created_at >= start_of_month
-        ).all()
+            Order.farmer_id == current_user.id
+        ).group_by(User.id)
+    ])
+
+    # Crop performance and revenue for the last 6 months come from the rollup table
+    crop_performance_labels, crop_performance_data, revenue_data = cached_widget(
+        current_user.id, 'farmer_series', lambda: farmer_monthly_series(current_user.id, months=6)
     )
+    revenue_labels = list(crop_performance_labels)
 
-    # Get market prices
-    market_prices = {
-        'Maize': 150.00,
-        'Wheat': 180.00,
-        'Potatoes': 25.00,
-        'Tomatoes': 30.00,
-        'Onions': 20.00
-    }
-
-    # Get connected distributors
-    connected_distributors = User.query.join(
-        Order, User.id == Order.distributor_id
-    ).filter(
-        Order.farmer_id == current_user.id
-    ).distinct().all()
-
-    # Add total orders for each distributor
-    for distributor in connected_distributors:
-        distributor.total_orders = Order.query.filter_by(
-            farmer_id=current_user.id,
-            distributor_id=distributor.id
-        ).count()
-
-    # Prepare crop performance data (last 6 months)
-    crop_performance_data = []
-    crop_performance_labels = []
-    revenue_data = []
-    revenue_labels = []
-
-    # Get data for the last 6 months
-    for i in range(5, -1, -1):
-        date = datetime.now() - timedelta(days=i*30)
-        month_start = date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(seconds=1)
-        
-        # Get crops harvested in this month
-        monthly_crops = Crop.query.filter_by(
-            farmer_id=current_user.id,
-            status='harvested'
-        ).filter(
-            Crop.harvest_date.between(month_start, month_end)
-        ).all()
-        
-        # Calculate total yield and revenue for the month
-        monthly_yield = sum(crop.quantity for crop in monthly_crops)
-        monthly_revenue = sum(
-            order.total_amount for order in Order.query.filter_by(
-                farmer_id=current_user.id,
-                status='completed'
-            ).filter(
-                Order.created_at.between(month_start, month_end)
-            ).all()
-        )
-        
-        crop_performance_labels.append(date.strftime('%b %Y'))
-        crop_performance_data.append(monthly_yield)
-        revenue_data.append(monthly_revenue)
-        revenue_labels.append(date.strftime('%b %Y'))
+    # Revenue for this month is the latest rollup bucket
+    total_revenue = revenue_data[-1]
 
     return render_template('farmer_dashboard.html',
         user=current_user,
         active_crops=active_crops,
         harvest_ready_crops=harvest_ready_crops,
-        pending_orders=pending_orders,
+        pending_order_count=pending_order_count,
         total_revenue=total_revenue,
         market_prices=market_prices,
         connected_distributors=connected_distributors,
@@ -251,6 +262,7 @@ def farmer_dashboard():
     )
 
 @app.route('/distributor/dashboard')
+@query_budget(5)
 @login_required
 @role_required('distributor')
 def distributor_dashboard():
@@ -259,35 +271,43 @@ def distributor_dashboard():
         return redirect(url_for('dashboard'))
 
     # Get active orders
-    active_orders = Order.query.filter(
-        Order.distributor_id == current_user.id,
-        Order.status.in_(['pending', 'processing'])
-    ).all()
+    active_orders = cached_widget(current_user.id, 'distributor_orders', lambda: [
+        snapshot(order, 'id', 'status', 'status_color', 'total_amount', item_count=len(order.items))
+        for order in Order.query.options(*loading_profile('dashboard_orders')).filter(
+            Order.distributor_id == current_user.id,
+            Order.status.in_(['pending', 'processing'])
+        )
+    ])
 
     # Calculate total revenue for this month
     start_of_month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    total_revenue = db.session.query(func.sum(Order.total_amount)).filter(
+    total_revenue = cached_widget(current_user.id, 'distributor_revenue', lambda: db.session.query(
+        func.sum(Order.total_amount)
+    ).filter(
         Order.distributor_id == current_user.id,
         Order.status == 'completed',
         Order.completed_at >= start_of_month
-    ).scalar() or 0.0
+    ).scalar() or 0.0)
 
-    # Get inventory items
-    inventory_items = InventoryItem.query.filter_by(
-        distributor_id=current_user.id
-    ).all()
+    # Items at or below their minimum, read from their open stock alerts
+    stock_alerts = cached_widget(current_user.id, 'distributor_inventory', lambda: [
+        snapshot(alert, 'name', 'category', 'quantity', 'unit', 'level') for alert in open_alerts(current_user.id)
+    ])
 
     # Get pending deliveries
-    pending_deliveries = Delivery.query.filter(
-        Delivery.distributor_id == current_user.id,
-        Delivery.status.in_(['scheduled', 'in_transit'])
-    ).all()
+    pending_deliveries = cached_widget(current_user.id, 'distributor_deliveries', lambda: [
+        snapshot(delivery, 'id', 'order_id', 'delivery_address', 'scheduled_date', 'status', 'status_color')
+        for delivery in Delivery.query.filter(
+            Delivery.distributor_id == current_user.id,
+            Delivery.status.in_(['scheduled', 'in_transit'])
+        )
+    ])
 
     return render_template('distributor_dashboard.html',
         user=current_user,
         active_orders=active_orders,
         total_revenue=total_revenue,
-        inventory_items=inventory_items,
+        stock_alerts=stock_alerts,
         pending_deliveries=pending_deliveries
     )
 
@@ -299,155 +319,74 @@ def retailer_dashboard():
         flash('Access denied. You must be a retailer to view this page.', 'danger')
         return redirect(url_for('dashboard'))
 
-    # Get active orders
-    active_orders = Order.query.filter(
+    # Count active orders
+    active_order_count = cached_widget(current_user.id, 'retailer_active_orders', lambda: Order.query.filter(
         Order.retailer_id == current_user.id,
         Order.status.in_(['pending', 'processing'])
-    ).all()
+    ).count())
 
-    # Calculate total purchases and revenue for this month
-    start_of_month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    total_purchases = db.session.query(func.sum(Order.total_amount)).filter(
-        Order.retailer_id == current_user.id,
-        Order.status == 'completed',
-        Order.completed_at >= start_of_month
-    ).scalar() or 0.0
-
-    # Calculate total revenue (assuming a 20% markup)
-    total_revenue = total_purchases * 1.2
-
-    # Get available products
-    products = Product.query.filter(
-        Product.current_stock > 0
-    ).all()
-
-    # Get low stock products
-    low_stock_products = [p for p in products if p.current_stock <= p.reorder_level]
+    # Product counts are the same for every retailer; the catalog itself is paged in from /api/products
+    product_counts = cached_widget(None, 'products', stock_summary)
 
     # Get recent orders
-    recent_orders = Order.query.filter_by(
-        retailer_id=current_user.id
-    ).order_by(
-        Order.created_at.desc()
-    ).limit(5).all()
-
-    # Get sales data for the last 6 months
-    sales_data = []
-    sales_labels = []
-    profit_data = []
-    for i in range(5, -1, -1):
-        date = datetime.now() - timedelta(days=i*30)
-        month_start = date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(seconds=1)
-        
-        # Calculate total sales and profit for the month
-        monthly_sales = db.session.query(func.sum(Order.total_amount)).filter(
-            Order.retailer_id == current_user.id,
-            Order.status == 'completed',
-            Order.completed_at.between(month_start, month_end)
-        ).scalar() or 0.0
-        
-        monthly_profit = monthly_sales * 0.2  # Assuming 20% profit margin
-        
-        sales_data.append(monthly_sales)
-        profit_data.append(monthly_profit)
-        sales_labels.append(date.strftime('%b %Y'))
-
-    # Get popular products data
-    popular_products = db.session.query(
-        OrderItem.product_id,
-        func.sum(OrderItem.quantity).label('total_quantity'),
-        func.sum(OrderItem.quantity * OrderItem.price_per_unit).label('total_revenue')
-    ).join(Order).filter(
-        Order.retailer_id == current_user.id,
-        Order.status == 'completed'
-    ).group_by(
-        OrderItem.product_id
-    ).order_by(
-        func.sum(OrderItem.quantity).desc()
-    ).limit(5).all()
-
-    # Get product names and prepare chart data
-    product_labels = []
-    product_quantities = []
-    product_revenues = []
-    for prod_id, quantity, revenue in popular_products:
-        product = Product.query.get(prod_id)
-        if product:
-            product_labels.append(product.name)
-            product_quantities.append(float(quantity))
-            product_revenues.append(float(revenue))
-
-    # Calculate year-over-year growth
-    last_year_start = datetime.now() - timedelta(days=365)
-    last_year_sales = db.session.query(func.sum(Order.total_amount)).filter(
-        Order.retailer_id == current_user.id,
-        Order.status == 'completed',
-        Order.completed_at >= last_year_start
-    ).scalar() or 0.0
+    recent_orders = cached_widget(current_user.id, 'retailer_recent_orders', lambda: [
+        snapshot(order, 'id', 'status', 'created_at')
+        for order in Order.query.filter_by(
+            retailer_id=current_user.id
+        ).order_by(
+            Order.created_at.desc()
+        ).limit(5)
+    ])
 
-    previous_year_sales = db.session.query(func.sum(Order.total_amount)).filter(
-        Order.retailer_id == current_user.id,
-        Order.status == 'completed',
-        Order.completed_at.between(
-            last_year_start - timedelta(days=365),
-            last_year_start
-        )
-    ).scalar() or 0.0
-
-    yoy_growth = ((last_year_sales - previous_year_sales) / previous_year_sales * 100) if previous_year_sales > 0 else 0
-
-    # Get category performance
-    category_performance = db.session.query(
-        Product.category,
-        func.sum(OrderItem.quantity * OrderItem.price_per_unit).label('total_revenue')
-    ).join(
-        OrderItem, Product.id == OrderItem.product_id
-    ).join(
-        Order, OrderItem.order_id == Order.id
-    ).filter(
-        Order.retailer_id == current_user.id,
-        Order.status == 'completed',
-        Product.category.isnot(None)  # Exclude products without categories
-    ).group_by(
-        Product.category
-    ).order_by(
-        func.sum(OrderItem.quantity * OrderItem.price_per_unit).desc()
-    ).all()
-
-    category_labels = []
-    category_revenues = []
-    for category, revenue in category_performance:
-        category_labels.append(category)
-        category_revenues.append(float(revenue))
-
-    # If no categories found, add a default one
-    if not category_labels:
-        category_labels = ['No Data']
-        category_revenues = [0.0]
+    # Sales, product and category series come from the shared analytics service
+    analytics = cached_widget(current_user.id, 'retailer_analytics', lambda: retailer_dashboard_stats(current_user.id))
 
     return render_template('retailer_dashboard.html',
         user=current_user,
-        active_orders=active_orders,
-        total_purchases=total_purchases,
-        total_revenue=total_revenue,
-        products=products,
-        low_stock_products=low_stock_products,
+        active_order_count=active_order_count,
+        product_counts=product_counts,
         recent_orders=recent_orders,
-        sales_labels=sales_labels,
-        sales_data=sales_data,
-        profit_data=profit_data,
-        product_labels=product_labels,
-        product_quantities=product_quantities,
-        product_revenues=product_revenues,
-        yoy_growth=yoy_growth,
-        category_labels=category_labels,
-        category_revenues=category_revenues
+        **analytics
     )
 
+@app.route('/api/retailer/analytics')
+@login_required
+@role_required('retailer')
+def retailer_analytics():
+    try:
+        return jsonify(cached_widget(current_user.id, 'retailer_analytics', lambda: retailer_dashboard_stats(current_user.id)))
+    except Exception as e:
+        app.logger.error(f'Error computing retailer analytics: {str(e)}')
+        return jsonify({'error': 'Failed to compute analytics'}), 500
+
+@app.route('/api/csrf-token')
+@login_required
+def csrf_token_api():
+    # Cached pages such as the distributor dashboard stay byte-stable by fetching a fresh token before they write
+    response = jsonify({'csrf_token': generate_csrf()})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/cache/stats')
+@login_required
+def cache_stats():
+    # Hit and miss counters of this worker process's caches; process internals are only shown in debug mode
+    if not app.debug:
+        abort(404)
+    return jsonify({
+        'dashboards': dashboard_cache.stats(),
+        'users': user_cache.stats(),
+        'counts': count_cache.stats()
+    })
+
+def crop_inventory_validator():
+    return rows_validator('crop_inventory', db.session.execute(
+        select(Crop.id, Crop.updated_at).where(Crop.farmer_id == current_user.id).order_by(Crop.id)).all())
+
 @app.route('/crop-inventory')
 @login_required
 @role_required('farmer')
+@conditional(crop_inventory_validator)
 def crop_inventory():
     crops = Crop.query.filter_by(farmer_id=current_user.id).all()
     return render_template('crop_inventory.html', crops=crops)
@@ -456,7 +395,11 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def save_crop_image(form_image):
-    """Save an uploaded crop image with proper validation and error handling."""
+    """Save an uploaded crop image and return its filename.
+
+    The caller queues the derivatives with image_pipeline.submit once the crop
+    row has been committed.
+    """
     if not form_image:
         return None
     
@@ -486,28 +429,16 @@ def save_crop_image(form_image):
         # Ensure upload directory exists
         os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
         
-        # Save the file
+        # Save the upload untouched; resizing happens in the image pipeline
         form_image.save(filepath)
         
         # Verify the saved file
         if not os.path.exists(filepath):
             raise IOError("Failed to save the uploaded file")
             
-        # Verify file integrity and optimize image
-        try:
-            with Image.open(filepath) as img:
-                img.verify()
-                # Reopen image after verify (verify closes the file)
-                img = Image.open(filepath)
-                # Convert to RGB if needed
-                if img.mode in ('RGBA', 'P'):
-                    img = img.convert('RGB')
-                # Optimize and save
-                img.save(filepath, 'JPEG', quality=85, optimize=True)
-        except Exception as e:
-            if os.path.exists(filepath):
-                os.remove(filepath)
-            raise ValueError(f"Invalid image file: {str(e)}")
+        # Only the header is read here; the full decode runs in a worker
+        inspect_upload(filepath)
+        register_upload(filepath, filename)
             
         return filename
         
@@ -558,6 +489,7 @@ def add_crop():
                 price_per_unit=form.price_per_unit.data,
                 description=form.description.data,
                 image=image_filename,
+                image_status='pending' if image_filename else None,
                 planting_season=form.planting_season.data,
                 harvest_period=form.harvest_period.data,
                 yield_per_acre=form.yield_per_acre.data,
@@ -566,6 +498,8 @@ def add_crop():
             
             db.session.add(crop)
             db.session.commit()
+            if image_filename:
+                image_pipeline.submit(Crop, crop.id, image_filename)
             flash('Crop added successfully!', 'success')
             return redirect(url_for('crop_inventory'))
             
@@ -600,28 +534,24 @@ def edit_crop(crop_id):
             # Handle image removal
             if request.form.get('remove_image') == 'true' and crop.image:
                 try:
-                    old_image_path = os.path.join(app.config['UPLOAD_FOLDER'], crop.image)
-                    if os.path.exists(old_image_path):
-                        os.remove(old_image_path)
+                    # The upload store releases the file once this commits
                     crop.image = None
+                    crop.image_status = None
                 except Exception as e:
                     app.logger.error(f"Error removing image: {str(e)}")
                     flash('Error removing the image. Please try again.', 'danger')
                     return render_template('edit_crop.html', form=form, crop=crop)
             
             # Handle new image upload
+            new_image = None
             if form.image.data:
                 try:
-                    # Delete old image if it exists
-                    if crop.image:
-                        old_image_path = os.path.join(app.config['UPLOAD_FOLDER'], crop.image)
-                        if os.path.exists(old_image_path):
-                            os.remove(old_image_path)
-                    
-                    # Save new image
+                    # Save new image; the old one is released when the crop is committed
                     image_filename = save_crop_image(form.image.data)
                     if image_filename:
                         crop.image = image_filename
+                        crop.image_status = 'pending'
+                        new_image = image_filename
                 except ValueError as e:
                     flash(str(e), 'danger')
                     return render_template('edit_crop.html', form=form, crop=crop)
@@ -631,9 +561,11 @@ def edit_crop(crop_id):
                     return render_template('edit_crop.html', form=form, crop=crop)
             
             # Update other fields
+            old_quantity = crop.quantity
             crop.name = form.name.data
             crop.variety = form.variety.data
             crop.quantity = form.quantity.data
+            record_harvest_adjusted(crop, old_quantity)
             crop.unit = form.unit.data
             crop.planting_date = form.planting_date.data
             crop.expected_harvest_date = form.expected_harvest_date.data
@@ -644,6 +576,8 @@ def edit_crop(crop_id):
             crop.yield_per_acre = form.yield_per_acre.data
             
             db.session.commit()
+            if new_image:
+                image_pipeline.submit(Crop, crop.id, new_image)
             flash('Crop updated successfully!', 'success')
             return redirect(url_for('crop_detail', crop_id=crop.id))
             
@@ -663,53 +597,141 @@ def image_url(self):
 
 Crop.image_url = image_url
 
+# Column linking each role to the orders it takes part in
+ORDER_PARTICIPANT_COLUMNS = {
+    'farmer': Order.farmer_id,
+    'distributor': Order.distributor_id,
+    'retailer': Order.retailer_id
+}
+
+def filtered_orders_query(user, args):
+    """Return the user's orders narrowed by the date/price filters, plus a count cache key."""
+    start_date = args.get('start_date')
+    end_date = args.get('end_date')
+    min_price = args.get('min_price', type=float)
+    max_price = args.get('max_price', type=float)
+
+    query = Order.query.filter(ORDER_PARTICIPANT_COLUMNS[user.role] == user.id)
+
+    # Apply date filters
+    if start_date:
+        query = query.filter(Order.created_at >= datetime.strptime(start_date, '%Y-%m-%d'))
+    if end_date:
+        query = query.filter(Order.created_at <= datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1))
+
+    # Apply price filters
+    if min_price is not None:
+        query = query.filter(Order.total_amount >= min_price)
+    if max_price is not None:
+        query = query.filter(Order.total_amount <= max_price)
+
+    count_key = ('orders', user.role, user.id, start_date, end_date, min_price, max_price)
+    return query, count_key
+
+def paginate_orders(user, args, profile=()):
+    query, count_key = filtered_orders_query(user, args)
+    return keyset_paginate(
+        query, Order,
+        after=args.get('after'),
+        before=args.get('before'),
+        per_page=args.get('per_page', type=int),
+        count_key=count_key,
+        options=profile
+    )
+
+def page_links(page):
+    """URLs of the neighbouring pages that keep the current filters."""
+    args = {key: value for key, value in request.args.items() if key not in ('after', 'before')}
+    next_url = url_for(request.endpoint, after=page.next_cursor, **args) if page.has_next else None
+    prev_url = url_for(request.endpoint, before=page.prev_cursor, **args) if page.has_prev else None
+    return {'page': page, 'next_url': next_url, 'prev_url': prev_url}
+
 @app.route('/orders')
+@query_budget(3)
 @login_required
 def orders():
     try:
-        # Base query
-        query = Order.query
-
-        # Filter based on user role
-        if current_user.role == 'farmer':
-            # Farmers see orders where they are the supplier
-            orders = query.filter_by(farmer_id=current_user.id)\
-                        .order_by(Order.created_at.desc()).all()
-            
-        elif current_user.role == 'distributor':
-            # Distributors see orders they're involved in
-            orders = query.filter_by(distributor_id=current_user.id)\
-                        .order_by(Order.created_at.desc()).all()
-            
-        elif current_user.role == 'retailer':
-            # Retailers see orders they've placed
-            orders = query.filter_by(retailer_id=current_user.id)\
-                        .order_by(Order.created_at.desc()).all()
-        else:
+        if current_user.role not in ORDER_PARTICIPANT_COLUMNS:
             flash('Invalid user role.', 'danger')
             return redirect(url_for('home'))
 
-        return render_template('orders.html', orders=orders)
+        try:
+            page = paginate_orders(current_user, request.args, loading_profile('order_list'))
+        except InvalidCursor:
+            # Stale or hand-edited link; start again from the newest orders
+            return redirect(url_for('orders'))
+
+        return render_template('orders.html', orders=page.items, **page_links(page))
         
     except Exception as e:
         app.logger.error(f"Error loading orders: {str(e)}")
         flash('An error occurred while loading orders.', 'danger')
         return redirect(url_for('dashboard'))
 
+@app.route('/api/orders')
+@login_required
+def api_orders():
+    """JSON variant of the order listings; accepts the same filters and cursors."""
+    if current_user.role not in ORDER_PARTICIPANT_COLUMNS:
+        return jsonify({'success': False, 'error': 'Invalid user role'}), 403
+    try:
+        page = paginate_orders(current_user, request.args)
+    except InvalidCursor:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Dates must use YYYY-MM-DD'}), 400
+    except Exception as e:
+        app.logger.error(f"Error listing orders: {str(e)}")
+        return jsonify({'success': False, 'error': 'Failed to load orders'}), 500
+
+    return jsonify({
+        'success': True,
+        'orders': [{
+            'id': order.id,
+            'parent_order_id': order.parent_order_id,
+            'farmer_id': order.farmer_id,
+            'distributor_id': order.distributor_id,
+            'retailer_id': order.retailer_id,
+            'status': order.status,
+            'total_amount': order.total_amount,
+            'created_at': order.created_at.isoformat() if order.created_at else None,
+            'completed_at': order.completed_at.isoformat() if order.completed_at else None
+        } for order in page.items],
+        'pagination': page.to_dict()
+    })
+
 @app.route('/market-prices')  # Note the dash (-) not underscore (_)
 @login_required
 def market_prices():
-    prices = {
-        'Maize': 150,
-        'Wheat': 180,
-        'Potatoes': 25
-    }
-    return render_template('market_prices.html', prices=prices, datetime=datetime)
+    return render_template('market_prices.html', prices=latest_prices.all())
+
+@app.route('/api/market-prices/<commodity>/series')
+@login_required
+def market_price_series(commodity):
+    try:
+        days = int(request.args.get('days', 365))
+        window = float(request.args.get('window', 7))
+        points = int(request.args.get('points', SERIES_POINTS))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'days, window and points must be numbers'}), 400
+    if days < 1 or window <= 0:
+        return jsonify({'success': False, 'error': 'days and window must be positive'}), 400
+
+    series = price_series(
+        commodity,
+        start=datetime.utcnow() - timedelta(days=days),
+        window=window * 86400,
+        max_points=max(2, min(points, MAX_SERIES_POINTS))
+    )
+    if series is None:
+        return jsonify({'success': False, 'error': f'No prices recorded for {commodity}'}), 404
+    return jsonify(series)
 
 @app.route('/order/<int:order_id>')
+@query_budget(5)
 @login_required
 def order_detail(order_id):
-    order = Order.query.get_or_404(order_id)
+    order = db.get_or_404(Order, order_id, options=loading_profile('order_detail'))
     if order.farmer_id != current_user.id and order.distributor_id != current_user.id:
         abort(403)
     return render_template('order_detail.html', order=order)
@@ -723,6 +745,7 @@ def process_order(order_id):
     if order.distributor_id != current_user.id:
         abort(403)
     order.status = 'processing'
+    record_order_event(order)
     db.session.commit()
     flash('Order is being processed', 'success')
     return redirect(url_for('distributor_dashboard'))
@@ -736,17 +759,53 @@ def track_order(order_id):
         abort(403)
     return render_template('track_order.html', order=order)
 
+def route_plan_date(args):
+    """Day to plan from ?date=YYYY-MM-DD; defaults to tomorrow, local time, when checkout schedules deliveries."""
+    value = args.get('date')
+    if not value:
+        return local_today() + timedelta(days=1)
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+@app.route('/distributor/supply_routes')
+@login_required
+@role_required('distributor')
+def supply_routes():
+    try:
+        day = route_plan_date(request.args)
+    except ValueError:
+        flash('Invalid date. Use YYYY-MM-DD.', 'danger')
+        return redirect(url_for('supply_routes'))
+    plan = plan_deliveries(current_user, day)
+    return render_template('supply_routes.html', plan=plan)
+
+@app.route('/api/distributor/supply_routes')
+@login_required
+@role_required('distributor')
+def supply_routes_api():
+    try:
+        day = route_plan_date(request.args)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid date. Use YYYY-MM-DD.'}), 400
+    return jsonify(plan_deliveries(current_user, day))
+
 @app.route('/distributor/reorder/<int:product_id>', methods=['POST'])
 @login_required
 @role_required('distributor')
 def reorder_product(product_id):
     product = Product.query.get_or_404(product_id)
-    new_order = RestockOrder(
-        product_id=product.id,
-        quantity=product.reorder_level,
-        distributor_id=current_user.id
-    )
-    db.session.add(new_order)
+    # A forecast suggestion already holds the quantity that covers expected demand
+    suggestion = RestockOrder.query.filter_by(
+        distributor_id=current_user.id, status=RESTOCK_SUGGESTED, product_id=product.id
+    ).first()
+    if suggestion:
+        suggestion.status = 'requested'
+        suggestion.created_at = datetime.utcnow()
+    else:
+        db.session.add(RestockOrder(
+            product_id=product.id,
+            quantity=product.reorder_level,
+            distributor_id=current_user.id
+        ))
     db.session.commit()
     flash(f'Restock order placed for {product.name}', 'success')
     return redirect(url_for('distributor_dashboard'))
@@ -793,8 +852,14 @@ def create_order():
             )
             db.session.add(order_item)
 
-            # Update product stock
-            product.current_stock -= form.quantity.data
+            # Take the stock unless another order got to it first
+            if move_stock('product', product.id, -form.quantity.data, 'sale', order_id=new_order.id) is None:
+                db.session.rollback()
+                available = db.session.query(Product.current_stock).filter(Product.id == form.product_id.data).scalar()
+                flash(f'Only {available} {product.unit} available.', 'danger')
+                return render_template('create_order.html', form=form)
+
+            record_order_event(new_order, 'order_created')
             
             db.session.commit()
             flash('Order created successfully!', 'success')
@@ -807,16 +872,23 @@ def create_order():
             
     return render_template('create_order.html', form=form)
 
-@app.route('/order_updates')
+@app.route('/api/order_updates')
 @login_required
-def order_updates():
-    def event_stream():
-        while True:
-            # Check for new updates
-            # This should come from your database/queue in real implementation
-            yield f"data: {json.dumps({'type': 'order_update', 'order_id': 1001, 'status': 'processing'})}\n\n"
-            time.sleep(5)
-    return Response(event_stream(), mimetype="text/event-stream")
+def api_order_updates():
+    """Short-poll feed of the user's order events after Last-Event-ID; returns the cursor for the next poll."""
+    # A first poll has no cursor yet; allow a query param as well as the header
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    events, last_event_id = poll_events(current_user.id, current_user.role, last_event_id)
+    return jsonify({
+        'success': True,
+        'events': [dict(order_event.to_dict(), id=order_event.id) for order_event in events],
+        'last_event_id': last_event_id
+    })
 
 @app.route('/logout')
 @login_required
@@ -835,9 +907,53 @@ def inject_now():
         return {'now': datetime.now(zoneinfo.ZoneInfo('UTC'))}
 
 # API Endpoints for Dashboard Functionality
+@app.route('/api/products')
+@login_required
+@role_required('retailer')
+def api_products():
+    """Pages of the in-stock catalog, or the products named by ?ids=1,2,3.
+
+    Catalog pages take ``sort``, ``category``, ``per_page`` and the ``after``
+    cursor of the previous page; both forms take ``fields`` to trim each item.
+    """
+    try:
+        fields = parse_fields(request.args.get('fields'))
+        if 'ids' in request.args:
+            products, missing = products_by_id(parse_ids(request.args['ids']), fields)
+            body = {'success': True, 'products': products, 'missing': missing}
+        else:
+            page = catalog_page(
+                sort=request.args.get('sort', 'name'),
+                after=request.args.get('after'),
+                per_page=request.args.get('per_page', type=int),
+                category=request.args.get('category') or None,
+                fields=fields
+            )
+            body = {'success': True, 'products': page.items, 'pagination': page.to_dict()}
+    except InvalidCursor:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f'Error listing products: {str(e)}')
+        return jsonify({'success': False, 'error': 'Failed to load products'}), 500
+
+    # Revisited pages the browser already holds come back as an empty 304
+    response = jsonify(body)
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+def product_validator(product_id):
+    updated_at = db.session.execute(select(Product.updated_at).where(Product.id == product_id)).first()
+    if updated_at is None:
+        return None
+    return validator('product', product_id, updated_at[0], last_modified=updated_at[0])
+
 @app.route('/api/products/<int:product_id>')
 @login_required
 @role_required('retailer')
+@conditional(product_validator)
 def get_product(product_id):
     try:
         product = Product.query.get_or_404(product_id)
@@ -858,18 +974,15 @@ def get_product(product_id):
 @login_required
 @role_required('retailer')
 def checkout():
-    data = request.get_json()
+    data = request.get_json() or {}
     try:
-        # Start a transaction
         cart_items = data.get('items', [])
         if not cart_items:
             return jsonify({'success': False, 'error': 'Cart is empty'})
 
-        # Get the nearest available distributor
-        distributor = User.query.filter_by(
-            role='distributor',
-            # Add any additional filters for distributor selection
-        ).first()
+        # Nearest distributor with spare capacity, see assignment.py
+        assignment = assign_distributor(current_user)
+        distributor = db.session.get(User, assignment.distributor_id) if assignment else None
 
         if not distributor:
             return jsonify({
@@ -877,108 +990,23 @@ def checkout():
                 'error': 'No distributors available. Please try again later.'
             })
 
-        # Create a new order
-        order = Order(
-            retailer_id=current_user.id,
-            distributor_id=distributor.id,  # Assign the distributor
-            status='pending',
-            total_amount=0,  # Will be calculated from items
-            created_at=datetime.utcnow()
+        order, failures = checkout_cart(
+            current_user,
+            distributor,
+            cart_items,
+            allow_partial=bool(data.get('allow_partial'))
         )
-        db.session.add(order)
-        db.session.flush()  # Get the order ID
-
-        total_amount = 0
-        farmer_orders = {}  # Group items by farmer
 
-        for item in cart_items:
-            # Get product and validate availability
-            product = Product.query.get(item['id'])
-            if not product:
-                db.session.rollback()
-                return jsonify({'success': False, 'error': f'Product {item["id"]} not found'})
-
-            quantity = int(item.get('quantity', 1))
-            if quantity > product.current_stock:
-                db.session.rollback()
-                return jsonify({
-                    'success': False, 
-                    'error': f'Insufficient stock for {product.name}. Available: {product.current_stock}'
-                })
-
-            # Create order item
-            order_item = OrderItem(
-                order_id=order.id,
-                product_id=product.id,
-                quantity=quantity,
-                price_per_unit=product.price_per_unit
-            )
-            db.session.add(order_item)
-
-            # Update product stock
-            product.current_stock -= quantity
-            subtotal = quantity * product.price_per_unit
-            total_amount += subtotal
-
-            # Group items by farmer for creating farmer-specific orders
-            if product.farmer_id not in farmer_orders:
-                farmer_orders[product.farmer_id] = {
-                    'items': [],
-                    'total': 0
-                }
-            farmer_orders[product.farmer_id]['items'].append({
-                'product_id': product.id,
-                'quantity': quantity,
-                'price_per_unit': product.price_per_unit
-            })
-            farmer_orders[product.farmer_id]['total'] += subtotal
-
-        # Update order total
-        order.total_amount = total_amount
-
-        # Create farmer-specific orders
-        for farmer_id, order_data in farmer_orders.items():
-            farmer_order = Order(
-                farmer_id=farmer_id,
-                retailer_id=current_user.id,
-                distributor_id=distributor.id,
-                status='pending',
-                total_amount=order_data['total'],
-                created_at=datetime.utcnow(),
-                parent_order_id=order.id  # Link to parent order
-            )
-            db.session.add(farmer_order)
-            
-            # Create order items for farmer order
-            for item in order_data['items']:
-                farmer_order_item = OrderItem(
-                    order_id=farmer_order.id,
-                    product_id=item['product_id'],
-                    quantity=item['quantity'],
-                    price_per_unit=item['price_per_unit']
-                )
-                db.session.add(farmer_order_item)
-
-        # Create initial delivery record
-        delivery = Delivery(
-            order_id=order.id,
-            distributor_id=distributor.id,
-            status='scheduled',
-            scheduled_date=datetime.utcnow() + timedelta(days=1),  # Schedule for tomorrow
-            delivery_address=current_user.location,  # Use retailer's address
-            tracking_number=f'TRK{order.id}{int(time.time())}'[-12:]  # Generate tracking number
-        )
-        db.session.add(delivery)
-        
-        # Commit the transaction
-        db.session.commit()
-        
         return jsonify({
             'success': True,
             'order_id': order.id,
-            'message': 'Order placed successfully'
+            'message': 'Order placed successfully',
+            'failures': failures,
+            'assignment': assignment.to_dict()
         })
 
+    except CheckoutError as e:
+        return jsonify({'success': False, 'error': str(e), 'failures': e.failures})
     except Exception as e:
         db.session.rollback()
         app.logger.error(f'Checkout error: {str(e)}')
@@ -998,9 +1026,14 @@ def harvest_crop(crop_id):
         if crop.farmer_id != current_user.id:
             return jsonify({'success': False, 'error': 'Unauthorized'}), 403
             
+        # Move any earlier harvest out of the rollup before re-dating it
+        already_harvested = crop.status == 'harvested'
+        record_crop_removed(crop)
+
         # Update crop status
         crop.status = 'harvested'
         crop.harvest_date = datetime.now()
+        record_crop_harvested(crop, already_harvested)
         
         db.session.commit()
         
@@ -1009,8 +1042,31 @@ def harvest_crop(crop_id):
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)})
 
+def crop_validator(crop_id):
+    # The crop row, its farmer's location (which picks the price region) and how many
+    # trades its realized prices cover, in one lookup
+    since = date.today() - timedelta(days=POSITION_DAYS)
+    indexed_items = (select(func.max(PriceIndexDay.last_item_id))
+                     .where(PriceIndexDay.commodity == Crop.name, PriceIndexDay.day >= since)
+                     .scalar_subquery())
+    row = db.session.execute(select(Crop.name, Crop.farmer_id, Crop.status, Crop.updated_at, indexed_items,
+                                    User.location)
+                             .outerjoin(User, User.id == Crop.farmer_id)
+                             .where(Crop.id == crop_id)).first()
+    if row is None:
+        return None
+    # Requests the view turns away are left to it
+    if current_user.role == 'farmer' and row.farmer_id != current_user.id:
+        return None
+    if current_user.role in ['distributor', 'retailer'] and row.status != 'ready_for_harvest':
+        return None
+    market = latest_prices.get(row.name)
+    return validator('crop', crop_id, row.updated_at, since, row[4], row.location,
+                     (market.price, market.observed_at) if market else None, last_modified=row.updated_at)
+
 @app.route('/crop/<int:crop_id>')
 @login_required
+@conditional(crop_validator, policy='private-short')
 def crop_detail(crop_id):
     # Get the crop
     crop = Crop.query.get_or_404(crop_id)
@@ -1025,60 +1081,40 @@ def crop_detail(crop_id):
         flash('This crop is not available for viewing.', 'danger')
         return redirect(url_for('available_crops'))
     
-    # Get current market price (mock data for now)
-    market_prices = {
-        'Maize': 150.00,
-        'Wheat': 180.00,
-        'Potatoes': 25.00,
-        'Tomatoes': 30.00,
-        'Onions': 20.00
-    }
-    market_price = market_prices.get(crop.name, 0.00)
+    # Get current market price
+    market_price = latest_prices.price(crop.name)
+
+    # Compare the asking price with what buyers actually paid recently
+    region = region_of(crop.farmer.location) if crop.farmer else UNKNOWN_REGION
+    realized_prices = price_position(crop.name, crop.price_per_unit, region=region)
+    if realized_prices is None:
+        realized_prices = price_position(crop.name, crop.price_per_unit)
     
     return render_template('crop_detail.html',
                          crop=crop,
-                         market_price=market_price)
+                         market_price=market_price,
+                         realized_prices=realized_prices)
 
 @app.route('/order-history')
+@query_budget(4)
 @login_required
 def order_history():
     try:
-        # Get filter parameters
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        min_price = request.args.get('min_price', type=float)
-        max_price = request.args.get('max_price', type=float)
-
-        # Base query
-        query = Order.query
-
-        # Apply role-specific filters
-        if current_user.role == 'retailer':
-            query = query.filter_by(retailer_id=current_user.id)
-        elif current_user.role == 'distributor':
-            query = query.filter_by(distributor_id=current_user.id)
-        else:
+        # Only buyers have an order history
+        if current_user.role not in ('retailer', 'distributor'):
             flash('Access denied. Invalid user role.', 'danger')
             return redirect(url_for('dashboard'))
 
-        # Apply date filters
-        if start_date:
-            query = query.filter(Order.created_at >= datetime.strptime(start_date, '%Y-%m-%d'))
-        if end_date:
-            query = query.filter(Order.created_at <= datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1))
-
-        # Apply price filters
-        if min_price is not None:
-            query = query.filter(Order.total_amount >= min_price)
-        if max_price is not None:
-            query = query.filter(Order.total_amount <= max_price)
-
-        # Get orders sorted by date
-        orders = query.order_by(Order.created_at.desc()).all()
+        try:
+            page = paginate_orders(current_user, request.args, loading_profile('order_history'))
+        except InvalidCursor:
+            args = {key: value for key, value in request.args.items() if key not in ('after', 'before')}
+            return redirect(url_for('order_history', **args))
 
         return render_template('order_history.html',
             user=current_user,
-            orders=orders
+            orders=page.items,
+            **page_links(page)
         )
 
     except Exception as e:
@@ -1100,7 +1136,9 @@ def inventory_management():
 
         return render_template('inventory_management.html',
             user=current_user,
-            inventory_items=inventory_items
+            inventory_items=inventory_items,
+            alert_levels=alert_levels(current_user.id),
+            level_colors=STOCK_LEVEL_COLORS
         )
 
     except Exception as e:
@@ -1147,18 +1185,18 @@ def add_inventory_item():
                 
                 try:
                     # Ensure upload directory exists
-                    upload_folder = os.path.join(app.static_folder, 'uploads')
+                    upload_folder = app.config['UPLOAD_FOLDER']
                     os.makedirs(upload_folder, exist_ok=True)
                     
                     # Save the image
                     image_path = os.path.join(upload_folder, image_filename)
                     image.save(image_path)
                     
-                    # Validate the saved image
+                    # Check the header; the image pipeline verifies and resizes it
                     try:
-                        with Image.open(image_path) as img:
-                            img.verify()
-                    except Exception:
+                        inspect_upload(image_path)
+                        register_upload(image_path, image_filename)
+                    except ValueError:
                         os.remove(image_path)
                         return jsonify({
                             'success': False,
@@ -1200,11 +1238,14 @@ def add_inventory_item():
             min_quantity=min_quantity,
             price_per_unit=price_per_unit,
             description=request.form.get('description', '').strip(),
-            image=image_filename
+            image=image_filename,
+            image_status='pending' if image_filename else None
         )
         
         db.session.add(new_item)
         db.session.commit()
+        if image_filename:
+            image_pipeline.submit(InventoryItem, new_item.id, image_filename)
         
         return jsonify({
             'success': True,
@@ -1216,9 +1257,7 @@ def add_inventory_item():
         # Clean up image if it was saved
         if image_filename:
             try:
-                image_path = os.path.join(app.static_folder, 'uploads', image_filename)
-                if os.path.exists(image_path):
-                    os.remove(image_path)
+                remove_upload(app.config['UPLOAD_FOLDER'], image_filename)
             except:
                 pass
         app.logger.error(f"Error adding inventory item: {str(e)}")
@@ -1227,9 +1266,82 @@ def add_inventory_item():
             'message': 'An error occurred while adding the product. Please try again.'
         }), 500
 
+def inventory_item_validator(item_id):
+    updated_at = db.session.execute(select(InventoryItem.updated_at).where(
+        InventoryItem.id == item_id, InventoryItem.distributor_id == current_user.id)).first()
+    if updated_at is None:
+        return None
+    return validator('inventory_item', item_id, updated_at[0], last_modified=updated_at[0])
+
+def parse_as_of(value):
+    """End of the day for a date, or the exact time for an ISO datetime; raises ValueError."""
+    if len(value) == 10:
+        return datetime.combine(date.fromisoformat(value), datetime.max.time())
+    return datetime.fromisoformat(value)
+
+@app.route('/api/inventory/levels', methods=['GET'])
+@login_required
+@role_required('distributor')
+def inventory_levels():
+    """Stock of the distributor's items from the ledger, now or as of a date (?as_of=YYYY-MM-DD)."""
+    try:
+        as_of = parse_as_of(request.args['as_of']) if request.args.get('as_of') else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'as_of must be an ISO date or datetime'}), 400
+    try:
+        items = db.session.execute(select(InventoryItem.id, InventoryItem.name, InventoryItem.unit).where(
+            InventoryItem.distributor_id == current_user.id).order_by(InventoryItem.name)).all()
+        levels = stock_levels('inventory', select(InventoryItem.id).where(
+            InventoryItem.distributor_id == current_user.id), as_of)
+        return jsonify({
+            'success': True,
+            'as_of': as_of.isoformat() if as_of else None,
+            'items': [{'id': item_id, 'name': name, 'unit': unit, 'quantity': levels.get(item_id, 0.0)}
+                      for item_id, name, unit in items]
+        })
+    except Exception as e:
+        app.logger.error(f'Error reading inventory levels: {str(e)}')
+        return jsonify({'success': False, 'error': 'Server error'}), 500
+
+@app.route('/api/inventory/import', methods=['POST'])
+@login_required
+@role_required('distributor')
+def import_inventory_items():
+    """Upsert items from a CSV or NDJSON body, streamed row by row; reports the rows it skipped."""
+    try:
+        fmt = upload_format(request.args.get('format'), request.mimetype)
+        # Read the raw body so uploads are not held to MAX_CONTENT_LENGTH or buffered whole
+        body = get_input_stream(request.environ, max_content_length=app.config['INVENTORY_IMPORT_MAX_BYTES'])
+        text = io.TextIOWrapper(io.BufferedReader(body), encoding='utf-8-sig', newline='')
+        report = import_inventory(current_user.id, text, fmt, batch_size=app.config['INVENTORY_IMPORT_BATCH_SIZE'])
+        return jsonify(dict(report.to_dict(), success=True))
+    except InventoryImportError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except UnicodeDecodeError:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': 'Uploads must be UTF-8 text'}), 400
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f'Error importing inventory: {str(e)}')
+        return jsonify({'success': False, 'error': 'Server error'}), 500
+
+@app.route('/api/inventory/export', methods=['GET'])
+@login_required
+@role_required('distributor')
+def export_inventory_items():
+    """Stream the distributor's items as CSV (default) or NDJSON."""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in INVENTORY_FORMATS:
+        return jsonify({'success': False, 'error': f"format must be one of {', '.join(INVENTORY_FORMATS)}"}), 400
+    return Response(stream_with_context(export_inventory(current_user.id, fmt)), mimetype=INVENTORY_FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename=inventory.{fmt}'})
+
 @app.route('/api/inventory/<int:item_id>', methods=['GET'])
 @login_required
 @role_required('distributor')
+@conditional(inventory_item_validator)
 def get_inventory_item(item_id):
     try:
         item = InventoryItem.query.get_or_404(item_id)
@@ -1269,27 +1381,50 @@ def update_inventory_stock(item_id):
         data = request.get_json()
         adjustment_type = data.get('adjustment_type')
         quantity = float(data.get('quantity', 0))
+        # Same rule as the batch endpoint, so inf cannot reach the stock level or the ledger
+        if not (math.isfinite(quantity) and quantity >= 0):
+            return jsonify({'success': False, 'message': 'quantity must be a positive number'}), 400
         
         if adjustment_type == 'add':
-            item.quantity += quantity
+            remaining = move_stock('inventory', item.id, quantity, 'received')
         elif adjustment_type == 'remove':
-            if item.quantity < quantity:
+            remaining = move_stock('inventory', item.id, -quantity, 'issued')
+            if remaining is None:
+                db.session.rollback()
                 return jsonify({
                     'success': False,
                     'message': f'Cannot remove {quantity} {item.unit}. Only {item.quantity} {item.unit} available.'
                 }), 400
-            item.quantity -= quantity
         else:
             return jsonify({'success': False, 'message': 'Invalid adjustment type'}), 400
         
         db.session.commit()
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'quantity': remaining})
         
     except Exception as e:
         db.session.rollback()
         app.logger.error(f"Error updating inventory stock: {str(e)}")
         return jsonify({'success': False, 'message': 'Server error'}), 500
 
+@app.route('/api/inventory/stock', methods=['PUT'])
+@login_required
+@role_required('distributor')
+def update_inventory_stock_batch():
+    """Apply a list of stock adjustments in one transaction, e.g. a whole stock-take; one result per entry."""
+    try:
+        data = request.get_json(silent=True) or {}
+        result = adjust_stock_batch(current_user.id, data.get('adjustments'), bool(data.get('allow_partial')))
+        return jsonify(result.to_dict()), 200 if result.applied else 400
+    except BatchError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except BatchConflict as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 409
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error updating inventory stock: {str(e)}")
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+
 @app.route('/api/inventory/<int:item_id>', methods=['DELETE'])
 @login_required
 @role_required('distributor')
@@ -1300,12 +1435,7 @@ def delete_inventory_item(item_id):
         if item.distributor_id != current_user.id:
             return jsonify({'success': False, 'message': 'Access denied'}), 403
         
-        # Delete associated image if exists
-        if item.image:
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], item.image)
-            if os.path.exists(image_path):
-                os.remove(image_path)
-        
+        # Its image is released by the upload store and swept later
         db.session.delete(item)
         db.session.commit()
         
@@ -1353,14 +1483,35 @@ def dashboard():
 @app.route('/available_crops')
 @login_required
 def available_crops():
-    # For distributors and retailers, show all ready-for-harvest crops
+    # For distributors and retailers, search the ready-for-harvest crops
     if current_user.role in ['distributor', 'retailer']:
-        crops = Crop.query.filter_by(status='ready_for_harvest').all()
-        return render_template('available_crops.html', crops=crops)
+        query = request.args.get('q', '').strip()
+        page = request.args.get('page', 1, type=int)
+        results = search(query, kind='crop', statuses=('ready_for_harvest',), page=page)
+        ids = [result['id'] for result in results['results']]
+        crops = {crop.id: crop for crop in Crop.query.options(joinedload(Crop.farmer)).filter(Crop.id.in_(ids))}
+        return render_template('available_crops.html', crops=[crops[i] for i in ids if i in crops], search=results)
     else:
         flash('Access denied. This page is only for distributors and retailers.', 'danger')
         return redirect(url_for('dashboard'))
 
+@app.route('/api/search')
+@login_required
+def api_search():
+    """Search crops and products by text with filters; returns one page of results and facet counts."""
+    try:
+        kwargs = parse_search_args(request.args, current_user)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except SearchForbidden as e:
+        return jsonify({'success': False, 'error': str(e)}), 403
+    try:
+        results = search(**kwargs)
+    except Exception as e:
+        app.logger.error(f'Error searching listings: {str(e)}')
+        return jsonify({'success': False, 'error': 'Search failed'}), 500
+    return jsonify(dict(results, success=True))
+
 @app.route('/place_order/<int:crop_id>', methods=['GET', 'POST'])
 @login_required
 @role_required('retailer')
@@ -1401,8 +1552,13 @@ def place_order(crop_id):
             )
             db.session.add(order_item)
             
-            # Update crop quantity
-            crop.quantity -= form.quantity.data
+            # Take the crop quantity unless another order got to it first
+            if move_stock('crop', crop.id, -form.quantity.data, 'sale', order_id=order.id) is None:
+                db.session.rollback()
+                flash(f'Only {crop.quantity} {crop.unit} available.', 'danger')
+                return render_template('place_order.html', form=form, crop=crop)
+
+            record_order_event(order, 'order_created')
             
             db.session.commit()
             flash('Order placed successfully!', 'success')
@@ -1439,39 +1595,6 @@ def mark_ready_for_harvest(crop_id):
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
-def cleanup_orphaned_images():
-    """Remove image files that are not referenced by any crop."""
-    try:
-        # Get all image filenames from the database
-        used_images = set()
-        crops = Crop.query.all()
-        for crop in crops:
-            if crop.image:
-                used_images.add(crop.image)
-        
-        # Get all image files from the uploads directory
-        upload_path = app.config['UPLOAD_FOLDER']
-        for filename in os.listdir(upload_path):
-            if filename.lower().endswith(tuple(ALLOWED_EXTENSIONS)):
-                filepath = os.path.join(upload_path, filename)
-                # If the file is not referenced in the database and is older than 24 hours, delete it
-                if filename not in used_images:
-                    file_age = time.time() - os.path.getctime(filepath)
-                    if file_age > 86400:  # 24 hours in seconds
-                        try:
-                            os.remove(filepath)
-                            app.logger.info(f"Removed orphaned image: {filename}")
-                        except Exception as e:
-                            app.logger.error(f"Error removing orphaned image {filename}: {str(e)}")
-    except Exception as e:
-        app.logger.error(f"Error during image cleanup: {str(e)}")
-
-# Schedule cleanup to run daily
-def init_app(app):
-    with app.app_context():
-        cleanup_orphaned_images()  # Run cleanup once at startup
-
-# Add cleanup after successful crop deletion
 @app.route('/delete_crop/<int:crop_id>', methods=['POST'])
 @login_required
 def delete_crop(crop_id):
@@ -1482,18 +1605,11 @@ def delete_crop(crop_id):
         return redirect(url_for('crop_inventory'))
     
     try:
-        # Delete the image file if it exists
-        if crop.image:
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], crop.image)
-            if os.path.exists(image_path):
-                os.remove(image_path)
-        
+        # The crop's image is released by the upload store and swept later
+        record_crop_removed(crop)
         db.session.delete(crop)
         db.session.commit()
         
-        # Run cleanup after successful deletion
-        cleanup_orphaned_images()
-        
         flash('Crop deleted successfully!', 'success')
         return redirect(url_for('crop_inventory'))
         
@@ -1520,14 +1636,7 @@ def update_order_status(order_id):
             return jsonify({'success': False, 'message': 'Unauthorized'}), 403
 
         # Validate status transition
-        valid_transitions = {
-            'pending': ['processing', 'cancelled'],
-            'processing': ['completed', 'cancelled'],
-            'completed': [],
-            'cancelled': []
-        }
-
-        if status not in valid_transitions.get(order.status, []):
+        if status not in VALID_TRANSITIONS.get(order.status, []):
             return jsonify({
                 'success': False,
                 'message': f'Invalid status transition from {order.status} to {status}'
@@ -1537,12 +1646,16 @@ def update_order_status(order_id):
         order.status = status
         if status == 'completed':
             order.completed_at = datetime.utcnow()
+            record_order_completed(order)
+        record_order_event(order)
 
         # Update child orders status
         for child_order in order.child_orders:
             child_order.status = status
             if status == 'completed':
                 child_order.completed_at = datetime.utcnow()
+                record_order_completed(child_order)
+            record_order_event(child_order)
 
         # Update delivery status if needed
         if order.order_deliveries:
@@ -1563,6 +1676,25 @@ def update_order_status(order_id):
         app.logger.error(f'Error updating order status: {str(e)}')
         return jsonify({'success': False, 'message': 'An error occurred'}), 500
 
+@app.route('/api/orders/status', methods=['PUT'])
+@login_required
+@role_required('distributor')
+def update_order_status_batch():
+    """Apply a list of order status transitions in one transaction; one result per entry."""
+    try:
+        data = request.get_json(silent=True) or {}
+        result = transition_orders_batch(current_user.id, data.get('transitions'), bool(data.get('allow_partial')))
+        return jsonify(result.to_dict()), 200 if result.applied else 400
+    except BatchError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except BatchConflict as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 409
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f'Error updating order status: {str(e)}')
+        return jsonify({'success': False, 'message': 'An error occurred'}), 500
+
 @app.route('/api/orders/<int:order_id>/cancel', methods=['POST'])
 @login_required
 def cancel_order(order_id):
@@ -1582,10 +1714,12 @@ def cancel_order(order_id):
 
         # Cancel main order
         order.status = 'cancelled'
+        record_order_event(order)
         
         # Cancel child orders
         for child_order in order.child_orders:
             child_order.status = 'cancelled'
+            record_order_event(child_order)
 
         # Cancel delivery if exists
         if order.order_deliveries:
@@ -1600,6 +1734,126 @@ def cancel_order(order_id):
         app.logger.error(f'Error cancelling order: {str(e)}')
         return jsonify({'success': False, 'message': 'An error occurred'}), 500
 
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Backfill the farmer monthly rollups from existing orders and crops."""
+    buckets = rebuild_farmer_rollups()
+    print(f'Rebuilt {buckets} farmer monthly rollup rows')
+
+@app.cli.command('ingest-prices')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--source', default=None, help='Recorded on rows whose CSV has no source column.')
+def ingest_prices_command(path, source):
+    """Load market price observations from a CSV file (commodity, price, observed_at[, unit, source])."""
+    try:
+        with open(path, newline='', encoding='utf-8') as f:
+            inserted, errors = ingest_csv(f, source=source or os.path.basename(path))
+    except PriceIngestError as e:
+        raise click.ClickException(str(e))
+    for error in errors[:20]:
+        print(f"Line {error['line']}: {error['error']}")
+    print(f'Ingested {inserted} price observations ({len(errors)} rows skipped)')
+
+@app.cli.command('update-price-index')
+@click.option('--rebuild', is_flag=True, help='Recompute the whole index instead of adding new order items.')
+def update_price_index_command(rebuild):
+    """Fold new order items into the realized price index."""
+    started = time.perf_counter()
+    items = rebuild_price_index() if rebuild else update_price_index()
+    print(f'Indexed {items} order items in {time.perf_counter() - started:.1f}s')
+
+@app.cli.command('geocode-locations')
+@click.option('--all', 'everything', is_flag=True, help='Geocode every row again, not just rows without coordinates.')
+def geocode_locations_command(everything):
+    """Cache coordinates for user locations and delivery addresses."""
+    users, deliveries = geocode_locations(everything)
+    print(f'Located {users} users and {deliveries} deliveries')
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Recopy crops and products into the search listings and rebuild the full-text index."""
+    started = time.perf_counter()
+    listings = rebuild_search_index()
+    print(f'Indexed {listings} listings in {time.perf_counter() - started:.1f}s')
+
+@app.cli.command('compact-stock-ledger')
+@click.option('--before', default=None, help='Fold movements made up to this ISO date or time (default now).')
+def compact_stock_ledger_command(before):
+    """Snapshot the stock of every item moved since the last compaction."""
+    try:
+        cutoff = parse_as_of(before) if before else None
+    except ValueError:
+        raise click.ClickException('--before must be an ISO date or datetime')
+    started = time.perf_counter()
+    snapshots = compact_stock_ledger(cutoff)
+    print(f'Wrote {snapshots} stock snapshots in {time.perf_counter() - started:.1f}s')
+
+@app.cli.command('forecast-demand')
+@click.option('--distributor', type=int, default=None, help='Replace this distributor\'s restock suggestions.')
+@click.option('--days', type=int, default=HISTORY_DAYS, show_default=True, help='Days of demand history to fit.')
+@click.option('--lead-time', type=float, default=LEAD_TIME_DAYS, show_default=True, help='Restock lead time in days.')
+@click.option('--review-days', type=float, default=REVIEW_DAYS, show_default=True, help='Days until the next run.')
+@click.option('--service-level', type=click.FloatRange(0.5, 0.9999), default=SERVICE_LEVEL, show_default=True)
+def forecast_demand_command(distributor, days, lead_time, review_days, service_level):
+    """Forecast product demand, update reorder levels and suggest restock orders."""
+    started = time.perf_counter()
+    plan = plan_restocks(distributor, days=days, lead_time=lead_time, review_days=review_days,
+                         service_level=service_level)
+    print(f'Forecast {plan.products} products ({plan.intermittent} intermittent) and suggested '
+          f'{plan.suggestions} restock orders in {time.perf_counter() - started:.1f}s')
+
+@app.cli.command('rebuild-stock-alerts')
+def rebuild_stock_alerts_command():
+    """Reconcile low-stock alerts with current inventory and product stock."""
+    started = time.perf_counter()
+    alerts = rebuild_stock_alerts()
+    print(f'{alerts} open stock alerts after {time.perf_counter() - started:.1f}s')
+
+@app.cli.command('notify-low-stock')
+def notify_low_stock_command():
+    """Send every distributor their queued low-stock alerts now."""
+    distributors, alerts = notify_low_stock()
+    print(f'Sent {alerts} low-stock alerts to {distributors} distributors')
+
+@app.cli.command('db-maintenance')
+def db_maintenance_command():
+    """Run PRAGMA optimize and a passive WAL checkpoint now."""
+    busy, log_frames, checkpointed = run_maintenance(app)
+    print(f'Checkpointed {checkpointed} of {log_frames} WAL frames (busy={busy})')
+
+@app.cli.command('sweep-uploads')
+def sweep_uploads_command():
+    """Delete uploads that have been unreferenced for longer than the grace period."""
+    removed = sweep_unreferenced(app.config['UPLOAD_FOLDER'], grace_period=app.config['UPLOAD_GRACE_PERIOD'])
+    print(f'Removed {removed} unreferenced uploads')
+
+@app.cli.command('rebuild-upload-manifest')
+def rebuild_upload_manifest_command():
+    """Register every file in the uploads folder with its current reference count."""
+    files, unreferenced = rebuild_manifest(app.config['UPLOAD_FOLDER'])
+    print(f'Registered {files} uploads ({unreferenced} unreferenced)')
+
+@app.cli.command('process-images')
+def process_images_command():
+    """Render derivatives for images that are unprocessed or were left pending."""
+    processed = failed = 0
+    for model in (Crop, InventoryItem):
+        rows = db.session.query(model.id, model.image).filter(
+            model.image.isnot(None),
+            db.or_(model.image_status.is_(None), model.image_status == 'pending')
+        ).all()
+        for record_id, filename in rows:
+            try:
+                render_derivatives(app.config['UPLOAD_FOLDER'], filename)
+                status = 'ready'
+                processed += 1
+            except Exception as e:
+                app.logger.error(f'Error processing image {filename}: {str(e)}')
+                status = 'failed'
+                failed += 1
+            model.query.filter_by(id=record_id, image=filename).update({'image_status': status})
+            db.session.commit()
+    print(f'Processed {processed} images ({failed} failed)')
+
 if __name__ == '__main__':
-    init_app(app)  # Initialize the app
     app.run(debug=True)
\ No newline at end of file
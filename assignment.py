@@ -0,0 +1,407 @@
+"""Distributor assignment for retailer checkout.
+
+Each process keeps an index of distributors: a KD-tree over their cached
+coordinates (as unit vectors, so straight-line nearness matches
+great-circle nearness) and live counters of their open orders and pending
+deliveries. Every tree node also counts the distributors below it that still
+have spare capacity. Full subtrees are skipped, so finding the nearest
+distributor with room stays logarithmic even when most of the country is
+busy.
+
+Rules, in order:
+
+1. The nearest distributor with spare capacity wins. Distributors within
+   ``TIE_KM`` of that distance tie, and the least loaded of them is chosen,
+   then the closest, then the lowest id.
+2. If no located distributor has room, or the retailer's location is not
+   recognised, the least loaded distributor with room is chosen, located or
+   not.
+3. If every distributor is full the least loaded one still gets the order,
+   so checkout is never refused for load alone.
+
+Counters follow committed inserts and status changes of orders and
+deliveries in this process. Writes made by other processes are picked up
+when the index reloads, every ``ASSIGNMENT_TTL`` seconds.
+"""
+import math
+import threading
+import time
+import numpy as np
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+from extensions import db
+from geo import EARTH_RADIUS_KM, locate
+from models import Delivery, Order, User
+
+ASSIGNMENT_TTL = 300
+MAX_OPEN_ORDERS = 50  # Per distributor
+MAX_PENDING_DELIVERIES = 50
+TIE_KM = 5.0
+OPEN_ORDER_STATUSES = ('pending', 'processing')
+PENDING_DELIVERY_STATUSES = ('scheduled', 'in_transit')
+
+NEAREST = 'nearest'
+LEAST_LOADED = 'least_loaded'
+OVER_CAPACITY = 'over_capacity'
+
+_UNKNOWN = object()
+
+
+def _unit_vector(point):
+    lat, lon = math.radians(point[0]), math.radians(point[1])
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def _chord_km(squared_chord):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(squared_chord) / 2))
+
+
+def _squared_chord(km):
+    return (2 * math.sin(min(math.pi / 2, km / (2 * EARTH_RADIUS_KM)))) ** 2
+
+
+class Assignment:
+    __slots__ = ('distributor_id', 'distance_km', 'reason')
+
+    def __init__(self, distributor_id, distance_km, reason):
+        self.distributor_id = distributor_id
+        self.distance_km = distance_km
+        self.reason = reason
+
+    def to_dict(self):
+        return {
+            'distributor_id': self.distributor_id,
+            'distance_km': round(self.distance_km, 1) if self.distance_km is not None else None,
+            'reason': self.reason
+        }
+
+    def __repr__(self):
+        return f'<Assignment {self.distributor_id} {self.reason}>'
+
+
+class DistributorIndex:
+    """Nearest-with-capacity lookup over distributors and their current load."""
+
+    def __init__(self, max_open_orders=MAX_OPEN_ORDERS, max_pending_deliveries=MAX_PENDING_DELIVERIES,
+                 ttl=ASSIGNMENT_TTL):
+        self.max_open_orders = max_open_orders
+        self.max_pending_deliveries = max_pending_deliveries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.build([], [], [], [])
+        self._loaded_at = None
+
+    def build(self, ids, points, open_orders, pending_deliveries):
+        """Index distributors; `points` holds (latitude, longitude) or None for each id."""
+        located = [n for n, point in enumerate(points) if point is not None]
+        vectors = np.array([_unit_vector(points[n]) for n in located]).reshape(-1, 3)
+
+        # Implicit KD-tree: the node for positions [lo, hi) sits at (lo + hi) // 2
+        order = np.arange(len(located))
+        stack = [(0, len(located), 0)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if hi - lo < 2:
+                continue
+            mid = (lo + hi) // 2
+            segment = order[lo:hi]
+            order[lo:hi] = segment[np.argpartition(vectors[segment, depth % 3], mid - lo)]
+            stack.extend(((lo, mid, depth + 1), (mid + 1, hi, depth + 1)))
+
+        # Located distributors in tree order, then the ones without coordinates
+        sequence = [located[n] for n in order] + [n for n, point in enumerate(points) if point is None]
+        self.ids = np.array([ids[n] for n in sequence], dtype=np.int64)
+        self.vectors = [tuple(vector) for vector in vectors[order]]
+        self.size = len(self.vectors)
+        self.orders = np.array([open_orders[n] for n in sequence], dtype=np.int64)
+        self.deliveries = np.array([pending_deliveries[n] for n in sequence], dtype=np.int64)
+        self.positions = {int(distributor_id): position for position, distributor_id in enumerate(self.ids)}
+        self.has_room = [self._room(position) for position in range(len(self.ids))]
+        self.subtree = [0] * self.size
+        self._count(0, self.size)
+        self._loaded_at = time.monotonic()
+
+    def _count(self, lo, hi):
+        if lo >= hi:
+            return 0
+        mid = (lo + hi) // 2
+        self.subtree[mid] = self.has_room[mid] + self._count(lo, mid) + self._count(mid + 1, hi)
+        return self.subtree[mid]
+
+    def _room(self, position):
+        return bool(self.orders[position] < self.max_open_orders
+                    and self.deliveries[position] < self.max_pending_deliveries)
+
+    def _load(self, position):
+        return max(self.orders[position] / self.max_open_orders,
+                   self.deliveries[position] / self.max_pending_deliveries)
+
+    def _update_path(self, position, delta):
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            self.subtree[mid] += delta
+            if position == mid:
+                return
+            if position < mid:
+                hi = mid
+            else:
+                lo = mid + 1
+
+    def adjust(self, distributor_id, orders=0, deliveries=0):
+        """Change a distributor's counters; False if the distributor is not indexed."""
+        position = self.positions.get(distributor_id)
+        if position is None:
+            return False
+        self.orders[position] = max(0, self.orders[position] + orders)
+        self.deliveries[position] = max(0, self.deliveries[position] + deliveries)
+        room = self._room(position)
+        if room != self.has_room[position]:
+            self.has_room[position] = room
+            if position < self.size:
+                self._update_path(position, 1 if room else -1)
+        return True
+
+    def _search(self, query, radius=None):
+        """Positions with room and their squared chord to `query`.
+
+        Without `radius` only the nearest is returned; otherwise everything
+        within that squared chord.
+        """
+        best, best_distance = [], math.inf if radius is None else radius
+        vectors, subtree, has_room = self.vectors, self.subtree, self.has_room
+        qx, qy, qz = query
+        stack = [(0, self.size, 0, 0.0)]
+        while stack:
+            lo, hi, depth, bound = stack.pop()
+            if lo >= hi or bound > best_distance:
+                continue
+            mid = (lo + hi) // 2
+            if not subtree[mid]:
+                continue
+            x, y, z = vectors[mid]
+            distance = (qx - x) ** 2 + (qy - y) ** 2 + (qz - z) ** 2
+            if has_room[mid] and distance <= best_distance:
+                if radius is None:
+                    best, best_distance = [(mid, distance)], distance
+                else:
+                    best.append((mid, distance))
+            gap = query[depth % 3] - vectors[mid][depth % 3]
+            near, far = ((lo, mid), (mid + 1, hi)) if gap < 0 else ((mid + 1, hi), (lo, mid))
+            stack.append((far[0], far[1], depth + 1, max(bound, gap * gap)))
+            stack.append((near[0], near[1], depth + 1, bound))
+        return best
+
+    def _least_loaded(self, with_room):
+        loads = np.maximum(self.orders / self.max_open_orders, self.deliveries / self.max_pending_deliveries)
+        candidates = np.flatnonzero(self.has_room) if with_room else np.arange(len(self.ids))
+        if not len(candidates):
+            return None
+        return int(candidates[np.lexsort((self.ids[candidates], loads[candidates]))[0]])
+
+    def _distance_km(self, query, position):
+        if query is None or position >= self.size:
+            return None
+        return _chord_km(sum((a - b) ** 2 for a, b in zip(query, self.vectors[position])))
+
+    def assign(self, point):
+        """Assignment for a retailer at `point` (latitude, longitude, or None); None without distributors."""
+        self._ensure_loaded()
+        # A reload rebuilds every array in turn, so searches must not run while it does
+        with self._lock:
+            return self._assign(point)
+
+    def _assign(self, point):
+        if not len(self.ids):
+            return None
+        query = _unit_vector(point) if point is not None else None
+        if query is not None and self.size:
+            nearest = self._search(query)
+            if nearest:
+                radius = _squared_chord(_chord_km(nearest[0][1]) + TIE_KM)
+                position, distance = min(self._search(query, radius), key=lambda candidate: (
+                    self._load(candidate[0]), candidate[1], self.ids[candidate[0]]))
+                return Assignment(int(self.ids[position]), _chord_km(distance), NEAREST)
+
+        position = self._least_loaded(with_room=True)
+        reason = LEAST_LOADED
+        if position is None:
+            position, reason = self._least_loaded(with_room=False), OVER_CAPACITY
+        return Assignment(int(self.ids[position]), self._distance_km(query, position), reason)
+
+    def load(self):
+        """Rebuild from the database: distributor coordinates and current counters."""
+        distributors = db.session.execute(
+            select(User.id, User.latitude, User.longitude, User.location)
+            .where(User.role == 'distributor').order_by(User.id)
+        ).all()
+        open_orders = dict(db.session.execute(
+            select(Order.distributor_id, func.count(Order.id)).where(
+                Order.distributor_id.isnot(None),
+                Order.parent_order_id.is_(None),
+                Order.status.in_(OPEN_ORDER_STATUSES)
+            ).group_by(Order.distributor_id)
+        ).all())
+        pending = dict(db.session.execute(
+            select(Delivery.distributor_id, func.count(Delivery.id))
+            .where(Delivery.status.in_(PENDING_DELIVERY_STATUSES))
+            .group_by(Delivery.distributor_id)
+        ).all())
+        self.replace(
+            [row.id for row in distributors],
+            [(row.latitude, row.longitude) if row.latitude is not None else locate(row.location)
+             for row in distributors],
+            [open_orders.get(row.id, 0) for row in distributors],
+            [pending.get(row.id, 0) for row in distributors]
+        )
+
+    def replace(self, ids, points, open_orders, pending_deliveries):
+        """Rebuild the index while no assignment or counter update is running; arguments as for build."""
+        with self._lock:
+            self.build(ids, points, open_orders, pending_deliveries)
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self.load()
+
+    def apply(self, deltas):
+        """Fold committed counter changes in; an unknown distributor forces a reload."""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            for distributor_id, (orders, deliveries) in deltas.items():
+                if not self.adjust(distributor_id, orders, deliveries):
+                    self._loaded_at = None
+                    return
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def clear(self):
+        self.replace([], [], [], [])
+        self._loaded_at = None
+
+
+distributor_index = DistributorIndex()
+
+
+def assign_distributor(retailer):
+    """Pick the distributor for a retailer's checkout; None when there are no distributors."""
+    latitude = getattr(retailer, 'latitude', None)
+    point = (latitude, retailer.longitude) if latitude is not None else locate(retailer.location)
+    return distributor_index.assign(point)
+
+
+# Live counters, updated when orders and deliveries commit
+
+def _row_values(connection, target, columns):
+    """Column values of a flushed row before and after the flush; _UNKNOWN where not loaded."""
+    state = inspect(target)
+    before, after, expired = {}, {}, []
+    for name in columns:
+        history = state.attrs[name].history
+        if history.added or history.deleted:
+            before[name] = history.deleted[0] if history.deleted else _UNKNOWN
+            after[name] = history.added[0] if history.added else None
+        elif name in state.dict:
+            before[name] = after[name] = state.dict[name]
+        else:
+            expired.append(name)
+    if expired:
+        # Unchanged but expired columns hold the same value before and after
+        table = type(target).__table__
+        row = connection.execute(select(*(table.c[name] for name in expired)).where(table.c.id == target.id)).first()
+        for name, value in zip(expired, row or [None] * len(expired)):
+            before[name] = after[name] = value
+    return before, after
+
+
+def _order_owner(values):
+    if values is None or _UNKNOWN in values.values():
+        return _UNKNOWN if values is not None else None
+    if values['parent_order_id'] is None and values['status'] in OPEN_ORDER_STATUSES:
+        return values['distributor_id']
+    return None
+
+
+def _delivery_owner(values):
+    if values is None or _UNKNOWN in values.values():
+        return _UNKNOWN if values is not None else None
+    return values['distributor_id'] if values['status'] in PENDING_DELIVERY_STATUSES else None
+
+
+def _queue(target, owner, before, after, column):
+    pending = Session.object_session(target).info.setdefault('distributor_load', {})
+    old, new = owner(before), owner(after)
+    if _UNKNOWN in (old, new):
+        pending['stale'] = True
+        return
+    if old == new:
+        return
+    deltas = pending.setdefault('deltas', {})
+    for distributor_id, step in ((old, -1), (new, 1)):
+        if distributor_id is not None:
+            counts = deltas.setdefault(distributor_id, [0, 0])
+            counts[column] += step
+
+
+def queue_load_change(session, distributor_id, orders=0, deliveries=0):
+    """Queue a counter change for writes the ORM events below do not see, such as bulk UPDATEs."""
+    counts = session.info.setdefault('distributor_load', {}).setdefault('deltas', {}).setdefault(distributor_id, [0, 0])
+    counts[0] += orders
+    counts[1] += deliveries
+
+
+def _track(model, columns, owner, column):
+    @event.listens_for(model, 'after_insert')
+    def _inserted(mapper, connection, target):
+        _queue(target, owner, None, {name: getattr(target, name) for name in columns}, column)
+
+    @event.listens_for(model, 'after_update')
+    def _updated(mapper, connection, target):
+        before, after = _row_values(connection, target, columns)
+        _queue(target, owner, before, after, column)
+
+    @event.listens_for(model, 'after_delete')
+    def _deleted(mapper, connection, target):
+        before, _after = _row_values(connection, target, columns)
+        _queue(target, owner, before, None, column)
+
+
+_track(Order, ('distributor_id', 'parent_order_id', 'status'), _order_owner, 0)
+_track(Delivery, ('distributor_id', 'status'), _delivery_owner, 1)
+
+
+def _queue_distributor_change(target, removed=False):
+    state = inspect(target)
+    if 'distributor' not in (state.dict.get('role'), *state.attrs.role.history.deleted):
+        return
+    if removed or any(state.attrs[name].history.has_changes() for name in ('role', 'latitude', 'longitude')):
+        Session.object_session(target).info.setdefault('distributor_load', {})['stale'] = True
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def _distributor_saved(mapper, connection, target):
+    _queue_distributor_change(target)
+
+
+@event.listens_for(User, 'after_delete')
+def _distributor_deleted(mapper, connection, target):
+    _queue_distributor_change(target, removed=True)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_committed(session):
+    pending = session.info.pop('distributor_load', None)
+    if not pending:
+        return
+    if pending.get('stale'):
+        distributor_index.invalidate()
+    else:
+        distributor_index.apply(pending.get('deltas', {}))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop('distributor_load', None)
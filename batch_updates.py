@@ -0,0 +1,301 @@
+"""Batch stock adjustments and order status transitions for distributors.
+
+A stock-take or a dispatch run touches hundreds of rows at once. A batch is
+validated as a whole first: the rows it names are loaded with one query and
+every entry is checked against them (stock may not go negative, orders must
+follow ``VALID_TRANSITIONS``). Unless a partial batch is allowed, one bad
+entry rejects the batch and nothing is written. What is accepted is written
+in one transaction with set-based UPDATEs, e.g. a single
+``UPDATE ... SET quantity = CASE id WHEN ... END WHERE id IN (...)`` per
+chunk of items. The UPDATEs are guarded by the values that were validated,
+so a row changed concurrently fails the whole batch with BatchConflict
+instead of being overwritten. Callers get one result per entry, in order.
+"""
+import math
+from datetime import datetime
+from sqlalchemy import case, select, update
+from extensions import db
+from models import Delivery, InventoryItem, Order
+from assignment import OPEN_ORDER_STATUSES, PENDING_DELIVERY_STATUSES, queue_load_change
+from dashboard_cache import queue_invalidation
+from order_events import record_order_events
+from rollups import record_orders_completed
+from stock_ledger import record_movements
+
+MAX_BATCH_ITEMS = 1000
+UPDATE_CHUNK_SIZE = 500  # Rows per UPDATE, keeping the CASE within SQLite's variable limit
+
+VALID_TRANSITIONS = {
+    'pending': ['processing', 'cancelled'],
+    'processing': ['completed', 'cancelled'],
+    'completed': [],
+    'cancelled': []
+}
+# What an order's delivery becomes when the order moves to a status
+DELIVERY_STATUSES = {'processing': 'scheduled', 'completed': 'delivered', 'cancelled': 'cancelled'}
+ADJUSTMENT_REASONS = {'add': 'received', 'remove': 'issued', 'set': 'adjustment'}
+
+NOT_APPLIED = 'Not applied: other entries in the batch failed'
+
+
+class BatchError(ValueError):
+    """Raised when a batch cannot be processed at all, e.g. it is not a list or is too long."""
+
+
+class BatchConflict(Exception):
+    """Raised when rows changed between validation and the UPDATE; nothing was written."""
+
+
+class BatchResult:
+    """Per-entry outcomes of a batch and whether its valid entries were written."""
+    __slots__ = ('results', 'applied')
+
+    def __init__(self, results, applied):
+        self.results = results
+        self.applied = applied
+
+    @property
+    def success(self):
+        return self.applied and all(result['success'] for result in self.results)
+
+    def to_dict(self):
+        return {
+            'success': self.success,
+            'applied': sum(1 for result in self.results if result['success']) if self.applied else 0,
+            'results': self.results
+        }
+
+
+def _entries(entries):
+    if not isinstance(entries, list):
+        raise BatchError('Send the batch as a list')
+    if not entries:
+        raise BatchError('The batch is empty')
+    if len(entries) > MAX_BATCH_ITEMS:
+        raise BatchError(f'A batch holds at most {MAX_BATCH_ITEMS} entries')
+    return entries
+
+
+def _entry_id(entry):
+    if not isinstance(entry, dict):
+        raise ValueError('Each entry must be an object')
+    try:
+        return int(entry.get('id'))
+    except (TypeError, ValueError):
+        raise ValueError('id is required')
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), UPDATE_CHUNK_SIZE):
+        yield ids[start:start + UPDATE_CHUNK_SIZE]
+
+
+def _finish(results, allow_partial):
+    """Whether the valid entries should be written; marks them unapplied otherwise."""
+    if allow_partial or all(result['success'] for result in results):
+        return True
+    for result in results:
+        if result['success']:
+            result.pop('quantity', None)
+            result.pop('status', None)
+            result.update(success=False, message=NOT_APPLIED)
+    return False
+
+
+def _parse_adjustment(entry):
+    item_id = _entry_id(entry)
+    adjustment_type = entry.get('adjustment_type')
+    if adjustment_type not in ADJUSTMENT_REASONS:
+        raise ValueError('Invalid adjustment type')
+    try:
+        quantity = float(entry.get('quantity'))
+    except (TypeError, ValueError):
+        raise ValueError('quantity is required')
+    if not (math.isfinite(quantity) and quantity >= 0):
+        raise ValueError('quantity must be a positive number')
+    return item_id, adjustment_type, quantity
+
+
+def adjust_stock_batch(distributor_id, entries, allow_partial=False):
+    """Apply `{id, adjustment_type: add|remove|set, quantity}` entries to a distributor's items.
+
+    Entries for the same item apply in order. Returns a BatchResult whose
+    results carry each entry's resulting quantity; raises BatchError or
+    BatchConflict.
+    """
+    parsed = []
+    for entry in _entries(entries):
+        try:
+            parsed.append(_parse_adjustment(entry))
+        except ValueError as e:
+            parsed.append(e)
+    item_ids = {entry[0] for entry in parsed if not isinstance(entry, Exception)}
+    items = {row.id: row for row in db.session.execute(
+        select(InventoryItem.id, InventoryItem.quantity, InventoryItem.unit).where(
+            InventoryItem.id.in_(item_ids), InventoryItem.distributor_id == distributor_id)
+    )} if item_ids else {}
+
+    levels = {item_id: row.quantity for item_id, row in items.items()}
+    results, movements = [], []
+    for entry in parsed:
+        if isinstance(entry, Exception):
+            results.append({'id': None, 'success': False, 'message': str(entry)})
+            continue
+        item_id, adjustment_type, quantity = entry
+        if item_id not in items:
+            results.append({'id': item_id, 'success': False, 'message': 'Inventory item not found'})
+            continue
+        current, unit = levels[item_id], items[item_id].unit
+        if adjustment_type == 'add':
+            level = current + quantity
+        elif adjustment_type == 'remove':
+            if quantity > current:
+                results.append({'id': item_id, 'success': False,
+                                'message': f'Cannot remove {quantity} {unit}. Only {current} {unit} available.'})
+                continue
+            level = current - quantity
+        else:
+            level = quantity
+        levels[item_id] = level
+        movements.append(('inventory', item_id, level - current, ADJUSTMENT_REASONS[adjustment_type], None))
+        results.append({'id': item_id, 'success': True, 'quantity': level})
+
+    if not _finish(results, allow_partial):
+        return BatchResult(results, False)
+
+    changed = {item_id: level for item_id, level in levels.items() if level != items[item_id].quantity}
+    now = datetime.utcnow()
+    for chunk in _chunks(changed):
+        applied = db.session.execute(
+            update(InventoryItem)
+            .where(InventoryItem.id.in_(chunk),
+                   InventoryItem.quantity == case({item_id: items[item_id].quantity for item_id in chunk},
+                                                  value=InventoryItem.id))
+            .values(quantity=case({item_id: changed[item_id] for item_id in chunk}, value=InventoryItem.id),
+                    updated_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if applied != len(chunk):
+            db.session.rollback()
+            raise BatchConflict('Stock changed while the batch was being applied; reload and try again')
+    record_movements(movements)
+    queue_invalidation(db.session, [distributor_id])
+    db.session.commit()
+    return BatchResult(results, True)
+
+
+def _parse_transition(entry):
+    order_id = _entry_id(entry)
+    status = entry.get('status')
+    if status not in VALID_TRANSITIONS:
+        raise ValueError('Invalid status')
+    return order_id, status
+
+
+def transition_orders_batch(distributor_id, entries, allow_partial=False):
+    """Move a distributor's orders to new statuses, with their child orders and deliveries.
+
+    Mirrors update_order_status for each entry: completed orders are
+    stamped and counted in the farmer rollups, every changed order gets an
+    event and deliveries follow ``DELIVERY_STATUSES``. An order may appear
+    once per batch. Returns a BatchResult; raises BatchError or BatchConflict.
+    """
+    parsed = []
+    for entry in _entries(entries):
+        try:
+            parsed.append(_parse_transition(entry))
+        except ValueError as e:
+            parsed.append(e)
+    order_ids = {entry[0] for entry in parsed if not isinstance(entry, Exception)}
+    columns = (Order.id, Order.status, Order.farmer_id, Order.retailer_id, Order.distributor_id,
+               Order.parent_order_id, Order.total_amount, Order.created_at)
+    orders = {row.id: row for row in db.session.execute(
+        select(*columns).where(Order.id.in_(order_ids)))} if order_ids else {}
+
+    results, targets = [], {}
+    for entry in parsed:
+        if isinstance(entry, Exception):
+            results.append({'id': None, 'success': False, 'message': str(entry)})
+            continue
+        order_id, status = entry
+        order = orders.get(order_id)
+        if order is None:
+            message = 'Order not found'
+        elif order.distributor_id != distributor_id:
+            message = 'Unauthorized'
+        elif order_id in targets:
+            message = 'Order appears more than once in the batch'
+        elif status not in VALID_TRANSITIONS.get(order.status, []):
+            message = f'Invalid status transition from {order.status} to {status}'
+        else:
+            targets[order_id] = status
+            results.append({'id': order_id, 'success': True, 'status': status})
+            continue
+        results.append({'id': order_id, 'success': False, 'message': message})
+
+    if not _finish(results, allow_partial):
+        return BatchResult(results, False)
+    if targets:
+        _apply_transitions([orders[order_id] for order_id in targets], targets)
+    db.session.commit()
+    return BatchResult(results, True)
+
+
+def _update_statuses(model, rows, statuses, guard, now):
+    """Set each row's status from `statuses` (keyed by `rows`' id); False if a guarded row had moved on."""
+    current = {row.id: row.status for row in rows}
+    for chunk in _chunks(current):
+        completed = {row_id: now for row_id in chunk if statuses[row_id] in ('completed', 'delivered')}
+        values = {'status': case({row_id: statuses[row_id] for row_id in chunk}, value=model.id)}
+        if completed:
+            values['completed_at'] = case(completed, value=model.id, else_=model.completed_at)
+        stmt = update(model).where(model.id.in_(chunk)).values(**values)
+        if guard:
+            stmt = stmt.where(model.status == case({row_id: current[row_id] for row_id in chunk}, value=model.id))
+        if db.session.execute(stmt.execution_options(synchronize_session=False)).rowcount != len(chunk):
+            return False
+    return True
+
+
+def _apply_transitions(parents, targets):
+    now = datetime.utcnow()
+    parent_ids = list(targets)
+    children = db.session.execute(select(
+        Order.id, Order.status, Order.farmer_id, Order.retailer_id, Order.distributor_id, Order.parent_order_id,
+        Order.total_amount, Order.created_at
+    ).where(Order.parent_order_id.in_(parent_ids))).all()
+    child_targets = {child.id: targets[child.parent_order_id] for child in children}
+    deliveries = db.session.execute(select(
+        Delivery.id, Delivery.order_id, Delivery.distributor_id, Delivery.status
+    ).where(Delivery.order_id.in_(parent_ids))).all()
+    delivery_targets = {delivery.id: DELIVERY_STATUSES[targets[delivery.order_id]] for delivery in deliveries
+                        if targets[delivery.order_id] in DELIVERY_STATUSES}
+
+    # Parents are guarded by the status they were validated in; children and deliveries follow them
+    if not _update_statuses(Order, parents, targets, True, now):
+        db.session.rollback()
+        raise BatchConflict('Orders changed while the batch was being applied; reload and try again')
+    _update_statuses(Order, children, child_targets, False, now)
+    _update_statuses(Delivery, [delivery for delivery in deliveries if delivery.id in delivery_targets],
+                     delivery_targets, False, now)
+
+    # Side effects the ORM events would have seen for row-by-row updates
+    changes = [(order, targets[order.id]) for order in parents] + \
+              [(child, child_targets[child.id]) for child in children]
+    record_order_events(changes)
+    record_orders_completed(order for order, status in changes if status == 'completed')
+    for order, status in changes:
+        if order.parent_order_id is None and order.distributor_id is not None:
+            step = (status in OPEN_ORDER_STATUSES) - (order.status in OPEN_ORDER_STATUSES)
+            if step:
+                queue_load_change(db.session, order.distributor_id, orders=step)
+    for delivery in deliveries:
+        if delivery.id in delivery_targets:
+            step = ((delivery_targets[delivery.id] in PENDING_DELIVERY_STATUSES)
+                    - (delivery.status in PENDING_DELIVERY_STATUSES))
+            if step:
+                queue_load_change(db.session, delivery.distributor_id, deliveries=step)
+    queue_invalidation(db.session, {user_id for order, _status in changes
+                                    for user_id in (order.farmer_id, order.retailer_id, order.distributor_id)}
+                       | {delivery.distributor_id for delivery in deliveries})
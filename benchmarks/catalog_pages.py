@@ -0,0 +1,98 @@
+"""Time the retailer dashboard and catalog pages as the catalog grows.
+
+Seeds a throwaway SQLite file with products, then requests the dashboard,
+the first and a deep catalog page (up to page 401), and a revalidation of
+the first page with its ETag. The dashboard response size should stay flat
+whatever the catalog size.
+
+    python benchmarks/catalog_pages.py --products 1000 10000 50000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def timed(client, url, repeat, headers=None):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(url, headers=headers or {})
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return response, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    os.environ['DISTANCE_CACHE_DIR'] = ''
+    os.environ['SQLITE_MAINTENANCE_INTERVAL'] = '0'
+    os.environ['UPLOAD_SWEEP_INTERVAL'] = '0'
+    sys.path.insert(0, ROOT)
+    from sqlalchemy import insert
+    from app import app
+    from extensions import db
+    from models import User, Product
+    from dashboard_cache import dashboard_cache
+    from pagination import count_cache
+
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    rng = random.Random(4)
+    with app.app_context():
+        db.create_all()
+        retailer = User(username='retailer', email='r@bench.test', role='retailer')
+        retailer.set_password('password123')
+        db.session.add(retailer)
+        db.session.commit()
+        retailer_id = retailer.id
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(retailer_id)
+        session['_fresh'] = True
+
+    seeded = 0
+    now = datetime.utcnow()
+    for count in sorted(args.products):
+        with app.app_context():
+            db.session.execute(insert(Product), [{
+                'name': f'Product {n}', 'category': rng.choice(['Cereals', 'Fruit', 'Vegetables']), 'unit': 'kg',
+                'current_stock': rng.choice([0, 5, 50, 500]), 'reorder_level': 10,
+                'price_per_unit': round(rng.uniform(1, 500), 2), 'created_at': now - timedelta(minutes=n)
+            } for n in range(seeded, count)])
+            db.session.commit()
+        seeded = count
+        dashboard_cache.clear()
+        count_cache.clear()
+
+        dashboard, dashboard_time = timed(client, '/retailer/dashboard', args.repeat)
+        first, first_time = timed(client, '/api/products?sort=price', args.repeat)
+        # Walk towards the end of the catalog; the last full page is as cheap as the first
+        cursor, pages = first.get_json()['pagination']['next_cursor'], 1
+        while pages < 400:
+            following = client.get(f'/api/products?sort=price&after={cursor}').get_json()['pagination']['next_cursor']
+            if not following:
+                break
+            cursor, pages = following, pages + 1
+        _deep, deep_time = timed(client, f'/api/products?sort=price&after={cursor}', args.repeat)
+        revalidated, revalidate_time = timed(client, '/api/products?sort=price', args.repeat,
+                                             {'If-None-Match': first.headers['ETag']})
+        print(f'{count:>6} products: dashboard {len(dashboard.data) / 1024:.0f}KiB {dashboard_time * 1000:.1f}ms, '
+              f'first page {len(first.data) / 1024:.1f}KiB {first_time * 1000:.1f}ms, '
+              f'page {pages + 1} {deep_time * 1000:.1f}ms, '
+              f'revalidated ({revalidated.status_code}) {revalidate_time * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Concurrent checkout load test against a single SQLite file.
+
+Runs the same cart workload through the legacy read-modify-write checkout
+loop and through the set-based checkout engine, then reports orders/sec and
+whether any product was oversold.
+
+    python benchmarks/checkout_load.py --threads 8 --orders 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DB_DIR = tempfile.mkdtemp(prefix='checkout_bench_')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(DB_DIR, "bench.db")}'
+
+from app import app  # noqa: E402
+from extensions import db  # noqa: E402
+from models import User, Product, Order, OrderItem, Delivery  # noqa: E402
+from checkout import checkout_cart, CheckoutError  # noqa: E402
+from order_events import record_order_event  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+PRODUCTS = 40
+STOCK_PER_PRODUCT = 400
+ITEMS_PER_CART = 8
+
+
+def seed():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        farmer = User(username='bench_farmer', email='f@bench.test', role='farmer')
+        distributor = User(username='bench_distributor', email='d@bench.test', role='distributor')
+        retailer = User(username='bench_retailer', email='r@bench.test', role='retailer', location='Cape Town')
+        db.session.add_all([farmer, distributor, retailer])
+        db.session.flush()
+        db.session.add_all([
+            Product(name=f'Product {i}', category='Bench', unit='kg', current_stock=STOCK_PER_PRODUCT,
+                    reorder_level=10, price_per_unit=1.0 + i, farmer_id=farmer.id)
+            for i in range(PRODUCTS)
+        ])
+        db.session.commit()
+        return retailer.id, distributor.id
+
+
+def cart_for(n):
+    return [{'id': (n * 7 + k) % PRODUCTS + 1, 'quantity': 1 + (n + k) % 4} for k in range(ITEMS_PER_CART)]
+
+
+def legacy_checkout(retailer, distributor, items):
+    """The original per-item loop: one lookup per line and a Python-side decrement."""
+    order = Order(retailer_id=retailer.id, distributor_id=distributor.id, status='pending',
+                  total_amount=0, created_at=datetime.utcnow())
+    db.session.add(order)
+    db.session.flush()
+    total = 0
+    farmer_orders = {}
+    for item in items:
+        product = Product.query.get(item['id'])
+        if item['quantity'] > product.current_stock:
+            db.session.rollback()
+            raise CheckoutError('Insufficient stock')
+        db.session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=item['quantity'],
+                                 price_per_unit=product.price_per_unit))
+        product.current_stock -= item['quantity']
+        subtotal = item['quantity'] * product.price_per_unit
+        total += subtotal
+        farmer_orders.setdefault(product.farmer_id, {'items': [], 'total': 0})
+        farmer_orders[product.farmer_id]['items'].append((product.id, item['quantity'], product.price_per_unit))
+        farmer_orders[product.farmer_id]['total'] += subtotal
+    order.total_amount = total
+    for farmer_id, order_data in farmer_orders.items():
+        farmer_order = Order(farmer_id=farmer_id, retailer_id=retailer.id, distributor_id=distributor.id,
+                             status='pending', total_amount=order_data['total'], created_at=datetime.utcnow(),
+                             parent_order_id=order.id)
+        db.session.add(farmer_order)
+        db.session.flush()
+        for product_id, quantity, price in order_data['items']:
+            db.session.add(OrderItem(order_id=farmer_order.id, product_id=product_id, quantity=quantity,
+                                     price_per_unit=price))
+        record_order_event(farmer_order, 'order_created')
+    record_order_event(order, 'order_created')
+    db.session.add(Delivery(order_id=order.id, distributor_id=distributor.id, status='scheduled',
+                            scheduled_date=datetime.utcnow() + timedelta(days=1),
+                            delivery_address=retailer.location, tracking_number=f'TRK{order.id:09d}'))
+    db.session.commit()
+    return order, []
+
+
+def run(engine, threads, orders):
+    retailer_id, distributor_id = seed()
+    counts = {'ok': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def worker(offset):
+        with app.app_context():
+            retailer = db.session.get(User, retailer_id)
+            distributor = db.session.get(User, distributor_id)
+            for n in range(offset, orders, threads):
+                try:
+                    engine(retailer, distributor, cart_for(n))
+                    outcome = 'ok'
+                except CheckoutError:
+                    outcome = 'rejected'
+                except OperationalError:
+                    db.session.rollback()
+                    outcome = 'errors'
+                with lock:
+                    counts[outcome] += 1
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        remaining = sum(p.current_stock for p in Product.query.all())
+        negative = Product.query.filter(Product.current_stock < 0).count()
+        ordered = db.session.query(db.func.sum(OrderItem.quantity)).join(Order).filter(
+            Order.parent_order_id.is_(None)
+        ).scalar() or 0
+    taken = PRODUCTS * STOCK_PER_PRODUCT - remaining
+    return {
+        'orders_per_sec': counts['ok'] / elapsed,
+        'placed': counts['ok'],
+        'rejected': counts['rejected'],
+        'lock_errors': counts['errors'],
+        'oversold_units': max(0, ordered - taken),
+        'negative_stock_rows': negative
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--orders', type=int, default=400)
+    args = parser.parse_args()
+
+    for name, engine in (('legacy', legacy_checkout), ('set-based', checkout_cart)):
+        result = run(engine, args.threads, args.orders)
+        print(f"{name:>10}: {result['orders_per_sec']:8.1f} orders/s  placed={result['placed']} "
+              f"rejected={result['rejected']} lock_errors={result['lock_errors']} "
+              f"oversold_units={result['oversold_units']} negative_stock_rows={result['negative_stock_rows']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Time a forecasting run over a large catalogue.
+
+Seeds a throwaway SQLite file with products and a history of completed
+orders, a mix of daily sellers and intermittent ones, then runs
+``plan_restocks`` for one distributor: demand history, fit, reorder levels
+and restock suggestions.
+
+    python benchmarks/demand_forecast.py --products 50000 --days 180
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--days', type=int, default=180)
+    parser.add_argument('--lines-per-day', type=int, default=5000, help='Order items completed each day.')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ['DISTANCE_CACHE_DIR'] = ''
+    os.environ['SQLITE_MAINTENANCE_INTERVAL'] = '0'
+    os.environ['UPLOAD_SWEEP_INTERVAL'] = '0'
+    sys.path.insert(0, ROOT)
+    import numpy as np
+    from sqlalchemy import insert, select
+    from app import app
+    from extensions import db
+    from models import User, Order, OrderItem, Product
+    from forecasting import plan_restocks
+
+    rng = np.random.default_rng(7)
+    today = date.today()
+    with app.app_context():
+        db.create_all()
+        distributor = User(username='distributor', email='d@bench.test', role='distributor')
+        distributor.set_password('password123')
+        db.session.add(distributor)
+        db.session.flush()
+        distributor_id = distributor.id
+        db.session.execute(insert(Product), [{
+            'name': f'Product {n}', 'category': 'Cereals', 'unit': 'kg', 'current_stock': float(rng.integers(0, 200)),
+            'reorder_level': 10, 'price_per_unit': 2.5
+        } for n in range(args.products)])
+        product_ids = np.array(db.session.execute(select(Product.id)).scalars().all())
+
+        # Popular products sell most days; the long tail sells now and then
+        weights = 1 / np.arange(1, args.products + 1) ** 0.8
+        weights /= weights.sum()
+        started = time.perf_counter()
+        for day in range(1, args.days + 1):
+            completed = datetime.combine(today, datetime.min.time()) - timedelta(days=day, hours=-12)
+            order_ids = []
+            for _order in range(args.lines_per_day // 50):
+                order = db.session.execute(insert(Order).values(
+                    distributor_id=distributor_id, status='completed', total_amount=100, created_at=completed,
+                    completed_at=completed))
+                order_ids.append(order.inserted_primary_key[0])
+            products = rng.choice(product_ids, size=len(order_ids) * 50, p=weights)
+            db.session.execute(insert(OrderItem), [{
+                'order_id': order_ids[n // 50], 'product_id': int(product_id),
+                'quantity': float(rng.integers(1, 20)), 'price_per_unit': 2.5
+            } for n, product_id in enumerate(products)])
+        db.session.commit()
+        print(f'Seeded {args.products} products and {args.days * args.lines_per_day} order items '
+              f'in {time.perf_counter() - started:.0f}s')
+
+        started = time.perf_counter()
+        plan = plan_restocks(distributor_id, days=args.days)
+        print(f'Forecast {plan.products} products ({plan.intermittent} intermittent), '
+              f'{plan.suggestions} suggestions in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
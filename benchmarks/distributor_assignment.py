@@ -0,0 +1,71 @@
+"""Time distributor assignment against a linear scan as the network grows.
+
+Builds the in-memory index for synthetic distributors spread over South
+Africa with random load, most of them near or at capacity, then assigns
+random retailers and takes orders off the chosen distributor so load keeps
+moving.
+
+    python benchmarks/distributor_assignment.py --distributors 1000 5000 20000
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from assignment import DistributorIndex  # noqa: E402
+from geo import haversine_km  # noqa: E402
+
+
+def linear_scan(points, orders, deliveries, index, point):
+    best, best_km = None, math.inf
+    for position, location in enumerate(points):
+        if orders[position] < index.max_open_orders and deliveries[position] < index.max_pending_deliveries:
+            km = haversine_km(point, location)
+            if km < best_km:
+                best, best_km = position, km
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--distributors', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--assignments', type=int, default=5000)
+    parser.add_argument('--full-share', type=float, default=0.8)
+    args = parser.parse_args()
+    rng = random.Random(3)
+
+    for count in args.distributors:
+        index = DistributorIndex(ttl=math.inf)
+        points = [(rng.uniform(-34.5, -22.5), rng.uniform(17, 32.5)) for _ in range(count)]
+        orders = [index.max_open_orders if rng.random() < args.full_share else rng.randrange(index.max_open_orders)
+                  for _ in range(count)]
+        deliveries = [rng.randrange(index.max_pending_deliveries) for _ in range(count)]
+        started = time.perf_counter()
+        index.build(list(range(1, count + 1)), points, orders, deliveries)
+        build = time.perf_counter() - started
+
+        retailers = [(rng.uniform(-34.5, -22.5), rng.uniform(17, 32.5)) for _ in range(args.assignments)]
+        started = time.perf_counter()
+        for point in retailers:
+            assignment = index.assign(point)
+            # Take the order, then free a slot somewhere so the share of full distributors holds
+            index.adjust(assignment.distributor_id, orders=1)
+            index.adjust(rng.randint(1, count), orders=-1)
+        per_assignment = (time.perf_counter() - started) / len(retailers)
+
+        scans = retailers[:200]
+        started = time.perf_counter()
+        for point in scans:
+            linear_scan(points, orders, deliveries, index, point)
+        per_scan = (time.perf_counter() - started) / len(scans)
+        print(f'{count} distributors: build {build * 1000:.1f}ms, '
+              f'assign {per_assignment * 1e6:.0f}us, linear scan {per_scan * 1e6:.0f}us')
+
+
+if __name__ == '__main__':
+    main()
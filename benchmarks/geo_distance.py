@@ -0,0 +1,65 @@
+"""Time offline geocoding and any-to-any distance matrices.
+
+Geocodes a batch of generated addresses (some with misspelt towns), then
+builds distance matrices for growing point counts, cold and from the on-disk
+cache.
+
+    python benchmarks/geo_distance.py --addresses 20000 --points 1000 3000 5000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+from geo import cached_distance_matrix, gazetteer, geocode  # noqa: E402
+
+
+def misspell(name, rng):
+    position = rng.randrange(1, len(name) - 1)
+    return name[:position] + name[position + 1:]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--addresses', type=int, default=20000)
+    parser.add_argument('--points', type=int, nargs='+', default=[1000, 3000, 5000])
+    args = parser.parse_args()
+    rng = random.Random(11)
+
+    started = time.perf_counter()
+    places = gazetteer()
+    print(f'Loaded {len(places)} places in {(time.perf_counter() - started) * 1000:.1f}ms')
+
+    addresses = []
+    for n in range(args.addresses):
+        index = rng.randrange(len(places))
+        town = places.names[index] if rng.random() > 0.2 else misspell(places.names[index], rng)
+        addresses.append(f'{n} Main Road, {town}, {places.provinces[index]}')
+    geocode.cache_clear()
+    started = time.perf_counter()
+    located = sum(1 for address in addresses if geocode(address))
+    elapsed = time.perf_counter() - started
+    print(f'Geocoded {located}/{len(addresses)} addresses in {elapsed:.2f}s '
+          f'({elapsed / len(addresses) * 1e6:.0f}us each)')
+
+    cache_dir = tempfile.mkdtemp()
+    generator = np.random.default_rng(5)
+    for count in args.points:
+        points = np.column_stack((generator.uniform(-34.5, -22.5, count), generator.uniform(17, 32.5, count)))
+        started = time.perf_counter()
+        cached_distance_matrix(points, cache_dir)
+        cold = time.perf_counter() - started
+        started = time.perf_counter()
+        cached_distance_matrix(points, cache_dir)
+        warm = time.perf_counter() - started
+        print(f'{count} points: cold {cold:.3f}s, cached {warm:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Time bulk inventory imports and exports and measure their peak memory.
+
+Writes CSV files of generated inventory rows, imports each into a throwaway
+SQLite file (the first pass inserts, the second updates every row) and
+streams the result back out. Peak traced memory should stay flat as the
+row count grows; it is measured on separate passes because tracing slows
+them down.
+
+    python benchmarks/inventory_import.py --rows 10000 100000
+"""
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_rows(path, count, quantity):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'category', 'quantity', 'unit', 'min_quantity', 'price_per_unit', 'description'])
+        for n in range(count):
+            writer.writerow([f'Item {n}', f'Category {n % 40}', quantity + n % 7, 'kg', 10, 12.5, 'Imported'])
+
+
+def measured(function, trace=False):
+    """Result, seconds and peak traced bytes (None unless traced; tracing slows the run down)."""
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - started
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def memory(peak):
+    return f', peak {peak / 1024 / 1024:.1f}MiB traced' if peak is not None else ''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(folder, 'bench.db')}"
+    os.environ['DISTANCE_CACHE_DIR'] = ''
+    os.environ['SQLITE_MAINTENANCE_INTERVAL'] = '0'
+    os.environ['UPLOAD_SWEEP_INTERVAL'] = '0'
+    sys.path.insert(0, ROOT)
+    from app import app
+    from extensions import db
+    from models import User
+    from inventory_bulk import export_inventory, import_inventory
+
+    with app.app_context():
+        db.create_all()
+        for count in args.rows:
+            distributor = User(username=f'distributor{count}', email=f'd{count}@bench.test', role='distributor')
+            distributor.set_password('password123')
+            db.session.add(distributor)
+            db.session.commit()
+            distributor_id = distributor.id
+
+            # The update pass is traced for memory, which makes it slower than the insert pass
+            for label, quantity, trace in (('insert', 100, False), ('update', 50, True)):
+                path = os.path.join(folder, f'{label}.csv')
+                write_rows(path, count, quantity)
+                with open(path, newline='', encoding='utf-8') as f:
+                    report, elapsed, peak = measured(
+                        lambda: import_inventory(distributor_id, f, 'csv', batch_size=args.batch_size), trace)
+                print(f'{count:>7} rows {label}: {elapsed:.1f}s{memory(peak)}, '
+                      f'{report.inserted} inserted, {report.updated} updated, {report.error_count} errors')
+
+            size, elapsed, _peak = measured(lambda: sum(len(chunk) for chunk in export_inventory(distributor_id)))
+            _size, _elapsed, peak = measured(lambda: sum(len(chunk) for chunk in export_inventory(distributor_id)), True)
+            print(f'{count:>7} rows export: {elapsed:.1f}s{memory(peak)}, {size / 1024 / 1024:.1f}MiB of CSV')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Time a full realized price index rebuild and an incremental update.
+
+Seeds a throwaway SQLite file with a year of order items spread over a few
+farmers, regions and commodities, then rebuilds the index from scratch and
+folds in one more day of items.
+
+    python benchmarks/price_index_rebuild.py --items 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMODITIES = ['Maize', 'Wheat', 'Potatoes', 'Tomatoes', 'Onions', 'Beans', 'Carrots', 'Cabbage']
+LOCATIONS = ['Kimberley, Northern Cape', 'Bloemfontein, Free State', 'Stellenbosch, Western Cape',
+             'Polokwane, Limpopo', 'Nelspruit, Mpumalanga']
+
+
+def seed(items, rng):
+    from extensions import db
+    from models import User, Crop, Order, OrderItem
+    from sqlalchemy import insert
+
+    farmers = [User(username=f'farmer{i}', email=f'f{i}@bench.test', role='farmer', location=location)
+               for i, location in enumerate(LOCATIONS)]
+    retailer = User(username='retailer', email='r@bench.test', role='retailer', location='Cape Town')
+    db.session.add_all(farmers + [retailer])
+    db.session.flush()
+    now = datetime.utcnow()
+    crops = [Crop(farmer_id=farmer.id, name=name, variety='Bench', quantity=10 ** 6, unit='kg', price_per_unit=10,
+                  status='harvested', planting_date=now, expected_harvest_date=now)
+             for farmer in farmers for name in COMMODITIES]
+    db.session.add_all(crops)
+    db.session.flush()
+
+    order_count = max(1, items // 4)
+    db.session.execute(insert(Order), [
+        {'farmer_id': farmers[n % len(farmers)].id, 'retailer_id': retailer.id, 'status': 'completed',
+         'total_amount': 0, 'created_at': now - timedelta(days=365 * n / order_count)}
+        for n in range(order_count)
+    ])
+    first_order = db.session.query(db.func.min(Order.id)).scalar()
+    base_prices = {crop.id: 5 + COMMODITIES.index(crop.name) * 7 for crop in crops}
+    crop_ids = [crop.id for crop in crops]
+    batch = []
+    for n in range(items):
+        crop_id = rng.choice(crop_ids)
+        batch.append({'order_id': first_order + n % order_count, 'crop_id': crop_id,
+                      'quantity': rng.randint(1, 50), 'price_per_unit': round(base_prices[crop_id] * rng.uniform(0.8, 1.2), 2)})
+        if len(batch) == 50000:
+            db.session.execute(insert(OrderItem), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(OrderItem), batch)
+    db.session.commit()
+    return crop_ids, retailer.id
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=1000000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    sys.path.insert(0, ROOT)
+    from app import app
+    from extensions import db
+    from models import Order, OrderItem
+    from price_index import rebuild_price_index, update_price_index
+
+    rng = random.Random(7)
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        crop_ids, retailer_id = seed(args.items, rng)
+        print(f'Seeded {args.items} order items in {time.perf_counter() - started:.1f}s')
+
+        started = time.perf_counter()
+        indexed = rebuild_price_index()
+        print(f'Rebuild: {indexed} items in {time.perf_counter() - started:.2f}s')
+
+        order = Order(retailer_id=retailer_id, status='completed', total_amount=0, created_at=datetime.utcnow())
+        db.session.add(order)
+        db.session.flush()
+        db.session.add_all([OrderItem(order_id=order.id, crop_id=rng.choice(crop_ids), quantity=5, price_per_unit=20)
+                            for _ in range(2000)])
+        db.session.commit()
+        started = time.perf_counter()
+        indexed = update_price_index()
+        print(f'Incremental update: {indexed} items in {time.perf_counter() - started:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
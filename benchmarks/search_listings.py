@@ -0,0 +1,107 @@
+"""Time listing search over a large synthetic catalog.
+
+Seeds a throwaway SQLite file with crops and products (the triggers fill the
+search index as rows are inserted), then times typical queries: selective
+words, a common word, a misspelling, a filtered browse without words and a
+deep page.
+
+    python benchmarks/search_listings.py --listings 500000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+NAMES = ['Maize', 'Wheat', 'Potatoes', 'Tomatoes', 'Onions', 'Beans', 'Carrots', 'Cabbage', 'Spinach', 'Butternut',
+         'Sweet potatoes', 'Sorghum', 'Sunflower seeds', 'Apples', 'Citrus', 'Grapes', 'Avocados', 'Peppers']
+VARIETIES = ['Yellow', 'White', 'Roma', 'Cherry', 'Red', 'Green', 'Organic', 'Heirloom', 'Early', 'Late', 'Golden']
+CATEGORIES = ['Vegetables', 'Fruit', 'Grains', 'Legumes', 'Seeds', 'Processed']
+UNITS = ['kg', 'ton', 'crate', 'bag', 'box']
+WORDS = ['fresh', 'local', 'sweet', 'crisp', 'graded', 'washed', 'packed', 'farm', 'premium', 'export', 'bulk', 'dry']
+
+
+def seed(listings, rng):
+    from extensions import db
+    from models import User, Crop, Product
+    from sqlalchemy import insert
+
+    farmer = User(username='farmer', email='f@bench.test', role='farmer', location='Kimberley')
+    db.session.add(farmer)
+    db.session.flush()
+    now = datetime.utcnow()
+    batch_size = 20000
+    for start in range(0, listings, batch_size):
+        crops, products = [], []
+        for n in range(start, min(listings, start + batch_size)):
+            name = rng.choice(NAMES)
+            description = ' '.join(rng.sample(WORDS, 4)) + f' {name.lower()} lot {n}'
+            if n % 2:
+                products.append({'name': f'{name} {rng.choice(VARIETIES)}', 'description': description,
+                                 'category': rng.choice(CATEGORIES), 'unit': rng.choice(UNITS),
+                                 'current_stock': rng.choice([0, 5, 50, 500]), 'reorder_level': 10,
+                                 'price_per_unit': round(rng.uniform(1, 1500), 2), 'farmer_id': farmer.id})
+            else:
+                crops.append({'farmer_id': farmer.id, 'name': name, 'variety': rng.choice(VARIETIES),
+                              'description': description, 'quantity': 100, 'unit': rng.choice(UNITS),
+                              'price_per_unit': round(rng.uniform(1, 1500), 2),
+                              'status': rng.choice(['growing', 'ready_for_harvest', 'harvested']),
+                              'planting_date': now, 'expected_harvest_date': now})
+        db.session.execute(insert(Crop), crops)
+        db.session.execute(insert(Product), products)
+    db.session.commit()
+    db.session.execute(db.text("INSERT INTO search_fts(search_fts) VALUES ('optimize')"))
+    db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--listings', type=int, default=500000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    os.environ['DISTANCE_CACHE_DIR'] = ''
+    sys.path.insert(0, ROOT)
+    from app import app
+    from extensions import db
+    from search import search
+
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        seed(args.listings, random.Random(2))
+        print(f'Seeded {args.listings} listings in {time.perf_counter() - started:.1f}s')
+
+        cases = [
+            ('selective words', dict(query='lot 47110')),
+            ('common word', dict(query='maize')),
+            ('misspelt word', dict(query='avocadoes')),
+            ('prefix and filters', dict(query='sweet pot', kind='crop', unit='kg', max_price=200)),
+            ('browse, filtered', dict(kind='product', category='Fruit', min_price=100, max_price=120)),
+            ('browse, everything', dict(statuses=None)),
+            ('deep page', dict(query='fresh', page=200)),
+        ]
+        print(f'{"":20s} {"first":>8s}  {"repeat":>8s}')
+        for label, kwargs in cases:
+            # The first call pays for the facet counts; repeats (next pages) reuse them
+            started = time.perf_counter()
+            result = search(**kwargs)
+            first = time.perf_counter() - started
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                result = search(**kwargs)
+                timings.append(time.perf_counter() - started)
+            print(f'{label:20s} {first * 1000:6.1f}ms  {min(timings) * 1000:6.1f}ms  {result["total"]:>7} matches'
+                  + (f'  (corrected to "{result["corrected_query"]}")' if result['corrected_query'] else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Dashboard read latency while checkouts write to the same SQLite file.
+
+Each database profile runs in its own process (the profile is applied when
+the app module is imported). Reader threads render the three dashboards while
+a writer thread places checkouts and adjusts inventory as fast as it can.
+
+    python benchmarks/sqlite_read_latency.py --seconds 10 --readers 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_profile(seconds, readers):
+    sys.path.insert(0, ROOT)
+    from app import app
+    from extensions import db
+    from models import User, Product, Order, OrderItem, InventoryItem
+    from checkout import checkout_cart, CheckoutError
+    from sqlalchemy import update
+
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+        farmer = User(username='farmer', email='f@bench.test', role='farmer')
+        distributor = User(username='distributor', email='d@bench.test', role='distributor')
+        retailer = User(username='retailer', email='r@bench.test', role='retailer', location='Cape Town')
+        db.session.add_all([farmer, distributor, retailer])
+        db.session.flush()
+        products = [Product(name=f'Product {i}', category=f'Category {i % 5}', unit='kg', current_stock=10 ** 7,
+                            reorder_level=10, price_per_unit=1.0 + i, farmer_id=farmer.id) for i in range(50)]
+        db.session.add_all(products)
+        db.session.add_all([InventoryItem(distributor_id=distributor.id, name=f'Item {i}', category='Bench',
+                                          quantity=1000, unit='kg', min_quantity=10, price_per_unit=2.0)
+                            for i in range(50)])
+        db.session.flush()
+        now = datetime.utcnow()
+        for n in range(3000):
+            order = Order(farmer_id=farmer.id, retailer_id=retailer.id, distributor_id=distributor.id,
+                          status='completed', total_amount=10.0 + n % 50, created_at=now - timedelta(days=n % 700),
+                          completed_at=now - timedelta(days=n % 700))
+            db.session.add(order)
+            db.session.flush()
+            db.session.add(OrderItem(order_id=order.id, product_id=products[n % 50].id, quantity=1 + n % 3,
+                                     price_per_unit=products[n % 50].price_per_unit))
+        db.session.commit()
+        user_ids = {'farmer': farmer.id, 'distributor': distributor.id, 'retailer': retailer.id}
+        retailer_id, distributor_id = retailer.id, distributor.id
+
+    stop = threading.Event()
+    latencies = []
+    errors = [0]
+    writes = [0]
+    lock = threading.Lock()
+
+    def writer():
+        with app.app_context():
+            retailer = db.session.get(User, retailer_id)
+            distributor = db.session.get(User, distributor_id)
+            n = 0
+            while not stop.is_set():
+                n += 1
+                try:
+                    checkout_cart(retailer, distributor, [{'id': 1 + n % 50, 'quantity': 1}, {'id': 1 + (n * 7) % 50, 'quantity': 2}])
+                    db.session.execute(update(InventoryItem).where(InventoryItem.id == 1 + n % 50)
+                                       .values(quantity=InventoryItem.quantity + 1))
+                    db.session.commit()
+                    writes[0] += 1
+                except CheckoutError:
+                    pass
+
+    def reader(role):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_ids[role])
+            session['_fresh'] = True
+        path = f'/{role}/dashboard'
+        while not stop.is_set():
+            started = time.perf_counter()
+            response = client.get(path)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                if response.status_code == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    roles = ['farmer', 'distributor', 'retailer']
+    threads = [threading.Thread(target=writer)]
+    threads += [threading.Thread(target=reader, args=(roles[i % 3],)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return {
+        'reads': len(latencies),
+        'read_errors': errors[0],
+        'writes': writes[0],
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies) if latencies else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--profile', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.profile:
+        print(json.dumps(run_profile(args.seconds, args.readers)))
+        return
+
+    for profile in ('default', 'production'):
+        db_dir = tempfile.mkdtemp(prefix='latency_bench_')
+        env = dict(os.environ,
+                   DATABASE_URL=f'sqlite:///{os.path.join(db_dir, "bench.db")}',
+                   DATABASE_PROFILE=profile)
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--profile', profile,
+             '--seconds', str(args.seconds), '--readers', str(args.readers)],
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{profile:>10}: reads={result['reads']} read_errors={result['read_errors']} writes={result['writes']} "
+              f"p50={result['p50']:.1f}ms p95={result['p95']:.1f}ms p99={result['p99']:.1f}ms max={result['max']:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Time as-of inventory reports against a long stock ledger, before and after compaction.
+
+Seeds a throwaway SQLite file with one distributor's inventory items and a
+year of daily movements per item, then reads the whole inventory as it
+stood a week ago by replaying the ledger, compacts it monthly and reads the
+same report from snapshot plus tail.
+
+    python benchmarks/stock_ledger.py --items 500 --days 365
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=500)
+    parser.add_argument('--days', type=int, default=365)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    os.environ['DISTANCE_CACHE_DIR'] = ''
+    os.environ['SQLITE_MAINTENANCE_INTERVAL'] = '0'
+    os.environ['UPLOAD_SWEEP_INTERVAL'] = '0'
+    sys.path.insert(0, ROOT)
+    from sqlalchemy import insert, select
+    from app import app
+    from extensions import db
+    from models import User, InventoryItem, StockMovement
+    from stock_ledger import compact_stock_ledger, stock_levels
+
+    with app.app_context():
+        db.create_all()
+        distributor = User(username='distributor', email='d@bench.test', role='distributor')
+        distributor.set_password('password123')
+        db.session.add(distributor)
+        db.session.flush()
+        db.session.execute(insert(InventoryItem), [{
+            'distributor_id': distributor.id, 'name': f'Item {n}', 'category': 'Grains', 'quantity': 0,
+            'unit': 'kg', 'min_quantity': 10, 'price_per_unit': 5
+        } for n in range(args.items)])
+        ids = db.session.execute(select(InventoryItem.id)).scalars().all()
+        start = datetime.utcnow() - timedelta(days=args.days)
+        for day in range(args.days):
+            db.session.execute(insert(StockMovement), [{
+                'item_type': 'inventory', 'item_id': item_id, 'delta': 5 if (day + item_id) % 3 else -3,
+                'reason': 'received', 'created_at': start + timedelta(days=day, hours=item_id % 24)
+            } for item_id in ids])
+        db.session.commit()
+
+        report = select(InventoryItem.id).where(InventoryItem.distributor_id == distributor.id)
+        as_of = datetime.utcnow() - timedelta(days=7)
+        started = time.perf_counter()
+        replayed = stock_levels('inventory', report, as_of)
+        replay_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        snapshots = sum(compact_stock_ledger(start + timedelta(days=month * 30))
+                        for month in range(1, args.days // 30 + 1))
+        compact_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        compacted = stock_levels('inventory', report, as_of)
+        snapshot_time = time.perf_counter() - started
+        assert compacted == replayed
+
+        print(f'{args.items} items x {args.days} days ({args.items * args.days} movements): '
+              f'replay {replay_time * 1000:.1f}ms, compaction {compact_time:.1f}s ({snapshots} snapshots), '
+              f'snapshot + tail {snapshot_time * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Time a stock-take sent item by item against the same stock-take sent as one batch.
+
+Seeds a throwaway SQLite file with one distributor's inventory, then counts
+every item through ``PUT /api/inventory/<id>/stock`` (one request and
+transaction per item) and through ``PUT /api/inventory/stock`` (one of each
+for the whole count).
+
+    python benchmarks/stock_take.py --items 500
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=500)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ['DISTANCE_CACHE_DIR'] = ''
+    os.environ['SQLITE_MAINTENANCE_INTERVAL'] = '0'
+    os.environ['UPLOAD_SWEEP_INTERVAL'] = '0'
+    sys.path.insert(0, ROOT)
+    from sqlalchemy import insert, select
+    from app import app
+    from extensions import db
+    from models import User, InventoryItem
+
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        db.create_all()
+        distributor = User(username='distributor', email='d@bench.test', role='distributor')
+        distributor.set_password('password123')
+        db.session.add(distributor)
+        db.session.flush()
+        distributor_id = distributor.id
+        db.session.execute(insert(InventoryItem), [{
+            'distributor_id': distributor_id, 'name': f'Item {n}', 'category': 'Grains', 'quantity': 100,
+            'unit': 'kg', 'min_quantity': 10, 'price_per_unit': 5
+        } for n in range(args.items)])
+        db.session.commit()
+        ids = db.session.execute(select(InventoryItem.id)).scalars().all()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(distributor_id)
+        session['_fresh'] = True
+
+    started = time.perf_counter()
+    for item_id in ids:
+        response = client.put(f'/api/inventory/{item_id}/stock', json={'adjustment_type': 'remove', 'quantity': 1})
+        assert response.status_code == 200, response.get_json()
+    single_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    response = client.put('/api/inventory/stock', json={'adjustments': [
+        {'id': item_id, 'adjustment_type': 'set', 'quantity': 90} for item_id in ids]})
+    batch_time = time.perf_counter() - started
+    assert response.status_code == 200, response.get_json()
+
+    print(f'{len(ids)} items: one request per item {single_time:.2f}s, one batch {batch_time * 1000:.0f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Planning quality and solve time of the delivery route solver.
+
+Generates random days of deliveries around a depot and solves them with
+routing.RouteSolver. Some deliveries are timed; the rest can arrive any time
+in the shift. Reports the fleet size and distance from the savings
+construction and after local search, next to a nearest-neighbour baseline,
+along with solve times.
+
+    python benchmarks/vrp_routes.py --stops 100 300 500 --seeds 3
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from geo import distance_matrix  # noqa: E402
+from routing import ROAD_FACTOR, RouteSolver, SHIFT_END, SHIFT_START  # noqa: E402
+
+DEPOT = (-33.9249, 18.4241)  # Cape Town
+
+
+def instance(stops, rng, radius_km=80, timed_share=0.3):
+    points = [DEPOT]
+    for _ in range(stops):
+        # Uniform over a disc, converted from km to degrees
+        distance = radius_km * math.sqrt(rng.random())
+        bearing = rng.uniform(0, 2 * math.pi)
+        points.append((DEPOT[0] + distance * math.cos(bearing) / 111.0,
+                       DEPOT[1] + distance * math.sin(bearing) / (111.0 * math.cos(math.radians(DEPOT[0])))))
+    distances = (distance_matrix(points) * ROAD_FACTOR).tolist()
+    demands = [rng.choice([25, 50, 100, 150, 250]) for _ in range(stops)]
+    windows = []
+    for _ in range(stops):
+        if rng.random() < timed_share:
+            opens = rng.randrange(SHIFT_START + 60, SHIFT_END - 5 * 60, 30)
+            windows.append((opens, opens + 4 * 60))
+        else:
+            windows.append((SHIFT_START, SHIFT_END))
+    return distances, demands, windows
+
+
+def nearest_neighbour(solver):
+    """Baseline: keep driving to the closest stop that still fits, then go home."""
+    remaining = {stop for stop in range(1, solver.size + 1) if solver._finish([stop]) is not None}
+    routes = []
+    while remaining:
+        route = []
+        while True:
+            last = route[-1] if route else 0
+            for candidate in sorted(remaining, key=solver.distances[last].__getitem__):
+                if solver._finish(route + [candidate]) is not None:
+                    route.append(candidate)
+                    remaining.discard(candidate)
+                    break
+            else:
+                break
+        routes.append(route)
+    return routes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stops', type=int, nargs='+', default=[100, 300, 500])
+    parser.add_argument('--seeds', type=int, default=3)
+    parser.add_argument('--time-limit', type=float, default=2.0)
+    args = parser.parse_args()
+
+    print(f"{'stops':>5} {'seed':>4} | {'NN vans':>7} {'NN km':>8} | {'CW km':>8} | "
+          f"{'final vans':>10} {'final km':>8} {'vs NN':>6} {'solve s':>7} {'unassigned':>10}")
+    for stops in args.stops:
+        for seed in range(args.seeds):
+            distances, demands, windows = instance(stops, random.Random(seed))
+            solver = RouteSolver(distances, demands, windows)
+            baseline = nearest_neighbour(solver)
+            baseline_km = sum(solver._distance(route) for route in baseline)
+
+            started = time.perf_counter()
+            plan = RouteSolver(distances, demands, windows).solve(time_limit=args.time_limit)
+            elapsed = time.perf_counter() - started
+            print(f'{stops:>5} {seed:>4} | {len(baseline):>7} {baseline_km:>8.0f} | '
+                  f'{plan.construction_km:>8.0f} | {len(plan.routes):>10} {plan.distance_km:>8.0f} '
+                  f'{plan.distance_km / baseline_km - 1:>+6.1%} {elapsed:>7.2f} {len(plan.unassigned):>10}')
+
+
+if __name__ == '__main__':
+    main()
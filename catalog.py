@@ -0,0 +1,170 @@
+"""Product catalog pages for the retailer dashboard.
+
+The dashboard loads the in-stock catalog a page at a time as the user
+scrolls, instead of rendering every product into the page. Pages are
+addressed by keyset cursors over the chosen sort key plus ``id``, so a deep
+page costs the same index seek as the first one. Callers can ask for a
+subset of fields, and products already referenced elsewhere (a cart, say)
+can be fetched by id in one request.
+"""
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import case, func, literal_column, select, tuple_
+from extensions import db
+from models import Product, Supplier
+from pagination import InvalidCursor, KeysetPage, MAX_PER_PAGE, clamp_per_page, count_cache
+from stock_alerts import low_stock_product_count
+
+MAX_LOOKUP_IDS = MAX_PER_PAGE
+
+STOCK_STATUS = case(
+    (func.coalesce(Product.current_stock, 0) <= 0, 'out_of_stock'),
+    (Product.current_stock <= func.coalesce(Product.reorder_level, 0), 'low_stock'),
+    else_='in_stock'
+)
+
+FIELDS = {
+    'id': Product.id,
+    'name': Product.name,
+    'description': Product.description,
+    'category': Product.category,
+    'unit': Product.unit,
+    'current_stock': Product.current_stock,
+    'reorder_level': Product.reorder_level,
+    'price_per_unit': Product.price_per_unit,
+    'status': STOCK_STATUS,
+    'supplier': Supplier.name,
+    'farmer_id': Product.farmer_id,
+    'updated_at': Product.updated_at,
+}
+DEFAULT_FIELDS = ('id', 'name', 'category', 'unit', 'current_stock', 'reorder_level', 'price_per_unit', 'status',
+                  'supplier')
+
+# Sort name -> (key expression, descending); ties are broken by id in the same direction.
+# The price key must render exactly like ix_products_price, so its 0 is not a bound parameter.
+PRICE_KEY = func.coalesce(Product.price_per_unit, literal_column('0'))
+SORTS = {
+    'name': (Product.name, False),
+    'price': (PRICE_KEY, False),
+    '-price': (PRICE_KEY, True),
+    'newest': (Product.created_at, True),
+}
+DEFAULT_SORT = 'name'
+
+
+def encode_cursor(sort, value, row_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort):
+    """Return the `(sort key, id)` pair stored in a cursor made for `sort`."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, value, row_id = json.loads(raw)
+        if cursor_sort != sort:
+            raise ValueError(f'cursor was made for sort {cursor_sort!r}')
+        if sort == 'newest':
+            value = datetime.fromisoformat(value)
+        return value, int(row_id)
+    except (TypeError, ValueError) as e:
+        raise InvalidCursor(f'Invalid cursor: {cursor!r}') from e
+
+
+def parse_fields(value):
+    """Field names from a comma separated list, `id` always included; raises ValueError on unknown names."""
+    if not value:
+        return DEFAULT_FIELDS
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return tuple(dict.fromkeys(['id'] + names))
+
+
+def parse_ids(value, limit=MAX_LOOKUP_IDS):
+    """Product ids from a comma separated list; raises ValueError if any is not a number or there are too many."""
+    try:
+        ids = list(dict.fromkeys(int(part) for part in value.split(',') if part.strip()))
+    except ValueError:
+        raise ValueError('ids must be a comma separated list of numbers')
+    if not ids:
+        raise ValueError('ids must name at least one product')
+    if len(ids) > limit:
+        raise ValueError(f'At most {limit} ids can be requested at once')
+    return ids
+
+
+def _select(fields, *extra):
+    query = select(*[FIELDS[name].label(name) for name in fields], *extra)
+    if 'supplier' in fields:
+        query = query.select_from(Product).outerjoin(Supplier, Supplier.id == Product.supplier_id)
+    return query
+
+
+def _serialize(row, fields):
+    item = {}
+    for name in fields:
+        value = getattr(row, name)
+        item[name] = value.isoformat() if isinstance(value, datetime) else value
+    return item
+
+
+def _in_stock(query, category, ordered=False):
+    if ordered:
+        # Hides the stock index, so a page walks its sort index and stops after one page
+        # instead of sorting every product in stock
+        query = query.where(Product.current_stock + 0 > 0)
+    else:
+        query = query.where(Product.current_stock > 0)
+    if category:
+        query = query.where(Product.category == category)
+    return query
+
+
+def catalog_page(sort=DEFAULT_SORT, after=None, per_page=None, category=None, fields=DEFAULT_FIELDS):
+    """Return a KeysetPage of in-stock products as dicts of `fields`.
+
+    Pass the `next_cursor` of a page as `after` to continue. The total is
+    estimated through the shared count cache.
+    """
+    if sort not in SORTS:
+        raise ValueError(f"sort must be one of {', '.join(SORTS)}")
+    key, descending = SORTS[sort]
+    per_page = clamp_per_page(per_page)
+    row_key = tuple_(key, Product.id)
+
+    query = _in_stock(_select(fields, key.label('_sort_key'), Product.id.label('_sort_id')), category, ordered=True)
+    if after:
+        boundary = decode_cursor(after, sort)
+        # The plain bound on the key lets SQLite seek an expression index; the row value alone does not
+        if descending:
+            query = query.where(key <= boundary[0], row_key < boundary)
+        else:
+            query = query.where(key >= boundary[0], row_key > boundary)
+    order = (key.desc(), Product.id.desc()) if descending else (key.asc(), Product.id.asc())
+    rows = db.session.execute(query.order_by(*order).limit(per_page + 1)).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(sort, rows[-1]._sort_key, rows[-1]._sort_id)
+    total = count_cache.get_or_set(('catalog', category), lambda: db.session.execute(
+        _in_stock(select(func.count(Product.id)), category)).scalar())
+    return KeysetPage([_serialize(row, fields) for row in rows], per_page, next_cursor=next_cursor, total=total)
+
+
+def products_by_id(ids, fields=DEFAULT_FIELDS):
+    """Products with the given ids in the order asked for, whatever their stock, and the ids not found."""
+    rows = db.session.execute(_select(fields, Product.id.label('_sort_id')).where(Product.id.in_(ids))).all()
+    found = {row._sort_id: _serialize(row, fields) for row in rows}
+    return [found[i] for i in ids if i in found], [i for i in ids if i not in found]
+
+
+def stock_summary():
+    """Counts of in-stock products and of those at or below their reorder level, from their open alerts."""
+    in_stock = db.session.execute(_in_stock(select(func.count(Product.id)), None)).scalar()
+    return {'in_stock': in_stock, 'low_stock': low_stock_product_count()}
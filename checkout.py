@@ -0,0 +1,184 @@
+"""Set-based retailer checkout.
+
+Cart products are loaded with one ``IN`` query and stock is reserved with
+guarded ``UPDATE ... WHERE current_stock >= ?`` statements, so concurrent
+checkouts can never oversell: whichever transaction reaches the row second
+sees the already reduced stock and its reservation simply matches no row.
+Order items, per-farmer child orders and the stock ledger movements are
+then written in bulk.
+"""
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import insert, update
+from sqlalchemy.exc import OperationalError
+from extensions import db
+from models import Product, Order, OrderItem, Delivery
+from order_events import record_order_event
+from stock_ledger import record_movements
+from routing import delivery_day, local_today
+
+LOCK_RETRIES = 3  # Attempts when SQLite reports the database as locked
+LOCK_RETRY_DELAY = 0.05
+
+
+class CheckoutError(Exception):
+    """Raised when a cart cannot be turned into an order."""
+
+    def __init__(self, message, failures=None):
+        super().__init__(message)
+        self.failures = failures or []
+
+
+def _normalize_items(cart_items):
+    """Merge cart lines per product and collect lines that cannot be parsed."""
+    quantities = {}
+    failures = []
+    for item in cart_items:
+        try:
+            product_id = int(item['id'])
+            quantity = int(item.get('quantity', 1))
+        except (KeyError, TypeError, ValueError):
+            failures.append({'product_id': item.get('id') if isinstance(item, dict) else None,
+                             'error': 'Invalid cart item'})
+            continue
+        if quantity <= 0:
+            failures.append({'product_id': product_id, 'error': 'Quantity must be at least 1'})
+            continue
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities, failures
+
+
+def _reserve_stock(product_id, quantity):
+    """Atomically take `quantity` units if they are available; True on success."""
+    result = db.session.execute(
+        update(Product)
+        .where(Product.id == product_id, Product.current_stock >= quantity)
+        .values(current_stock=Product.current_stock - quantity, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def _place(retailer, distributor, quantities, failures, allow_partial, now):
+    products = {
+        product.id: product
+        for product in Product.query.filter(Product.id.in_(list(quantities))).all()
+    }
+
+    # Reservations are the first writes of the transaction, so rejecting the
+    # cart only has to roll back the stock taken for its own lines
+    reserved = []
+    for product_id in sorted(quantities):
+        quantity = quantities[product_id]
+        product = products.get(product_id)
+        if product is None:
+            failures.append({'product_id': product_id, 'error': f'Product {product_id} not found'})
+        elif product.price_per_unit is None:
+            failures.append({'product_id': product_id, 'error': f'{product.name} has no price'})
+        elif _reserve_stock(product_id, quantity):
+            reserved.append((product, quantity))
+        else:
+            available = db.session.query(Product.current_stock).filter(Product.id == product_id).scalar()
+            failures.append({
+                'product_id': product_id,
+                'error': f'Insufficient stock for {product.name}. Available: {available}',
+                'available': available
+            })
+
+    if not reserved or (failures and not allow_partial):
+        raise CheckoutError(failures[0]['error'] if failures else 'Cart is empty', failures)
+
+    total_amount = sum(quantity * product.price_per_unit for product, quantity in reserved)
+
+    # Create the retailer's order
+    order = Order(
+        retailer_id=retailer.id,
+        distributor_id=distributor.id,
+        status='pending',
+        total_amount=total_amount,
+        created_at=now
+    )
+    db.session.add(order)
+
+    # Group items by farmer for creating farmer-specific orders
+    farmer_lines = {}
+    for product, quantity in reserved:
+        if product.farmer_id is not None:
+            farmer_lines.setdefault(product.farmer_id, []).append((product, quantity))
+
+    farmer_orders = [
+        (Order(
+            farmer_id=farmer_id,
+            retailer_id=retailer.id,
+            distributor_id=distributor.id,
+            status='pending',
+            total_amount=sum(quantity * product.price_per_unit for product, quantity in lines),
+            created_at=now,
+            parent_order=order
+        ), lines)
+        for farmer_id, lines in farmer_lines.items()
+    ]
+    db.session.add_all([farmer_order for farmer_order, _lines in farmer_orders])
+    db.session.flush()  # Assigns ids to the parent and child orders in one batch
+
+    # Bulk insert the order items for the parent and every child order
+    item_rows = [
+        {'order_id': order.id, 'product_id': product.id, 'quantity': quantity,
+         'price_per_unit': product.price_per_unit}
+        for product, quantity in reserved
+    ]
+    for farmer_order, lines in farmer_orders:
+        item_rows.extend(
+            {'order_id': farmer_order.id, 'product_id': product.id, 'quantity': quantity,
+             'price_per_unit': product.price_per_unit}
+            for product, quantity in lines
+        )
+    db.session.execute(insert(OrderItem), item_rows)
+    record_movements(('product', product.id, -quantity, 'sale', order.id) for product, quantity in reserved)
+
+    # Create initial delivery record
+    db.session.add(Delivery(
+        order_id=order.id,
+        distributor_id=distributor.id,
+        status='scheduled',
+        scheduled_date=delivery_day(local_today(now) + timedelta(days=1)),  # Any time tomorrow, local time
+        delivery_address=retailer.location or '',  # Use retailer's address
+        tracking_number=f'TRK{order.id:09d}'  # Derived from the order id so concurrent checkouts never collide
+    ))
+
+    record_order_event(order, 'order_created')
+    for farmer_order, _lines in farmer_orders:
+        record_order_event(farmer_order, 'order_created')
+
+    db.session.commit()
+    return order
+
+
+def checkout_cart(retailer, distributor, cart_items, allow_partial=False, now=None):
+    """Turn a cart into an order and return `(order, failures)`.
+
+    Lines that cannot be fulfilled are reported in `failures`. Unless
+    `allow_partial` is set, any failed line rejects the whole cart and raises
+    CheckoutError with the per-line failures attached.
+    """
+    quantities, parse_failures = _normalize_items(cart_items)
+    if not quantities:
+        raise CheckoutError(parse_failures[0]['error'] if parse_failures else 'Cart is empty', parse_failures)
+    if parse_failures and not allow_partial:
+        raise CheckoutError(parse_failures[0]['error'], parse_failures)
+
+    now = now or datetime.utcnow()
+    for attempt in range(LOCK_RETRIES):
+        failures = list(parse_failures)
+        try:
+            order = _place(retailer, distributor, quantities, failures, allow_partial, now)
+            return order, failures
+        except CheckoutError:
+            db.session.rollback()
+            raise
+        except OperationalError as e:
+            db.session.rollback()
+            # Another checkout holds the write lock; retry with fresh stock levels
+            if 'locked' not in str(e) or attempt == LOCK_RETRIES - 1:
+                raise
+            time.sleep(LOCK_RETRY_DELAY * (attempt + 1))
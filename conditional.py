@@ -0,0 +1,121 @@
+"""Conditional GET handling driven by row versions.
+
+A view decorated with ``conditional`` names a validator: a function of the
+view arguments that fetches only what decides the response, typically the
+``updated_at`` of the rows it shows in one indexed lookup, and returns a
+``Validator`` built from those parts. When the request carries a matching
+``If-None-Match`` (or, without one, an ``If-Modified-Since`` no older than
+the rows) the client gets an empty 304 and the view, its queries and its
+template never run. Otherwise the view runs and its 200 response is
+stamped with the ``ETag``, ``Last-Modified`` and the route's
+``Cache-Control`` policy.
+
+Validators return None when the request would not get a 200 (a missing row
+or one the user may not see), which leaves the answer to the view. The
+current user and the release of the templates and code are part of every
+ETag, so a different login or a deploy never revalidates a stale page.
+Views that embed CSRF tokens should not be decorated: a revalidated page
+would keep serving an expired token.
+"""
+import hashlib
+import os
+from datetime import datetime
+from functools import wraps
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+
+# Cache-Control per kind of route; responses are per user, so never stored by shared caches
+CACHE_POLICIES = {
+    'private': 'private, no-cache',  # Revalidated on every use
+    'private-short': 'private, max-age=30, must-revalidate',  # Reused for a few seconds, e.g. back navigation
+}
+DEFAULT_POLICY = 'private'
+
+
+class Validator:
+    """Strong ETag and optional Last-Modified of one response."""
+    __slots__ = ('etag', 'last_modified')
+
+    def __init__(self, etag, last_modified=None):
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+def _stamp(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def validator(*parts, last_modified=None):
+    """Validator hashing `parts`, e.g. the ids and ``updated_at`` of the rows a response shows."""
+    digest = hashlib.blake2b(repr([_stamp(part) for part in parts]).encode(), digest_size=16)
+    return Validator(digest.hexdigest(), last_modified)
+
+
+def rows_validator(kind, rows, *parts):
+    """Validator of a collection from its `(id, updated_at)` rows; the newest row is its Last-Modified."""
+    rows = list(rows)
+    stamps = [updated_at for _row_id, updated_at in rows if updated_at is not None]
+    return validator(kind, rows, *parts, last_modified=max(stamps) if stamps else None)
+
+
+def release_token(app):
+    """Fingerprint of the templates and modules, so responses change their ETag on deploy."""
+    digest = hashlib.blake2b(digest_size=8)
+    root = app.root_path
+    for folder in (root, os.path.join(root, app.template_folder or 'templates')):
+        for name in sorted(os.listdir(folder)):
+            if name.endswith(('.py', '.html')):
+                stat = os.stat(os.path.join(folder, name))
+                digest.update(f'{name}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return digest.hexdigest()
+
+
+def _etag(found):
+    # Responses differ per user (the navigation shows who is logged in) and per release
+    user = current_user.get_id() if current_user.is_authenticated else None
+    raw = f"{found.etag}:{user}:{current_app.config.get('RESPONSE_VERSION', '')}"
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified is not None:
+        # HTTP dates have whole seconds
+        return last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def _headers(response, etag, last_modified, policy):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = CACHE_POLICIES[policy]
+    response.vary.add('Cookie')
+    return response
+
+
+def conditional(validate, policy=DEFAULT_POLICY):
+    """Answer conditional GETs of a view from `validate(**view_args)` before the view runs."""
+    if policy not in CACHE_POLICIES:
+        raise ValueError(f'Unknown cache policy {policy!r}')
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # Pending flash messages must be rendered, not revalidated away
+            if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+                return f(*args, **kwargs)
+            found = validate(**kwargs)
+            if found is None:
+                return f(*args, **kwargs)
+            etag = _etag(found)
+            if _not_modified(etag, found.last_modified):
+                return _headers(current_app.response_class(status=304), etag, found.last_modified, policy)
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                _headers(response, etag, found.last_modified, policy)
+            return response
+        return decorated_function
+    return decorator
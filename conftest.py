@@ -0,0 +1,66 @@
+import os
+import pytest
+
+# Tests run against an in-memory database, never the instance database file,
+# and never write distance matrices into the instance folder
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['DISTANCE_CACHE_DIR'] = ''
+
+from app import app as flask_app  # noqa: E402
+from extensions import db  # noqa: E402
+from models import User  # noqa: E402
+from user_cache import load_cached_user  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def clear_process_caches():
+    # Ids are reused when each test recreates the schema, so cached rows must not leak between tests
+    from user_cache import user_cache
+    from pagination import count_cache
+    from dashboard_cache import dashboard_cache
+    from market import latest_prices
+    from assignment import distributor_index
+    from search import facet_cache, _vocabulary
+    user_cache.clear()
+    count_cache.clear()
+    dashboard_cache.clear()
+    latest_prices.clear()
+    distributor_index.clear()
+    facet_cache.clear()
+    _vocabulary.invalidate()
+    yield
+
+
+@pytest.fixture
+def schema():
+    """Create the tables for one test and drop them afterwards; yields the app with CSRF checks off."""
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with flask_app.app_context():
+        db.create_all()
+    yield flask_app
+    with flask_app.app_context():
+        db.drop_all()
+
+
+def add_users(prefix, roles, **columns):
+    """Add a user per `{name: role}` entry (or per role) and flush; returns `{name: User}`."""
+    if not isinstance(roles, dict):
+        roles = {role: role for role in roles}
+    users = {name: User(username=f'{prefix}_{name}', email=f'{name}@{prefix}.test', role=role, **columns)
+             for name, role in roles.items()}
+    for user in users.values():
+        user.set_password('password123')
+    db.session.add_all(users.values())
+    db.session.flush()
+    return users
+
+
+def client_for(user_id):
+    """A test client logged in as `user_id`, whose identity is already cached as after a real login."""
+    with flask_app.app_context():
+        load_cached_user(user_id)
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
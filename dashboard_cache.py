@@ -0,0 +1,128 @@
+"""Per-user cache of dashboard widgets.
+
+Each dashboard is assembled from widgets, e.g. a farmer's crop list or a
+retailer's sales analytics. A widget's result is kept under
+``(user_id, widget)`` as plain data: numbers, dicts, or ``snapshot`` copies
+of the few row fields a template reads. Nothing cached is attached to a
+session.
+
+Entries are invalidated when a flush writes an ``Order``, ``OrderItem``,
+``Crop``, ``InventoryItem`` or ``Delivery`` owned by that user, or when
+``stock_ledger.move_stock`` changes the stock of one with a guarded UPDATE.
+The invalidation is applied once the transaction commits. The product counts
+are the same for every retailer, so they are cached under
+``(None, 'products')`` and dropped on any ``Product`` write. Other worker processes pick changes up
+when their entries expire, after at most ``DASHBOARD_CACHE_TTL`` seconds.
+"""
+from types import SimpleNamespace
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+from cache import TTLCache
+from models import Crop, Delivery, InventoryItem, Order, OrderItem, Product
+
+DASHBOARD_CACHE_TTL = 120
+DASHBOARD_CACHE_SIZE = 5000
+
+# Every widget cached per user; a user's write drops all of them
+WIDGETS = (
+    'farmer_crops', 'farmer_pending_orders', 'farmer_distributors', 'farmer_series',
+    'distributor_orders', 'distributor_revenue', 'distributor_inventory', 'distributor_deliveries',
+    'retailer_active_orders', 'retailer_recent_orders', 'retailer_analytics',
+)
+SHARED_PRODUCTS = (None, 'products')
+
+# Columns naming the users a row belongs to
+OWNER_COLUMNS = {
+    Order: ('farmer_id', 'distributor_id', 'retailer_id'),
+    Crop: ('farmer_id',),
+    InventoryItem: ('distributor_id',),
+    Delivery: ('distributor_id',),
+}
+
+dashboard_cache = TTLCache(max_size=DASHBOARD_CACHE_SIZE, ttl=DASHBOARD_CACHE_TTL)
+
+
+def cached_widget(user_id, widget, compute):
+    """Return the cached result of `widget` for `user_id`, computing it on a miss."""
+    return dashboard_cache.get_or_set((user_id, widget), compute)
+
+
+def snapshot(obj, *fields, **extra):
+    """Copy `fields` of a row into a plain object templates can read like the row."""
+    values = {name: getattr(obj, name) for name in fields}
+    values.update(extra)
+    return SimpleNamespace(**values)
+
+
+def invalidate_dashboards(user_id):
+    for widget in WIDGETS:
+        dashboard_cache.invalidate((user_id, widget))
+
+
+def _owners(obj, columns):
+    """Current and previous values of the owner columns, so a reassigned row clears both users."""
+    state = inspect(obj)
+    owners = set()
+    for name in columns:
+        history = state.attrs[name].history
+        owners.update(history.added, history.unchanged, history.deleted)
+    return owners
+
+
+def queue_invalidation(session, user_ids=(), products=False):
+    """Drop the users' dashboards (and the shared product counts) once the session commits."""
+    pending = session.info.setdefault('invalidated_dashboards', set())
+    pending.update(user_id for user_id in user_ids if user_id is not None)
+    if products:
+        pending.add(SHARED_PRODUCTS)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_invalidations(session, flush_context):
+    user_ids = set()
+    order_ids = set()
+    products = False
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        columns = OWNER_COLUMNS.get(type(obj))
+        if columns:
+            user_ids.update(_owners(obj, columns))
+        elif isinstance(obj, OrderItem):
+            order = obj.__dict__.get('order')
+            if order is not None:
+                user_ids.update(_owners(order, OWNER_COLUMNS[Order]))
+            elif obj.order_id is not None:
+                order_ids.add(obj.order_id)
+        elif isinstance(obj, Product):
+            products = True
+
+    if order_ids:
+        # Items flushed without their order loaded; one query finds its participants
+        for row in session.connection().execute(
+            select(Order.farmer_id, Order.distributor_id, Order.retailer_id).where(Order.id.in_(order_ids))
+        ):
+            user_ids.update(row)
+    if user_ids or products:
+        queue_invalidation(session, user_ids, products)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_invalidations(orm_execute_state):
+    # Bulk UPDATEs such as checkout's stock reservation skip the flush
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ is Product:
+            queue_invalidation(orm_execute_state.session, products=True)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    for key in session.info.pop('invalidated_dashboards', ()):
+        if key == SHARED_PRODUCTS:
+            dashboard_cache.invalidate(SHARED_PRODUCTS)
+        else:
+            invalidate_dashboards(key)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidations(session):
+    session.info.pop('invalidated_dashboards', None)
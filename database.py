@@ -0,0 +1,106 @@
+"""SQLite engine profiles.
+
+A profile is a set of PRAGMAs applied to every new connection plus the pool
+settings for the engine. The ``production`` profile switches the database to
+WAL so dashboard reads are not blocked by checkout and inventory writes.
+Select one with the ``DATABASE_PROFILE`` environment variable.
+"""
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from extensions import db
+from periodic import start_periodic_job
+
+SQLITE_PROFILES = {
+    # SQLite's own defaults: rollback journal, no tuning
+    'default': {
+        'pragmas': {},
+        'pool': {}
+    },
+    'production': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',  # Safe with WAL; only the last commits can be lost on power failure
+            'busy_timeout': 5000,  # Milliseconds a writer waits for the lock before failing
+            'cache_size': -64000,  # Negative values are KiB, so 64MB of page cache per connection
+            'mmap_size': 268435456,  # 256MB of memory-mapped reads
+            'temp_store': 'MEMORY'
+        },
+        'pool': {
+            'pool_size': 10,
+            'max_overflow': 20,
+            'pool_timeout': 30,
+            'pool_recycle': 3600
+        }
+    }
+}
+
+MAINTENANCE_INTERVAL = 3600  # Seconds between optimize/checkpoint runs
+
+
+def _is_file_database(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def configure_engine_options(app):
+    """Set pool options for the selected profile; call before db.init_app."""
+    profile = SQLITE_PROFILES[app.config.get('DATABASE_PROFILE', 'production')]
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    # In-memory databases use a single shared connection and cannot be pooled
+    if _is_file_database(uri):
+        for key, value in profile['pool'].items():
+            options.setdefault(key, value)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+    finally:
+        cursor.close()
+
+
+def install_pragmas(app):
+    """Apply the profile's PRAGMAs to every connection the engine opens."""
+    pragmas = SQLITE_PROFILES[app.config.get('DATABASE_PROFILE', 'production')]['pragmas']
+    if not _is_file_database(app.config['SQLALCHEMY_DATABASE_URI']):
+        # WAL and mmap do not apply to in-memory databases
+        pragmas = {name: value for name, value in pragmas.items() if name not in ('journal_mode', 'mmap_size')}
+
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name != 'sqlite':
+            return
+
+        @event.listens_for(engine, 'connect')
+        def _on_connect(dbapi_connection, connection_record):
+            apply_pragmas(dbapi_connection, pragmas)
+
+
+def run_maintenance(app):
+    """Refresh planner statistics and fold the WAL back into the database file."""
+    with app.app_context():
+        with db.engine.connect() as connection:
+            connection.execute(text('PRAGMA optimize'))
+            result = connection.execute(text('PRAGMA wal_checkpoint(PASSIVE)')).fetchone()
+            connection.commit()
+    return result
+
+
+def start_maintenance(app):
+    """Start the maintenance thread once per process."""
+    if not _is_file_database(app.config['SQLALCHEMY_DATABASE_URI']):
+        return
+    start_periodic_job(app, 'sqlite-maintenance',
+                       app.config.get('SQLITE_MAINTENANCE_INTERVAL', MAINTENANCE_INTERVAL),
+                       run_maintenance, 'SQLite maintenance')
+
+
+def init_database(app):
+    """Bind the db extension to the app using its database profile."""
+    configure_engine_options(app)
+    db.init_app(app)
+    install_pragmas(app)
@@ -0,0 +1,191 @@
+"""Demand forecasts, reorder points and restock suggestions for products.
+
+Daily demand per product is read from completed orders: each order item
+counts on the day its order completed. Checkout's per-farmer child orders
+repeat lines of their parent, so only top-level orders are read. The
+history becomes a products x days NumPy matrix and every product is fitted
+at once, one vectorised step per day:
+
+* regular demand with simple exponential smoothing;
+* intermittent demand, where the average interval between demand days
+  exceeds ``ADI_CUTOFF``, with Croston's method. It smooths the size of
+  non-zero demands and the interval between them separately, so long runs
+  of zero days do not drag the forecast towards zero.
+
+A product's history starts on its first demand day: the days before it was
+listed are not zero demand, so they neither make a new steady seller look
+intermittent nor count towards either model.
+
+The one-step-ahead errors give each product's demand spread sigma. With
+lead time L, review period R and the service level's normal quantile z:
+
+    reorder point = d * L + z * sigma * sqrt(L)
+    order-up-to   = d * (L + R) + z * sigma * sqrt(L + R)
+
+The reorder point becomes the product's ``reorder_level``. A product whose
+stock position (stock plus requested restocks) is at or below its reorder
+point gets a ``suggested`` RestockOrder bringing it up to the order-up-to
+level; the distributor turns it into a request with ``reorder_product``.
+"""
+import math
+from datetime import datetime, time, timedelta
+from statistics import NormalDist
+import numpy as np
+from sqlalchemy import Integer, cast, delete, func, insert, select, update
+from extensions import db
+from models import Order, OrderItem, Product, RestockOrder
+
+HISTORY_DAYS = 180
+LEAD_TIME_DAYS = 7
+REVIEW_DAYS = 7  # Days between forecast runs, covered by the order-up-to level
+SERVICE_LEVEL = 0.95  # Chance a lead time passes without running out
+ALPHA = 0.1  # Smoothing constant of both models
+ADI_CUTOFF = 1.32  # Average inter-demand interval above which demand counts as intermittent (Syntetos-Boylan)
+WRITE_BATCH_SIZE = 1000
+
+SUGGESTED = 'suggested'
+REQUESTED = 'requested'
+
+_UNIX_EPOCH_JULIAN_DAY = 2440587.5
+
+
+class Forecast:
+    """Per-product daily demand forecast, its error spread and the model used, as arrays aligned with `product_ids`."""
+    __slots__ = ('product_ids', 'daily_demand', 'sigma', 'intermittent')
+
+    def __init__(self, product_ids, daily_demand, sigma, intermittent):
+        self.product_ids = product_ids
+        self.daily_demand = daily_demand
+        self.sigma = sigma
+        self.intermittent = intermittent
+
+    def reorder_levels(self, lead_time=LEAD_TIME_DAYS, review_days=REVIEW_DAYS, service_level=SERVICE_LEVEL):
+        """Reorder points and order-up-to levels for the given lead time, review period and service level."""
+        z = NormalDist().inv_cdf(service_level)
+        reorder_point = self.daily_demand * lead_time + z * self.sigma * math.sqrt(lead_time)
+        cover = lead_time + review_days
+        order_up_to = self.daily_demand * cover + z * self.sigma * math.sqrt(cover)
+        return reorder_point, order_up_to
+
+
+class RestockPlan:
+    """Counts from a forecasting run."""
+    __slots__ = ('products', 'intermittent', 'suggestions')
+
+    def __init__(self, products, intermittent, suggestions):
+        self.products = products
+        self.intermittent = intermittent
+        self.suggestions = suggestions
+
+    def to_dict(self):
+        return {'products': self.products, 'intermittent': self.intermittent, 'suggestions': self.suggestions}
+
+
+def _julian_day(when):
+    return (when - datetime(1970, 1, 1)).total_seconds() / 86400 + _UNIX_EPOCH_JULIAN_DAY
+
+
+def demand_history(days=HISTORY_DAYS, today=None):
+    """Product ids with demand in the `days` days before `today`, and their products x days demand matrix."""
+    end = datetime.combine(today or datetime.utcnow().date(), time())
+    start = end - timedelta(days=days)
+    day = cast(func.julianday(Order.completed_at) - _julian_day(start), Integer)
+    rows = db.session.execute(
+        select(OrderItem.product_id, day, func.sum(OrderItem.quantity))
+        .join(Order, Order.id == OrderItem.order_id)
+        .where(Order.status == 'completed', Order.completed_at >= start, Order.completed_at < end,
+               Order.parent_order_id.is_(None), OrderItem.product_id.isnot(None))
+        .group_by(OrderItem.product_id, day)
+    ).all()
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, days))
+    product_ids, days_ago, quantities = (np.array(column) for column in zip(*rows))
+    product_ids, rows_of = np.unique(product_ids.astype(np.int64), return_inverse=True)
+    demand = np.zeros((len(product_ids), days))
+    demand[rows_of, np.clip(days_ago.astype(np.int64), 0, days - 1)] = quantities
+    return product_ids, demand
+
+
+def fit(product_ids, demand, alpha=ALPHA):
+    """Fit every row of a products x days demand matrix and return a Forecast."""
+    count, days = demand.shape
+    demand_days = np.count_nonzero(demand, axis=1)
+    # Each product's history runs from its first demand day
+    started = np.cumsum(demand > 0, axis=1) > 0
+    active_days = np.maximum(started.sum(axis=1), 1)
+    interval = active_days / np.maximum(demand_days, 1)  # Average inter-demand interval
+    intermittent = interval > ADI_CUTOFF
+
+    # Both models start from their product's averages; their errors are measured from its first demand day
+    total = demand.sum(axis=1)
+    level = total / active_days
+    size = total / np.maximum(demand_days, 1)
+    since = np.ones(count)
+    squared_error = np.zeros(count)
+    for column, active in zip(np.ascontiguousarray(demand.T), np.ascontiguousarray(started.T)):
+        forecast = np.where(intermittent, size / interval, level)
+        squared_error += np.where(active, (column - forecast) ** 2, 0.0)
+        level = np.where(active, level + alpha * (column - level), level)
+        hit = column > 0
+        size = np.where(hit, size + alpha * (column - size), size)
+        interval = np.where(hit, interval + alpha * (since - interval), interval)
+        since = np.where(hit, 1.0, np.where(active, since + 1.0, since))
+
+    daily_demand = np.where(intermittent, size / interval, level)
+    return Forecast(product_ids, daily_demand, np.sqrt(squared_error / active_days), intermittent)
+
+
+def _stock_positions(product_ids):
+    """Stock plus requested restocks of each product, aligned with `product_ids`."""
+    stock = db.session.execute(select(Product.id, Product.current_stock).order_by(Product.id)).all()
+    ids = np.array([row[0] for row in stock], dtype=np.int64)
+    levels = np.array([row[1] or 0.0 for row in stock], dtype=float)
+    positions = np.zeros(len(product_ids))
+    found = np.searchsorted(ids, product_ids)
+    known = found < len(ids)
+    known[known] = ids[found[known]] == product_ids[known]
+    positions[known] = levels[found[known]]
+    for product_id, quantity in db.session.execute(
+        select(RestockOrder.product_id, func.sum(RestockOrder.quantity))
+        .where(RestockOrder.status == REQUESTED).group_by(RestockOrder.product_id)
+    ):
+        at = np.searchsorted(product_ids, product_id)
+        if at < len(product_ids) and product_ids[at] == product_id:
+            positions[at] += quantity
+    return positions, known
+
+
+def plan_restocks(distributor_id=None, today=None, days=HISTORY_DAYS, lead_time=LEAD_TIME_DAYS,
+                  review_days=REVIEW_DAYS, service_level=SERVICE_LEVEL):
+    """Forecast every product with recent demand and store its reorder point as `reorder_level`.
+
+    With a distributor, their previous suggestions are replaced by
+    ``suggested`` RestockOrders for every product at or below its reorder
+    point. Products without demand in the window keep their reorder level.
+    Commits and returns a RestockPlan.
+    """
+    product_ids, demand = demand_history(days, today)
+    forecast = fit(product_ids, demand)
+    reorder_point, order_up_to = forecast.reorder_levels(lead_time, review_days, service_level)
+    positions, known = _stock_positions(product_ids)
+
+    levels = [{'id': int(product_id), 'reorder_level': round(float(level), 2)}
+              for product_id, level in zip(product_ids[known], reorder_point[known])]
+    for start in range(0, len(levels), WRITE_BATCH_SIZE):
+        db.session.execute(update(Product), levels[start:start + WRITE_BATCH_SIZE])
+
+    suggestions = 0
+    if distributor_id is not None:
+        db.session.execute(delete(RestockOrder).where(
+            RestockOrder.distributor_id == distributor_id, RestockOrder.status == SUGGESTED))
+        due = known & (forecast.daily_demand > 0) & (positions <= reorder_point)
+        quantities = np.ceil(order_up_to[due] - positions[due])
+        now = datetime.utcnow()
+        rows = [{'product_id': int(product_id), 'quantity': float(quantity), 'distributor_id': distributor_id,
+                 'status': SUGGESTED, 'created_at': now}
+                for product_id, quantity in zip(product_ids[due], quantities) if quantity > 0]
+        for start in range(0, len(rows), WRITE_BATCH_SIZE):
+            db.session.execute(insert(RestockOrder.__table__), rows[start:start + WRITE_BATCH_SIZE])
+        suggestions = len(rows)
+    db.session.commit()
+    return RestockPlan(int(known.sum()), int(forecast.intermittent[known].sum()), suggestions)
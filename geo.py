@@ -0,0 +1,365 @@
+"""Offline geocoding and distances for the free-text locations users and deliveries carry.
+
+Locations look like "Kimberley, Northern Cape" or "12 Long Street, Cape
+Town". They are resolved against a gazetteer of South African towns bundled
+in ``data/za_towns.csv``. No network access is needed. The gazetteer is held
+in NumPy arrays: a sorted array of normalised names (alternate names
+included) for exact lookup with ``searchsorted``, and a trigram index for
+misspelt names.
+
+Resolved coordinates are cached on ``User`` and ``Delivery`` whenever a
+location or delivery address is saved. Distance matrices are computed in one
+vectorized pass and can be cached on disk, keyed by the set of points.
+"""
+import csv
+import difflib
+import hashlib
+import math
+import os
+import re
+import tempfile
+import threading
+import unicodedata
+from functools import lru_cache
+import numpy as np
+from sqlalchemy import event, inspect, select, update
+from extensions import db
+from models import Delivery, User
+
+EARTH_RADIUS_KM = 6371.0
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'za_towns.csv')
+FUZZY_CUTOFF = 0.85  # Minimum similarity for a misspelt town name
+FUZZY_MIN_LENGTH = 5  # Shorter words are never fuzzy-matched
+FUZZY_CANDIDATES = 5  # Trigram matches checked with a full similarity ratio
+MATRIX_BLOCK_ROWS = 1024  # Rows per block, which bounds temporary memory
+CACHE_DECIMALS = 5  # Points are rounded to about a metre before keying the cache
+DISTANCE_CACHE_FILES = 64  # Newest matrices kept on disk
+GEOCODE_BATCH_SIZE = 1000
+
+PROVINCES = {
+    'Eastern Cape': ('ec',),
+    'Free State': ('fs', 'orange free state'),
+    'Gauteng': ('gp',),
+    'KwaZulu-Natal': ('kzn', 'natal'),
+    'Limpopo': ('lp',),
+    'Mpumalanga': ('mp',),
+    'North West': ('nw',),
+    'Northern Cape': ('nc',),
+    'Western Cape': ('wc',),
+}
+
+
+def normalise(text):
+    """Lowercase ASCII words separated by single spaces."""
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii').lower()
+    return ' '.join(re.findall(r'[a-z0-9]+', text.replace("'", '')))
+
+
+# Province names are matched anywhere; the short codes only as a whole part
+_PROVINCE_NAMES = {normalise(name): name for name in PROVINCES}
+_PROVINCE_CODES = dict(_PROVINCE_NAMES)
+for _name, _aliases in PROVINCES.items():
+    for _alias in _aliases:
+        _PROVINCE_CODES[normalise(_alias)] = _name
+
+
+def _trigrams(key):
+    padded = f' {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Place:
+    __slots__ = ('name', 'province', 'latitude', 'longitude', 'exact')
+
+    def __init__(self, name, province, latitude, longitude, exact=True):
+        self.name = name
+        self.province = province
+        self.latitude = latitude
+        self.longitude = longitude
+        self.exact = exact
+
+    @property
+    def point(self):
+        return (self.latitude, self.longitude)
+
+    def __repr__(self):
+        return f'<Place {self.name}, {self.province}>'
+
+
+class Gazetteer:
+    """Array-backed index of named places with exact and fuzzy lookup."""
+
+    def __init__(self, rows):
+        names, provinces, latitudes, longitudes, keys, targets = [], [], [], [], [], []
+        for row in rows:
+            place = len(names)
+            names.append(row['name'])
+            provinces.append(row['province'])
+            latitudes.append(float(row['latitude']))
+            longitudes.append(float(row['longitude']))
+            for name in [row['name']] + (row.get('alternate_names') or '').split(';'):
+                key = normalise(name)
+                if key:
+                    keys.append(key)
+                    targets.append(place)
+
+        self.names = names
+        self.provinces = provinces
+        self.latitudes = np.array(latitudes)
+        self.longitudes = np.array(longitudes)
+        # Stable sort keeps file order among equal keys, so the first listed town wins ties
+        order = np.argsort(np.array(keys), kind='stable')
+        self.keys = np.array(keys)[order]
+        self.targets = np.array(targets, dtype=np.int32)[order]
+        self.max_words = max(key.count(' ') + 1 for key in keys)
+
+        grams = {}
+        for index, key in enumerate(self.keys):
+            for gram in _trigrams(key):
+                grams.setdefault(gram, []).append(index)
+        self.grams = {gram: np.array(indexes, dtype=np.int32) for gram, indexes in grams.items()}
+        self.gram_counts = np.array([len(_trigrams(key)) for key in self.keys])
+
+    @classmethod
+    def load(cls, path=GAZETTEER_PATH):
+        with open(path, newline='', encoding='utf-8') as handle:
+            return cls(csv.DictReader(handle))
+
+    def __len__(self):
+        return len(self.names)
+
+    def place(self, index, exact=True):
+        return Place(self.names[index], self.provinces[index], float(self.latitudes[index]),
+                     float(self.longitudes[index]), exact)
+
+    def _pick(self, indexes, province):
+        if province is not None:
+            for index in indexes:
+                if self.provinces[index] == province:
+                    return index
+        return indexes[0] if indexes else None
+
+    def exact(self, name, province=None):
+        """Index of the place called `name`, preferring one in `province`; None if unknown."""
+        key = normalise(name)
+        start = np.searchsorted(self.keys, key, side='left')
+        end = np.searchsorted(self.keys, key, side='right')
+        return self._pick([int(index) for index in self.targets[start:end]], province)
+
+    def fuzzy(self, name, province=None, cutoff=FUZZY_CUTOFF):
+        """Index of the place whose name is closest to `name`, or None below `cutoff`."""
+        key = normalise(name)
+        if len(key) < FUZZY_MIN_LENGTH:
+            return None
+        grams = _trigrams(key)
+        hits = [self.grams[gram] for gram in grams if gram in self.grams]
+        if not hits:
+            return None
+        # Dice similarity of trigram sets narrows the field before the slower ratio
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.keys))
+        dice = 2 * shared / (len(grams) + self.gram_counts)
+        candidates = np.argsort(-dice, kind='stable')[:FUZZY_CANDIDATES]
+
+        best, best_ratio = [], cutoff
+        for candidate in candidates:
+            other = self.keys[candidate]
+            if dice[candidate] == 0 or other[0] != key[0]:
+                continue
+            ratio = difflib.SequenceMatcher(None, key, other).ratio()
+            if ratio > best_ratio:
+                best, best_ratio = [int(self.targets[candidate])], ratio
+            elif ratio == best_ratio and best:
+                best.append(int(self.targets[candidate]))
+        return self._pick(best, province)
+
+    def _phrases(self, part):
+        """Word n-grams of a location part, longest first and rightmost first within a length."""
+        words = part.split()
+        for size in range(min(self.max_words, len(words)), 0, -1):
+            for start in range(len(words) - size, -1, -1):
+                yield ' '.join(words[start:start + size])
+
+    def resolve(self, location):
+        """Best matching Place for a free-text location, or None.
+
+        Town names usually come after street details, so comma-separated
+        parts are tried from the right. Exact names anywhere beat misspelt
+        ones; a province named in the text settles towns that share a name.
+        """
+        parts = [normalise(part) for part in (location or '').split(',')]
+        parts = [part for part in parts if part]
+        province = None
+        for part in parts:
+            province = _PROVINCE_CODES.get(part) or next(
+                (name for key, name in _PROVINCE_NAMES.items() if re.search(rf'\b{key}\b', part)), None)
+            if province:
+                break
+        candidates = [phrase for part in reversed(parts) if part not in _PROVINCE_CODES for phrase in self._phrases(part)]
+
+        for phrase in candidates:
+            index = self.exact(phrase, province)
+            if index is not None:
+                return self.place(index)
+        for phrase in candidates:
+            index = self.fuzzy(phrase, province)
+            if index is not None:
+                return self.place(index, exact=False)
+        return None
+
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def gazetteer():
+    """The bundled gazetteer, loaded on first use."""
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                _gazetteer = Gazetteer.load()
+    return _gazetteer
+
+
+@lru_cache(maxsize=4096)
+def geocode(location):
+    """Place for a free-text location, or None if no town is recognised."""
+    if not location or not location.strip():
+        return None
+    return gazetteer().resolve(location)
+
+
+def locate(location):
+    """Return (latitude, longitude) for a free-text location, or None if no town is recognised."""
+    place = geocode(location)
+    return place.point if place else None
+
+
+def haversine_km(a, b):
+    """Great-circle distance between two (latitude, longitude) points."""
+    lat1, lon1 = math.radians(a[0]), math.radians(a[1])
+    lat2, lon2 = math.radians(b[0]), math.radians(b[1])
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+def distance_matrix(points):
+    """Symmetric NumPy matrix of great-circle distances in km between (latitude, longitude) points."""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    lat, lon = np.radians(points[:, 0]), np.radians(points[:, 1])
+    # Unit vectors turn each row into one matrix product: the chord between
+    # two points gives the same result as the haversine formula
+    vectors = np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+    matrix = np.empty((len(points), len(points)))
+    for start in range(0, len(points), MATRIX_BLOCK_ROWS):
+        block = matrix[start:start + MATRIX_BLOCK_ROWS]
+        np.dot(vectors[start:start + MATRIX_BLOCK_ROWS], vectors.T, out=block)
+        np.clip(2 - 2 * block, 0, 4, out=block)
+        np.sqrt(block, out=block)
+        np.arcsin(block / 2, out=block)
+        block *= 2 * EARTH_RADIUS_KM
+    np.fill_diagonal(matrix, 0.0)
+    return matrix
+
+
+def _prune_cache(cache_dir, keep=DISTANCE_CACHE_FILES):
+    entries = sorted((entry for entry in os.scandir(cache_dir) if entry.name.endswith('.npy')),
+                     key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[keep:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def cached_distance_matrix(points, cache_dir=None):
+    """distance_matrix for `points`, reusing a matrix cached on disk for the same set of locations.
+
+    The cache is keyed by the distinct points, rounded to about a metre, so
+    the same places in another order (or repeated) share one file. Without
+    `cache_dir` nothing is written.
+    """
+    points = np.round(np.asarray(points, dtype=float).reshape(-1, 2), CACHE_DECIMALS)
+    if not len(points):
+        return np.zeros((0, 0))
+    unique, inverse = np.unique(points, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    if not cache_dir:
+        return distance_matrix(unique)[np.ix_(inverse, inverse)]
+
+    path = os.path.join(cache_dir, hashlib.sha1(unique.tobytes()).hexdigest() + '.npy')
+    matrix = None
+    if os.path.exists(path):
+        try:
+            matrix = np.load(path)
+            os.utime(path)  # Recently used files survive pruning
+        except (OSError, ValueError):
+            matrix = None
+        if matrix is not None and matrix.shape != (len(unique), len(unique)):
+            matrix = None
+    if matrix is None:
+        matrix = distance_matrix(unique)
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written aside and renamed, so readers never see a partial file
+        handle, temporary = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as stream:
+            np.save(stream, matrix)
+        os.replace(temporary, path)
+        _prune_cache(cache_dir)
+    return matrix[np.ix_(inverse, inverse)]
+
+
+# Coordinates cached on users and deliveries
+
+def _store_coordinates(target, text):
+    place = geocode(text)
+    target.latitude = place.latitude if place else None
+    target.longitude = place.longitude if place else None
+
+
+@event.listens_for(User, 'before_insert')
+def _geocode_new_user(mapper, connection, target):
+    _store_coordinates(target, target.location)
+
+
+@event.listens_for(User, 'before_update')
+def _geocode_user(mapper, connection, target):
+    if inspect(target).attrs.location.history.has_changes():
+        _store_coordinates(target, target.location)
+
+
+@event.listens_for(Delivery, 'before_insert')
+def _geocode_new_delivery(mapper, connection, target):
+    _store_coordinates(target, target.delivery_address)
+
+
+@event.listens_for(Delivery, 'before_update')
+def _geocode_delivery(mapper, connection, target):
+    if inspect(target).attrs.delivery_address.history.has_changes():
+        _store_coordinates(target, target.delivery_address)
+
+
+def _geocode_table(model, text_column, everything):
+    query = select(model.id, text_column).where(text_column.isnot(None))
+    if not everything:
+        query = query.where(model.latitude.is_(None))
+    changes = []
+    for row_id, text in db.session.execute(query):
+        place = geocode(text)
+        if place or everything:
+            changes.append({'id': row_id, 'latitude': place.latitude if place else None,
+                            'longitude': place.longitude if place else None})
+    for start in range(0, len(changes), GEOCODE_BATCH_SIZE):
+        db.session.execute(update(model), changes[start:start + GEOCODE_BATCH_SIZE])
+    return sum(1 for change in changes if change['latitude'] is not None)
+
+
+def geocode_locations(everything=False):
+    """Fill in cached coordinates for rows saved before they existed, or for all rows.
+
+    Returns the number of users and deliveries that were located.
+    """
+    users = _geocode_table(User, User.location, everything)
+    deliveries = _geocode_table(Delivery, Delivery.delivery_address, everything)
+    db.session.commit()
+    return users, deliveries
@@ -0,0 +1,16 @@
+"""Gunicorn settings, read automatically by ``gunicorn app:app`` from this directory.
+
+Threaded workers: a worker serves ``GUNICORN_THREADS`` requests at a time.
+Dashboards follow order updates by short polling /api/order_updates, so an
+open tab costs one brief request every few seconds rather than a thread.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+# Long enough for streamed inventory exports to finish
+timeout = 90
+keepalive = 75
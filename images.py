@@ -0,0 +1,173 @@
+"""Background processing of uploaded crop and inventory photos.
+
+An upload is written to disk as-is and only its header is checked inside
+the request. Full verification and resizing happen in a process pool that
+writes a thumbnail (list cards) and a medium image (detail pages), each as
+JPEG and WebP, into ``uploads/derived``. When a job finishes the owning
+record's ``image_status`` moves from ``pending`` to ``ready`` or ``failed``;
+templates fall back to the original upload until then.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from flask import url_for
+from PIL import Image, ImageOps
+from sqlalchemy import update
+from extensions import db
+
+DERIVED_DIR = 'derived'
+
+# Bounding boxes; images are scaled down to fit, never up
+VARIANTS = {
+    'thumb': (480, 360),
+    'medium': (1200, 900),
+}
+
+FORMATS = {
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+}
+
+ACCEPTED_FORMATS = {'JPEG', 'PNG', 'GIF'}
+IMAGE_WORKERS = 2  # Worker processes; 0 renders inline, which the tests use
+
+
+def derivative_name(filename, variant, ext):
+    """Path of a derivative relative to the uploads folder."""
+    stem = os.path.splitext(filename)[0]
+    return f'{DERIVED_DIR}/{stem}_{variant}.{ext}'
+
+
+def derivative_names(filename):
+    return [derivative_name(filename, variant, ext) for variant in VARIANTS for ext in FORMATS]
+
+
+def image_variant_url(filename, status, variant=None, ext='jpg'):
+    """URL of a derivative once it exists, otherwise of the original upload."""
+    if not filename:
+        return None
+    if variant and status == 'ready':
+        return url_for('static', filename=f'uploads/{derivative_name(filename, variant, ext)}')
+    return url_for('static', filename=f'uploads/{filename}')
+
+
+def inspect_upload(path):
+    """Cheap header check done in the request; raises ValueError for non-images."""
+    try:
+        with Image.open(path) as img:
+            image_format = img.format
+    except Exception as e:
+        raise ValueError(f'Invalid image file: {str(e)}')
+    if image_format not in ACCEPTED_FORMATS:
+        raise ValueError(f'Unsupported image format: {image_format}')
+    return image_format
+
+
+def render_derivatives(upload_folder, filename):
+    """Verify an upload and write all its derivatives. Runs in a worker process."""
+    source = os.path.join(upload_folder, filename)
+    with Image.open(source) as img:
+        img.verify()
+
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)  # Phone photos store rotation in EXIF
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        os.makedirs(os.path.join(upload_folder, DERIVED_DIR), exist_ok=True)
+        for variant, size in VARIANTS.items():
+            resized = img.copy()
+            resized.thumbnail(size, Image.LANCZOS)
+            for ext, (image_format, options) in FORMATS.items():
+                target = os.path.join(upload_folder, derivative_name(filename, variant, ext))
+                # Written under a temporary name so a page never links a half-written file
+                resized.save(target + '.tmp', image_format, **options)
+                os.replace(target + '.tmp', target)
+    return filename
+
+
+def remove_upload(upload_folder, filename):
+    """Delete an upload and any derivatives rendered from it."""
+    for name in [filename] + derivative_names(filename):
+        path = os.path.join(upload_folder, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class ImagePipeline:
+    """Hands uploads to a process pool and records the outcome on the owning row."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('IMAGE_WORKERS', IMAGE_WORKERS)
+        app.extensions['image_pipeline'] = self
+        atexit.register(self.shutdown)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawned rather than forked: the web process runs other threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.app.config['IMAGE_WORKERS'],
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def submit(self, model, record_id, filename):
+        """Queue derivative rendering for `filename`, owned by `model` row `record_id`."""
+        upload_folder = self.app.config['UPLOAD_FOLDER']
+        if not self.app.config['IMAGE_WORKERS']:
+            try:
+                render_derivatives(upload_folder, filename)
+                status = 'ready'
+            except Exception as e:
+                self.app.logger.error(f'Error processing image {filename}: {str(e)}')
+                status = 'failed'
+            self._mark(model, record_id, filename, status)
+            return None
+
+        future = self._get_executor().submit(render_derivatives, upload_folder, filename)
+        future.add_done_callback(lambda done: self._finish(model, record_id, filename, done))
+        return future
+
+    def _finish(self, model, record_id, filename, future):
+        try:
+            future.result()
+            status = 'ready'
+        except Exception as e:
+            self.app.logger.error(f'Error processing image {filename}: {str(e)}')
+            status = 'failed'
+        try:
+            self._mark(model, record_id, filename, status)
+        except Exception as e:
+            self.app.logger.error(f'Error recording image status for {filename}: {str(e)}')
+
+    def _mark(self, model, record_id, filename, status):
+        # Own app context, so the update never shares the request's session
+        with self.app.app_context():
+            # Matching on the filename skips rows whose image was replaced meanwhile
+            db.session.execute(
+                update(model)
+                .where(model.id == record_id, model.image == filename)
+                .values(image_status=status)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                # Unfinished jobs stay pending; `flask process-images` picks them up
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+image_pipeline = ImagePipeline()
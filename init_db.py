@@ -1,7 +1,12 @@
 import os
+import random
 from app import app, db
-from models import User, Crop, Product, Order, RestockOrder, Supplier, Cart, CartItem, InventoryItem, Delivery, OrderItem
+from models import User, Crop, Product, Order, RestockOrder, Supplier, Cart, CartItem, InventoryItem, Delivery, OrderItem, PriceObservation
+from sqlalchemy import insert
 from werkzeug.security import generate_password_hash
+from rollups import rebuild_farmer_rollups
+from price_index import rebuild_price_index
+from routing import delivery_day, local_today
 from datetime import datetime, timedelta
 
 def initialize_database():
@@ -21,6 +26,11 @@ def initialize_database():
         except Exception as e:
             print(f"⚠️ Failed to remove existing database: {e}")
             return False
+
+    # A leftover WAL from the old database must not be replayed into the new one
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
     
     # Create new database and tables
     with app.app_context():
@@ -31,6 +41,10 @@ def initialize_database():
             # Add sample data
             print("📝 Adding sample data...")
             add_sample_data()
+
+            # Backfill dashboard rollups and the price index from the sample orders and crops
+            rebuild_farmer_rollups()
+            rebuild_price_index()
             
             print(f"✅ Database initialized successfully at '{db_path}'")
             return True
@@ -118,7 +132,8 @@ def add_sample_data():
                 unit="kg",
                 current_stock=1000,
                 reorder_level=200,
-                price_per_unit=0.50
+                price_per_unit=0.50,
+                farmer_id=users[0].id
             ),
             Product(
                 name="Beans",
@@ -127,7 +142,8 @@ def add_sample_data():
                 unit="kg",
                 current_stock=500,
                 reorder_level=100,
-                price_per_unit=1.20
+                price_per_unit=1.20,
+                farmer_id=users[0].id
             )
         ]
         db.session.add_all(products)
@@ -329,7 +345,7 @@ def add_sample_data():
             order_id=test_order.id,
             distributor_id=distributor.id,
             status='scheduled',
-            scheduled_date=datetime.utcnow() + timedelta(days=1),
+            scheduled_date=delivery_day(local_today() + timedelta(days=1)),
             delivery_address=retailer.location,
             tracking_number='TRK123456789'
         )
@@ -358,6 +374,8 @@ def add_sample_data():
             db.session.add(item)
         
         db.session.commit()
+
+        add_sample_prices()
         
         print('Database initialized with test data!')
 
@@ -366,5 +384,19 @@ def add_sample_data():
         print(f"❌ Failed to add sample data: {e}")
         raise
 
+def add_sample_prices(days=180):
+    """Seed a daily price history per commodity as a gentle random walk."""
+    rng = random.Random(42)  # Same history on every run
+    base_prices = {'Maize': 150.00, 'Wheat': 180.00, 'Potatoes': 25.00, 'Tomatoes': 30.00, 'Onions': 20.00}
+    start = datetime.utcnow().replace(hour=8, minute=0, second=0, microsecond=0) - timedelta(days=days)
+    rows = []
+    for commodity, price in base_prices.items():
+        for day in range(days + 1):
+            price = max(1.0, price * (1 + rng.gauss(0, 0.015)))
+            rows.append({'commodity': commodity, 'price': round(price, 2), 'unit': 'kg',
+                         'source': 'sample', 'observed_at': start + timedelta(days=day)})
+    db.session.execute(insert(PriceObservation), rows)
+    db.session.commit()
+
 if __name__ == '__main__':
     initialize_database()
\ No newline at end of file
@@ -0,0 +1,226 @@
+"""Bulk inventory import and export for distributors.
+
+An import streams a CSV or NDJSON request body through a generator that
+parses and validates one row at a time, so memory stays flat however long
+the upload is. Valid rows are upserted in batches, each its own
+transaction: one indexed lookup finds the rows that already exist (matched
+by category and name within the distributor's inventory), then new rows are
+inserted and existing ones updated with one executemany each. A row's
+quantity is the new stock level; the change is recorded in the stock ledger
+as an ``import`` movement. Invalid rows are skipped and reported by line.
+
+An export streams the distributor's items in keyset batches, so the
+inventory is never loaded whole.
+"""
+import csv
+import io
+import json
+import math
+from datetime import datetime
+from sqlalchemy import insert, select, tuple_, update
+from sqlalchemy.exc import SQLAlchemyError
+from extensions import db
+from models import InventoryItem
+from dashboard_cache import queue_invalidation
+from stock_ledger import record_movements
+
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+IMPORT_BATCH_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000  # Further errors are only counted
+
+REQUIRED_COLUMNS = ('name', 'category', 'quantity', 'unit', 'min_quantity', 'price_per_unit')  # description is optional
+TEXT_LIMITS = {'name': 100, 'category': 50, 'unit': 20}  # Column lengths of InventoryItem
+EXPORT_COLUMNS = ('id', 'name', 'category', 'quantity', 'unit', 'min_quantity', 'price_per_unit', 'description',
+                  'updated_at')
+
+
+class InventoryImportError(ValueError):
+    """Raised when an upload cannot be imported at all, e.g. an unknown format or a missing CSV column."""
+
+
+def upload_format(requested, mimetype):
+    """Format named by `?format=`, or else by the upload's content type; raises InventoryImportError."""
+    if requested:
+        if requested not in FORMATS:
+            raise InventoryImportError(f"format must be one of {', '.join(FORMATS)}")
+        return requested
+    if mimetype in ('application/x-ndjson', 'application/ndjson', 'application/jsonl'):
+        return 'ndjson'
+    if mimetype in ('text/csv', 'text/plain', 'application/csv'):
+        return 'csv'
+    raise InventoryImportError('Send the rows as text/csv or application/x-ndjson')
+
+
+def _records(text, fmt):
+    """Yield `(line, row dict or exception)` for every record of the upload."""
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or ())]
+        if missing:
+            raise InventoryImportError(f"Missing CSV columns: {', '.join(missing)}")
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line, raw in enumerate(text, 1):
+        if not raw.strip():
+            continue
+        try:
+            row = json.loads(raw)
+        except ValueError:
+            yield line, ValueError('Invalid JSON')
+            continue
+        yield line, row if isinstance(row, dict) else ValueError('Each line must be a JSON object')
+
+
+def _parse_row(row):
+    values = {}
+    for name in ('name', 'category', 'unit'):
+        value = str(row.get(name) or '').strip()
+        if not value:
+            raise ValueError(f'{name} is required')
+        if len(value) > TEXT_LIMITS[name]:
+            raise ValueError(f'{name} is longer than {TEXT_LIMITS[name]} characters')
+        values[name] = value
+    for name in ('quantity', 'min_quantity', 'price_per_unit'):
+        if row.get(name) in (None, ''):
+            raise ValueError(f'{name} is required')
+        value = float(row[name])
+        if not (math.isfinite(value) and value >= 0):
+            raise ValueError(f'{name} must be a positive number')
+        values[name] = value
+    values['description'] = str(row.get('description') or '').strip()
+    return values
+
+
+def parse_rows(text, fmt):
+    """Yield `(line, values, error)` per record; exactly one of values and error is set."""
+    for line, row in _records(text, fmt):
+        if isinstance(row, Exception):
+            yield line, None, str(row)
+            continue
+        try:
+            yield line, _parse_row(row), None
+        except (TypeError, ValueError) as e:
+            yield line, None, str(e)
+
+
+class ImportReport:
+    """Counts of an import and its per-row errors, the first `MAX_REPORTED_ERRORS` of them listed."""
+    __slots__ = ('inserted', 'updated', 'errors', 'error_count')
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.errors = []
+        self.error_count = 0
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def to_dict(self):
+        return {'inserted': self.inserted, 'updated': self.updated, 'errors': self.errors,
+                'error_count': self.error_count}
+
+
+def _existing(distributor_id, keys):
+    """Map `(category, name)` keys of the distributor's items to `(id, quantity)` with one indexed lookup."""
+    found = {}
+    for item_id, category, name, quantity in db.session.execute(
+        select(InventoryItem.id, InventoryItem.category, InventoryItem.name, InventoryItem.quantity).where(
+            InventoryItem.distributor_id == distributor_id,
+            tuple_(InventoryItem.category, InventoryItem.name).in_(keys)
+        ).order_by(InventoryItem.id)
+    ):
+        found.setdefault((category, name), (item_id, quantity))
+    return found
+
+
+def _write_batch(distributor_id, batch, report):
+    """Upsert one batch of `(category, name) -> (line, values)` in its own transaction."""
+    existing = _existing(distributor_id, list(batch))
+    now = datetime.utcnow()
+    new_rows, changed_rows, movements = [], [], []
+    for key, (_line, values) in batch.items():
+        if key in existing:
+            item_id, quantity = existing[key]
+            changed_rows.append(dict(values, id=item_id, updated_at=now))
+            movements.append(('inventory', item_id, values['quantity'] - quantity, 'import', None))
+        else:
+            new_rows.append(dict(values, distributor_id=distributor_id, created_at=now, updated_at=now))
+    try:
+        if new_rows:
+            # A plain executemany; RETURNING would make SQLite insert the rows one at a time
+            db.session.execute(insert(InventoryItem.__table__), new_rows)
+            added = _existing(distributor_id, [(row['category'], row['name']) for row in new_rows])
+            movements.extend(('inventory', item_id, quantity, 'import', None) for item_id, quantity in added.values())
+        if changed_rows:
+            db.session.execute(update(InventoryItem), changed_rows)
+        record_movements(movements)
+        queue_invalidation(db.session, [distributor_id])
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        for line, _values in batch.values():
+            report.error(line, f'Not saved: {e.__class__.__name__}')
+        return
+    report.inserted += len(new_rows)
+    report.updated += len(changed_rows)
+
+
+def import_inventory(distributor_id, text, fmt='csv', batch_size=IMPORT_BATCH_SIZE):
+    """Upsert a distributor's items from a CSV or NDJSON text stream and return an ImportReport.
+
+    Rows are matched on category and name; a later row for the same item
+    wins. Each batch of `batch_size` rows commits on its own, so rows
+    reported as saved stay saved if a later batch fails.
+    """
+    report = ImportReport()
+    batch = {}
+    for line, values, error in parse_rows(text, fmt):
+        if error:
+            report.error(line, error)
+            continue
+        batch[(values['category'], values['name'])] = (line, values)
+        if len(batch) >= batch_size:
+            _write_batch(distributor_id, batch, report)
+            batch = {}
+    if batch:
+        _write_batch(distributor_id, batch, report)
+    return report
+
+
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_inventory(distributor_id, fmt='csv', batch_size=EXPORT_BATCH_SIZE):
+    """Yield a distributor's items as CSV or NDJSON text, a batch of rows per chunk."""
+    columns = [getattr(InventoryItem, name) for name in EXPORT_COLUMNS]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(EXPORT_COLUMNS)
+    last_id = 0
+    while True:
+        rows = db.session.execute(select(*columns).where(
+            InventoryItem.distributor_id == distributor_id, InventoryItem.id > last_id
+        ).order_by(InventoryItem.id).limit(batch_size)).all()
+        if not rows:
+            break
+        for row in rows:
+            values = [_export_value(value) for value in row]
+            if fmt == 'csv':
+                writer.writerow(values)
+            else:
+                buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, values))) + '\n')
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        last_id = rows[-1].id
+        if len(rows) < batch_size:
+            break
+    if fmt == 'csv' and last_id == 0:
+        yield buffer.getvalue()  # Just the header
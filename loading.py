@@ -0,0 +1,51 @@
+"""Named eager-loading profiles for the order pages.
+
+Every relationship on the order models is ``lazy=True``, so a template that
+walks ``order.items`` or ``item.item_name`` issues a SELECT per row. Each
+profile below bundles the loader options one page needs so the whole page
+is loaded in a fixed number of queries, however many orders it shows.
+Many-to-one links are joined into the main query; collections are fetched
+with one ``IN`` query per relationship.
+"""
+from sqlalchemy.orm import joinedload, selectinload
+from models import Order, OrderItem
+
+# Order parties by role, as rendered next to each order
+_PARTIES = (
+    joinedload(Order.farmer),
+    joinedload(Order.distributor),
+    joinedload(Order.retailer),
+)
+
+# Line items including the crop/product that OrderItem.item_name reads
+_ITEMS_WITH_NAMES = (
+    selectinload(Order.items).joinedload(OrderItem.crop),
+    selectinload(Order.items).joinedload(OrderItem.product),
+)
+
+LOADING_PROFILES = {
+    # orders.html: parties plus every item's name
+    'order_list': _PARTIES + _ITEMS_WITH_NAMES,
+    # order_history.html: counterpart, item count and delivery badge
+    'order_history': (
+        joinedload(Order.distributor),
+        joinedload(Order.retailer),
+        selectinload(Order.items),
+        selectinload(Order.order_deliveries),
+    ),
+    # order_detail.html: the order, its farmer orders and its deliveries
+    'order_detail': _PARTIES + _ITEMS_WITH_NAMES + (
+        selectinload(Order.child_orders).joinedload(Order.farmer),
+        selectinload(Order.child_orders).selectinload(Order.items),
+        selectinload(Order.order_deliveries),
+    ),
+    # distributor_dashboard.html: item counts of the active orders
+    'dashboard_orders': (
+        selectinload(Order.items),
+    ),
+}
+
+
+def loading_profile(name):
+    """Return the loader options of a named profile."""
+    return LOADING_PROFILES[name]
@@ -0,0 +1,268 @@
+"""Market prices: a time series of observations per commodity.
+
+Prices arrive as CSV files and are bulk inserted into ``price_observations``.
+Pages only need the latest price of each commodity, so those are kept in an
+in-process ``LatestPrices`` map. It is reloaded after every ingestion, and
+other worker processes reload theirs after ``LATEST_PRICE_TTL`` seconds.
+Longer histories are loaded into NumPy arrays. There they are summarised,
+smoothed with time-based rolling averages, and downsampled to a few hundred
+points for Chart.js.
+"""
+import csv
+import math
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from sqlalchemy import insert, select
+from extensions import db
+from models import PriceObservation
+
+LATEST_PRICE_TTL = 300
+INGEST_BATCH_SIZE = 1000
+SERIES_POINTS = 200  # Default number of points sent to a chart
+MAX_SERIES_POINTS = 1000
+
+CSV_COLUMNS = ('commodity', 'price', 'observed_at')  # Required; unit and source are optional
+
+
+class PriceIngestError(ValueError):
+    """Raised when a CSV file cannot be ingested at all, e.g. a missing column."""
+
+
+class LatestPrice:
+    __slots__ = ('commodity', 'price', 'unit', 'observed_at', 'previous_price')
+
+    def __init__(self, commodity, price, unit, observed_at, previous_price=None):
+        self.commodity = commodity
+        self.price = price
+        self.unit = unit
+        self.observed_at = observed_at
+        self.previous_price = previous_price
+
+    @property
+    def change(self):
+        """Percentage change from the previous observation, or None."""
+        if not self.previous_price:
+            return None
+        return round((self.price - self.previous_price) / self.previous_price * 100, 1)
+
+
+class LatestPrices:
+    """Latest observation per commodity, loaded in bulk and read without queries."""
+
+    def __init__(self, ttl=LATEST_PRICE_TTL):
+        self.ttl = ttl
+        self._prices = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _current(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self.refresh()
+        return self._prices
+
+    def get(self, commodity):
+        return self._current().get(commodity)
+
+    def price(self, commodity, default=0.0):
+        latest = self.get(commodity)
+        return latest.price if latest else default
+
+    def all(self):
+        """Latest prices of every commodity, sorted by name."""
+        prices = self._current()
+        return [prices[name] for name in sorted(prices)]
+
+    def refresh(self, commodities=None):
+        """Reload all commodities, or only `commodities` after an ingestion."""
+        partial = commodities is not None and self._loaded_at is not None
+        if not partial:
+            commodities = db.session.execute(
+                select(PriceObservation.commodity).distinct()
+            ).scalars().all()
+        loaded = {}
+        for commodity in commodities:
+            # Two index seeks per commodity: the latest row and the one before it
+            rows = db.session.execute(
+                select(PriceObservation.price, PriceObservation.unit, PriceObservation.observed_at)
+                .where(PriceObservation.commodity == commodity)
+                .order_by(PriceObservation.observed_at.desc())
+                .limit(2)
+            ).all()
+            if rows:
+                previous = rows[1].price if len(rows) > 1 else None
+                loaded[commodity] = LatestPrice(commodity, rows[0].price, rows[0].unit, rows[0].observed_at, previous)
+        with self._lock:
+            if partial:
+                prices = dict(self._prices)
+                prices.update(loaded)
+            else:
+                prices = loaded
+            # Swapped in whole, so readers never see a half-built map
+            self._prices = prices
+            self._loaded_at = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._prices = {}
+            self._loaded_at = None
+
+
+latest_prices = LatestPrices()
+
+
+def _parse_row(row):
+    commodity = (row.get('commodity') or '').strip()
+    if not commodity:
+        raise ValueError('Commodity is required')
+    price = float(row['price'])
+    if not math.isfinite(price):
+        raise ValueError('Price must be a number')
+    if price < 0:
+        raise ValueError('Price must not be negative')
+    observed_at = datetime.fromisoformat(row['observed_at'].strip())
+    if observed_at.tzinfo is not None:
+        raise ValueError('Timestamps must be UTC without an offset')
+    return {
+        'commodity': commodity,
+        'price': price,
+        'unit': (row.get('unit') or '').strip() or 'kg',
+        'source': (row.get('source') or '').strip() or None,
+        'observed_at': observed_at
+    }
+
+
+def ingest_csv(stream, source=None, batch_size=INGEST_BATCH_SIZE):
+    """Bulk insert observations from a CSV text stream.
+
+    Returns the number of rows inserted and a list of per-line errors; rows
+    with errors are skipped. The latest prices of the ingested commodities
+    are reloaded afterwards.
+    """
+    reader = csv.DictReader(stream)
+    missing = [column for column in CSV_COLUMNS if column not in (reader.fieldnames or ())]
+    if missing:
+        raise PriceIngestError(f"Missing CSV columns: {', '.join(missing)}")
+
+    inserted = 0
+    errors = []
+    commodities = set()
+    batch = []
+    for row in reader:
+        try:
+            values = _parse_row(row)
+        except (KeyError, TypeError, ValueError) as e:
+            errors.append({'line': reader.line_num, 'error': str(e)})
+            continue
+        values['source'] = values['source'] or source
+        commodities.add(values['commodity'])
+        batch.append(values)
+        if len(batch) >= batch_size:
+            db.session.execute(insert(PriceObservation), batch)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(PriceObservation), batch)
+        inserted += len(batch)
+    db.session.commit()
+
+    if commodities:
+        latest_prices.refresh(commodities)
+    return inserted, errors
+
+
+def load_series(commodity, start=None, end=None):
+    """Return (epoch seconds, prices) arrays for a commodity, oldest first."""
+    query = select(PriceObservation.observed_at, PriceObservation.price).where(
+        PriceObservation.commodity == commodity
+    )
+    if start is not None:
+        query = query.where(PriceObservation.observed_at >= start)
+    if end is not None:
+        query = query.where(PriceObservation.observed_at <= end)
+    rows = db.session.execute(query.order_by(PriceObservation.observed_at)).all()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    observed, prices = zip(*rows)
+    timestamps = np.array(observed, dtype='datetime64[s]').astype(np.int64)
+    return timestamps, np.array(prices, dtype=float)
+
+
+def summarize(prices):
+    """Min, mean and max of a price array, or None for an empty series."""
+    if not len(prices):
+        return None
+    return {
+        'min': float(prices.min()),
+        'avg': float(prices.mean()),
+        'max': float(prices.max()),
+        'count': int(len(prices))
+    }
+
+
+def rolling_mean(timestamps, prices, window):
+    """Mean of the observations in the `window` seconds up to each point.
+
+    Observations are irregular, so the window is measured in time rather than
+    in rows. Prefix sums make it O(n) whatever the window length.
+    """
+    if not len(prices):
+        return np.empty(0)
+    sums = np.concatenate(([0.0], np.cumsum(prices)))
+    ends = np.arange(1, len(prices) + 1)
+    starts = np.searchsorted(timestamps, timestamps - window, side='left')
+    return (sums[ends] - sums[starts]) / (ends - starts)
+
+
+def bucket_rollup(timestamps, values, bucket_starts):
+    """Min, mean and max of `values` per bucket; returns the non-empty buckets.
+
+    `bucket_starts` must be sorted; a value belongs to the last bucket whose
+    start is at or before its timestamp.
+    """
+    index = np.searchsorted(bucket_starts, timestamps, side='right') - 1
+    keep = index >= 0
+    index, timestamps, values = index[keep], timestamps[keep], values[keep]
+    if not len(values):
+        empty = np.empty(0)
+        return np.empty(0, dtype=np.int64), empty, empty, empty
+
+    # Values are in time order, so each bucket is one contiguous run
+    run_starts = np.flatnonzero(np.diff(index, prepend=-1))
+    counts = np.diff(np.append(run_starts, len(values)))
+    return (
+        bucket_starts[index[run_starts]],
+        np.minimum.reduceat(values, run_starts),
+        np.add.reduceat(values, run_starts) / counts,
+        np.maximum.reduceat(values, run_starts)
+    )
+
+
+def price_series(commodity, start=None, end=None, window=7 * 86400, max_points=SERIES_POINTS):
+    """Chart.js-ready history of a commodity, or None when it has no observations."""
+    timestamps, prices = load_series(commodity, start, end)
+    if not len(prices):
+        return None
+
+    rolling = rolling_mean(timestamps, prices, window)
+    points, (low, average, high) = timestamps, (prices, prices, prices)
+    if len(timestamps) > max_points:
+        edges = np.linspace(timestamps[0], timestamps[-1], max_points, endpoint=False).astype(np.int64)
+        points, low, average, high = bucket_rollup(timestamps, prices, edges)
+        rolling = bucket_rollup(timestamps, rolling, edges)[2]
+
+    labels = points.astype('datetime64[s]').astype(str)
+    return {
+        'commodity': commodity,
+        'labels': labels.tolist(),
+        'datasets': {
+            'average': np.round(average, 2).tolist(),
+            'min': np.round(low, 2).tolist(),
+            'max': np.round(high, 2).tolist(),
+            'rolling_average': np.round(rolling, 2).tolist()
+        },
+        'summary': summarize(prices),
+        'observations': int(len(prices)),
+        'downsampled': len(points) < len(prices)
+    }
@@ -0,0 +1,30 @@
+"""Record each crop's harvested quantity for the yield rollups
+
+Revision ID: add_crop_harvested_quantity
+Revises: add_stock_alerts
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'add_crop_harvested_quantity'
+down_revision = 'add_stock_alerts'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # A plain ADD COLUMN; a batch rebuild of crops would drop its search triggers
+    op.add_column('crops', sa.Column('harvested_quantity', sa.Float(), nullable=True))
+    # What is left plus what the ledger says was sold since the harvest
+    op.execute("""
+        UPDATE crops SET harvested_quantity = quantity - coalesce((
+            SELECT sum(delta) FROM stock_movements
+            WHERE item_type = 'crop' AND item_id = crops.id AND reason = 'sale' AND created_at >= crops.harvest_date
+        ), 0)
+        WHERE status = 'harvested'
+    """)
+
+def downgrade():
+    op.drop_column('crops', 'harvested_quantity')
@@ -0,0 +1,34 @@
+"""Add farmer_monthly_rollups table
+
+Revision ID: add_farmer_monthly_rollups
+Revises: add_parent_order_id
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'add_farmer_monthly_rollups'
+down_revision = 'add_parent_order_id'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Per-(farmer, month) revenue, order count and harvested yield aggregates
+    op.create_table(
+        'farmer_monthly_rollups',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('farmer_id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.String(length=7), nullable=False),
+        sa.Column('revenue', sa.Float(), nullable=False),
+        sa.Column('order_count', sa.Integer(), nullable=False),
+        sa.Column('harvested_yield', sa.Float(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['farmer_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('farmer_id', 'month', name='uq_farmer_monthly_rollup')
+    )
+
+def downgrade():
+    op.drop_table('farmer_monthly_rollups')
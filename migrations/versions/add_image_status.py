@@ -0,0 +1,29 @@
+"""Add image_status to crops and inventory items for the image pipeline
+
+Revision ID: add_image_status
+Revises: add_order_keyset_indexes
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'add_image_status'
+down_revision = 'add_order_keyset_indexes'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Existing images keep a NULL status and are served as uploaded until
+    # `flask process-images` renders their derivatives
+    with op.batch_alter_table('crops') as batch_op:
+        batch_op.add_column(sa.Column('image_status', sa.String(length=20), nullable=True))
+    with op.batch_alter_table('inventory_item') as batch_op:
+        batch_op.add_column(sa.Column('image_status', sa.String(length=20), nullable=True))
+
+def downgrade():
+    with op.batch_alter_table('inventory_item') as batch_op:
+        batch_op.drop_column('image_status')
+    with op.batch_alter_table('crops') as batch_op:
+        batch_op.drop_column('image_status')
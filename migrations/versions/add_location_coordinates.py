@@ -0,0 +1,32 @@
+"""Add cached latitude/longitude to users and deliveries
+
+Revision ID: add_location_coordinates
+Revises: add_price_index
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'add_location_coordinates'
+down_revision = 'add_price_index'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Existing rows stay NULL until `flask geocode-locations` fills them in
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('latitude', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('longitude', sa.Float(), nullable=True))
+    with op.batch_alter_table('delivery') as batch_op:
+        batch_op.add_column(sa.Column('latitude', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('longitude', sa.Float(), nullable=True))
+
+def downgrade():
+    with op.batch_alter_table('delivery') as batch_op:
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
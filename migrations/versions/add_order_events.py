@@ -0,0 +1,43 @@
+"""Add order_events table
+
+Revision ID: add_order_events
+Revises: add_farmer_monthly_rollups
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'add_order_events'
+down_revision = 'add_farmer_monthly_rollups'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Append-only log of order status changes streamed to /order_updates
+    op.create_table(
+        'order_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('order_id', sa.Integer(), nullable=False),
+        sa.Column('event_type', sa.String(length=30), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('farmer_id', sa.Integer(), nullable=True),
+        sa.Column('retailer_id', sa.Integer(), nullable=True),
+        sa.Column('distributor_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['order_id'], ['orders.id']),
+        sa.ForeignKeyConstraint(['farmer_id'], ['users.id']),
+        sa.ForeignKeyConstraint(['retailer_id'], ['users.id']),
+        sa.ForeignKeyConstraint(['distributor_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_order_events_farmer', 'order_events', ['farmer_id', 'id'])
+    op.create_index('ix_order_events_retailer', 'order_events', ['retailer_id', 'id'])
+    op.create_index('ix_order_events_distributor', 'order_events', ['distributor_id', 'id'])
+
+def downgrade():
+    op.drop_index('ix_order_events_distributor', table_name='order_events')
+    op.drop_index('ix_order_events_retailer', table_name='order_events')
+    op.drop_index('ix_order_events_farmer', table_name='order_events')
+    op.drop_table('order_events')
@@ -0,0 +1,28 @@
+"""Add (participant, created_at, id) indexes for keyset pagination of orders
+
+Revision ID: add_order_keyset_indexes
+Revises: add_route_indexes
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic
+revision = 'add_order_keyset_indexes'
+down_revision = 'add_route_indexes'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_orders_farmer_created', ['farmer_id', 'created_at', 'id']),
+    ('ix_orders_distributor_created', ['distributor_id', 'created_at', 'id']),
+    ('ix_orders_retailer_created', ['retailer_id', 'created_at', 'id']),
+]
+
+def upgrade():
+    for name, columns in INDEXES:
+        op.create_index(name, 'orders', columns)
+
+def downgrade():
+    for name, _columns in reversed(INDEXES):
+        op.drop_index(name, table_name='orders')
@@ -0,0 +1,42 @@
+"""Add price_index_days, the realized price index built from order items
+
+Revision ID: add_price_index
+Revises: add_price_observations
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'add_price_index'
+down_revision = 'add_price_observations'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'price_index_days',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('commodity', sa.String(length=100), nullable=False),
+        sa.Column('region', sa.String(length=100), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('trades', sa.Integer(), nullable=False),
+        sa.Column('volume', sa.Float(), nullable=False),
+        sa.Column('turnover', sa.Float(), nullable=False),
+        sa.Column('vwap', sa.Float(), nullable=True),
+        sa.Column('p10', sa.Float(), nullable=True),
+        sa.Column('p50', sa.Float(), nullable=True),
+        sa.Column('p90', sa.Float(), nullable=True),
+        sa.Column('low', sa.Float(), nullable=True),
+        sa.Column('high', sa.Float(), nullable=True),
+        sa.Column('change_pct', sa.Float(), nullable=True),
+        sa.Column('sketch', sa.Text(), nullable=True),
+        sa.Column('last_item_id', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('commodity', 'region', 'day', name='uq_price_index_day')
+    )
+    # Filled by `flask update-price-index --rebuild`
+
+def downgrade():
+    op.drop_table('price_index_days')
@@ -0,0 +1,33 @@
+"""Add the price_observations market price time series
+
+Revision ID: add_price_observations
+Revises: add_stored_uploads
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'add_price_observations'
+down_revision = 'add_stored_uploads'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'price_observations',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('commodity', sa.String(length=100), nullable=False),
+        sa.Column('price', sa.Float(), nullable=False),
+        sa.Column('unit', sa.String(length=20), nullable=False),
+        sa.Column('source', sa.String(length=50), nullable=True),
+        sa.Column('observed_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_price_observations_commodity_observed', 'price_observations', ['commodity', 'observed_at'])
+    # Prices are loaded with `flask ingest-prices <file.csv>`
+
+def downgrade():
+    op.drop_index('ix_price_observations_commodity_observed', table_name='price_observations')
+    op.drop_table('price_observations')
@@ -0,0 +1,25 @@
+"""Add indexes on the product catalog sort keys
+
+Revision ID: add_product_catalog_indexes
+Revises: add_search_index
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'add_product_catalog_indexes'
+down_revision = 'add_search_index'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_index('ix_products_name', 'products', ['name'])
+    op.create_index('ix_products_price', 'products', [sa.text('coalesce(price_per_unit, 0)')])
+    op.create_index('ix_products_created_at', 'products', ['created_at'])
+
+def downgrade():
+    op.drop_index('ix_products_created_at', table_name='products')
+    op.drop_index('ix_products_price', table_name='products')
+    op.drop_index('ix_products_name', table_name='products')
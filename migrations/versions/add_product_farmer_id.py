@@ -0,0 +1,33 @@
+"""Add farmer_id to products and allow orders without a farmer
+
+Revision ID: add_product_farmer_id
+Revises: add_order_events
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'add_product_farmer_id'
+down_revision = 'add_order_events'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Checkout splits retailer orders into per-farmer child orders by product grower
+    with op.batch_alter_table('products') as batch_op:
+        batch_op.add_column(sa.Column('farmer_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_product_farmer', 'users', ['farmer_id'], ['id'])
+
+    # Retailer checkout parent orders are not tied to a single farmer
+    with op.batch_alter_table('orders') as batch_op:
+        batch_op.alter_column('farmer_id', existing_type=sa.Integer(), nullable=True)
+
+def downgrade():
+    with op.batch_alter_table('orders') as batch_op:
+        batch_op.alter_column('farmer_id', existing_type=sa.Integer(), nullable=False)
+
+    with op.batch_alter_table('products') as batch_op:
+        batch_op.drop_constraint('fk_product_farmer', type_='foreignkey')
+        batch_op.drop_column('farmer_id')
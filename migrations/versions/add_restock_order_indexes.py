@@ -0,0 +1,23 @@
+"""Add indexes for restock suggestions
+
+Revision ID: add_restock_order_indexes
+Revises: add_stock_ledger
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic
+revision = 'add_restock_order_indexes'
+down_revision = 'add_stock_ledger'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_index('ix_restock_orders_distributor_status', 'restock_orders',
+                    ['distributor_id', 'status', 'product_id'])
+    op.create_index('ix_restock_orders_status_product', 'restock_orders', ['status', 'product_id'])
+
+def downgrade():
+    op.drop_index('ix_restock_orders_status_product', table_name='restock_orders')
+    op.drop_index('ix_restock_orders_distributor_status', table_name='restock_orders')
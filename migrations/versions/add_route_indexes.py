@@ -0,0 +1,40 @@
+"""Add composite indexes for the route access patterns
+
+Revision ID: add_route_indexes
+Revises: add_product_farmer_id
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic
+revision = 'add_route_indexes'
+down_revision = 'add_product_farmer_id'
+branch_labels = None
+depends_on = None
+
+# (index name, table, columns); test_query_plans.py checks the routes stay on these
+INDEXES = [
+    ('ix_users_role', 'users', ['role']),
+    ('ix_crops_farmer_status_harvest', 'crops', ['farmer_id', 'status', 'harvest_date']),
+    ('ix_crops_status', 'crops', ['status']),
+    ('ix_products_current_stock', 'products', ['current_stock']),
+    ('ix_orders_farmer_status_created', 'orders', ['farmer_id', 'status', 'created_at']),
+    ('ix_orders_distributor_status_completed', 'orders', ['distributor_id', 'status', 'completed_at']),
+    ('ix_orders_retailer_status_completed', 'orders', ['retailer_id', 'status', 'completed_at']),
+    ('ix_orders_parent_order_id', 'orders', ['parent_order_id']),
+    ('ix_inventory_item_distributor_category_name', 'inventory_item', ['distributor_id', 'category', 'name']),
+    ('ix_delivery_distributor_status', 'delivery', ['distributor_id', 'status']),
+    ('ix_delivery_order_id', 'delivery', ['order_id']),
+    ('ix_order_items_order_product', 'order_items', ['order_id', 'product_id']),
+    ('ix_order_items_product_id', 'order_items', ['product_id']),
+    ('ix_order_items_crop_id', 'order_items', ['crop_id']),
+]
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+def downgrade():
+    for name, table, _columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,149 @@
+"""Add search listings, the FTS5 text index and the facet summary
+
+Revision ID: add_search_index
+Revises: add_location_coordinates
+Create Date: 2026-10-18 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'add_search_index'
+down_revision = 'add_location_coordinates'
+branch_labels = None
+depends_on = None
+
+# Text index, facet summary and the triggers that keep them in step, as at this revision
+SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+        name, variety, description, category,
+        content='search_listings', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_vocab USING fts5vocab(search_fts, 'row')",
+    """CREATE TABLE IF NOT EXISTS search_facets (
+        kind TEXT NOT NULL, status TEXT NOT NULL, unit TEXT NOT NULL, category TEXT NOT NULL,
+        bucket INTEGER NOT NULL, listings INTEGER NOT NULL,
+        PRIMARY KEY (kind, status, unit, category, bucket)
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS search_listings_ai AFTER INSERT ON search_listings BEGIN
+        INSERT INTO search_fts(rowid, name, variety, description, category)
+        VALUES (new.id, new.name, new.variety, new.description, new.category);
+        INSERT INTO search_facets(kind, status, unit, category, bucket, listings) VALUES (new.kind, coalesce(new.status, ''), coalesce(new.unit, ''), coalesce(new.category, ''), coalesce(CASE WHEN new.price IS NULL THEN NULL WHEN new.price >= 1000 THEN 7 WHEN new.price >= 500 THEN 6 WHEN new.price >= 250 THEN 5 WHEN new.price >= 100 THEN 4 WHEN new.price >= 50 THEN 3 WHEN new.price >= 25 THEN 2 WHEN new.price >= 10 THEN 1 WHEN new.price >= 0 THEN 0 ELSE 0 END, -1), 1)
+        ON CONFLICT DO UPDATE SET listings = listings + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_listings_ad AFTER DELETE ON search_listings BEGIN
+        INSERT INTO search_fts(search_fts, rowid, name, variety, description, category)
+        VALUES ('delete', old.id, old.name, old.variety, old.description, old.category);
+        UPDATE search_facets SET listings = listings - 1
+        WHERE (kind, status, unit, category, bucket) = (old.kind, coalesce(old.status, ''), coalesce(old.unit, ''), coalesce(old.category, ''), coalesce(CASE WHEN old.price IS NULL THEN NULL WHEN old.price >= 1000 THEN 7 WHEN old.price >= 500 THEN 6 WHEN old.price >= 250 THEN 5 WHEN old.price >= 100 THEN 4 WHEN old.price >= 50 THEN 3 WHEN old.price >= 25 THEN 2 WHEN old.price >= 10 THEN 1 WHEN old.price >= 0 THEN 0 ELSE 0 END, -1));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_listings_au_text AFTER UPDATE ON search_listings
+    WHEN old.name IS NOT new.name OR old.variety IS NOT new.variety
+        OR old.description IS NOT new.description OR old.category IS NOT new.category BEGIN
+        INSERT INTO search_fts(search_fts, rowid, name, variety, description, category)
+        VALUES ('delete', old.id, old.name, old.variety, old.description, old.category);
+        INSERT INTO search_fts(rowid, name, variety, description, category)
+        VALUES (new.id, new.name, new.variety, new.description, new.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_listings_au_facets AFTER UPDATE ON search_listings
+    WHEN (old.kind, coalesce(old.status, ''), coalesce(old.unit, ''), coalesce(old.category, ''), coalesce(CASE WHEN old.price IS NULL THEN NULL WHEN old.price >= 1000 THEN 7 WHEN old.price >= 500 THEN 6 WHEN old.price >= 250 THEN 5 WHEN old.price >= 100 THEN 4 WHEN old.price >= 50 THEN 3 WHEN old.price >= 25 THEN 2 WHEN old.price >= 10 THEN 1 WHEN old.price >= 0 THEN 0 ELSE 0 END, -1)) IS NOT (new.kind, coalesce(new.status, ''), coalesce(new.unit, ''), coalesce(new.category, ''), coalesce(CASE WHEN new.price IS NULL THEN NULL WHEN new.price >= 1000 THEN 7 WHEN new.price >= 500 THEN 6 WHEN new.price >= 250 THEN 5 WHEN new.price >= 100 THEN 4 WHEN new.price >= 50 THEN 3 WHEN new.price >= 25 THEN 2 WHEN new.price >= 10 THEN 1 WHEN new.price >= 0 THEN 0 ELSE 0 END, -1)) BEGIN
+        UPDATE search_facets SET listings = listings - 1
+        WHERE (kind, status, unit, category, bucket) = (old.kind, coalesce(old.status, ''), coalesce(old.unit, ''), coalesce(old.category, ''), coalesce(CASE WHEN old.price IS NULL THEN NULL WHEN old.price >= 1000 THEN 7 WHEN old.price >= 500 THEN 6 WHEN old.price >= 250 THEN 5 WHEN old.price >= 100 THEN 4 WHEN old.price >= 50 THEN 3 WHEN old.price >= 25 THEN 2 WHEN old.price >= 10 THEN 1 WHEN old.price >= 0 THEN 0 ELSE 0 END, -1));
+        INSERT INTO search_facets(kind, status, unit, category, bucket, listings) VALUES (new.kind, coalesce(new.status, ''), coalesce(new.unit, ''), coalesce(new.category, ''), coalesce(CASE WHEN new.price IS NULL THEN NULL WHEN new.price >= 1000 THEN 7 WHEN new.price >= 500 THEN 6 WHEN new.price >= 250 THEN 5 WHEN new.price >= 100 THEN 4 WHEN new.price >= 50 THEN 3 WHEN new.price >= 25 THEN 2 WHEN new.price >= 10 THEN 1 WHEN new.price >= 0 THEN 0 ELSE 0 END, -1), 1)
+        ON CONFLICT DO UPDATE SET listings = listings + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_crops_ai AFTER INSERT ON crops BEGIN
+        INSERT INTO search_listings(id, kind, item_id, name, variety, description, category, unit, status, price,
+                                    farmer_id)
+        VALUES (new.id * 2, 'crop', new.id, new.name, new.variety, new.description, NULL, new.unit, new.status,
+                new.price_per_unit, new.farmer_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_crops_au
+    AFTER UPDATE OF name, variety, description, unit, status, price_per_unit, farmer_id ON crops BEGIN
+        UPDATE search_listings SET name = new.name, variety = new.variety, description = new.description,
+            unit = new.unit, status = new.status, price = new.price_per_unit, farmer_id = new.farmer_id
+        WHERE id = new.id * 2;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_crops_ad AFTER DELETE ON crops BEGIN
+        DELETE FROM search_listings WHERE id = old.id * 2;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_products_ai AFTER INSERT ON products BEGIN
+        INSERT INTO search_listings(id, kind, item_id, name, variety, description, category, unit, status, price,
+                                    farmer_id)
+        VALUES (new.id * 2 + 1, 'product', new.id, new.name, NULL, new.description, new.category, new.unit,
+                CASE WHEN coalesce(new.current_stock, 0) <= 0 THEN 'out_of_stock'
+        WHEN new.current_stock <= coalesce(new.reorder_level, 0) THEN 'low_stock'
+        ELSE 'in_stock' END, new.price_per_unit, new.farmer_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_products_au
+    AFTER UPDATE OF name, description, category, unit, current_stock, reorder_level, price_per_unit, farmer_id
+    ON products BEGIN
+        UPDATE search_listings SET name = new.name, description = new.description, category = new.category,
+            unit = new.unit, status = CASE WHEN coalesce(new.current_stock, 0) <= 0 THEN 'out_of_stock'
+        WHEN new.current_stock <= coalesce(new.reorder_level, 0) THEN 'low_stock'
+        ELSE 'in_stock' END, price = new.price_per_unit, farmer_id = new.farmer_id
+        WHERE id = new.id * 2 + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_products_ad AFTER DELETE ON products BEGIN
+        DELETE FROM search_listings WHERE id = old.id * 2 + 1;
+    END""",
+]
+
+# Dropped on downgrade along with the triggers
+DROP_DDL = [
+    'DROP TABLE IF EXISTS search_vocab',
+    'DROP TABLE IF EXISTS search_fts',
+    'DROP TABLE IF EXISTS search_facets',
+]
+
+# Copies the existing crops and products into the listings
+REBUILD_SQL = [
+    'DELETE FROM search_listings',
+    """INSERT INTO search_listings(id, kind, item_id, name, variety, description, category, unit, status, price,
+                                   farmer_id)
+    SELECT id * 2, 'crop', id, name, variety, description, NULL, unit, status, price_per_unit, farmer_id FROM crops""",
+    """INSERT INTO search_listings(id, kind, item_id, name, variety, description, category, unit, status, price,
+                                    farmer_id)
+    SELECT id * 2 + 1, 'product', id, name, NULL, description, category, unit,
+        CASE WHEN coalesce(current_stock, 0) <= 0 THEN 'out_of_stock'
+        WHEN current_stock <= coalesce(reorder_level, 0) THEN 'low_stock'
+        ELSE 'in_stock' END, price_per_unit, farmer_id FROM products""",
+    "INSERT INTO search_fts(search_fts) VALUES ('rebuild')",
+    "INSERT INTO search_fts(search_fts) VALUES ('optimize')",
+]
+
+def upgrade():
+    op.create_table(
+        'search_listings',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('kind', sa.String(length=10), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('variety', sa.String(length=100), nullable=True),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('category', sa.String(length=50), nullable=True),
+        sa.Column('unit', sa.String(length=20), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('price', sa.Float(), nullable=True),
+        sa.Column('farmer_id', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_search_listings_status_price', 'search_listings', ['status', 'price'])
+    op.create_index('ix_search_listings_kind_status', 'search_listings', ['kind', 'status'])
+    for statement in SEARCH_DDL:
+        op.execute(statement)
+    # Copies the existing crops and products in; the triggers keep them in step from here on
+    for statement in REBUILD_SQL:
+        op.execute(statement)
+
+def downgrade():
+    for trigger in ('search_crops_ai', 'search_crops_au', 'search_crops_ad',
+                    'search_products_ai', 'search_products_au', 'search_products_ad'):
+        op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    for statement in DROP_DDL:
+        op.execute(statement)
+    op.drop_index('ix_search_listings_kind_status', table_name='search_listings')
+    op.drop_index('ix_search_listings_status_price', table_name='search_listings')
+    op.drop_table('search_listings')
@@ -0,0 +1,158 @@
+"""Add low-stock alerts, their triggers and the low-stock partial indexes
+
+Revision ID: add_stock_alerts
+Revises: add_restock_order_indexes
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'add_stock_alerts'
+down_revision = 'add_restock_order_indexes'
+branch_labels = None
+depends_on = None
+
+# Triggers that open, update and resolve alerts, as at this revision
+ALERT_DDL = [
+    """CREATE TRIGGER IF NOT EXISTS stock_alerts_inventory_ai AFTER INSERT ON inventory_item BEGIN
+            INSERT INTO stock_alerts(item_type, item_id, distributor_id, level, quantity, threshold, opened_at,
+                                     updated_at)
+        SELECT 'inventory', new.id, new.distributor_id, CASE WHEN new.quantity <= 0 THEN 'out_of_stock' ELSE 'low_stock' END,
+            new.quantity, new.min_quantity, strftime('%Y-%m-%d %H:%M:%f', 'now') || '000', strftime('%Y-%m-%d %H:%M:%f', 'now') || '000'
+        WHERE new.quantity <= new.min_quantity
+        ON CONFLICT(item_type, item_id) WHERE resolved_at IS NULL DO UPDATE SET
+            distributor_id = excluded.distributor_id, level = excluded.level, quantity = excluded.quantity,
+            threshold = excluded.threshold, updated_at = excluded.updated_at,
+            notified_at = CASE WHEN excluded.level = stock_alerts.level THEN stock_alerts.notified_at END;
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS stock_alerts_inventory_au AFTER UPDATE OF quantity, min_quantity, distributor_id ON inventory_item BEGIN
+            INSERT INTO stock_alerts(item_type, item_id, distributor_id, level, quantity, threshold, opened_at,
+                                     updated_at)
+        SELECT 'inventory', new.id, new.distributor_id, CASE WHEN new.quantity <= 0 THEN 'out_of_stock' ELSE 'low_stock' END,
+            new.quantity, new.min_quantity, strftime('%Y-%m-%d %H:%M:%f', 'now') || '000', strftime('%Y-%m-%d %H:%M:%f', 'now') || '000'
+        WHERE new.quantity <= new.min_quantity
+        ON CONFLICT(item_type, item_id) WHERE resolved_at IS NULL DO UPDATE SET
+            distributor_id = excluded.distributor_id, level = excluded.level, quantity = excluded.quantity,
+            threshold = excluded.threshold, updated_at = excluded.updated_at,
+            notified_at = CASE WHEN excluded.level = stock_alerts.level THEN stock_alerts.notified_at END;
+            UPDATE stock_alerts SET resolved_at = strftime('%Y-%m-%d %H:%M:%f', 'now') || '000', updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') || '000', quantity = new.quantity
+        WHERE item_type = 'inventory' AND item_id = new.id AND resolved_at IS NULL AND NOT (new.quantity <= new.min_quantity);
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS stock_alerts_inventory_ad AFTER DELETE ON inventory_item BEGIN
+            UPDATE stock_alerts SET resolved_at = strftime('%Y-%m-%d %H:%M:%f', 'now') || '000', updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') || '000', quantity = old.quantity
+        WHERE item_type = 'inventory' AND item_id = old.id AND resolved_at IS NULL;
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS stock_alerts_product_ai AFTER INSERT ON products BEGIN
+            INSERT INTO stock_alerts(item_type, item_id, distributor_id, level, quantity, threshold, opened_at,
+                                     updated_at)
+        SELECT 'product', new.id, NULL, CASE WHEN coalesce(new.current_stock, 0) <= 0 THEN 'out_of_stock' ELSE 'low_stock' END,
+            coalesce(new.current_stock, 0), coalesce(new.reorder_level, 0), strftime('%Y-%m-%d %H:%M:%f', 'now') || '000', strftime('%Y-%m-%d %H:%M:%f', 'now') || '000'
+        WHERE coalesce(new.current_stock, 0) <= coalesce(new.reorder_level, 0)
+        ON CONFLICT(item_type, item_id) WHERE resolved_at IS NULL DO UPDATE SET
+            distributor_id = excluded.distributor_id, level = excluded.level, quantity = excluded.quantity,
+            threshold = excluded.threshold, updated_at = excluded.updated_at,
+            notified_at = CASE WHEN excluded.level = stock_alerts.level THEN stock_alerts.notified_at END;
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS stock_alerts_product_au AFTER UPDATE OF current_stock, reorder_level ON products BEGIN
+            INSERT INTO stock_alerts(item_type, item_id, distributor_id, level, quantity, threshold, opened_at,
+                                     updated_at)
+        SELECT 'product', new.id, NULL, CASE WHEN coalesce(new.current_stock, 0) <= 0 THEN 'out_of_stock' ELSE 'low_stock' END,
+            coalesce(new.current_stock, 0), coalesce(new.reorder_level, 0), strftime('%Y-%m-%d %H:%M:%f', 'now') || '000', strftime('%Y-%m-%d %H:%M:%f', 'now') || '000'
+        WHERE coalesce(new.current_stock, 0) <= coalesce(new.reorder_level, 0)
+        ON CONFLICT(item_type, item_id) WHERE resolved_at IS NULL DO UPDATE SET
+            distributor_id = excluded.distributor_id, level = excluded.level, quantity = excluded.quantity,
+            threshold = excluded.threshold, updated_at = excluded.updated_at,
+            notified_at = CASE WHEN excluded.level = stock_alerts.level THEN stock_alerts.notified_at END;
+            UPDATE stock_alerts SET resolved_at = strftime('%Y-%m-%d %H:%M:%f', 'now') || '000', updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') || '000', quantity = coalesce(new.current_stock, 0)
+        WHERE item_type = 'product' AND item_id = new.id AND resolved_at IS NULL AND NOT (coalesce(new.current_stock, 0) <= coalesce(new.reorder_level, 0));
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS stock_alerts_product_ad AFTER DELETE ON products BEGIN
+            UPDATE stock_alerts SET resolved_at = strftime('%Y-%m-%d %H:%M:%f', 'now') || '000', updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') || '000', quantity = coalesce(old.current_stock, 0)
+        WHERE item_type = 'product' AND item_id = old.id AND resolved_at IS NULL;
+        END""",
+]
+
+# Resolves stale alerts and opens alerts for items that are already low
+REBUILD_SQL = [
+    """UPDATE stock_alerts SET resolved_at = strftime('%Y-%m-%d %H:%M:%f', 'now') || '000', updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') || '000'
+    WHERE resolved_at IS NULL AND NOT EXISTS (
+        SELECT 1 FROM inventory_item AS item WHERE item.id = stock_alerts.item_id
+            AND item.quantity <= item.min_quantity
+    ) AND item_type = 'inventory'""",
+    """UPDATE stock_alerts SET resolved_at = strftime('%Y-%m-%d %H:%M:%f', 'now') || '000', updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') || '000'
+    WHERE resolved_at IS NULL AND NOT EXISTS (
+        SELECT 1 FROM products AS item WHERE item.id = stock_alerts.item_id
+            AND coalesce(item.current_stock, 0) <= coalesce(item.reorder_level, 0)
+    ) AND item_type = 'product'""",
+    """INSERT INTO stock_alerts(item_type, item_id, distributor_id, level, quantity, threshold, opened_at,
+                                     updated_at)
+        SELECT 'inventory', item.id, item.distributor_id, CASE WHEN item.quantity <= 0 THEN 'out_of_stock' ELSE 'low_stock' END,
+            item.quantity, item.min_quantity, strftime('%Y-%m-%d %H:%M:%f', 'now') || '000', strftime('%Y-%m-%d %H:%M:%f', 'now') || '000' FROM inventory_item AS item
+        WHERE item.quantity <= item.min_quantity
+        ON CONFLICT(item_type, item_id) WHERE resolved_at IS NULL DO UPDATE SET
+            distributor_id = excluded.distributor_id, level = excluded.level, quantity = excluded.quantity,
+            threshold = excluded.threshold, updated_at = excluded.updated_at,
+            notified_at = CASE WHEN excluded.level = stock_alerts.level THEN stock_alerts.notified_at END""",
+    """INSERT INTO stock_alerts(item_type, item_id, distributor_id, level, quantity, threshold, opened_at,
+                                     updated_at)
+        SELECT 'product', item.id, NULL, CASE WHEN coalesce(item.current_stock, 0) <= 0 THEN 'out_of_stock' ELSE 'low_stock' END,
+            coalesce(item.current_stock, 0), coalesce(item.reorder_level, 0), strftime('%Y-%m-%d %H:%M:%f', 'now') || '000', strftime('%Y-%m-%d %H:%M:%f', 'now') || '000' FROM products AS item
+        WHERE coalesce(item.current_stock, 0) <= coalesce(item.reorder_level, 0)
+        ON CONFLICT(item_type, item_id) WHERE resolved_at IS NULL DO UPDATE SET
+            distributor_id = excluded.distributor_id, level = excluded.level, quantity = excluded.quantity,
+            threshold = excluded.threshold, updated_at = excluded.updated_at,
+            notified_at = CASE WHEN excluded.level = stock_alerts.level THEN stock_alerts.notified_at END""",
+]
+
+TRIGGERS = (
+    'stock_alerts_inventory_ai',
+    'stock_alerts_inventory_au',
+    'stock_alerts_inventory_ad',
+    'stock_alerts_product_ai',
+    'stock_alerts_product_au',
+    'stock_alerts_product_ad',
+)
+
+def upgrade():
+    op.create_table(
+        'stock_alerts',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('item_type', sa.String(length=20), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('distributor_id', sa.Integer(), nullable=True),
+        sa.Column('level', sa.String(length=20), nullable=False),
+        sa.Column('quantity', sa.Float(), nullable=False),
+        sa.Column('threshold', sa.Float(), nullable=False),
+        sa.Column('opened_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('notified_at', sa.DateTime(), nullable=True),
+        sa.Column('resolved_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_stock_alerts_open_item', 'stock_alerts', ['item_type', 'item_id'], unique=True,
+                    sqlite_where=sa.text('resolved_at IS NULL'))
+    op.create_index('ix_stock_alerts_open_owner', 'stock_alerts', ['item_type', 'distributor_id', 'level'],
+                    sqlite_where=sa.text('resolved_at IS NULL'))
+    op.create_index('ix_stock_alerts_unnotified', 'stock_alerts', ['distributor_id'],
+                    sqlite_where=sa.text('resolved_at IS NULL AND notified_at IS NULL'))
+    op.create_index('ix_inventory_item_low_stock', 'inventory_item', ['distributor_id'],
+                    sqlite_where=sa.text('quantity <= min_quantity'))
+    op.create_index('ix_products_low_stock', 'products', ['id'],
+                    sqlite_where=sa.text('coalesce(current_stock, 0) <= coalesce(reorder_level, 0)'))
+    for statement in ALERT_DDL:
+        op.execute(statement)
+    # Opens alerts for items that are already low; the triggers keep them in step from here on
+    for statement in REBUILD_SQL:
+        op.execute(statement)
+
+def downgrade():
+    for trigger in TRIGGERS:
+        op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    op.drop_index('ix_products_low_stock', table_name='products')
+    op.drop_index('ix_inventory_item_low_stock', table_name='inventory_item')
+    op.drop_index('ix_stock_alerts_unnotified', table_name='stock_alerts')
+    op.drop_index('ix_stock_alerts_open_owner', table_name='stock_alerts')
+    op.drop_index('ix_stock_alerts_open_item', table_name='stock_alerts')
+    op.drop_table('stock_alerts')
@@ -0,0 +1,64 @@
+"""Add the stock movement ledger and snapshots
+
+Revision ID: add_stock_ledger
+Revises: add_product_catalog_indexes
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'add_stock_ledger'
+down_revision = 'add_product_catalog_indexes'
+branch_labels = None
+depends_on = None
+
+# Item type -> (table, quantity column), see stock_ledger.ITEMS
+ITEM_TABLES = {
+    'crop': ('crops', 'quantity'),
+    'product': ('products', 'current_stock'),
+    'inventory': ('inventory_item', 'quantity'),
+}
+
+def upgrade():
+    op.create_table(
+        'stock_movements',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('item_type', sa.String(length=20), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('delta', sa.Float(), nullable=False),
+        sa.Column('reason', sa.String(length=20), nullable=False),
+        sa.Column('order_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['order_id'], ['orders.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_stock_movements_item', 'stock_movements', ['item_type', 'item_id', 'id'])
+    op.create_index('ix_stock_movements_created_at', 'stock_movements', ['created_at'])
+    op.create_table(
+        'stock_snapshots',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('item_type', sa.String(length=20), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('quantity', sa.Float(), nullable=False),
+        sa.Column('last_movement_id', sa.Integer(), nullable=False),
+        sa.Column('taken_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_stock_snapshots_item', 'stock_snapshots',
+                    ['item_type', 'item_id', 'last_movement_id', 'taken_at'])
+
+    # Current stock becomes each item's opening snapshot; history starts here
+    for item_type, (table, column) in ITEM_TABLES.items():
+        op.execute(
+            f"INSERT INTO stock_snapshots (item_type, item_id, quantity, last_movement_id, taken_at) "
+            f"SELECT '{item_type}', id, coalesce({column}, 0), 0, CURRENT_TIMESTAMP FROM {table}"
+        )
+
+def downgrade():
+    op.drop_index('ix_stock_snapshots_item', table_name='stock_snapshots')
+    op.drop_table('stock_snapshots')
+    op.drop_index('ix_stock_movements_created_at', table_name='stock_movements')
+    op.drop_index('ix_stock_movements_item', table_name='stock_movements')
+    op.drop_table('stock_movements')
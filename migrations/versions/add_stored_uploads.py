@@ -0,0 +1,41 @@
+"""Add the stored_uploads manifest for reference-counted uploads
+
+Also indexes inventory.crop_id so deleting a crop stays a point lookup.
+
+Revision ID: add_stored_uploads
+Revises: add_image_status
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'add_stored_uploads'
+down_revision = 'add_image_status'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'stored_uploads',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('filename', sa.String(length=255), nullable=False),
+        sa.Column('refcount', sa.Integer(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('released_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('filename')
+    )
+    op.create_index('ix_stored_uploads_unreferenced', 'stored_uploads', ['released_at'],
+                    sqlite_where=sa.text('refcount = 0'))
+    # Deleting a crop checks inventory.crop_id; without an index that scans the table
+    op.create_index('ix_inventory_crop_id', 'inventory', ['crop_id'])
+    # Existing files are registered by `flask rebuild-upload-manifest`, which
+    # has to scan the uploads folder
+
+def downgrade():
+    op.drop_index('ix_inventory_crop_id', table_name='inventory')
+    op.drop_index('ix_stored_uploads_unreferenced', table_name='stored_uploads')
+    op.drop_table('stored_uploads')
@@ -6,6 +6,7 @@ from wtforms import StringField, SelectField, FloatField, TextAreaField, FileFie
 from wtforms.validators import DataRequired, Optional, Length, Email, ValidationError, EqualTo
 from flask_wtf import FlaskForm
 from flask import url_for
+from images import image_variant_url
 
 class User(db.Model, UserMixin):
     __tablename__ = 'users'
@@ -15,12 +16,18 @@ class User(db.Model, UserMixin):
     password_hash = db.Column(db.String(128))
     role = db.Column(db.String(20), nullable=False, default='farmer')
     location = db.Column(db.String(100))
+    latitude = db.Column(db.Float)  # Geocoded from location, see geo.py
+    longitude = db.Column(db.Float)
     farm_size = db.Column(db.String(50))
     
     # Relationships
     crops = db.relationship('Crop', backref='farmer', lazy=True)
     restock_orders = db.relationship('RestockOrder', backref='distributor', lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_users_role', 'role'),
+    )
+
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
 
@@ -34,27 +41,39 @@ class Crop(db.Model):
     farmer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     variety = db.Column(db.String(100))
-    quantity = db.Column(db.Float, nullable=False)
+    # Old value is loaded on reassignment so the change reaches the stock ledger, see stock_ledger.py
+    quantity = db.column_property(db.Column(db.Float, nullable=False), active_history=True)
     unit = db.Column(db.String(20), nullable=False)
     price_per_unit = db.Column(db.Float, nullable=False)
     description = db.Column(db.Text)
-    image = db.Column(db.String(255))
+    # Old value is loaded on reassignment so the upload store can release it
+    image = db.column_property(db.Column(db.String(255)), active_history=True)
+    image_status = db.Column(db.String(20))  # pending, ready, failed; NULL for images that predate the pipeline
     status = db.Column(db.String(20), nullable=False, default='growing')  # Options: growing, ready_for_harvest, harvested
     expected_harvest_date = db.Column(db.DateTime, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     planting_date = db.Column(db.DateTime, nullable=False)
     harvest_date = db.Column(db.DateTime)
+    harvested_quantity = db.Column(db.Float)  # Yield recorded at harvest; later sales only lower quantity
     planting_season = db.Column(db.String(50))  # Store the planting season
     harvest_period = db.Column(db.Integer)  # Store the harvest period in days
     yield_per_acre = db.Column(db.Float)  # Store the expected yield per acre
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_crops_farmer_status_harvest', 'farmer_id', 'status', 'harvest_date'),
+        db.Index('ix_crops_status', 'status'),
+    )
+
     @property
     def image_url(self):
         if self.image:
             return url_for('static', filename=f'uploads/{self.image}')
         return url_for('static', filename='images/default-crop.jpg')
 
+    def image_variant(self, variant, ext='jpg'):
+        return image_variant_url(self.image, self.image_status, variant, ext)
+
 class Inventory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     farmer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -69,6 +88,11 @@ class Inventory(db.Model):
     # Relationships
     farmer = db.relationship('User', backref=db.backref('inventory_items', lazy=True))
 
+    # Foreign key checks on crop deletion look rows up by crop
+    __table_args__ = (
+        db.Index('ix_inventory_crop_id', 'crop_id'),
+    )
+
 class Product(db.Model):
     __tablename__ = 'products'
     id = db.Column(db.Integer, primary_key=True)
@@ -76,15 +100,27 @@ class Product(db.Model):
     description = db.Column(db.Text)
     category = db.Column(db.String(50))
     unit = db.Column(db.String(20))  # kg, lb, etc.
-    current_stock = db.Column(db.Float, default=0)
+    current_stock = db.column_property(db.Column(db.Float, default=0), active_history=True)  # Ledgered like Crop.quantity
     reorder_level = db.Column(db.Float, default=10)
     price_per_unit = db.Column(db.Float)
     supplier_id = db.Column(db.Integer, db.ForeignKey('suppliers.id', name='fk_product_supplier'))
+    farmer_id = db.Column(db.Integer, db.ForeignKey('users.id', name='fk_product_farmer'), nullable=True)  # Grower, used to split checkout orders
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
     supplier = db.relationship('Supplier', backref=db.backref('products', lazy=True))
+    farmer = db.relationship('User', backref=db.backref('products', lazy=True))
+
+    __table_args__ = (
+        db.Index('ix_products_current_stock', 'current_stock'),
+        # Catalog sort keys, see catalog.SORTS
+        db.Index('ix_products_name', 'name'),
+        db.Index('ix_products_price', db.func.coalesce(price_per_unit, 0)),
+        db.Index('ix_products_created_at', 'created_at'),
+        db.Index('ix_products_low_stock', 'id',
+                 sqlite_where=db.text('coalesce(current_stock, 0) <= coalesce(reorder_level, 0)')),
+    )
 
     def __repr__(self):
         return f'<Product {self.name}>'
@@ -92,7 +128,7 @@ class Product(db.Model):
 class Order(db.Model):
     __tablename__ = 'orders'
     id = db.Column(db.Integer, primary_key=True)
-    farmer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    farmer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # Null on retailer checkout parent orders
     retailer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # Changed to nullable
     distributor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     parent_order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=True)
@@ -109,6 +145,17 @@ class Order(db.Model):
     items = db.relationship('OrderItem', backref='order', lazy=True, cascade='all, delete-orphan')
     parent_order = db.relationship('Order', remote_side=[id], backref=db.backref('child_orders', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_orders_farmer_status_created', 'farmer_id', 'status', 'created_at'),
+        db.Index('ix_orders_distributor_status_completed', 'distributor_id', 'status', 'completed_at'),
+        db.Index('ix_orders_retailer_status_completed', 'retailer_id', 'status', 'completed_at'),
+        db.Index('ix_orders_parent_order_id', 'parent_order_id'),
+        # Keyset pagination of each participant's orders, see pagination.py
+        db.Index('ix_orders_farmer_created', 'farmer_id', 'created_at', 'id'),
+        db.Index('ix_orders_distributor_created', 'distributor_id', 'created_at', 'id'),
+        db.Index('ix_orders_retailer_created', 'retailer_id', 'created_at', 'id'),
+    )
+
     @property
     def status_color(self):
         status_colors = {
@@ -125,12 +172,17 @@ class RestockOrder(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     quantity = db.Column(db.Float, nullable=False)
     distributor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    status = db.Column(db.String(20), default='requested')
+    status = db.Column(db.String(20), default='requested')  # suggested (by forecasting.py), requested
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
     product = db.relationship('Product', backref='restock_orders')
 
+    __table_args__ = (
+        db.Index('ix_restock_orders_distributor_status', 'distributor_id', 'status', 'product_id'),
+        db.Index('ix_restock_orders_status_product', 'status', 'product_id'),
+    )
+
 class Supplier(db.Model):
     __tablename__ = 'suppliers'  # Fixed tablename to be plural
     id = db.Column(db.Integer, primary_key=True)
@@ -175,18 +227,25 @@ class InventoryItem(db.Model):
     distributor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     category = db.Column(db.String(50), nullable=False)
-    quantity = db.Column(db.Float, nullable=False)
+    quantity = db.column_property(db.Column(db.Float, nullable=False), active_history=True)  # Ledgered like Crop.quantity
     unit = db.Column(db.String(20), nullable=False)
     min_quantity = db.Column(db.Float, nullable=False)
     price_per_unit = db.Column(db.Float, nullable=False)
     description = db.Column(db.Text)
-    image = db.Column(db.String(255))
+    image = db.column_property(db.Column(db.String(255)), active_history=True)  # Reference counted, see uploads.py
+    image_status = db.Column(db.String(20))  # Same states as Crop.image_status
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
     distributor = db.relationship('User', backref=db.backref('distributor_inventory', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_inventory_item_distributor_category_name', 'distributor_id', 'category', 'name'),
+        # Only rows at or below their minimum, for rebuilding stock alerts, see stock_alerts.py
+        db.Index('ix_inventory_item_low_stock', 'distributor_id', sqlite_where=db.text('quantity <= min_quantity')),
+    )
+
     @property
     def status(self):
         if self.quantity <= 0:
@@ -205,14 +264,19 @@ class InventoryItem(db.Model):
         }
         return status_colors.get(self.status, 'secondary')
 
+    def image_variant(self, variant, ext='jpg'):
+        return image_variant_url(self.image, self.image_status, variant, ext)
+
 class Delivery(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
     distributor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     status = db.Column(db.String(20), default='scheduled')  # scheduled, in_transit, completed, failed
-    scheduled_date = db.Column(db.DateTime, nullable=False)
+    scheduled_date = db.Column(db.DateTime, nullable=False)  # Local wall-clock time; midnight means any time that day, see routing.py
     completed_at = db.Column(db.DateTime)
     delivery_address = db.Column(db.Text, nullable=False)
+    latitude = db.Column(db.Float)  # Geocoded from delivery_address, see geo.py
+    longitude = db.Column(db.Float)
     tracking_number = db.Column(db.String(50), unique=True)
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -222,6 +286,11 @@ class Delivery(db.Model):
     order = db.relationship('Order', backref=db.backref('order_deliveries', lazy=True))
     distributor = db.relationship('User', backref=db.backref('distributor_deliveries', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_delivery_distributor_status', 'distributor_id', 'status'),
+        db.Index('ix_delivery_order_id', 'order_id'),
+    )
+
     @property
     def status_color(self):
         status_colors = {
@@ -245,6 +314,12 @@ class OrderItem(db.Model):
     crop = db.relationship('Crop', backref=db.backref('order_items', lazy=True))
     product = db.relationship('Product', backref=db.backref('order_items', lazy=True))
     
+    __table_args__ = (
+        db.Index('ix_order_items_order_product', 'order_id', 'product_id'),
+        db.Index('ix_order_items_product_id', 'product_id'),
+        db.Index('ix_order_items_crop_id', 'crop_id'),
+    )
+
     @property
     def total_amount(self):
         return self.quantity * self.price_per_unit
@@ -257,4 +332,174 @@ class OrderItem(db.Model):
             return self.product.name
         return "Unknown Item"
 
-    
\ No newline at end of file
+    
+class FarmerMonthlyRollup(db.Model):
+    __tablename__ = 'farmer_monthly_rollups'
+    id = db.Column(db.Integer, primary_key=True)
+    farmer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    month = db.Column(db.String(7), nullable=False)  # YYYY-MM bucket
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    harvested_yield = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # One row per farmer and month; the unique index doubles as the dashboard lookup index
+    __table_args__ = (
+        db.UniqueConstraint('farmer_id', 'month', name='uq_farmer_monthly_rollup'),
+    )
+
+class OrderEvent(db.Model):
+    __tablename__ = 'order_events'
+    id = db.Column(db.Integer, primary_key=True)  # Doubles as the SSE event id
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
+    event_type = db.Column(db.String(30), nullable=False, default='order_update')  # order_created, order_update
+    status = db.Column(db.String(20))
+    # Participants are copied from the order so streams can filter without a join
+    farmer_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    retailer_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    distributor_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Relationships
+    order = db.relationship('Order')
+
+    __table_args__ = (
+        db.Index('ix_order_events_farmer', 'farmer_id', 'id'),
+        db.Index('ix_order_events_retailer', 'retailer_id', 'id'),
+        db.Index('ix_order_events_distributor', 'distributor_id', 'id'),
+    )
+
+    def to_dict(self):
+        return {
+            'type': self.event_type,
+            'order_id': self.order_id,
+            'status': self.status,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class StoredUpload(db.Model):
+    __tablename__ = 'stored_uploads'
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), nullable=False, unique=True)  # Relative to UPLOAD_FOLDER
+    refcount = db.Column(db.Integer, nullable=False, default=0)  # Crops and inventory items using the file
+    size = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    released_at = db.Column(db.DateTime)  # When refcount last dropped to zero
+
+    # Only unreferenced files are indexed, so the sweeper's lookup stays small
+    __table_args__ = (
+        db.Index('ix_stored_uploads_unreferenced', 'released_at', sqlite_where=db.text('refcount = 0')),
+    )
+
+class PriceObservation(db.Model):
+    __tablename__ = 'price_observations'
+    id = db.Column(db.Integer, primary_key=True)
+    commodity = db.Column(db.String(100), nullable=False)  # Matches Crop.name, e.g. Maize
+    price = db.Column(db.Float, nullable=False)  # Rand per unit
+    unit = db.Column(db.String(20), nullable=False, default='kg')
+    source = db.Column(db.String(50))  # Feed or file the price was ingested from
+    observed_at = db.Column(db.DateTime, nullable=False)
+
+    # Series reads and latest-price lookups are range scans on this index
+    __table_args__ = (
+        db.Index('ix_price_observations_commodity_observed', 'commodity', 'observed_at'),
+    )
+
+class PriceIndexDay(db.Model):
+    __tablename__ = 'price_index_days'
+    id = db.Column(db.Integer, primary_key=True)
+    commodity = db.Column(db.String(100), nullable=False)
+    region = db.Column(db.String(100), nullable=False)  # Seller's province, or '*' for all regions
+    day = db.Column(db.Date, nullable=False)
+    trades = db.Column(db.Integer, nullable=False, default=0)
+    volume = db.Column(db.Float, nullable=False, default=0)
+    turnover = db.Column(db.Float, nullable=False, default=0)
+    vwap = db.Column(db.Float)  # Volume-weighted average price
+    p10 = db.Column(db.Float)
+    p50 = db.Column(db.Float)
+    p90 = db.Column(db.Float)
+    low = db.Column(db.Float)
+    high = db.Column(db.Float)
+    change_pct = db.Column(db.Float)  # VWAP change from the previous traded day
+    sketch = db.Column(db.Text)  # Mergeable price histogram, see price_index.py
+    last_item_id = db.Column(db.Integer, nullable=False, default=0)  # Highest order_items.id folded in
+
+    __table_args__ = (
+        db.UniqueConstraint('commodity', 'region', 'day', name='uq_price_index_day'),
+    )
+
+class SearchListing(db.Model):
+    """One searchable crop or product, kept in sync by triggers, see search.py."""
+    __tablename__ = 'search_listings'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # crops.id * 2, products.id * 2 + 1
+    kind = db.Column(db.String(10), nullable=False)  # crop, product
+    item_id = db.Column(db.Integer, nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    variety = db.Column(db.String(100))
+    description = db.Column(db.Text)
+    category = db.Column(db.String(50))
+    unit = db.Column(db.String(20))
+    status = db.Column(db.String(20))  # Crop status, or in_stock/low_stock/out_of_stock for products
+    price = db.Column(db.Float)
+    farmer_id = db.Column(db.Integer)
+
+    __table_args__ = (
+        db.Index('ix_search_listings_status_price', 'status', 'price'),
+        db.Index('ix_search_listings_kind_status', 'kind', 'status'),  # Browsing walks it newest id first
+    )
+
+class StockMovement(db.Model):
+    """One change to the stock of a crop, product or inventory item, never updated, see stock_ledger.py."""
+    __tablename__ = 'stock_movements'
+    id = db.Column(db.Integer, primary_key=True)  # Orders the ledger; snapshots fold movements up to an id
+    item_type = db.Column(db.String(20), nullable=False)  # crop, product, inventory
+    item_id = db.Column(db.Integer, nullable=False)
+    delta = db.Column(db.Float, nullable=False)
+    reason = db.Column(db.String(20), nullable=False)  # See stock_ledger.REASONS
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_stock_movements_item', 'item_type', 'item_id', 'id'),
+        db.Index('ix_stock_movements_created_at', 'created_at'),  # Compaction finds items moved before its cutoff
+    )
+
+class StockSnapshot(db.Model):
+    """Stock of one item after every movement up to `last_movement_id`."""
+    __tablename__ = 'stock_snapshots'
+    id = db.Column(db.Integer, primary_key=True)
+    item_type = db.Column(db.String(20), nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Float, nullable=False)
+    last_movement_id = db.Column(db.Integer, nullable=False, default=0)
+    taken_at = db.Column(db.DateTime, nullable=False)  # Compaction cutoff; answers as-of queries from this time on
+
+    __table_args__ = (
+        # Latest snapshot of an item, optionally by a date, without reading the table
+        db.Index('ix_stock_snapshots_item', 'item_type', 'item_id', 'last_movement_id', 'taken_at'),
+    )
+
+class StockAlert(db.Model):
+    """An inventory item or product at or below its minimum, maintained by triggers, see stock_alerts.py."""
+    __tablename__ = 'stock_alerts'
+    id = db.Column(db.Integer, primary_key=True)
+    item_type = db.Column(db.String(20), nullable=False)  # inventory, product
+    item_id = db.Column(db.Integer, nullable=False)
+    distributor_id = db.Column(db.Integer)  # Owner of an inventory item; None for products
+    level = db.Column(db.String(20), nullable=False)  # low_stock, out_of_stock
+    quantity = db.Column(db.Float, nullable=False)
+    threshold = db.Column(db.Float, nullable=False)  # min_quantity or reorder_level when last changed
+    opened_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+    notified_at = db.Column(db.DateTime)  # None while queued for notification
+    resolved_at = db.Column(db.DateTime)  # None while open
+
+    __table_args__ = (
+        # At most one open alert per item; the triggers upsert against it
+        db.Index('ix_stock_alerts_open_item', 'item_type', 'item_id', unique=True,
+                 sqlite_where=db.text('resolved_at IS NULL')),
+        db.Index('ix_stock_alerts_open_owner', 'item_type', 'distributor_id', 'level',
+                 sqlite_where=db.text('resolved_at IS NULL')),
+        db.Index('ix_stock_alerts_unnotified', 'distributor_id',
+                 sqlite_where=db.text('resolved_at IS NULL AND notified_at IS NULL')),
+    )
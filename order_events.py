@@ -0,0 +1,72 @@
+"""Order event log and the short-poll feed behind /api/order_updates.
+
+Every order status change appends a row to ``order_events``. Dashboards poll
+``poll_events`` with the id of the last event they saw, sent as
+``Last-Event-ID``, and get the newer events plus the cursor for the next
+poll. Each poll is one indexed read that returns at once, so open
+dashboards do not hold worker threads between polls.
+"""
+from datetime import datetime
+from sqlalchemy import func, insert
+from extensions import db
+from models import OrderEvent
+
+BATCH_SIZE = 200
+
+# Which event column identifies a user's own events, per role
+PARTICIPANT_COLUMNS = {
+    'farmer': OrderEvent.farmer_id,
+    'retailer': OrderEvent.retailer_id,
+    'distributor': OrderEvent.distributor_id
+}
+
+
+def record_order_event(order, event_type='order_update'):
+    """Append an event for the order's current status to the session."""
+    db.session.add(OrderEvent(
+        order=order,
+        event_type=event_type,
+        status=order.status,
+        farmer_id=order.farmer_id,
+        retailer_id=order.retailer_id,
+        distributor_id=order.distributor_id
+    ))
+
+
+def record_order_events(changes, event_type='order_update'):
+    """Append events for `(order, new status)` pairs with one INSERT, for orders changed by bulk UPDATEs."""
+    now = datetime.utcnow()
+    rows = [{
+        'order_id': order.id,
+        'event_type': event_type,
+        'status': status,
+        'farmer_id': order.farmer_id,
+        'retailer_id': order.retailer_id,
+        'distributor_id': order.distributor_id,
+        'created_at': now
+    } for order, status in changes]
+    if rows:
+        db.session.execute(insert(OrderEvent.__table__), rows)
+
+
+def latest_event_id():
+    return db.session.query(func.max(OrderEvent.id)).scalar() or 0
+
+
+def fetch_events(user_id, role, after_id, limit=BATCH_SIZE):
+    """Return a user's events newer than `after_id`, oldest first."""
+    column = PARTICIPANT_COLUMNS.get(role)
+    if column is None:
+        return []
+    return OrderEvent.query.filter(
+        column == user_id,
+        OrderEvent.id > after_id
+    ).order_by(OrderEvent.id).limit(limit).all()
+
+
+def poll_events(user_id, role, last_event_id=None):
+    """Return `(events, cursor)` for one poll; a first poll without a cursor only learns the current one."""
+    if last_event_id is None:
+        return [], latest_event_id()
+    events = fetch_events(user_id, role, last_event_id)
+    return events, events[-1].id if events else last_event_id
@@ -0,0 +1,126 @@
+"""Keyset pagination for the order listings.
+
+A page is addressed by an opaque cursor holding the ``(created_at, id)`` of
+the row at its boundary, so the next page is a single index seek past that
+row no matter how deep into the history it is. Row counts for the page
+label come from a short-lived cache instead of a ``COUNT(*)`` per view.
+"""
+import base64
+import json
+import math
+from datetime import datetime
+from sqlalchemy import func, tuple_
+from cache import TTLCache
+
+PER_PAGE = 25
+MAX_PER_PAGE = 100
+COUNT_CACHE_TTL = 300  # Seconds a row count estimate is reused
+COUNT_CACHE_SIZE = 1024
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor cannot be decoded."""
+
+
+def encode_cursor(created_at, row_id):
+    raw = json.dumps([created_at.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the `(created_at, id)` pair stored in a cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (TypeError, ValueError) as e:
+        raise InvalidCursor(f'Invalid cursor: {cursor!r}') from e
+
+
+# Row counts for page labels, shared by the order listings and the product catalog
+count_cache = TTLCache(max_size=COUNT_CACHE_SIZE, ttl=COUNT_CACHE_TTL)
+
+
+class KeysetPage:
+    """One page of rows plus the cursors for its neighbours."""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    @property
+    def pages(self):
+        if self.total is None:
+            return None
+        return max(1, math.ceil(self.total / self.per_page))
+
+    def to_dict(self):
+        return {
+            'per_page': self.per_page,
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor,
+            'total_estimate': self.total,
+            'pages_estimate': self.pages
+        }
+
+
+def clamp_per_page(value):
+    if not value or value < 1:
+        return PER_PAGE
+    return min(value, MAX_PER_PAGE)
+
+
+def keyset_paginate(query, model, after=None, before=None, per_page=PER_PAGE, count_key=None, options=()):
+    """Return a KeysetPage of `query`, newest first by `(created_at, id)`.
+
+    Pass the `next_cursor` of a page as `after` to get the older rows behind
+    it, or its `prev_cursor` as `before` to step back. When `count_key` is
+    given the total row count is estimated through the shared count cache.
+    Loader `options` apply to the page rows only, not to the count.
+    """
+    key = tuple_(model.created_at, model.id)
+    per_page = clamp_per_page(per_page)
+    base_query = query
+    query = query.options(*options)
+
+    if before:
+        # Walk forwards from the boundary, then flip back to newest first
+        rows = (query.filter(key > decode_cursor(before))
+                .order_by(model.created_at.asc(), model.id.asc())
+                .limit(per_page + 1).all())
+        has_newer = len(rows) > per_page
+        rows = list(reversed(rows[:per_page]))
+        has_older = True
+    else:
+        if after:
+            query = query.filter(key < decode_cursor(after))
+        rows = (query.order_by(model.created_at.desc(), model.id.desc())
+                .limit(per_page + 1).all())
+        has_older = len(rows) > per_page
+        rows = rows[:per_page]
+        has_newer = bool(after)
+
+    next_cursor = prev_cursor = None
+    if rows and has_older:
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    if rows and has_newer:
+        prev_cursor = encode_cursor(rows[0].created_at, rows[0].id)
+
+    total = None
+    if count_key is not None:
+        total = count_cache.get_or_set(
+            count_key,
+            lambda: base_query.order_by(None).with_entities(func.count(model.id)).scalar()
+        )
+    return KeysetPage(rows, per_page, next_cursor, prev_cursor, total)
@@ -0,0 +1,44 @@
+"""Background jobs that run on a fixed interval inside each worker process.
+
+``start_periodic_job`` starts one daemon ``PeriodicJob`` thread per job
+name and process, however many requests ask for it. The thread sleeps for
+the interval, calls the job with the app inside an app context and logs
+failures, so one bad run does not stop the next.
+"""
+import threading
+import time
+
+
+class PeriodicJob(threading.Thread):
+    """Daemon thread that calls `job(app)` every `interval` seconds."""
+
+    def __init__(self, app, name, interval, job, description):
+        super().__init__(name=name, daemon=True)
+        self.app = app
+        self.interval = interval
+        self.job = job
+        self.description = description
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    self.job(self.app)
+            except Exception as e:
+                self.app.logger.error(f'{self.description} failed: {str(e)}')
+
+
+_lock = threading.Lock()
+_started = set()
+
+
+def start_periodic_job(app, name, interval, job, description):
+    """Start the job's thread once per process; a falsy interval disables it."""
+    if not interval:
+        return
+    with _lock:
+        if name in _started:
+            return
+        PeriodicJob(app, name, interval, job, description).start()
+        _started.add(name)
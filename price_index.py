@@ -0,0 +1,327 @@
+"""Realized price index built from the prices actually paid in orders.
+
+Order items are folded into one ``price_index_days`` row per commodity,
+region and day. A row holds the traded volume, turnover and volume-weighted
+average price (VWAP), plus 10th/50th/90th percentile bands and the VWAP
+change from the previous traded day. Every item also counts towards the
+``ALL_REGIONS`` row of its commodity.
+
+Percentiles come from a mergeable log-bucket histogram (the ``sketch``
+column). Each bucket spans 1% of price, so bands are accurate to about
+0.5%. Because sketches merge, an update only reads items above the highest
+``order_items.id`` already indexed and adds them to the stored rows, in a
+single streaming pass. Orders cancelled after their items were indexed stay
+counted until the next ``rebuild_price_index``.
+"""
+import json
+import math
+from datetime import date, timedelta
+from sqlalchemy import and_, delete, exists, func, insert, or_, select, update
+from sqlalchemy.orm import aliased
+from extensions import db
+from models import Crop, Order, OrderItem, PriceIndexDay, Product, User
+
+ALL_REGIONS = '*'
+UNKNOWN_REGION = 'Unknown'
+PERCENTILES = (10, 50, 90)
+POSITION_DAYS = 30  # Window crop_detail compares a farmer's price against
+ROWS_PER_FETCH = 10000
+WRITE_BATCH_SIZE = 1000
+
+STORED_COLUMNS = ('id', 'commodity', 'region', 'day', 'trades', 'volume', 'turnover', 'low', 'high',
+                  'sketch', 'last_item_id')
+
+GAMMA = 1.01  # Ratio between neighbouring sketch buckets
+_LOG_GAMMA = math.log(GAMMA)
+
+
+def region_of(location):
+    """Province part of a location such as 'Kimberley, Northern Cape'."""
+    if not location or not location.strip():
+        return UNKNOWN_REGION
+    return location.rsplit(',', 1)[-1].strip()
+
+
+def _bucket(price):
+    return math.ceil(math.log(price) / _LOG_GAMMA)
+
+
+def _bucket_value(bucket):
+    # Midpoint of (GAMMA^(b-1), GAMMA^b], which bounds the relative error
+    return 2 * GAMMA ** bucket / (GAMMA + 1)
+
+
+class _Accumulator:
+    __slots__ = ('trades', 'volume', 'turnover', 'low', 'high', 'sketch', 'last_item_id')
+
+    def __init__(self):
+        self.trades = 0
+        self.volume = 0.0
+        self.turnover = 0.0
+        self.low = None
+        self.high = None
+        self.sketch = {}
+        self.last_item_id = 0
+
+    def add(self, item_id, quantity, price, bucket):
+        self.trades += 1
+        self.volume += quantity
+        self.turnover += quantity * price
+        if self.low is None or price < self.low:
+            self.low = price
+        if self.high is None or price > self.high:
+            self.high = price
+        self.sketch[bucket] = self.sketch.get(bucket, 0.0) + quantity
+        self.last_item_id = item_id
+
+    def merge(self, other):
+        self._combine(other.trades, other.volume, other.turnover, other.low, other.high, other.last_item_id)
+        for bucket, weight in other.sketch.items():
+            self.sketch[bucket] = self.sketch.get(bucket, 0.0) + weight
+
+    def merge_row(self, row):
+        """Fold in a stored PriceIndexDay so the row can be rewritten with both."""
+        self._combine(row.trades, row.volume, row.turnover, row.low, row.high, row.last_item_id)
+        for bucket, weight in json.loads(row.sketch or '{}').items():
+            bucket = int(bucket)
+            self.sketch[bucket] = self.sketch.get(bucket, 0.0) + weight
+
+    def _combine(self, trades, volume, turnover, low, high, last_item_id):
+        self.trades += trades
+        self.volume += volume
+        self.turnover += turnover
+        self.low = low if self.low is None else min(self.low, low)
+        self.high = high if self.high is None else max(self.high, high)
+        self.last_item_id = max(self.last_item_id, last_item_id)
+
+    def values(self):
+        bands = sketch_percentiles(self.sketch, PERCENTILES, self.low, self.high)
+        return {
+            'trades': self.trades,
+            'volume': self.volume,
+            'turnover': self.turnover,
+            'vwap': self.turnover / self.volume if self.volume else None,
+            'p10': bands[0],
+            'p50': bands[1],
+            'p90': bands[2],
+            'low': self.low,
+            'high': self.high,
+            'sketch': json.dumps({str(bucket): round(weight, 6) for bucket, weight in sorted(self.sketch.items())}),
+            'last_item_id': self.last_item_id
+        }
+
+
+def sketch_percentiles(sketch, percentiles, low=None, high=None):
+    """Volume-weighted percentiles of a sketch, clamped to the observed range."""
+    total = sum(sketch.values())
+    if not total:
+        return [None] * len(percentiles)
+    buckets = sorted(sketch.items())
+    results = []
+    for pct in percentiles:
+        target = total * pct / 100
+        running = 0.0
+        for bucket, weight in buckets:
+            running += weight
+            if running >= target:
+                break
+        value = _bucket_value(bucket)
+        if low is not None:
+            value = max(low, min(high, value))
+        results.append(value)
+    return results
+
+
+def sketch_rank(sketch, price):
+    """Share of volume (0-100) traded at or below `price`."""
+    total = sum(sketch.values())
+    if not total:
+        return None
+    if price <= 0:
+        return 0.0
+    # Compared by bucket, so a price counts the trades recorded at that same price
+    limit = _bucket(price)
+    below = sum(weight for bucket, weight in sketch.items() if bucket <= limit)
+    return round(below / total * 100, 1)
+
+
+def _indexed_items(after_id):
+    """Statement streaming every indexable item above `after_id`, in id order."""
+    child = aliased(Order)
+    # Checkout copies each farmer's lines into a child order; the parent's
+    # copy of such a line is the same trade and is skipped
+    duplicated = and_(
+        Product.farmer_id.isnot(None),
+        exists().where(child.parent_order_id == Order.id)
+    )
+    return select(
+        OrderItem.id,
+        func.coalesce(Crop.name, Product.name),
+        func.coalesce(Crop.farmer_id, Product.farmer_id, Order.farmer_id),
+        func.date(Order.created_at),
+        OrderItem.quantity,
+        OrderItem.price_per_unit
+    ).join(
+        Order, Order.id == OrderItem.order_id
+    ).outerjoin(
+        Crop, Crop.id == OrderItem.crop_id
+    ).outerjoin(
+        Product, Product.id == OrderItem.product_id
+    ).where(
+        OrderItem.id > after_id,
+        or_(Order.status.is_(None), Order.status != 'cancelled'),
+        ~duplicated
+    ).order_by(OrderItem.id)
+
+
+def _scan(after_id):
+    """Single streaming pass folding items into accumulators per (commodity, region, day)."""
+    by_seller = {}
+    buckets = {}
+    result = db.session.connection().execution_options(yield_per=ROWS_PER_FETCH).execute(_indexed_items(after_id))
+    for partition in result.partitions():
+        for item_id, commodity, seller_id, day, quantity, price in partition:
+            if not commodity or day is None or not quantity or quantity <= 0 or not price or price <= 0:
+                continue
+            # Prices repeat a lot, so their bucket is worked out once
+            bucket = buckets.get(price)
+            if bucket is None:
+                bucket = buckets[price] = _bucket(price)
+            key = (commodity, seller_id, day)
+            accumulator = by_seller.get(key)
+            if accumulator is None:
+                accumulator = by_seller[key] = _Accumulator()
+            accumulator.add(item_id, quantity, price, bucket)
+
+    # Sellers are folded into their region and the all-regions row afterwards,
+    # which keeps the per-item work to one accumulator
+    regions = {
+        user_id: region_of(location)
+        for user_id, location in db.session.execute(select(User.id, User.location).where(
+            User.id.in_({seller_id for _commodity, seller_id, _day in by_seller if seller_id is not None})
+        ))
+    }
+    groups = {}
+    for (commodity, seller_id, day), accumulator in by_seller.items():
+        for region in (regions.get(seller_id, UNKNOWN_REGION), ALL_REGIONS):
+            group = groups.get((commodity, region, day))
+            if group is None:
+                group = groups[(commodity, region, day)] = _Accumulator()
+            group.merge(accumulator)
+    return groups
+
+
+def _write(groups, merge):
+    """Store accumulated groups, merged into existing rows when `merge` is set."""
+    existing = {}
+    if merge:
+        series = {(commodity, region) for commodity, region, _day in groups}
+        first_day = min(date.fromisoformat(day) for _commodity, _region, day in groups)
+        columns = [getattr(PriceIndexDay, name) for name in STORED_COLUMNS]
+        for commodity, region in series:
+            # Plain rows rather than entities; they are rewritten with bulk statements
+            for row in db.session.execute(select(*columns).where(
+                PriceIndexDay.commodity == commodity,
+                PriceIndexDay.region == region,
+                PriceIndexDay.day >= first_day
+            )):
+                existing[(row.commodity, row.region, row.day.isoformat())] = row
+
+    inserts, updates = [], []
+    for (commodity, region, day), accumulator in groups.items():
+        row = existing.get((commodity, region, day))
+        if row is not None:
+            accumulator.merge_row(row)
+            updates.append(dict(accumulator.values(), id=row.id))
+        else:
+            inserts.append(dict(accumulator.values(), commodity=commodity, region=region,
+                                day=date.fromisoformat(day)))
+    for start in range(0, len(inserts), WRITE_BATCH_SIZE):
+        db.session.execute(insert(PriceIndexDay), inserts[start:start + WRITE_BATCH_SIZE])
+    for start in range(0, len(updates), WRITE_BATCH_SIZE):
+        db.session.execute(update(PriceIndexDay), updates[start:start + WRITE_BATCH_SIZE])
+
+
+def _refresh_changes(series):
+    """Recompute day-over-day VWAP changes along each (commodity, region) series."""
+    changes = []
+    for commodity, region in series:
+        previous = None
+        for row_id, vwap, change_pct in db.session.execute(
+            select(PriceIndexDay.id, PriceIndexDay.vwap, PriceIndexDay.change_pct)
+            .where(PriceIndexDay.commodity == commodity, PriceIndexDay.region == region)
+            .order_by(PriceIndexDay.day)
+        ):
+            change = round((vwap - previous) / previous * 100, 2) if previous and vwap is not None else None
+            if change != change_pct:
+                changes.append({'id': row_id, 'change_pct': change})
+            previous = vwap
+    for start in range(0, len(changes), WRITE_BATCH_SIZE):
+        db.session.execute(update(PriceIndexDay), changes[start:start + WRITE_BATCH_SIZE])
+
+
+def _item_count(groups):
+    # Every item is in exactly one ALL_REGIONS group
+    return sum(accumulator.trades for (_commodity, region, _day), accumulator in groups.items() if region == ALL_REGIONS)
+
+
+def high_water_mark():
+    """Highest order_items.id already folded into the index."""
+    return db.session.query(func.max(PriceIndexDay.last_item_id)).scalar() or 0
+
+
+def update_price_index():
+    """Fold order items added since the last run into the index; returns the item count."""
+    groups = _scan(high_water_mark())
+    if not groups:
+        return 0
+    items = _item_count(groups)
+    _write(groups, merge=True)
+    _refresh_changes({(commodity, region) for commodity, region, _day in groups})
+    db.session.commit()
+    return items
+
+
+def rebuild_price_index():
+    """Recompute the whole index from order_items; returns the item count."""
+    db.session.execute(delete(PriceIndexDay))
+    groups = _scan(0)
+    items = _item_count(groups)
+    _write(groups, merge=False)
+    _refresh_changes({(commodity, region) for commodity, region, _day in groups})
+    db.session.commit()
+    return items
+
+
+def price_position(commodity, price, region=ALL_REGIONS, days=POSITION_DAYS, today=None):
+    """Where `price` sits among realized prices of the last `days` days.
+
+    Returns None when nothing was traded in that window, otherwise the VWAP,
+    bands, latest daily change and the percentile rank of `price`.
+    """
+    since = (today or date.today()) - timedelta(days=days)
+    rows = PriceIndexDay.query.filter(
+        PriceIndexDay.commodity == commodity,
+        PriceIndexDay.region == region,
+        PriceIndexDay.day >= since
+    ).order_by(PriceIndexDay.day).all()
+    if not rows:
+        return None
+
+    accumulator = _Accumulator()
+    for row in rows:
+        accumulator.merge_row(row)
+    values = accumulator.values()
+    return {
+        'commodity': commodity,
+        'region': region,
+        'days': days,
+        'trades': values['trades'],
+        'volume': values['volume'],
+        'vwap': values['vwap'],
+        'p10': values['p10'],
+        'p50': values['p50'],
+        'p90': values['p90'],
+        'change_pct': rows[-1].change_pct,
+        'rank': sketch_rank(accumulator.sketch, price) if price is not None else None
+    }
@@ -0,0 +1,97 @@
+"""Per-request SQL statement counting.
+
+Every statement the engine executes inside an app context is added to the
+counters that are open at that moment. A counter is opened for every
+request, so the number of statements a page costs is logged with the
+request (and returned as ``X-Query-Count`` in debug and testing), and
+``query_budget`` lets a route declare how many statements it may issue.
+"""
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from extensions import db
+
+QUERY_COUNT_WARNING = 30  # Statements in one request before it is logged as a warning
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised by query_budget when QUERY_BUDGET_STRICT is set."""
+
+
+class QueryCounter:
+    __slots__ = ('count', 'statements')
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+
+def _on_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_app_context():
+        return
+    for counter in g.get('query_counters', ()):
+        counter.count += 1
+        counter.statements.append(statement)
+
+
+@contextmanager
+def count_queries():
+    """Count the statements executed inside the block.
+
+        with count_queries() as counter:
+            orders = Order.query.options(*loading_profile('order_list')).all()
+        assert counter.count <= 4
+    """
+    counter = QueryCounter()
+    counters = g.setdefault('query_counters', [])
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+def query_budget(limit):
+    """Flag a view that issues more than `limit` statements.
+
+    Over-budget requests are logged as warnings, or raise QueryBudgetExceeded
+    when the app sets QUERY_BUDGET_STRICT.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with count_queries() as counter:
+                rv = f(*args, **kwargs)
+            if counter.count > limit:
+                message = f'{request.endpoint} issued {counter.count} queries, budget is {limit}'
+                if current_app.config.get('QUERY_BUDGET_STRICT'):
+                    raise QueryBudgetExceeded(message)
+                current_app.logger.warning(message)
+            return rv
+        return decorated_function
+    return decorator
+
+
+def install_query_counter(app):
+    """Count statements per request and log the total when the request ends."""
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _on_execute)
+
+    @app.before_request
+    def _open_request_counter():
+        g.request_queries = QueryCounter()
+        g.setdefault('query_counters', []).append(g.request_queries)
+
+    @app.after_request
+    def _log_request_queries(response):
+        counter = g.pop('request_queries', None)
+        if counter is None:
+            return response
+        g.query_counters.remove(counter)
+        threshold = app.config.get('QUERY_COUNT_WARNING', QUERY_COUNT_WARNING)
+        log = app.logger.warning if counter.count > threshold else app.logger.debug
+        log(f'{request.method} {request.path}: {counter.count} queries')
+        if app.debug or app.testing:
+            response.headers['X-Query-Count'] = str(counter.count)
+        return response
@@ -0,0 +1,168 @@
+"""Monthly revenue and yield rollups for the farmer dashboard.
+
+Each (farmer, month) pair has a single row in ``farmer_monthly_rollups`` that is
+bumped whenever an order completes or a crop is harvested, so the dashboard can
+read its charts with one indexed query instead of summing raw rows.
+"""
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from extensions import db
+from models import FarmerMonthlyRollup, Order, Crop
+
+
+def month_key(when):
+    """Return the YYYY-MM bucket a datetime falls into."""
+    return when.strftime('%Y-%m')
+
+
+def recent_months(count, now=None):
+    """Return the first day of the last `count` calendar months, oldest first."""
+    now = now or datetime.now()
+    year, month = now.year, now.month
+    months = []
+    for _ in range(count):
+        months.append(datetime(year, month, 1))
+        month -= 1
+        if month == 0:
+            year, month = year - 1, 12
+    return list(reversed(months))
+
+
+def _bump(farmer_id, when, revenue=0.0, order_count=0, harvested_yield=0.0):
+    """Add deltas to a farmer's month bucket, creating the bucket if needed."""
+    if not farmer_id or when is None:
+        return
+
+    table = FarmerMonthlyRollup.__table__
+    stmt = sqlite_insert(table).values(
+        farmer_id=farmer_id,
+        month=month_key(when),
+        revenue=revenue or 0.0,
+        order_count=order_count,
+        harvested_yield=harvested_yield or 0.0,
+        updated_at=datetime.utcnow()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['farmer_id', 'month'],
+        set_={
+            'revenue': table.c.revenue + stmt.excluded.revenue,
+            'order_count': table.c.order_count + stmt.excluded.order_count,
+            'harvested_yield': table.c.harvested_yield + stmt.excluded.harvested_yield,
+            'updated_at': stmt.excluded.updated_at
+        }
+    )
+    db.session.execute(stmt)
+
+
+def record_order_completed(order):
+    """Count a newly completed order towards its farmer's revenue."""
+    _bump(order.farmer_id, order.created_at, revenue=order.total_amount, order_count=1)
+
+
+def record_orders_completed(orders):
+    """Count many newly completed orders, with one upsert per farmer and month."""
+    buckets = {}
+    for order in orders:
+        if order.farmer_id and order.created_at is not None:
+            bucket = buckets.setdefault((order.farmer_id, month_key(order.created_at)), [order.created_at, 0.0, 0])
+            bucket[1] += order.total_amount or 0.0
+            bucket[2] += 1
+    for (farmer_id, _month), (when, revenue, order_count) in buckets.items():
+        _bump(farmer_id, when, revenue=revenue, order_count=order_count)
+
+
+def record_crop_harvested(crop, already_harvested=False):
+    """Record a newly harvested crop's quantity as its yield and count it towards its farmer's month.
+
+    Harvesting a crop again only re-dates it: sales since the first harvest
+    have lowered ``quantity``, so the yield recorded then is kept.
+    """
+    if crop.status == 'harvested':
+        if not already_harvested or crop.harvested_quantity is None:
+            crop.harvested_quantity = crop.quantity
+        _bump(crop.farmer_id, crop.harvest_date, harvested_yield=crop.harvested_quantity)
+
+
+def record_harvest_adjusted(crop, old_quantity):
+    """Apply a quantity edit on an already harvested crop as a correction to its yield."""
+    if crop.status == 'harvested' and crop.quantity != old_quantity:
+        delta = crop.quantity - old_quantity
+        crop.harvested_quantity = (crop.harvested_quantity or 0.0) + delta
+        _bump(crop.farmer_id, crop.harvest_date, harvested_yield=delta)
+
+
+def record_crop_removed(crop):
+    """Take a deleted crop's recorded yield back out of the rollup.
+
+    Sales lower ``quantity`` after the harvest, so the yield that was added
+    is ``harvested_quantity``, not what is left.
+    """
+    if crop.status == 'harvested':
+        _bump(crop.farmer_id, crop.harvest_date, harvested_yield=-(crop.harvested_quantity or 0.0))
+
+
+def farmer_monthly_series(farmer_id, months=6, now=None):
+    """Return chart labels, yields and revenues for a farmer's recent months."""
+    month_starts = recent_months(months, now)
+    keys = [month_key(start) for start in month_starts]
+
+    rows = FarmerMonthlyRollup.query.filter(
+        FarmerMonthlyRollup.farmer_id == farmer_id,
+        FarmerMonthlyRollup.month.in_(keys)
+    ).all()
+    by_month = {row.month: row for row in rows}
+
+    labels, yields, revenues = [], [], []
+    for start, key in zip(month_starts, keys):
+        row = by_month.get(key)
+        labels.append(start.strftime('%b %Y'))
+        yields.append(row.harvested_yield if row else 0.0)
+        revenues.append(row.revenue if row else 0.0)
+    return labels, yields, revenues
+
+
+def rebuild_farmer_rollups(farmer_id=None):
+    """Recompute rollups from the orders and crops tables.
+
+    Used to backfill existing databases; normal operation keeps the rollups
+    current through the record_* helpers above.
+    """
+    order_month = func.strftime('%Y-%m', Order.created_at)
+    revenue_rows = db.session.query(
+        Order.farmer_id, order_month, func.sum(Order.total_amount), func.count(Order.id)
+    ).filter(
+        Order.status == 'completed',
+        Order.farmer_id.isnot(None)
+    )
+
+    harvest_month = func.strftime('%Y-%m', Crop.harvest_date)
+    yield_rows = db.session.query(
+        Crop.farmer_id, harvest_month, func.sum(Crop.harvested_quantity)
+    ).filter(
+        Crop.status == 'harvested',
+        Crop.harvest_date.isnot(None)
+    )
+
+    delete_query = FarmerMonthlyRollup.query
+    if farmer_id is not None:
+        revenue_rows = revenue_rows.filter(Order.farmer_id == farmer_id)
+        yield_rows = yield_rows.filter(Crop.farmer_id == farmer_id)
+        delete_query = delete_query.filter_by(farmer_id=farmer_id)
+
+    buckets = {}
+    for owner_id, month, revenue, order_count in revenue_rows.group_by(Order.farmer_id, order_month):
+        bucket = buckets.setdefault((owner_id, month), {'revenue': 0.0, 'order_count': 0, 'harvested_yield': 0.0})
+        bucket['revenue'] = revenue or 0.0
+        bucket['order_count'] = order_count
+    for owner_id, month, harvested in yield_rows.group_by(Crop.farmer_id, harvest_month):
+        bucket = buckets.setdefault((owner_id, month), {'revenue': 0.0, 'order_count': 0, 'harvested_yield': 0.0})
+        bucket['harvested_yield'] = harvested or 0.0
+
+    delete_query.delete(synchronize_session=False)
+    db.session.add_all([
+        FarmerMonthlyRollup(farmer_id=owner_id, month=month, **values)
+        for (owner_id, month), values in buckets.items()
+    ])
+    db.session.commit()
+    return len(buckets)
@@ -0,0 +1,422 @@
+"""Delivery route planning for distributors.
+
+A distributor's scheduled deliveries for one day form a capacitated vehicle
+routing problem with time windows. Every van leaves the distributor's depot
+at the start of the shift. It must reach each stop inside that stop's
+window, never carry more than the vehicle capacity, and be back before the
+shift ends.
+
+Routes are built with the Clarke-Wright savings heuristic. They are then
+improved by local search: 2-opt within a route, and or-opt moves of one to
+three consecutive stops within and between routes. Moves are only tried
+next to each stop's nearest neighbours, which keeps a few hundred stops
+within a second or two on one core.
+
+The shift, route days and ``Delivery.scheduled_date`` are local wall-clock
+time in ``LOCAL_TIMEZONE``. A delivery scheduled for midnight carries only
+a date and may arrive at any time during that day's shift.
+"""
+import heapq
+import time
+import zoneinfo
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from sqlalchemy import func
+from extensions import db
+from geo import cached_distance_matrix, locate
+from models import Delivery, OrderItem
+
+try:
+    LOCAL_TIMEZONE = zoneinfo.ZoneInfo('Africa/Johannesburg')
+except zoneinfo.ZoneInfoNotFoundError:
+    LOCAL_TIMEZONE = timezone.utc
+
+VEHICLE_CAPACITY_KG = 3000
+SHIFT_START = 6 * 60  # Minutes after local midnight
+SHIFT_END = 20 * 60
+SERVICE_MINUTES = 15  # Unloading time at each stop
+AVERAGE_SPEED_KMH = 70
+ROAD_FACTOR = 1.3  # Road distance over great-circle distance
+DELIVERY_WINDOW_MINUTES = 4 * 60  # A timed delivery may arrive up to this long after its scheduled time
+NEIGHBOURS = 12  # Nearest stops considered for each or-opt move
+TIME_LIMIT = 2.0  # Seconds of local search per plan
+
+_EPSILON = 1e-9
+
+
+class Route:
+    """One van's stops in visiting order, with its schedule."""
+
+    def __init__(self, stops, distance_km, load, arrivals, finish):
+        self.stops = stops
+        self.distance_km = distance_km
+        self.load = load
+        self.arrivals = arrivals  # Minutes after midnight, one per stop
+        self.finish = finish  # Back at the depot
+
+
+class RoutePlan:
+    """Result of RouteSolver.solve; stop numbers index the solver's inputs."""
+
+    def __init__(self, routes, unassigned, construction_km, solve_seconds):
+        self.routes = routes
+        self.unassigned = unassigned  # (stop, reason) pairs
+        self.construction_km = construction_km  # Total distance before local search
+        self.solve_seconds = solve_seconds
+
+    @property
+    def distance_km(self):
+        return sum(route.distance_km for route in self.routes)
+
+    @property
+    def improvement(self):
+        """Share of the savings routes' distance removed by local search."""
+        if not self.construction_km:
+            return 0.0
+        return 1 - self.distance_km / self.construction_km
+
+
+class RouteSolver:
+    """Savings construction plus 2-opt/or-opt improvement.
+
+    `distances` is a square matrix of road kilometres in which index 0 is
+    the depot and index i is stop i. `windows` gives each stop's earliest and
+    latest arrival in minutes after midnight.
+    """
+
+    def __init__(self, distances, demands, windows, capacity=VEHICLE_CAPACITY_KG, shift=(SHIFT_START, SHIFT_END),
+                 service_minutes=SERVICE_MINUTES, speed_kmh=AVERAGE_SPEED_KMH):
+        self.distances = distances
+        self.minutes = [[km / speed_kmh * 60 for km in row] for row in distances]
+        self.demands = [0.0] + list(demands)
+        self.windows = [shift] + list(windows)
+        self.capacity = capacity
+        self.shift = shift
+        self.service_minutes = service_minutes
+        self.size = len(distances) - 1
+        self.neighbours = [()] + [
+            heapq.nsmallest(NEIGHBOURS, (j for j in range(1, self.size + 1) if j != i), key=distances[i].__getitem__)
+            for i in range(1, self.size + 1)
+        ]
+
+    def _finish(self, route):
+        """Time the van is back at the depot, or None if the route breaks a constraint."""
+        minutes = self.minutes
+        windows = self.windows
+        load = 0.0
+        now = self.shift[0]
+        previous = 0
+        for stop in route:
+            load += self.demands[stop]
+            if load > self.capacity:
+                return None
+            now += minutes[previous][stop]
+            earliest, latest = windows[stop]
+            if now < earliest:
+                now = earliest  # Wait for the window to open
+            elif now > latest:
+                return None
+            now += self.service_minutes
+            previous = stop
+        now += minutes[previous][0]
+        return now if now <= self.shift[1] else None
+
+    def _distance(self, route):
+        distances = self.distances
+        total = 0.0
+        previous = 0
+        for stop in route:
+            total += distances[previous][stop]
+            previous = stop
+        return total + distances[previous][0]
+
+    def _schedule(self, route):
+        arrivals = []
+        now = self.shift[0]
+        previous = 0
+        for stop in route:
+            now = max(now + self.minutes[previous][stop], self.windows[stop][0])
+            arrivals.append(now)
+            now += self.service_minutes
+            previous = stop
+        return arrivals, now + self.minutes[previous][0]
+
+    def _infeasible_reason(self, stop):
+        if self.demands[stop] > self.capacity:
+            return 'Load exceeds vehicle capacity'
+        return 'Cannot be reached within its delivery window and the shift'
+
+    def _savings(self, stops):
+        """Clarke-Wright: merge route ends in order of the distance they save."""
+        distances = self.distances
+        routes = {stop: [stop] for stop in stops}
+        loads = {stop: self.demands[stop] for stop in stops}
+        route_of = {stop: stop for stop in stops}
+
+        savings = []
+        for position, i in enumerate(stops):
+            depot_i = distances[0][i]
+            row = distances[i]
+            for j in stops[position + 1:]:
+                saving = depot_i + distances[0][j] - row[j]
+                if saving > _EPSILON:
+                    savings.append((saving, i, j))
+        savings.sort(reverse=True)
+
+        for _saving, i, j in savings:
+            key_i, key_j = route_of[i], route_of[j]
+            if key_i == key_j or loads[key_i] + loads[key_j] > self.capacity:
+                continue
+            first, second = routes[key_i], routes[key_j]
+            if first[-1] == i and second[0] == j:
+                merged = first + second
+            elif second[-1] == j and first[0] == i:
+                merged = second + first
+            else:
+                continue  # i or j is inside its route
+            if self._finish(merged) is None:
+                continue
+            routes[key_i] = merged
+            loads[key_i] += loads.pop(key_j)
+            for stop in routes.pop(key_j):
+                route_of[stop] = key_i
+        return list(routes.values())
+
+    def _two_opt(self, route):
+        """Reverse segments while that shortens the route; returns the improved route."""
+        distances = self.distances
+        improved = True
+        while improved:
+            improved = False
+            length = len(route)
+            for i in range(length - 1):
+                before = route[i - 1] if i else 0
+                for j in range(i + 1, length):
+                    after = route[j + 1] if j + 1 < length else 0
+                    delta = (distances[before][route[j]] + distances[route[i]][after]
+                             - distances[before][route[i]] - distances[route[j]][after])
+                    if delta < -_EPSILON:
+                        candidate = route[:i] + route[i:j + 1][::-1] + route[j + 1:]
+                        if self._finish(candidate) is not None:
+                            route = candidate
+                            improved = True
+                            break
+                if improved:
+                    break
+        return route
+
+    def _or_opt_pass(self, routes, deadline):
+        """Move short segments next to a near neighbour, within or across routes.
+
+        Returns True if any move was applied. `routes` is changed in place.
+        """
+        distances = self.distances
+        where = {}
+        for index, route in enumerate(routes):
+            for position, stop in enumerate(route):
+                where[stop] = (index, position)
+        loads = [sum(self.demands[stop] for stop in route) for route in routes]
+
+        def gap(route, position):
+            # Stops on either side of an insertion at `position`; 0 is the depot
+            before = route[position - 1] if position else 0
+            after = route[position] if position < len(route) else 0
+            return before, after
+
+        improved = False
+        for stop in range(1, self.size + 1):
+            if stop not in where or time.perf_counter() > deadline:
+                continue
+            for length in (1, 2, 3):
+                index, start = where[stop]
+                source = routes[index]
+                if start + length > len(source):
+                    break
+                segment = source[start:start + length]
+                before = source[start - 1] if start else 0
+                after = source[start + length] if start + length < len(source) else 0
+                removal = distances[before][segment[0]] + distances[segment[-1]][after] - distances[before][after]
+                segment_load = sum(self.demands[s] for s in segment)
+
+                best = None
+                for neighbour in self.neighbours[segment[0]]:
+                    if neighbour in segment or neighbour not in where:
+                        continue
+                    target_index, position = where[neighbour]
+                    if target_index == index:
+                        target = source[:start] + source[start + length:]
+                        position = target.index(neighbour)
+                    else:
+                        if loads[target_index] + segment_load > self.capacity:
+                            continue
+                        target = routes[target_index]
+                    for insert_at in (position, position + 1):
+                        p, q = gap(target, insert_at)
+                        base = distances[p][q]
+                        forward = distances[p][segment[0]] + distances[segment[-1]][q] - base
+                        backward = distances[p][segment[-1]] + distances[segment[0]][q] - base
+                        for cost, oriented in ((forward, segment), (backward, segment[::-1])):
+                            delta = cost - removal
+                            if delta < -_EPSILON and (best is None or delta < best[0]):
+                                best = (delta, target_index, target, insert_at, oriented)
+                if best is None:
+                    continue
+
+                _delta, target_index, target, insert_at, oriented = best
+                moved = target[:insert_at] + oriented + target[insert_at:]
+                if self._finish(moved) is None:
+                    continue
+                if target_index != index:
+                    shortened = source[:start] + source[start + length:]
+                    if shortened and self._finish(shortened) is None:
+                        continue
+                    routes[index] = shortened
+                    loads[index] -= segment_load
+                    loads[target_index] += segment_load
+                routes[target_index] = moved
+                for changed in {index, target_index}:
+                    for position, s in enumerate(routes[changed]):
+                        where[s] = (changed, position)
+                improved = True
+                break
+        return improved
+
+    def solve(self, time_limit=TIME_LIMIT):
+        started = time.perf_counter()
+        deadline = started + time_limit
+        stops, unassigned = [], []
+        for stop in range(1, self.size + 1):
+            if self._finish([stop]) is None:
+                unassigned.append((stop, self._infeasible_reason(stop)))
+            else:
+                stops.append(stop)
+
+        routes = self._savings(stops)
+        construction_km = sum(self._distance(route) for route in routes)
+
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            routes = [self._two_opt(route) for route in routes]
+            improved = self._or_opt_pass(routes, deadline)
+            routes = [route for route in routes if route]
+
+        planned = []
+        for route in sorted(routes, key=lambda r: self._schedule(r)[0][0]):
+            arrivals, finish = self._schedule(route)
+            planned.append(Route(route, self._distance(route), sum(self.demands[s] for s in route), arrivals, finish))
+        return RoutePlan(planned, unassigned, construction_km, time.perf_counter() - started)
+
+
+def local_today(now=None):
+    """Today's date in LOCAL_TIMEZONE; `now` is a naive UTC datetime like the stored timestamps."""
+    now = now or datetime.utcnow()
+    return now.replace(tzinfo=timezone.utc).astimezone(LOCAL_TIMEZONE).date()
+
+
+def delivery_day(day):
+    """The scheduled_date of a delivery due at any time on `day`: its local midnight."""
+    return datetime(day.year, day.month, day.day)
+
+
+def delivery_window(scheduled, shift=(SHIFT_START, SHIFT_END)):
+    """Arrival window of a delivery, in minutes after midnight of its day.
+
+    Deliveries scheduled for midnight carry only a date and may arrive at any
+    time in the shift. Timed deliveries may arrive from their scheduled time
+    until DELIVERY_WINDOW_MINUTES later. A time whose window misses the shift
+    entirely, such as 01:30 or 21:15, cannot be what was meant and is treated
+    as a date.
+    """
+    minute = scheduled.hour * 60 + scheduled.minute
+    if minute == 0 or minute >= shift[1] or minute + DELIVERY_WINDOW_MINUTES <= shift[0]:
+        return shift
+    return max(minute, shift[0]), minute + DELIVERY_WINDOW_MINUTES
+
+
+def _clock(minutes):
+    return f'{int(minutes) // 60:02d}:{int(minutes) % 60:02d}'
+
+
+def plan_deliveries(distributor, day, capacity=VEHICLE_CAPACITY_KG, time_limit=TIME_LIMIT):
+    """Plan a distributor's scheduled deliveries for `day`.
+
+    Returns a dict ready for the template and the JSON API. Deliveries whose
+    address is not recognised are listed as unassigned.
+    """
+    depot = locate(distributor.location)
+    start = datetime(day.year, day.month, day.day)
+    deliveries = Delivery.query.filter(
+        Delivery.distributor_id == distributor.id,
+        Delivery.status == 'scheduled',
+        Delivery.scheduled_date >= start,
+        Delivery.scheduled_date < start + timedelta(days=1)
+    ).order_by(Delivery.id).all()
+    weights = dict(db.session.query(OrderItem.order_id, func.sum(OrderItem.quantity)).filter(
+        OrderItem.order_id.in_({delivery.order_id for delivery in deliveries})
+    ).group_by(OrderItem.order_id).all()) if deliveries else {}
+
+    result = {
+        'date': day.isoformat(),
+        'depot': distributor.location,
+        'capacity_kg': capacity,
+        'routes': [],
+        'unassigned': [],
+        'stops': len(deliveries),
+        'distance_km': 0.0,
+        'construction_km': 0.0,
+        'solve_seconds': 0.0
+    }
+    if depot is None:
+        result['error'] = 'Your location is not recognised, so routes cannot be planned'
+        return result
+
+    located, points = [], [depot]
+    for delivery in deliveries:
+        # Coordinates are cached on the delivery when its address is saved
+        if delivery.latitude is not None:
+            point = (delivery.latitude, delivery.longitude)
+        else:
+            point = locate(delivery.delivery_address)
+        if point is None:
+            result['unassigned'].append({'delivery_id': delivery.id, 'order_id': delivery.order_id,
+                                         'address': delivery.delivery_address, 'reason': 'Address not recognised'})
+        else:
+            located.append(delivery)
+            points.append(point)
+    if not located:
+        return result
+
+    distances = (cached_distance_matrix(points, current_app.config.get('DISTANCE_CACHE_DIR')) * ROAD_FACTOR).tolist()
+    solver = RouteSolver(
+        distances,
+        [weights.get(delivery.order_id) or 0.0 for delivery in located],
+        [delivery_window(delivery.scheduled_date) for delivery in located],
+        capacity=capacity
+    )
+    plan = solver.solve(time_limit=time_limit)
+
+    for number, route in enumerate(plan.routes, start=1):
+        result['routes'].append({
+            'vehicle': number,
+            'distance_km': round(route.distance_km, 1),
+            'load_kg': round(route.load, 1),
+            'departs': _clock(SHIFT_START),
+            'returns': _clock(route.finish),
+            'stops': [{
+                'delivery_id': located[stop - 1].id,
+                'order_id': located[stop - 1].order_id,
+                'address': located[stop - 1].delivery_address,
+                'arrival': _clock(arrival),
+                'load_kg': round(solver.demands[stop], 1)
+            } for stop, arrival in zip(route.stops, route.arrivals)]
+        })
+    for stop, reason in plan.unassigned:
+        delivery = located[stop - 1]
+        result['unassigned'].append({'delivery_id': delivery.id, 'order_id': delivery.order_id,
+                                     'address': delivery.delivery_address, 'reason': reason})
+    result.update(
+        distance_km=round(plan.distance_km, 1),
+        construction_km=round(plan.construction_km, 1),
+        solve_seconds=round(plan.solve_seconds, 3)
+    )
+    return result
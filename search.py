@@ -0,0 +1,457 @@
+"""Full-text search over crops and products.
+
+Crops and products are copied into ``search_listings`` by SQLite triggers,
+one row per item, with the columns search filters and facets use. An FTS5
+table ``search_fts`` indexes the listing name, variety, description and
+category. It uses the listings table as external content and is kept in
+step by triggers of its own. Listing rows change whenever stock or prices
+do, but the text index is only rewritten when the text itself changes.
+
+Facet counts for browsing without words come from ``search_facets``, a
+summary table the listing triggers keep up to date. Counts for a text query
+take one grouped pass over its matches and are cached briefly, so paging
+through the results does not repeat it.
+
+Query words are matched as prefixes and ranked with bm25, with the name
+weighted highest; browsing without words lists the newest listings first.
+If a query matches nothing, each unknown word is replaced by the closest
+indexed word. Candidates come from a trigram index over the FTS vocabulary,
+so a misspelling such as "tomatos" still finds "tomatoes".
+"""
+import difflib
+import math
+import re
+import threading
+import time
+import unicodedata
+import numpy as np
+from sqlalchemy import bindparam, event, text
+from extensions import db
+from cache import TTLCache
+from pagination import PER_PAGE, MAX_PER_PAGE
+
+KINDS = ('crop', 'product')
+STATUSES = ('growing', 'ready_for_harvest', 'harvested', 'in_stock', 'low_stock', 'out_of_stock')
+AVAILABLE_STATUSES = ('ready_for_harvest', 'in_stock', 'low_stock')  # Searched unless a status is asked for
+PRICE_RANGES = (0, 10, 25, 50, 100, 250, 500, 1000)  # Lower bounds of the price facet buckets
+COLUMN_WEIGHTS = (10.0, 4.0, 1.0, 2.0)  # bm25 weights of name, variety, description, category
+VOCABULARY_TTL = 300
+FUZZY_CUTOFF = 0.75
+FUZZY_CANDIDATES = 10
+FUZZY_MIN_LENGTH = 4
+MAX_SEARCH_RESULTS = 10000  # Deepest result a page may reach
+FACET_CACHE_TTL = 60
+FACET_CACHE_SIZE = 1024
+
+
+def _price_bucket_sql(column):
+    cases = ' '.join(f'WHEN {column} >= {bound} THEN {index}'
+                     for index, bound in reversed(list(enumerate(PRICE_RANGES))))
+    return f'CASE WHEN {column} IS NULL THEN NULL {cases} ELSE 0 END'
+
+
+def _facet_key_sql(row):
+    # NULLs never conflict in a unique index, so the summary stores '' and -1 instead
+    return (f"{row}.kind, coalesce({row}.status, ''), coalesce({row}.unit, ''), coalesce({row}.category, ''), "
+            f"coalesce({_price_bucket_sql(f'{row}.price')}, -1)")
+
+
+_PRODUCT_STATUS = """CASE WHEN coalesce(new.current_stock, 0) <= 0 THEN 'out_of_stock'
+        WHEN new.current_stock <= coalesce(new.reorder_level, 0) THEN 'low_stock'
+        ELSE 'in_stock' END"""
+
+SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+        name, variety, description, category,
+        content='search_listings', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_vocab USING fts5vocab(search_fts, 'row')",
+    """CREATE TABLE IF NOT EXISTS search_facets (
+        kind TEXT NOT NULL, status TEXT NOT NULL, unit TEXT NOT NULL, category TEXT NOT NULL,
+        bucket INTEGER NOT NULL, listings INTEGER NOT NULL,
+        PRIMARY KEY (kind, status, unit, category, bucket)
+    )""",
+
+    # Listings -> text index and facet summary
+    f"""CREATE TRIGGER IF NOT EXISTS search_listings_ai AFTER INSERT ON search_listings BEGIN
+        INSERT INTO search_fts(rowid, name, variety, description, category)
+        VALUES (new.id, new.name, new.variety, new.description, new.category);
+        INSERT INTO search_facets(kind, status, unit, category, bucket, listings) VALUES ({_facet_key_sql('new')}, 1)
+        ON CONFLICT DO UPDATE SET listings = listings + 1;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS search_listings_ad AFTER DELETE ON search_listings BEGIN
+        INSERT INTO search_fts(search_fts, rowid, name, variety, description, category)
+        VALUES ('delete', old.id, old.name, old.variety, old.description, old.category);
+        UPDATE search_facets SET listings = listings - 1
+        WHERE (kind, status, unit, category, bucket) = ({_facet_key_sql('old')});
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_listings_au_text AFTER UPDATE ON search_listings
+    WHEN old.name IS NOT new.name OR old.variety IS NOT new.variety
+        OR old.description IS NOT new.description OR old.category IS NOT new.category BEGIN
+        INSERT INTO search_fts(search_fts, rowid, name, variety, description, category)
+        VALUES ('delete', old.id, old.name, old.variety, old.description, old.category);
+        INSERT INTO search_fts(rowid, name, variety, description, category)
+        VALUES (new.id, new.name, new.variety, new.description, new.category);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS search_listings_au_facets AFTER UPDATE ON search_listings
+    WHEN ({_facet_key_sql('old')}) IS NOT ({_facet_key_sql('new')}) BEGIN
+        UPDATE search_facets SET listings = listings - 1
+        WHERE (kind, status, unit, category, bucket) = ({_facet_key_sql('old')});
+        INSERT INTO search_facets(kind, status, unit, category, bucket, listings) VALUES ({_facet_key_sql('new')}, 1)
+        ON CONFLICT DO UPDATE SET listings = listings + 1;
+    END""",
+
+    # Crops -> listings
+    """CREATE TRIGGER IF NOT EXISTS search_crops_ai AFTER INSERT ON crops BEGIN
+        INSERT INTO search_listings(id, kind, item_id, name, variety, description, category, unit, status, price,
+                                    farmer_id)
+        VALUES (new.id * 2, 'crop', new.id, new.name, new.variety, new.description, NULL, new.unit, new.status,
+                new.price_per_unit, new.farmer_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_crops_au
+    AFTER UPDATE OF name, variety, description, unit, status, price_per_unit, farmer_id ON crops BEGIN
+        UPDATE search_listings SET name = new.name, variety = new.variety, description = new.description,
+            unit = new.unit, status = new.status, price = new.price_per_unit, farmer_id = new.farmer_id
+        WHERE id = new.id * 2;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_crops_ad AFTER DELETE ON crops BEGIN
+        DELETE FROM search_listings WHERE id = old.id * 2;
+    END""",
+
+    # Products -> listings
+    f"""CREATE TRIGGER IF NOT EXISTS search_products_ai AFTER INSERT ON products BEGIN
+        INSERT INTO search_listings(id, kind, item_id, name, variety, description, category, unit, status, price,
+                                    farmer_id)
+        VALUES (new.id * 2 + 1, 'product', new.id, new.name, NULL, new.description, new.category, new.unit,
+                {_PRODUCT_STATUS}, new.price_per_unit, new.farmer_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS search_products_au
+    AFTER UPDATE OF name, description, category, unit, current_stock, reorder_level, price_per_unit, farmer_id
+    ON products BEGIN
+        UPDATE search_listings SET name = new.name, description = new.description, category = new.category,
+            unit = new.unit, status = {_PRODUCT_STATUS}, price = new.price_per_unit, farmer_id = new.farmer_id
+        WHERE id = new.id * 2 + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_products_ad AFTER DELETE ON products BEGIN
+        DELETE FROM search_listings WHERE id = old.id * 2 + 1;
+    END""",
+]
+
+DROP_DDL = [
+    'DROP TABLE IF EXISTS search_vocab',
+    'DROP TABLE IF EXISTS search_fts',
+    'DROP TABLE IF EXISTS search_facets',
+]
+
+REBUILD_SQL = [
+    'DELETE FROM search_listings',
+    """INSERT INTO search_listings(id, kind, item_id, name, variety, description, category, unit, status, price,
+                                   farmer_id)
+    SELECT id * 2, 'crop', id, name, variety, description, NULL, unit, status, price_per_unit, farmer_id FROM crops""",
+    f"""INSERT INTO search_listings(id, kind, item_id, name, variety, description, category, unit, status, price,
+                                    farmer_id)
+    SELECT id * 2 + 1, 'product', id, name, NULL, description, category, unit,
+        {_PRODUCT_STATUS.replace('new.', '')}, price_per_unit, farmer_id FROM products""",
+    "INSERT INTO search_fts(search_fts) VALUES ('rebuild')",
+    "INSERT INTO search_fts(search_fts) VALUES ('optimize')",
+]
+
+
+def _includes_listings(connection, tables):
+    return connection.dialect.name == 'sqlite' and any(table.name == 'search_listings' for table in tables or ())
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_search_index(target, connection, tables=None, **kw):
+    # The FTS tables and triggers are not part of the metadata; they follow the listings table
+    if _includes_listings(connection, tables):
+        for statement in SEARCH_DDL:
+            connection.exec_driver_sql(statement)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def _drop_search_index(target, connection, tables=None, **kw):
+    if _includes_listings(connection, tables):
+        for statement in DROP_DDL:
+            connection.exec_driver_sql(statement)
+
+
+def rebuild_search_index():
+    """Recopy every crop and product into the listings and rebuild the text index; returns the row count."""
+    for statement in REBUILD_SQL:
+        db.session.execute(text(statement))
+    db.session.commit()
+    _vocabulary.invalidate()
+    facet_cache.clear()
+    return db.session.execute(text('SELECT count(*) FROM search_listings')).scalar()
+
+
+def query_terms(query):
+    """Lowercase ASCII words of a search query."""
+    if not query:
+        return []
+    query = unicodedata.normalize('NFKD', query).encode('ascii', 'ignore').decode('ascii').lower()
+    return re.findall(r'[a-z0-9]+', query)
+
+
+def _trigrams(term):
+    padded = f' {term} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Vocabulary:
+    """Indexed words with a trigram index for correcting misspelt query words."""
+
+    def __init__(self, terms, documents):
+        order = np.argsort(np.array(terms, dtype=str), kind='stable')
+        self.terms = np.array(terms, dtype=str)[order]
+        self.documents = np.array(documents, dtype=np.int64)[order]
+        grams = {}
+        for index, term in enumerate(self.terms):
+            for gram in _trigrams(term):
+                grams.setdefault(gram, []).append(index)
+        self.grams = {gram: np.array(indexes, dtype=np.int32) for gram, indexes in grams.items()}
+        self.gram_counts = np.array([len(_trigrams(term)) for term in self.terms])
+
+    def has_prefix(self, term):
+        position = np.searchsorted(self.terms, term)
+        return position < len(self.terms) and self.terms[position].startswith(term)
+
+    def correct(self, term):
+        """Closest indexed word to `term`, `term` itself if it is known or not a word, or None."""
+        if not term.isalpha() or self.has_prefix(term):
+            return term
+        if len(term) < FUZZY_MIN_LENGTH:
+            return None
+        grams = _trigrams(term)
+        hits = [self.grams[gram] for gram in grams if gram in self.grams]
+        if not hits:
+            return None
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.terms))
+        dice = 2 * shared / (len(grams) + self.gram_counts)
+        candidates = np.flatnonzero(shared)
+        best, best_key = None, None
+        for candidate in candidates[np.argsort(-dice[candidates], kind='stable')][:FUZZY_CANDIDATES]:
+            ratio = difflib.SequenceMatcher(None, term, self.terms[candidate]).ratio()
+            # Common words win among equally close spellings
+            key = (ratio, self.documents[candidate])
+            if ratio >= FUZZY_CUTOFF and (best_key is None or key > best_key):
+                best, best_key = str(self.terms[candidate]), key
+        return best
+
+
+class _VocabularyCache:
+    """Vocabulary loaded from ``search_vocab``, reloaded after ``VOCABULARY_TTL`` seconds."""
+
+    def __init__(self, ttl=VOCABULARY_TTL):
+        self.ttl = ttl
+        self._vocabulary = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._vocabulary is None or time.monotonic() - self._loaded_at > self.ttl:
+                # Codes and numbers are left as typed and can far outnumber the words
+                rows = db.session.execute(text(
+                    "SELECT term, doc FROM search_vocab WHERE term NOT GLOB '*[^a-z]*'")).all()
+                self._vocabulary = Vocabulary([row[0] for row in rows], [row[1] for row in rows])
+                self._loaded_at = time.monotonic()
+            return self._vocabulary
+
+    def invalidate(self):
+        with self._lock:
+            self._vocabulary = None
+
+
+class SearchForbidden(Exception):
+    """A user asked for listings they may not see."""
+
+
+_vocabulary = _VocabularyCache()
+facet_cache = TTLCache(max_size=FACET_CACHE_SIZE, ttl=FACET_CACHE_TTL)
+
+
+def _filters(kind, statuses, unit, category, min_price, max_price, farmer_id):
+    clauses, params, binds = [], {}, []
+    if farmer_id is not None:
+        clauses.append('l.farmer_id = :farmer_id')
+        params['farmer_id'] = farmer_id
+    if kind:
+        clauses.append('l.kind = :kind')
+        params['kind'] = kind
+    if statuses:
+        clauses.append('l.status IN :statuses')
+        params['statuses'] = list(statuses)
+        binds.append(bindparam('statuses', expanding=True))
+    if unit:
+        clauses.append('l.unit = :unit')
+        params['unit'] = unit
+    if category:
+        clauses.append('l.category = :category')
+        params['category'] = category
+    if min_price is not None:
+        clauses.append('l.price >= :min_price')
+        params['min_price'] = min_price
+    if max_price is not None:
+        clauses.append('l.price <= :max_price')
+        params['max_price'] = max_price
+    return clauses, params, binds
+
+
+def _run(terms, filters, page, per_page):
+    clauses, params, binds = filters
+    if terms:
+        source = 'search_fts JOIN search_listings l ON l.id = search_fts.rowid'
+        clauses = ['search_fts MATCH :match'] + clauses
+        params = dict(params, match=' '.join(f'"{term}"*' for term in terms))
+        score = f"bm25(search_fts, {', '.join(str(weight) for weight in COLUMN_WEIGHTS)})"
+        order = 'score, l.id'
+    else:
+        source = 'search_listings l'
+        score = 'NULL'
+        order = 'l.id DESC'
+    where = ' AND '.join(clauses) or '1'
+
+    rows = db.session.execute(text(
+        f"""SELECT l.id, l.kind, l.item_id, l.name, l.variety, l.description, l.category, l.unit, l.status,
+                   l.price, l.farmer_id, {score} AS score
+            FROM {source} WHERE {where} ORDER BY {order} LIMIT :limit OFFSET :offset"""
+    ).bindparams(*binds), dict(params, limit=per_page, offset=(page - 1) * per_page)).all()
+
+    if not terms and not {'min_price', 'max_price', 'farmer_id'} & params.keys():
+        # The summary table holds these counts already
+        grouped = text(f"""SELECT nullif(l.status, ''), nullif(l.unit, ''), nullif(l.category, ''),
+                                  nullif(l.bucket, -1), sum(l.listings)
+                           FROM search_facets l WHERE {where} AND l.listings > 0 GROUP BY 1, 2, 3, 4""")
+        key = None
+    else:
+        grouped = text(f"""SELECT l.status, l.unit, l.category, {_price_bucket_sql('l.price')} AS bucket, count(*)
+                           FROM {source} WHERE {where} GROUP BY 1, 2, 3, 4""")
+        key = (where, tuple(sorted((name, tuple(value) if isinstance(value, list) else value)
+                                   for name, value in params.items())))
+    cached = facet_cache.get(key) if key else None
+    if cached is None:
+        # One grouped pass over the matches feeds every facet
+        facets = {'status': {}, 'unit': {}, 'category': {}, 'price': {}}
+        total = 0
+        for status, unit, category, bucket, count in db.session.execute(grouped.bindparams(*binds), params):
+            total += count
+            for name, value in (('status', status), ('unit', unit), ('category', category), ('price', bucket)):
+                if value is not None:
+                    facets[name][value] = facets[name].get(value, 0) + count
+        cached = (facets, total)
+        if key:
+            facet_cache.set(key, cached)
+    return rows, cached[0], cached[1]
+
+
+def _facet_list(counts):
+    return [{'value': value, 'count': count}
+            for value, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))]
+
+
+def _price_facets(counts):
+    return [{
+        'min': PRICE_RANGES[bucket],
+        'max': PRICE_RANGES[bucket + 1] if bucket + 1 < len(PRICE_RANGES) else None,
+        'count': counts[bucket]
+    } for bucket in sorted(counts)]
+
+
+def search(query=None, kind=None, statuses=AVAILABLE_STATUSES, unit=None, category=None, min_price=None,
+           max_price=None, page=1, per_page=PER_PAGE, farmer_id=None):
+    """One page of listings matching `query` and the filters, with facet counts over all matches.
+
+    Without a query, the newest listings come first. A query that matches
+    nothing is retried once with misspelt words corrected; the response then
+    carries ``corrected_query``.
+    """
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    page = max(1, min(page, MAX_SEARCH_RESULTS // per_page))
+    filters = _filters(kind, statuses, unit, category, min_price, max_price, farmer_id)
+    terms = query_terms(query)
+    rows, facets, total = _run(terms, filters, page, per_page)
+
+    corrected = None
+    if terms and not total:
+        vocabulary = _vocabulary.get()
+        fixed = [vocabulary.correct(term) for term in terms]
+        if None not in fixed and fixed != terms:
+            rows, facets, total = _run(fixed, filters, page, per_page)
+            corrected = ' '.join(fixed)
+
+    return {
+        'query': query or '',
+        'corrected_query': corrected,
+        'page': page,
+        'per_page': per_page,
+        'pages': max(1, math.ceil(total / per_page)),
+        'total': total,
+        'results': [{
+            'kind': row.kind,
+            'id': row.item_id,
+            'name': row.name,
+            'variety': row.variety,
+            'description': row.description,
+            'category': row.category,
+            'unit': row.unit,
+            'status': row.status,
+            'price': row.price,
+            'farmer_id': row.farmer_id,
+            'score': round(-row.score, 3) if row.score is not None else None
+        } for row in rows],
+        'facets': {
+            'status': _facet_list(facets['status']),
+            'unit': _facet_list(facets['unit']),
+            'category': _facet_list(facets['category']),
+            'price': _price_facets(facets['price'])
+        }
+    }
+
+
+def parse_search_args(args, user):
+    """Keyword arguments for `search` from request args for `user`.
+
+    Raises ValueError on bad input, and SearchForbidden when `user` asks for
+    listings that are not for sale: only a farmer may see those, and only
+    their own, by passing their own ``farmer_id``.
+    """
+    kind = args.get('kind') or None
+    if kind is not None and kind not in KINDS:
+        raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+
+    def number(name, cast):
+        value = args.get(name)
+        if value in (None, ''):
+            return None
+        try:
+            return cast(value)
+        except ValueError:
+            raise ValueError(f'{name} must be a number')
+
+    farmer_id = number('farmer_id', int)
+    statuses = args.getlist('status')
+    if not statuses:
+        statuses = AVAILABLE_STATUSES
+    else:
+        if not set(statuses) <= {'all', *STATUSES}:
+            raise ValueError(f"status must be one of all, {', '.join(STATUSES)}")
+        if not set(statuses) <= set(AVAILABLE_STATUSES) and (user.role != 'farmer' or farmer_id != user.id):
+            raise SearchForbidden('Only available listings can be searched')
+        if 'all' in statuses:
+            statuses = None
+
+    return {
+        'query': args.get('q', '').strip() or None,
+        'kind': kind,
+        'statuses': statuses,
+        'unit': args.get('unit') or None,
+        'category': args.get('category') or None,
+        'min_price': number('min_price', float),
+        'max_price': number('max_price', float),
+        'page': number('page', int) or 1,
+        'per_page': number('per_page', int) or PER_PAGE,
+        'farmer_id': farmer_id
+    }
@@ -7,15 +7,25 @@ function setupDistributorDashboard() {
         });
     });
 
-    // Real-time updates
-    if (typeof EventSource !== 'undefined') {
-        const eventSource = new EventSource('/order_updates');
-        eventSource.onmessage = handleOrderUpdate;
-    }
+    // Order updates: short polls resume from the last event seen, so no server thread waits on an open tab
+    pollOrderUpdates(null);
+}
+
+const ORDER_POLL_INTERVAL = 5000;
+
+function pollOrderUpdates(lastEventId) {
+    const headers = lastEventId === null ? {} : {'Last-Event-ID': String(lastEventId)};
+    fetch('/api/order_updates', {headers})
+        .then((response) => response.json())
+        .then((data) => {
+            data.events.forEach(handleOrderUpdate);
+            lastEventId = data.last_event_id;
+        })
+        .catch(() => {})
+        .finally(() => setTimeout(() => pollOrderUpdates(lastEventId), ORDER_POLL_INTERVAL));
 }
 
-function handleOrderUpdate(event) {
-    const data = JSON.parse(event.data);
+function handleOrderUpdate(data) {
     if (data.type === 'order_update') {
         updateOrderRow(data.order_id, data.status);
     }
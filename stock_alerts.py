@@ -0,0 +1,203 @@
+"""Low-stock alerts for inventory items and products.
+
+SQLite triggers on ``inventory_item`` and ``products`` keep
+``stock_alerts`` in step with every write, including the bulk UPDATEs of
+the stock ledger, imports and batch endpoints that skip ORM events. An item
+at or below its minimum (``min_quantity`` for inventory, ``reorder_level``
+for products) has exactly one open alert, ``low_stock`` or
+``out_of_stock``; the alert is resolved when the item recovers or is
+deleted. Dashboards read open alerts through partial indexes, so finding
+low-stock items costs O(alerts) rather than O(catalog).
+
+New and escalated alerts wait in a notification queue (``notified_at`` is
+NULL). ``notify_low_stock`` sends each distributor one message covering all
+their queued alerts; a background thread runs it every
+``STOCK_ALERT_INTERVAL`` seconds. Every worker process runs that thread, so
+a batch is claimed by stamping ``notified_at`` before it is sent and only
+the rows a run claimed go into its message.
+"""
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event, func, select, text, update
+from extensions import db
+from models import InventoryItem, StockAlert
+from periodic import start_periodic_job
+
+NOTIFY_INTERVAL = 300
+LEVEL_COLORS = {'out_of_stock': 'danger', 'low_stock': 'warning', 'in_stock': 'success'}
+
+_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now') || '000'"  # Microseconds, as SQLAlchemy writes datetimes
+
+# Item type -> (table, quantity, threshold and owner SQL for a row alias, columns that move them)
+ITEMS = {
+    'inventory': ('inventory_item', '{row}.quantity', '{row}.min_quantity', '{row}.distributor_id',
+                  'quantity, min_quantity, distributor_id'),
+    'product': ('products', 'coalesce({row}.current_stock, 0)', 'coalesce({row}.reorder_level, 0)', 'NULL',
+                'current_stock, reorder_level'),
+}
+
+
+def _open_sql(kind, row, source=''):
+    """Upsert the open alert of every `row` at or below its threshold."""
+    _table, quantity, threshold, owner, _columns = (part.format(row=row) for part in ITEMS[kind])
+    return f"""INSERT INTO stock_alerts(item_type, item_id, distributor_id, level, quantity, threshold, opened_at,
+                                     updated_at)
+        SELECT '{kind}', {row}.id, {owner}, CASE WHEN {quantity} <= 0 THEN 'out_of_stock' ELSE 'low_stock' END,
+            {quantity}, {threshold}, {_NOW}, {_NOW} {source}
+        WHERE {quantity} <= {threshold}
+        ON CONFLICT(item_type, item_id) WHERE resolved_at IS NULL DO UPDATE SET
+            distributor_id = excluded.distributor_id, level = excluded.level, quantity = excluded.quantity,
+            threshold = excluded.threshold, updated_at = excluded.updated_at,
+            notified_at = CASE WHEN excluded.level = stock_alerts.level THEN stock_alerts.notified_at END"""
+
+
+def _resolve_sql(kind, row, recovered=True):
+    _table, quantity, threshold, _owner, _columns = (part.format(row=row) for part in ITEMS[kind])
+    condition = f' AND NOT ({quantity} <= {threshold})' if recovered else ''
+    return f"""UPDATE stock_alerts SET resolved_at = {_NOW}, updated_at = {_NOW}, quantity = {quantity}
+        WHERE item_type = '{kind}' AND item_id = {row}.id AND resolved_at IS NULL{condition}"""
+
+
+def _triggers(kind):
+    table, _quantity, _threshold, _owner, columns = ITEMS[kind]
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS stock_alerts_{kind}_ai AFTER INSERT ON {table} BEGIN
+            {_open_sql(kind, 'new')};
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS stock_alerts_{kind}_au AFTER UPDATE OF {columns} ON {table} BEGIN
+            {_open_sql(kind, 'new')};
+            {_resolve_sql(kind, 'new')};
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS stock_alerts_{kind}_ad AFTER DELETE ON {table} BEGIN
+            {_resolve_sql(kind, 'old', recovered=False)};
+        END""",
+    ]
+
+
+ALERT_DDL = _triggers('inventory') + _triggers('product')
+TRIGGERS = [f'stock_alerts_{kind}_{suffix}' for kind in ITEMS for suffix in ('ai', 'au', 'ad')]
+
+# Opens alerts for items already low and resolves stale ones; the partial indexes on
+# inventory_item and products keep the scan to rows at or below their minimum
+REBUILD_SQL = [
+    f"""UPDATE stock_alerts SET resolved_at = {_NOW}, updated_at = {_NOW}
+    WHERE resolved_at IS NULL AND NOT EXISTS (
+        SELECT 1 FROM {table} AS item WHERE item.id = stock_alerts.item_id
+            AND {quantity.format(row='item')} <= {threshold.format(row='item')}
+    ) AND item_type = '{kind}'"""
+    for kind, (table, quantity, threshold, _owner, _columns) in ITEMS.items()
+] + [
+    _open_sql(kind, 'item', f'FROM {table} AS item') for kind, (table, *_rest) in ITEMS.items()
+]
+
+
+def _includes_alerts(connection, tables):
+    return connection.dialect.name == 'sqlite' and any(table.name == 'stock_alerts' for table in tables or ())
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_alert_triggers(target, connection, tables=None, **kw):
+    # The triggers live on the item tables but write to stock_alerts, so they follow it
+    if _includes_alerts(connection, tables):
+        for statement in ALERT_DDL:
+            connection.exec_driver_sql(statement)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def _drop_alert_triggers(target, connection, tables=None, **kw):
+    if _includes_alerts(connection, tables):
+        for trigger in TRIGGERS:
+            connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS {trigger}')
+
+
+def rebuild_stock_alerts():
+    """Reconcile open alerts with current stock; returns the number of open alerts."""
+    for statement in REBUILD_SQL:
+        db.session.execute(text(statement))
+    db.session.commit()
+    return db.session.execute(select(func.count(StockAlert.id)).where(StockAlert.resolved_at.is_(None))).scalar()
+
+
+def open_alerts(distributor_id):
+    """A distributor's open inventory alerts with their item details, most urgent first."""
+    return db.session.execute(
+        select(StockAlert.item_id, StockAlert.level, StockAlert.quantity, StockAlert.threshold,
+               StockAlert.opened_at, InventoryItem.name, InventoryItem.category, InventoryItem.unit)
+        .join(InventoryItem, InventoryItem.id == StockAlert.item_id)
+        .where(StockAlert.item_type == 'inventory', StockAlert.distributor_id == distributor_id,
+               StockAlert.resolved_at.is_(None))
+        .order_by(StockAlert.level.desc(), StockAlert.opened_at)  # 'out_of_stock' > 'low_stock'
+    ).all()
+
+
+def alert_levels(distributor_id):
+    """`{item_id: level}` for a distributor's items with open alerts; other items are in stock."""
+    return dict(db.session.execute(
+        select(StockAlert.item_id, StockAlert.level).where(
+            StockAlert.item_type == 'inventory', StockAlert.distributor_id == distributor_id,
+            StockAlert.resolved_at.is_(None))
+    ).all())
+
+
+def low_stock_product_count():
+    """Products in stock but at or below their reorder level."""
+    return db.session.execute(select(func.count(StockAlert.id)).where(
+        StockAlert.item_type == 'product', StockAlert.distributor_id.is_(None), StockAlert.level == 'low_stock',
+        StockAlert.resolved_at.is_(None))).scalar()
+
+
+def log_notification(distributor_id, alerts):
+    lines = ', '.join(f'{alert.name} {alert.quantity:g} {alert.unit} ({alert.level})' for alert in alerts)
+    current_app.logger.info(f'Low stock for distributor {distributor_id}: {lines}')
+
+
+def notify_low_stock(send=log_notification):
+    """Send every distributor one batch of their queued alerts; returns (distributors, alerts) sent.
+
+    `send(distributor_id, alerts)` receives rows like open_alerts. Rows are
+    claimed before sending, so concurrent runs never send the same alert; a
+    batch whose send fails is released back to the queue for the next run.
+    """
+    rows = db.session.execute(
+        select(StockAlert.id, StockAlert.distributor_id, StockAlert.item_id, StockAlert.level,
+               StockAlert.quantity, StockAlert.threshold, InventoryItem.name, InventoryItem.unit)
+        .join(InventoryItem, InventoryItem.id == StockAlert.item_id)
+        .where(StockAlert.item_type == 'inventory', StockAlert.resolved_at.is_(None),
+               StockAlert.notified_at.is_(None), StockAlert.distributor_id.isnot(None))
+        .order_by(StockAlert.distributor_id, StockAlert.id)
+    ).all()
+    db.session.rollback()  # Do not hold a read snapshot while sending
+    batches = {}
+    for row in rows:
+        batches.setdefault(row.distributor_id, []).append(row)
+
+    distributors = sent = 0
+    for distributor_id, alerts in batches.items():
+        claimed_at = datetime.utcnow()
+        claimed = set(db.session.execute(update(StockAlert).where(
+            StockAlert.id.in_([alert.id for alert in alerts]), StockAlert.notified_at.is_(None)
+        ).values(notified_at=claimed_at).returning(StockAlert.id).execution_options(
+            synchronize_session=False)).scalars())
+        db.session.commit()
+        alerts = [alert for alert in alerts if alert.id in claimed]  # Another run may have claimed the rest
+        if not alerts:
+            continue
+        try:
+            send(distributor_id, alerts)
+        except Exception as e:
+            current_app.logger.error(f'Low stock notification for distributor {distributor_id} failed: {str(e)}')
+            # Release only our claim; an alert escalated meanwhile is already queued again
+            db.session.execute(update(StockAlert).where(
+                StockAlert.id.in_(claimed), StockAlert.notified_at == claimed_at
+            ).values(notified_at=None).execution_options(synchronize_session=False))
+            db.session.commit()
+            continue
+        distributors += 1
+        sent += len(alerts)
+    return distributors, sent
+
+
+def start_stock_alert_notifier(app):
+    """Start the notifier thread once per process."""
+    start_periodic_job(app, 'stock-alert-notifier', app.config.get('STOCK_ALERT_INTERVAL', NOTIFY_INTERVAL),
+                       lambda app: notify_low_stock(), 'Low stock notification run')
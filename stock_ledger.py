@@ -0,0 +1,230 @@
+"""Append-only stock ledger with periodic per-item snapshots.
+
+Every change to ``Crop.quantity``, ``Product.current_stock`` or
+``InventoryItem.quantity`` appends a ``stock_movements`` row holding the
+delta, a reason and, for sales, the order it belongs to. The quantity
+columns remain the current balance that listings, indexes and triggers
+read; the ledger is the history behind them.
+
+Changes reach the ledger in three ways. ``move_stock`` applies a delta with
+one guarded ``UPDATE ... SET quantity = quantity + ?`` and records it, so
+concurrent orders never read-modify-write a row and can never take more
+than is there. Set-based writers such as checkout run their own UPDATEs and
+hand the movements to ``record_movements``. Anything else done through the
+ORM (creating, editing or deleting an item) is picked up at flush time as
+an ``opening``, ``adjustment`` or ``closing`` movement.
+
+``compact_stock_ledger`` folds each item's new movements into a
+``stock_snapshots`` row. An item's stock, now or at an earlier time, is its
+latest snapshot taken by then plus the movements after it, so reads cost
+O(tail) rather than a replay of the whole history. Movements are never
+deleted, which keeps as-of answers exact between snapshots. Movement ids
+order the ledger: a snapshot holds the sum of every movement of its item up
+to ``last_movement_id``.
+"""
+from datetime import datetime
+from sqlalchemy import event, func, insert, select, update
+from sqlalchemy.orm import Session, attributes
+from sqlalchemy.orm.util import identity_key
+from extensions import db
+from models import Crop, InventoryItem, Product, StockMovement, StockSnapshot
+from dashboard_cache import queue_invalidation
+
+# Item type -> (model, quantity column, owner column)
+ITEMS = {
+    'crop': (Crop, Crop.quantity, Crop.farmer_id),
+    'product': (Product, Product.current_stock, None),
+    'inventory': (InventoryItem, InventoryItem.quantity, InventoryItem.distributor_id),
+}
+ITEM_TYPES = {model: (item_type, column.key) for item_type, (model, column, _owner) in ITEMS.items()}
+
+REASONS = (
+    'opening',  # Item created
+    'adjustment',  # Quantity edited in place
+    'closing',  # Item deleted
+    'received',  # Stock added by hand
+    'issued',  # Stock removed by hand
+    'sale',  # Taken by an order
+    'import',  # Bulk import
+)
+BATCH_SIZE = 500  # Items per compaction or report query
+
+
+def _chunks(values, size=BATCH_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _movement(item_type, item_id, delta, reason, order_id=None, created_at=None):
+    if reason not in REASONS:
+        raise ValueError(f'Unknown stock movement reason {reason!r}')
+    return {'item_type': item_type, 'item_id': item_id, 'delta': delta, 'reason': reason,
+            'order_id': order_id, 'created_at': created_at or datetime.utcnow()}
+
+
+def record_movements(movements):
+    """Append `(item_type, item_id, delta, reason, order_id)` tuples to the ledger in one statement.
+
+    For writers that change the quantity columns with their own set-based
+    UPDATEs; the caller commits.
+    """
+    now = datetime.utcnow()
+    rows = [_movement(*movement, created_at=now) for movement in movements if movement[2]]
+    if rows:
+        db.session.execute(insert(StockMovement.__table__), rows)
+    return len(rows)
+
+
+def move_stock(item_type, item_id, delta, reason, order_id=None):
+    """Add `delta` to an item's stock and record the movement; the caller commits.
+
+    A negative delta only applies if that much is in stock. Returns the new
+    quantity, or None when the item does not exist or has too little stock.
+    """
+    model, column, owner = ITEMS[item_type]
+    stmt = update(model).where(model.id == item_id)
+    if delta < 0:
+        stmt = stmt.where(column >= -delta)
+    returning = (column,) if owner is None else (column, owner)
+    row = db.session.execute(
+        stmt.values({column: column + delta}).returning(*returning)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        return None
+
+    # Keep a loaded copy of the row current without marking it as changed
+    obj = db.session.identity_map.get(identity_key(model, item_id))
+    if obj is not None:
+        attributes.set_committed_value(obj, column.key, row[0])
+    if owner is not None:
+        queue_invalidation(db.session, [row[1]])
+    record_movements([(item_type, item_id, delta, reason, order_id)])
+    return row[0]
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_stock_changes(session, flush_context, instances):
+    changes = []
+    for obj in session.new:
+        tracked = ITEM_TYPES.get(type(obj))
+        if tracked and getattr(obj, tracked[1]):
+            changes.append((obj, tracked[0], getattr(obj, tracked[1]), 'opening'))
+    for obj in session.dirty:
+        tracked = ITEM_TYPES.get(type(obj))
+        if tracked:
+            history = attributes.get_history(obj, tracked[1])
+            if history.added:
+                old = history.deleted[0] if history.deleted else None
+                delta = (history.added[0] or 0) - (old or 0)
+                if delta:
+                    changes.append((obj, tracked[0], delta, 'adjustment'))
+    for obj in session.deleted:
+        tracked = ITEM_TYPES.get(type(obj))
+        if tracked and getattr(obj, tracked[1]):
+            changes.append((obj, tracked[0], -getattr(obj, tracked[1]), 'closing'))
+    # Replaces whatever a failed flush left behind
+    session.info['stock_changes'] = changes
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_stock_changes(session, flush_context):
+    # New items only have ids once they are flushed
+    changes = session.info.pop('stock_changes', None)
+    if changes:
+        now = datetime.utcnow()
+        session.connection().execute(insert(StockMovement.__table__), [
+            _movement(item_type, obj.id, delta, reason, created_at=now) for obj, item_type, delta, reason in changes
+        ])
+
+
+def _latest_snapshot(column, item_type, item_id, as_of=None):
+    """Correlated lookup of one column of an item's latest snapshot taken by `as_of`."""
+    query = select(column).where(StockSnapshot.item_type == item_type, StockSnapshot.item_id == item_id)
+    if as_of is not None:
+        query = query.where(StockSnapshot.taken_at <= as_of)
+    return query.order_by(StockSnapshot.last_movement_id.desc()).limit(1).scalar_subquery()
+
+
+def _tail(item_type, item_id, after, upto=None, as_of=None):
+    """Correlated sum of an item's movements after movement `after`, up to `upto` and made by `as_of`."""
+    query = select(func.coalesce(func.sum(StockMovement.delta), 0.0)).where(
+        StockMovement.item_type == item_type,
+        StockMovement.item_id == item_id,
+        StockMovement.id > after
+    )
+    if upto is not None:
+        query = query.where(StockMovement.id <= upto)
+    if as_of is not None:
+        query = query.where(StockMovement.created_at <= as_of)
+    return query.scalar_subquery()
+
+
+def stock_levels(item_type, item_ids, as_of=None):
+    """Stock of the given items from the ledger, now or as it stood at `as_of`, keyed by item id.
+
+    `item_ids` is a list of ids or a select of them, e.g. one distributor's
+    inventory. Each item costs an index seek for its snapshot plus a range
+    read of the movements after it.
+    """
+    model = ITEMS[item_type][0]
+    bases = select(
+        model.id.label('item_id'),
+        func.coalesce(_latest_snapshot(StockSnapshot.quantity, item_type, model.id, as_of), 0.0).label('quantity'),
+        func.coalesce(_latest_snapshot(StockSnapshot.last_movement_id, item_type, model.id, as_of), 0).label('after')
+    )
+    chunks = _chunks(item_ids) if isinstance(item_ids, (list, tuple)) else [item_ids]
+    levels = {}
+    for chunk in chunks:
+        base = bases.where(model.id.in_(chunk)).subquery()
+        rows = db.session.execute(select(
+            base.c.item_id, base.c.quantity + _tail(item_type, base.c.item_id, base.c.after, as_of=as_of)
+        ))
+        levels.update(rows.all())
+    return levels
+
+
+def stock_level(item_type, item_id, as_of=None):
+    """Stock of one item from the ledger, now or at `as_of`; 0 for items with no history."""
+    return stock_levels(item_type, [item_id], as_of).get(item_id, 0.0)
+
+
+def compact_stock_ledger(before=None):
+    """Fold movements made up to `before` (default now) into a new snapshot of every item they touched.
+
+    Snapshots are taken in cutoff order, so a cutoff no later than the last
+    one is a no-op. Returns the number of snapshots written.
+    """
+    cutoff = before or datetime.utcnow()
+    written = 0
+    for item_type in ITEMS:
+        last_cutoff = db.session.execute(
+            select(func.max(StockSnapshot.taken_at)).where(StockSnapshot.item_type == item_type)
+        ).scalar()
+        if last_cutoff is not None and last_cutoff >= cutoff:
+            continue
+        # Items moved since the last compaction, with the last movement each one gets folded up to
+        moved = select(StockMovement.item_id, func.max(StockMovement.id).label('upto')).where(
+            StockMovement.item_type == item_type, StockMovement.created_at <= cutoff)
+        if last_cutoff is not None:
+            moved = moved.where(StockMovement.created_at > last_cutoff)
+        moved = moved.group_by(StockMovement.item_id).subquery()
+        base = select(
+            moved.c.item_id, moved.c.upto,
+            func.coalesce(_latest_snapshot(StockSnapshot.quantity, item_type, moved.c.item_id), 0.0).label('quantity'),
+            func.coalesce(_latest_snapshot(StockSnapshot.last_movement_id, item_type, moved.c.item_id), 0).label('after')
+        ).subquery()
+        rows = db.session.execute(select(
+            base.c.item_id, base.c.upto,
+            base.c.quantity + _tail(item_type, base.c.item_id, base.c.after, upto=base.c.upto)
+        ).where(base.c.upto > base.c.after)).all()
+
+        for chunk in _chunks(rows):
+            db.session.execute(insert(StockSnapshot), [
+                {'item_type': item_type, 'item_id': item_id, 'quantity': quantity,
+                 'last_movement_id': upto, 'taken_at': cutoff}
+                for item_id, upto, quantity in chunk
+            ])
+        written += len(rows)
+    db.session.commit()
+    return written
@@ -0,0 +1,103 @@
+"""The two grouped analytics queries give the numbers the per-month and per-product queries gave."""
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import func
+from app import app as flask_app
+from extensions import db
+from models import Order, OrderItem, Product
+from analytics import retailer_dashboard_stats
+from conftest import add_users
+
+NOW = datetime(2026, 6, 15, 12, 0)  # Mid-month, where 30-day steps land in consecutive calendar months
+
+
+def per_row_stats(retailer_id, now):
+    """The dashboard's figures as the retailer view computed them before the analytics service."""
+    completed = (Order.retailer_id == retailer_id, Order.status == 'completed')
+
+    def total(*conditions):
+        return db.session.query(func.sum(Order.total_amount)).filter(*completed, *conditions).scalar() or 0.0
+
+    sales_data, sales_labels = [], []
+    for i in range(5, -1, -1):
+        date = now - timedelta(days=i * 30)
+        month_start = date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(seconds=1)
+        sales_data.append(total(Order.completed_at.between(month_start, month_end)))
+        sales_labels.append(date.strftime('%b %Y'))
+
+    popular = db.session.query(
+        OrderItem.product_id, func.sum(OrderItem.quantity), func.sum(OrderItem.quantity * OrderItem.price_per_unit)
+    ).join(Order).filter(*completed).group_by(OrderItem.product_id).order_by(
+        func.sum(OrderItem.quantity).desc()).limit(5).all()
+    popular = [(db.session.get(Product, product_id), quantity, revenue) for product_id, quantity, revenue in popular]
+
+    last_year_start = now - timedelta(days=365)
+    last_year_sales = total(Order.completed_at >= last_year_start)
+    previous_year_sales = total(Order.completed_at.between(last_year_start - timedelta(days=365), last_year_start))
+
+    categories = db.session.query(
+        Product.category, func.sum(OrderItem.quantity * OrderItem.price_per_unit)
+    ).join(OrderItem, Product.id == OrderItem.product_id).join(Order, OrderItem.order_id == Order.id).filter(
+        *completed, Product.category.isnot(None)
+    ).group_by(Product.category).order_by(func.sum(OrderItem.quantity * OrderItem.price_per_unit).desc()).all()
+
+    total_purchases = total(Order.completed_at >= now.replace(day=1, hour=0, minute=0, second=0, microsecond=0))
+    return {
+        'total_purchases': total_purchases,
+        'total_revenue': total_purchases * 1.2,
+        'sales_labels': sales_labels,
+        'sales_data': sales_data,
+        'profit_data': [sales * 0.2 for sales in sales_data],
+        'product_labels': [product.name for product, _quantity, _revenue in popular if product],
+        'product_quantities': [float(quantity) for product, quantity, _revenue in popular if product],
+        'product_revenues': [float(revenue) for product, _quantity, revenue in popular if product],
+        'yoy_growth': ((last_year_sales - previous_year_sales) / previous_year_sales * 100)
+        if previous_year_sales > 0 else 0,
+        'category_labels': [category for category, _revenue in categories] or ['No Data'],
+        'category_revenues': [float(revenue) for _category, revenue in categories] or [0.0],
+    }
+
+
+@pytest.fixture
+def ids(schema):
+    with flask_app.app_context():
+        users = add_users('analytics', {'shop': 'retailer', 'other': 'retailer'})
+        products = [Product(name=f'Product {n}', category=(None, 'Cereals', 'Fruit', 'Dairy')[n % 4], unit='kg',
+                            current_stock=100, reorder_level=5, price_per_unit=n + 1) for n in range(8)]
+        db.session.add_all(products)
+        db.session.flush()
+        # Two years of orders every 8 days, with every third one still pending and some for another retailer
+        for n in range(95):
+            completed_at = NOW - timedelta(days=8 * n + 1, hours=n % 24)
+            retailer = users['other' if n % 7 == 0 else 'shop']
+            order = Order(retailer_id=retailer.id, status='pending' if n % 3 == 0 else 'completed',
+                          total_amount=10 + n * 3.5, created_at=completed_at, completed_at=completed_at)
+            db.session.add(order)
+            db.session.flush()
+            db.session.add_all(OrderItem(order_id=order.id, product_id=products[(n + line) % 8].id,
+                                         quantity=1 + (n * 7 + line * 3) % 11 + line / 10, price_per_unit=2 + line)
+                               for line in range(3))
+        db.session.commit()
+        result = {name: user.id for name, user in users.items()}
+        db.session.remove()
+    return result
+
+
+@pytest.mark.parametrize('retailer', ['shop', 'other'])
+def test_grouped_queries_match_per_row_queries(ids, retailer):
+    with flask_app.app_context():
+        stats = retailer_dashboard_stats(ids[retailer], now=NOW)
+        expected = per_row_stats(ids[retailer], NOW)
+        assert stats.keys() == expected.keys()
+        for key, value in expected.items():
+            assert stats[key] == (value if key.endswith('labels') else pytest.approx(value)), key
+        assert len(stats['product_labels']) == 5 and any(stats['sales_data'])
+
+
+def test_no_orders_gives_empty_series(ids):
+    with flask_app.app_context():
+        retailer = add_users('analytics', {'new': 'retailer'})['new']
+        stats = retailer_dashboard_stats(retailer.id, now=NOW)
+        assert stats == per_row_stats(retailer.id, NOW)
+        assert stats['category_labels'] == ['No Data'] and stats['sales_data'] == [0.0] * 6
@@ -0,0 +1,151 @@
+"""Checkout picks the nearest distributor with spare capacity."""
+import math
+import random
+import threading
+import pytest
+from app import app as flask_app
+from extensions import db
+from geo import haversine_km
+from models import User, Product, Delivery
+from assignment import DistributorIndex, distributor_index, LEAST_LOADED, NEAREST, OVER_CAPACITY, TIE_KM
+
+
+def brute_force(distributors, point, index):
+    """Nearest distributor with room, ties within TIE_KM broken by load, distance and id."""
+    candidates = [(haversine_km(point, location), distributor_id, orders, deliveries)
+                  for distributor_id, location, orders, deliveries in distributors
+                  if orders < index.max_open_orders and deliveries < index.max_pending_deliveries]
+    nearest = min(km for km, *_rest in candidates)
+    return min((max(orders / index.max_open_orders, deliveries / index.max_pending_deliveries), km, distributor_id)
+               for km, distributor_id, orders, deliveries in candidates if km <= nearest + TIE_KM)[2]
+
+
+def test_index_matches_brute_force_and_tracks_capacity():
+    rng = random.Random(5)
+    distributors = [(n + 1, (rng.uniform(-34.5, -22.5), rng.uniform(17, 32.5)), rng.randint(0, 12), rng.randint(0, 12))
+                    for n in range(2000)]
+    index = DistributorIndex(max_open_orders=10, max_pending_deliveries=10, ttl=math.inf)
+    index.build(*zip(*distributors))
+    for _ in range(200):
+        point = (rng.uniform(-34.5, -22.5), rng.uniform(17, 32.5))
+        assignment = index.assign(point)
+        assert assignment.reason == NEAREST
+        assert assignment.distributor_id == brute_force(distributors, point, index)
+
+    # Filling the chosen distributor moves the next order elsewhere
+    point = (-29.0852, 26.1596)
+    first = index.assign(point).distributor_id
+    assert index.adjust(first, orders=10)
+    assert index.assign(point).distributor_id != first
+    index.adjust(first, orders=-10)
+    assert index.assign(point).distributor_id == first
+
+
+def test_fallbacks_for_unknown_locations_and_full_distributors():
+    index = DistributorIndex(max_open_orders=2, max_pending_deliveries=2, ttl=math.inf)
+    index.build([1, 2, 3], [(-33.9249, 18.4241), None, (-29.0852, 26.1596)], [1, 0, 2], [0, 0, 0])
+    assert index.assign(None).to_dict() == {'distributor_id': 2, 'distance_km': None, 'reason': LEAST_LOADED}
+    index.adjust(2, orders=2)
+    index.adjust(1, orders=1)
+    # Nobody has room, so the order still goes to the least loaded distributor
+    assignment = index.assign((-33.9, 18.5))
+    assert (assignment.distributor_id, assignment.reason) == (1, OVER_CAPACITY)
+    assert assignment.distance_km == pytest.approx(8, abs=2)
+
+
+@pytest.fixture
+def ids():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with flask_app.app_context():
+        db.create_all()
+        users = [
+            User(username='cape_dist', email='cape@assign.test', role='distributor', location='Stellenbosch'),
+            User(username='bloem_dist', email='bloem@assign.test', role='distributor', location='Bloemfontein'),
+            User(username='paarl_shop', email='shop@assign.test', role='retailer', location='Paarl'),
+        ]
+        for user in users:
+            user.set_password('password123')
+        product = Product(name='Maize meal', category='Cereals', unit='kg', current_stock=500, reorder_level=10,
+                          price_per_unit=2.5)
+        db.session.add_all(users + [product])
+        db.session.commit()
+        result = {user.username: user.id for user in users}
+        result['product'] = product.id
+        db.session.remove()
+    yield result
+    with flask_app.app_context():
+        db.drop_all()
+
+
+def checkout(ids):
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(ids['paarl_shop'])
+        session['_fresh'] = True
+    response = client.post('/api/checkout', json={'items': [{'id': ids['product'], 'quantity': 1}]})
+    assert response.get_json()['success'], response.get_json()
+    return response.get_json()
+
+
+def test_checkout_assigns_nearest_distributor_and_counts_its_load(ids, monkeypatch):
+    monkeypatch.setattr(distributor_index, 'max_open_orders', 2)
+    first = checkout(ids)
+    assert first['assignment']['distributor_id'] == ids['cape_dist']
+    assert first['assignment']['distance_km'] == pytest.approx(24, abs=5)
+
+    position = distributor_index.positions[ids['cape_dist']]
+    assert (distributor_index.orders[position], distributor_index.deliveries[position]) == (1, 1)
+    assert checkout(ids)['assignment']['distributor_id'] == ids['cape_dist']
+    # Two open orders fill the nearby distributor, so the next one goes inland
+    assert checkout(ids)['assignment']['distributor_id'] == ids['bloem_dist']
+
+    with flask_app.app_context():
+        deliveries = Delivery.query.filter_by(distributor_id=ids['cape_dist']).order_by(Delivery.id).all()
+        order = deliveries[0].order
+        for delivery in deliveries:
+            delivery.status = 'completed'
+        db.session.commit()
+        assert (distributor_index.orders[position], distributor_index.deliveries[position]) == (2, 0)
+        # The commit expired the order, so its previous status is unknown and the index reloads
+        order.status = 'completed'
+        db.session.commit()
+        assert distributor_index._loaded_at is None
+    assert checkout(ids)['assignment']['distributor_id'] == ids['cape_dist']
+    position = distributor_index.positions[ids['cape_dist']]
+    assert (distributor_index.orders[position], distributor_index.deliveries[position]) == (2, 1)
+
+
+def test_reloads_never_race_assignments():
+    rng = random.Random(9)
+
+    def distributors(count, first_id):
+        return ([first_id + n for n in range(count)],
+                [(rng.uniform(-34.5, -22.5), rng.uniform(17, 32.5)) for _ in range(count)],
+                [rng.randint(0, 12) for _ in range(count)], [rng.randint(0, 12) for _ in range(count)])
+
+    index = DistributorIndex(max_open_orders=10, max_pending_deliveries=10, ttl=math.inf)
+    snapshots = [distributors(1500, 1), distributors(40, 5001)]
+    valid_ids = set(snapshots[0][0]) | set(snapshots[1][0])
+    index.replace(*snapshots[0])
+    stop, errors = threading.Event(), []
+
+    def reload():
+        # Alternate between a large and a small index, as TTL reloads would after distributors change
+        n = 0
+        while not stop.is_set():
+            n += 1
+            index.replace(*snapshots[n % 2])
+
+    reloader = threading.Thread(target=reload)
+    reloader.start()
+    try:
+        for _ in range(3000):
+            try:
+                assignment = index.assign((rng.uniform(-34.5, -22.5), rng.uniform(17, 32.5)))
+                assert assignment.distributor_id in valid_ids
+            except Exception as e:
+                errors.append(e)
+    finally:
+        stop.set()
+        reloader.join()
+    assert errors == []
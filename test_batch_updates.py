@@ -0,0 +1,163 @@
+"""Batch stock adjustments and order transitions validate every entry and apply in one transaction."""
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import select
+from app import app as flask_app
+from extensions import db
+from models import Order, Delivery, InventoryItem, OrderEvent, StockMovement, FarmerMonthlyRollup
+from assignment import distributor_index
+from dashboard_cache import cached_widget
+from conftest import add_users, client_for
+
+
+@pytest.fixture
+def ids(schema):
+    with flask_app.app_context():
+        now = datetime.utcnow()
+        users = add_users('batch', {'farmer': 'farmer', 'distributor': 'distributor', 'other': 'distributor',
+                                    'retailer': 'retailer'}, location='Durban')
+        maize, beans, foreign = (
+            InventoryItem(distributor_id=users[owner].id, name=name, category='Grains', quantity=quantity,
+                          unit='kg', min_quantity=5, price_per_unit=10)
+            for owner, name, quantity in (('distributor', 'Maize', 40), ('distributor', 'Beans', 10),
+                                          ('other', 'Rice', 8)))
+
+        def order(status, distributor='distributor', total_amount=30, **kwargs):
+            return Order(retailer_id=users['retailer'].id, distributor_id=users[distributor].id, status=status,
+                         total_amount=total_amount, created_at=now - timedelta(days=1), **kwargs)
+
+        pending, processing, theirs = order('pending'), order('processing'), order('pending', 'other')
+        db.session.add_all([maize, beans, foreign, pending, processing, theirs])
+        db.session.flush()
+        child = order('processing', farmer_id=users['farmer'].id, parent_order_id=processing.id, total_amount=20)
+        db.session.add_all([child] + [
+            Delivery(order_id=parent.id, distributor_id=users['distributor'].id, status=status,
+                     scheduled_date=now + timedelta(days=1), delivery_address='Durban',
+                     tracking_number=f'TRKBATCH{parent.id}')
+            for parent, status in ((pending, 'pending'), (processing, 'scheduled'))])
+        db.session.commit()
+        result = {role: user.id for role, user in users.items()}
+        result.update(maize=maize.id, beans=beans.id, foreign=foreign.id, pending=pending.id,
+                      processing=processing.id, theirs=theirs.id, child=child.id)
+        db.session.remove()
+    yield result
+    distributor_index.clear()
+
+
+def quantities(*item_ids):
+    return [db.session.get(InventoryItem, item_id).quantity for item_id in item_ids]
+
+
+def test_stock_batch_is_all_or_nothing(ids):
+    client = client_for(ids['distributor'])
+    rejected = client.put('/api/inventory/stock', json={'adjustments': [
+        {'id': ids['maize'], 'adjustment_type': 'remove', 'quantity': 15},
+        {'id': ids['beans'], 'adjustment_type': 'remove', 'quantity': 11},
+        {'id': ids['foreign'], 'adjustment_type': 'set', 'quantity': 1},
+        {'id': ids['maize'], 'adjustment_type': 'shrink', 'quantity': 1},
+        {'id': ids['beans'], 'adjustment_type': 'set', 'quantity': 'inf'},
+    ]})
+    assert rejected.status_code == 400
+    assert [result['message'] for result in rejected.get_json()['results']] == [
+        'Not applied: other entries in the batch failed', 'Cannot remove 11.0 kg. Only 10.0 kg available.',
+        'Inventory item not found', 'Invalid adjustment type', 'quantity must be a positive number']
+    with flask_app.app_context():
+        assert quantities(ids['maize'], ids['beans'], ids['foreign']) == [40, 10, 8]
+
+    # Entries for one item apply in order, so a count followed by a receipt lands on the sum
+    applied = client.put('/api/inventory/stock', json={'adjustments': [
+        {'id': ids['maize'], 'adjustment_type': 'set', 'quantity': 32},
+        {'id': ids['beans'], 'adjustment_type': 'remove', 'quantity': 10},
+        {'id': ids['maize'], 'adjustment_type': 'add', 'quantity': 3},
+    ]})
+    assert applied.status_code == 200
+    assert applied.get_json() == {'success': True, 'applied': 3, 'results': [
+        {'id': ids['maize'], 'success': True, 'quantity': 32},
+        {'id': ids['beans'], 'success': True, 'quantity': 0},
+        {'id': ids['maize'], 'success': True, 'quantity': 35}]}
+    with flask_app.app_context():
+        assert quantities(ids['maize'], ids['beans']) == [35, 0]
+        moves = db.session.execute(select(StockMovement.item_id, StockMovement.delta, StockMovement.reason).where(
+            StockMovement.reason != 'opening').order_by(StockMovement.id)).all()
+        assert moves == [(ids['maize'], -8, 'adjustment'), (ids['beans'], -10, 'issued'),
+                         (ids['maize'], 3, 'received')]
+
+    partial = client.put('/api/inventory/stock', json={'allow_partial': True, 'adjustments': [
+        {'id': ids['maize'], 'adjustment_type': 'remove', 'quantity': 5}, {'id': 'nope'}]})
+    assert partial.status_code == 200
+    assert partial.get_json()['applied'] == 1
+    with flask_app.app_context():
+        assert quantities(ids['maize']) == [30]
+    assert client.put('/api/inventory/stock', json={'adjustments': []}).status_code == 400
+
+
+def test_single_item_adjustments_validate_like_the_batch(ids):
+    client = client_for(ids['distributor'])
+    for quantity in ('inf', 'nan', '1e309', -5):
+        response = client.put(f"/api/inventory/{ids['maize']}/stock",
+                              json={'adjustment_type': 'add', 'quantity': quantity})
+        assert response.status_code == 400
+        assert response.get_json()['message'] == 'quantity must be a positive number'
+    response = client.put(f"/api/inventory/{ids['maize']}/stock", data='{"adjustment_type": "add", "quantity": 1e309}',
+                          content_type='application/json')
+    assert response.status_code == 400
+    with flask_app.app_context():
+        assert quantities(ids['maize']) == [40]
+
+
+def test_order_batch_moves_children_deliveries_and_counters(ids):
+    with flask_app.app_context():
+        distributor_index.load()
+        assert cached_widget(ids['farmer'], 'farmer_crops', lambda: 'stale') == 'stale'
+    start = int(distributor_index.orders[distributor_index.positions[ids['distributor']]])
+    client = client_for(ids['distributor'])
+
+    rejected = client.put('/api/orders/status', json={'transitions': [
+        {'id': ids['pending'], 'status': 'processing'},
+        {'id': ids['processing'], 'status': 'pending'},
+        {'id': ids['theirs'], 'status': 'processing'},
+        {'id': ids['pending'], 'status': 'cancelled'},
+    ]})
+    assert rejected.status_code == 400
+    assert [result['message'] for result in rejected.get_json()['results']] == [
+        'Not applied: other entries in the batch failed', 'Invalid status transition from processing to pending',
+        'Unauthorized', 'Order appears more than once in the batch']
+
+    applied = client.put('/api/orders/status', json={'transitions': [
+        {'id': ids['pending'], 'status': 'processing'}, {'id': ids['processing'], 'status': 'completed'}]})
+    assert applied.status_code == 200, applied.get_json()
+    with flask_app.app_context():
+        statuses = {order.id: (order.status, order.completed_at is not None) for order in Order.query}
+        assert statuses[ids['pending']] == ('processing', False)
+        assert statuses[ids['processing']] == ('completed', True)
+        assert statuses[ids['child']] == ('completed', True)
+        assert statuses[ids['theirs']] == ('pending', False)
+        assert dict(db.session.execute(select(Delivery.order_id, Delivery.status)).all()) == {
+            ids['pending']: 'scheduled', ids['processing']: 'delivered'}
+        assert db.session.execute(select(OrderEvent.order_id, OrderEvent.status).order_by(OrderEvent.id)).all() == [
+            (ids['pending'], 'processing'), (ids['processing'], 'completed'), (ids['child'], 'completed')]
+        rollup = FarmerMonthlyRollup.query.filter_by(farmer_id=ids['farmer']).one()
+        assert (rollup.revenue, rollup.order_count) == (20, 1)
+        # The farmer's cached dashboard was dropped on commit
+        assert cached_widget(ids['farmer'], 'farmer_crops', lambda: 'fresh') == 'fresh'
+
+    # One order left the open set; the delivery count moved by one up and one down
+    position = distributor_index.positions[ids['distributor']]
+    assert distributor_index.orders[position] == start - 1
+    with flask_app.app_context():
+        distributor_index.load()
+    assert distributor_index.orders[position] == start - 1
+
+
+def test_dashboard_status_updates_carry_a_csrf_token(ids, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'WTF_CSRF_ENABLED', True)
+    client = client_for(ids['distributor'])
+    transitions = {'transitions': [{'id': ids['pending'], 'status': 'processing'}]}
+    assert client.put('/api/orders/status', json=transitions).status_code == 400
+
+    # The cached dashboard fetches its token rather than embedding one
+    token = client.get('/api/csrf-token')
+    assert token.headers['Cache-Control'] == 'no-store'
+    applied = client.put('/api/orders/status', json=transitions,
+                         headers={'X-CSRFToken': token.get_json()['csrf_token']})
+    assert applied.status_code == 200, applied.get_json()
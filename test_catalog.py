@@ -0,0 +1,106 @@
+"""The retailer catalog API pages, trims and revalidates product listings."""
+from datetime import datetime, timedelta
+import pytest
+from app import app as flask_app
+from extensions import db
+from models import Product, Supplier
+from conftest import add_users, client_for
+
+
+@pytest.fixture
+def ids(schema):
+    with flask_app.app_context():
+        users = add_users('catalog', ('retailer', 'farmer'))
+        supplier = Supplier(name='Karoo Mills', address='Graaff-Reinet')
+        db.session.add(supplier)
+        db.session.flush()
+        now = datetime.utcnow()
+        products = [
+            Product(name=f'Product {n:02d}', category='Cereals' if n % 2 else 'Fruit', unit='kg',
+                    current_stock=0 if n % 10 == 0 else n, reorder_level=5, price_per_unit=None if n == 7 else n % 6,
+                    supplier_id=supplier.id if n % 3 == 0 else None, created_at=now - timedelta(hours=n))
+            for n in range(1, 31)
+        ]
+        db.session.add_all(products)
+        db.session.commit()
+        result = {'retailer': users['retailer'].id, 'farmer': users['farmer'].id,
+                  'products': [p.id for p in products]}
+        db.session.remove()
+    return result
+
+
+def walk(client, query):
+    """Every product of a catalog listing, following next cursors."""
+    products, cursor = [], None
+    while True:
+        response = client.get(f'/api/products?{query}' + (f'&after={cursor}' if cursor else ''))
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+        products.extend(body['products'])
+        cursor = body['pagination']['next_cursor']
+        if not cursor:
+            return products
+
+
+@pytest.mark.parametrize('sort, key, reverse', [
+    ('name', lambda p: (p['name'], p['id']), False),
+    ('price', lambda p: (p['price_per_unit'] or 0, p['id']), False),
+    ('-price', lambda p: (p['price_per_unit'] or 0, p['id']), True),
+    ('newest', lambda p: p['name'], False),  # Product n was created n hours ago
+])
+def test_cursor_pages_cover_the_in_stock_catalog_once(ids, sort, key, reverse):
+    client = client_for(ids['retailer'])
+    products = walk(client, f'sort={sort}&per_page=4&fields=name,price_per_unit,current_stock,updated_at')
+    assert len(products) == 27  # Every tenth product is out of stock
+    assert len({p['id'] for p in products}) == 27
+    assert all(p['current_stock'] > 0 for p in products)
+    assert set(products[0]) == {'id', 'name', 'price_per_unit', 'current_stock', 'updated_at'}
+    assert products == sorted(products, key=key, reverse=reverse)
+
+    fruit = walk(client, f'sort={sort}&per_page=5&category=Fruit')
+    assert {p['category'] for p in fruit} == {'Fruit'}
+    assert len(fruit) == 12
+
+
+def test_batch_lookup_and_etags(ids):
+    client = client_for(ids['retailer'])
+    wanted = [ids['products'][9], ids['products'][2], 9999]
+    body = client.get(f"/api/products?ids={','.join(map(str, wanted))}").get_json()
+    assert [p['id'] for p in body['products']] == wanted[:2]
+    assert body['missing'] == [9999]
+    assert body['products'][0]['status'] == 'out_of_stock'
+    assert body['products'][1]['supplier'] == 'Karoo Mills'
+
+    response = client.get('/api/products?per_page=5')
+    etag = response.headers['ETag']
+    assert response.get_json()['pagination']['total_estimate'] == 27
+    again = client.get('/api/products?per_page=5', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+
+    with flask_app.app_context():
+        db.session.get(Product, ids['products'][0]).price_per_unit = 99
+        db.session.commit()
+    changed = client.get('/api/products?per_page=5', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+@pytest.mark.parametrize('query', [
+    'sort=cheapest', 'fields=name,secret', 'ids=1,two', 'ids=' + ','.join(str(n) for n in range(1, 102)),
+    'after=not-a-cursor',
+])
+def test_bad_requests(ids, query):
+    response = client_for(ids['retailer']).get(f'/api/products?{query}')
+    assert response.status_code == 400
+    assert not response.get_json()['success']
+
+
+def test_cursor_is_bound_to_its_sort(ids):
+    client = client_for(ids['retailer'])
+    cursor = client.get('/api/products?sort=price&per_page=2').get_json()['pagination']['next_cursor']
+    assert client.get(f'/api/products?sort=name&after={cursor}').status_code == 400
+    # The dashboard itself no longer embeds the catalog
+    page = client.get('/retailer/dashboard').get_data(as_text=True)
+    assert 'Product 01' not in page
+    assert 'catalog-rows' in page
@@ -0,0 +1,154 @@
+"""Checkout reserves stock with guarded UPDATEs, reports failed lines and splits orders per farmer."""
+import threading
+import pytest
+from flask import Flask
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from app import app as flask_app
+from extensions import db
+from models import User, Product, Order, OrderItem, Delivery, StockMovement
+from database import init_database
+import checkout
+from checkout import CheckoutError, checkout_cart
+from conftest import add_users
+
+
+def seed():
+    users = add_users('checkout', ('farmer', 'retailer', 'distributor'), location='Durban')
+    users.update(add_users('checkout', {'grower': 'farmer'}))
+    products = {
+        name: Product(name=name, category='Cereals', unit='kg', current_stock=stock, reorder_level=1,
+                      price_per_unit=price, farmer_id=users[farmer].id if farmer else None)
+        for name, stock, price, farmer in (('maize', 10, 2.0, 'farmer'), ('beans', 5, 3.0, 'farmer'),
+                                           ('rice', 8, 4.0, 'grower'), ('salt', 20, 1.0, None),
+                                           ('unpriced', 20, None, None))
+    }
+    db.session.add_all(products.values())
+    db.session.commit()
+    result = {name: user.id for name, user in users.items()}
+    result.update({name: product.id for name, product in products.items()})
+    return result
+
+
+@pytest.fixture
+def ids(schema):
+    with flask_app.app_context():
+        result = seed()
+        db.session.remove()
+    return result
+
+
+def place(ids, lines, allow_partial=False):
+    retailer, distributor = db.session.get(User, ids['retailer']), db.session.get(User, ids['distributor'])
+    return checkout_cart(retailer, distributor, [{'id': ids.get(name, name), 'quantity': quantity}
+                                                 for name, quantity in lines], allow_partial)
+
+
+def stock(ids, *names):
+    return [db.session.get(Product, ids[name]).current_stock for name in names]
+
+
+def test_orders_are_split_per_farmer(ids):
+    with flask_app.app_context():
+        order, failures = place(ids, [('maize', 4), ('rice', 2), ('salt', 3), ('maize', 1)])
+        assert failures == []
+        assert order.total_amount == 5 * 2.0 + 2 * 4.0 + 3 * 1.0
+        assert stock(ids, 'maize', 'rice', 'salt') == [5, 6, 17]
+
+        def lines(order_id):
+            return sorted(db.session.execute(select(OrderItem.product_id, OrderItem.quantity).where(
+                OrderItem.order_id == order_id)).all())
+
+        assert lines(order.id) == sorted([(ids['maize'], 5), (ids['rice'], 2), (ids['salt'], 3)])
+        children = {child.farmer_id: child for child in Order.query.filter_by(parent_order_id=order.id)}
+        assert children.keys() == {ids['farmer'], ids['grower']}
+        assert (children[ids['farmer']].total_amount, lines(children[ids['farmer']].id)) == (
+            10.0, [(ids['maize'], 5)])
+        assert (children[ids['grower']].total_amount, lines(children[ids['grower']].id)) == (
+            8.0, [(ids['rice'], 2)])
+
+        assert Delivery.query.filter_by(order_id=order.id).one().tracking_number == f'TRK{order.id:09d}'
+        assert sorted(db.session.execute(select(StockMovement.item_id, StockMovement.delta).where(
+            StockMovement.reason == 'sale', StockMovement.order_id == order.id)).all()) == sorted(
+            [(ids['maize'], -5), (ids['rice'], -2), (ids['salt'], -3)])
+
+
+def test_failed_lines_reject_the_cart_unless_partial(ids):
+    cart = [('maize', 3), ('beans', 6), ('unpriced', 1), (999, 1), ('salt', 'many')]
+    with flask_app.app_context():
+        with pytest.raises(CheckoutError) as rejected:
+            place(ids, cart)
+        assert rejected.value.failures == [{'product_id': ids['salt'], 'error': 'Invalid cart item'}]
+
+        with pytest.raises(CheckoutError) as rejected:
+            place(ids, cart[:4])
+        assert [failure['product_id'] for failure in rejected.value.failures] == [ids['beans'], ids['unpriced'], 999]
+        assert rejected.value.failures[0]['available'] == 5
+        # Nothing is kept from a rejected cart
+        assert stock(ids, 'maize', 'beans') == [10, 5]
+        assert Order.query.count() == 0
+
+        order, failures = place(ids, cart, allow_partial=True)
+        assert [failure['product_id'] for failure in failures] == [ids['salt'], ids['beans'], ids['unpriced'], 999]
+        assert order.total_amount == 6.0
+        assert stock(ids, 'maize', 'beans') == [7, 5]
+
+        with pytest.raises(CheckoutError, match='Insufficient stock for beans'):
+            place(ids, [('beans', 6)], allow_partial=True)
+
+
+def test_locked_database_is_retried(ids, monkeypatch):
+    place_once = checkout._place
+    attempts = []
+
+    def locked_once(*args):
+        attempts.append(len(attempts))
+        if len(attempts) == 1:
+            raise OperationalError('UPDATE products', {}, Exception('database is locked'))
+        return place_once(*args)
+
+    monkeypatch.setattr(checkout, '_place', locked_once)
+    with flask_app.app_context():
+        order, _failures = place(ids, [('maize', 2)])
+        assert attempts == [0, 1] and order.id is not None
+        assert stock(ids, 'maize') == [8]
+
+
+def test_concurrent_checkouts_never_oversell(tmp_path):
+    # A file database with the production profile, so checkouts really run on separate connections
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'checkout.db'}", DATABASE_PROFILE='production')
+    init_database(app)
+    with app.app_context():
+        db.create_all()
+        ids = seed()
+        db.session.remove()
+
+    barrier = threading.Barrier(6)
+    outcomes = []
+
+    def buy():
+        with app.app_context():
+            barrier.wait()
+            try:
+                place(ids, [('maize', 3)])
+                outcomes.append('placed')
+            except CheckoutError:
+                outcomes.append('rejected')
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=buy) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        assert sorted(outcomes) == ['placed'] * 3 + ['rejected'] * 3
+        assert stock(ids, 'maize') == [1]
+        assert db.session.execute(select(StockMovement.delta).where(
+            StockMovement.item_id == ids['maize'], StockMovement.reason == 'sale')).scalars().all() == [-3] * 3
+        db.drop_all()
+        db.session.remove()
+        db.engine.dispose()
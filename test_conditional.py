@@ -0,0 +1,110 @@
+"""Repeat views are answered with 304 from one row lookup until the rows change."""
+from datetime import datetime, timedelta
+import pytest
+from app import app as flask_app
+from extensions import db
+from models import User, Crop, Product, InventoryItem
+from conftest import add_users, client_for
+
+
+@pytest.fixture
+def ids(schema):
+    with flask_app.app_context():
+        now = datetime.utcnow()
+        users = add_users('etag', ('farmer', 'distributor', 'retailer'), location='Durban')
+        users.update(add_users('etag', {'other': 'distributor'}))
+        crop = Crop(farmer_id=users['farmer'].id, name='Maize', variety='Yellow', quantity=100, unit='kg',
+                    price_per_unit=150, status='ready_for_harvest', planting_date=now - timedelta(days=30),
+                    expected_harvest_date=now)
+        product = Product(name='Maize meal', category='Cereals', unit='kg', current_stock=50, reorder_level=10,
+                          price_per_unit=2.5)
+        item = InventoryItem(distributor_id=users['distributor'].id, name='Maize', category='Cereals', quantity=40,
+                             unit='kg', min_quantity=10, price_per_unit=150)
+        db.session.add_all([crop, product, item])
+        db.session.commit()
+        result = {name: user.id for name, user in users.items()}
+        result.update(crop=crop.id, product=product.id, item=item.id)
+        db.session.remove()
+    return result
+
+
+@pytest.mark.parametrize('role, url, policy', [
+    ('farmer', '/crop/{crop}', 'private, max-age=30, must-revalidate'),
+    ('retailer', '/crop/{crop}', 'private, max-age=30, must-revalidate'),
+    ('farmer', '/crop-inventory', 'private, no-cache'),
+    ('retailer', '/api/products/{product}', 'private, no-cache'),
+    ('distributor', '/api/inventory/{item}', 'private, no-cache'),
+])
+def test_repeat_views_revalidate_with_one_query(ids, role, url, policy):
+    client = client_for(ids[role])
+    url = url.format(**ids)
+    first = client.get(url)
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == policy
+    assert first.last_modified is not None
+    etag = first.headers['ETag']
+
+    again = client.get(url, headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+    assert again.headers['ETag'] == etag
+    assert again.headers['X-Query-Count'] == '1'
+    assert client.get(url, headers={'If-Modified-Since': first.headers['Last-Modified']}).status_code == 304
+
+
+def test_writes_users_and_access_change_the_answer(ids):
+    farmer = client_for(ids['farmer'])
+    etag = farmer.get(f"/crop/{ids['crop']}").headers['ETag']
+    with flask_app.app_context():
+        db.session.get(Crop, ids['crop']).price_per_unit = 175
+        db.session.commit()
+    changed = farmer.get(f"/crop/{ids['crop']}", headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert 'R175' in changed.get_data(as_text=True)
+
+    # The same crop seen by someone else is a different representation
+    retailer = client_for(ids['retailer'])
+    assert retailer.get(f"/crop/{ids['crop']}", headers={'If-None-Match': changed.headers['ETag']}).status_code == 200
+
+    # An ETag never lets a request past the access checks
+    item_etag = client_for(ids['distributor']).get(f"/api/inventory/{ids['item']}").headers['ETag']
+    denied = client_for(ids['other']).get(f"/api/inventory/{ids['item']}", headers={'If-None-Match': item_etag})
+    assert denied.status_code == 403
+    assert 'ETag' not in denied.headers
+    with flask_app.app_context():
+        db.session.get(Crop, ids['crop']).status = 'harvested'
+        db.session.commit()
+    assert retailer.get(f"/crop/{ids['crop']}", headers={'If-None-Match': etag}).status_code == 302
+
+
+def test_farmer_moving_changes_the_crop_page(ids):
+    # The farmer's location picks the region of the realized prices shown with the crop
+    retailer = client_for(ids['retailer'])
+    etag = retailer.get(f"/crop/{ids['crop']}").headers['ETag']
+    with flask_app.app_context():
+        db.session.get(User, ids['farmer']).location = 'Kimberley'
+        db.session.commit()
+    assert retailer.get(f"/crop/{ids['crop']}", headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_bulk_stock_updates_and_flashes_are_not_revalidated_away(ids):
+    from sqlalchemy import update
+    retailer = client_for(ids['retailer'])
+    etag = retailer.get(f"/api/products/{ids['product']}").headers['ETag']
+    with flask_app.app_context():
+        # Checkout reserves stock with a bulk UPDATE, which still moves updated_at
+        db.session.execute(update(Product).where(Product.id == ids['product'])
+                           .values(current_stock=Product.current_stock - 1))
+        db.session.commit()
+    response = retailer.get(f"/api/products/{ids['product']}", headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['current_stock'] == 49
+
+    farmer = client_for(ids['farmer'])
+    etag = farmer.get('/crop-inventory').headers['ETag']
+    with farmer.session_transaction() as session:
+        session['_flashes'] = [('success', 'Crop updated')]
+    response = farmer.get('/crop-inventory', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'Crop updated' in response.get_data(as_text=True)
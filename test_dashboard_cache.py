@@ -0,0 +1,120 @@
+"""Dashboard widgets are cached per user until that user's data changes."""
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import update
+from app import app as flask_app
+from extensions import db
+from models import User, Crop, Product, Order, OrderItem, InventoryItem, Delivery
+from dashboard_cache import dashboard_cache
+from user_cache import load_cached_user
+
+
+@pytest.fixture
+def ids():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with flask_app.app_context():
+        db.create_all()
+        now = datetime.utcnow()
+        users = {role: User(username=f'dash_{role}', email=f'{role}@dash.test', role=role)
+                 for role in ('farmer', 'distributor', 'retailer')}
+        other = User(username='dash_other', email='other@dash.test', role='distributor')
+        for user in list(users.values()) + [other]:
+            user.set_password('password123')
+        db.session.add_all(list(users.values()) + [other])
+        db.session.flush()
+
+        crop = Crop(farmer_id=users['farmer'].id, name='Maize', variety='Yellow', quantity=100, unit='kg',
+                    price_per_unit=150, status='growing', planting_date=now - timedelta(days=30),
+                    expected_harvest_date=now + timedelta(days=60))
+        product = Product(name='Maize meal', category='Cereals', unit='kg', current_stock=50, reorder_level=10,
+                          price_per_unit=2.5, farmer_id=users['farmer'].id)
+        order = Order(farmer_id=users['farmer'].id, retailer_id=users['retailer'].id,
+                      distributor_id=users['distributor'].id, status='pending', total_amount=25)
+        db.session.add_all([crop, product, order])
+        db.session.flush()
+        db.session.add_all([
+            OrderItem(order_id=order.id, product_id=product.id, quantity=10, price_per_unit=2.5),
+            InventoryItem(distributor_id=users['distributor'].id, name='Maize', category='Cereals', quantity=40,
+                          unit='kg', min_quantity=10, price_per_unit=150),
+            Delivery(order_id=order.id, distributor_id=users['distributor'].id, status='scheduled',
+                     scheduled_date=now, delivery_address='Cape Town', tracking_number='TRKDASH1'),
+        ])
+        db.session.commit()
+        result = {role: user.id for role, user in users.items()}
+        result.update(other=other.id, order=order.id, product=product.id)
+        for role in ('farmer', 'distributor', 'retailer'):
+            load_cached_user(result[role])
+        db.session.remove()
+    # Yielded outside the app context so each request gets its own
+    yield result
+    with flask_app.app_context():
+        db.drop_all()
+
+
+def get_dashboard(ids, role):
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(ids[role])
+        session['_fresh'] = True
+    response = client.get(f'/{role}/dashboard')
+    assert response.status_code == 200
+    return response
+
+
+def test_cache_stats_are_only_served_in_debug_mode(ids, monkeypatch):
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(ids['retailer'])
+        session['_fresh'] = True
+    assert client.get('/api/cache/stats').status_code == 404
+    monkeypatch.setattr(flask_app, 'debug', True)
+    assert set(client.get('/api/cache/stats').get_json()) == {'dashboards', 'users', 'counts'}
+
+
+@pytest.mark.parametrize('role', ['farmer', 'distributor', 'retailer'])
+def test_refresh_is_served_from_the_cache(ids, role):
+    first = get_dashboard(ids, role)
+    second = get_dashboard(ids, role)
+    assert int(first.headers['X-Query-Count']) > 0
+    assert int(second.headers['X-Query-Count']) == 0
+    assert second.data == first.data
+
+
+def test_committed_writes_invalidate_the_owners_widgets(ids):
+    for role in ('farmer', 'distributor', 'retailer'):
+        get_dashboard(ids, role)
+    dashboard_cache.set((ids['other'], 'distributor_orders'), [])
+
+    with flask_app.app_context():
+        order = db.session.get(Order, ids['order'])
+        order.status = 'processing'
+        db.session.flush()
+        db.session.rollback()
+        assert dashboard_cache.get((ids['distributor'], 'distributor_orders')) is not None
+
+        order = db.session.get(Order, ids['order'])
+        order.distributor_id = ids['other']
+        db.session.commit()
+
+    for role in ('farmer', 'distributor', 'retailer', 'other'):
+        assert dashboard_cache.get((ids[role], 'distributor_orders')) is None
+        assert dashboard_cache.get((ids[role], 'farmer_pending_orders')) is None
+    assert dashboard_cache.get((None, 'products')) is not None  # No product was written
+
+
+def test_order_items_and_bulk_stock_updates_invalidate(ids):
+    get_dashboard(ids, 'retailer')
+    with flask_app.app_context():
+        db.session.add(OrderItem(order_id=ids['order'], product_id=ids['product'], quantity=1, price_per_unit=2.5))
+        db.session.commit()
+        assert dashboard_cache.get((ids['retailer'], 'retailer_analytics')) is None
+        assert dashboard_cache.get((None, 'products')) is not None
+
+        db.session.execute(
+            update(Product).where(Product.id == ids['product']).values(current_stock=Product.current_stock - 45)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        assert dashboard_cache.get((None, 'products')) is None
+    get_dashboard(ids, 'retailer')
+    assert dashboard_cache.get((None, 'products')) == {'in_stock': 1, 'low_stock': 1}
@@ -0,0 +1,102 @@
+"""SQLite profiles pick the pool and PRAGMAs, and maintenance checkpoints the WAL."""
+import threading
+from datetime import datetime
+import pytest
+from flask import Flask
+from sqlalchemy import text
+from app import app as flask_app
+from extensions import db
+from models import Crop, Inventory
+from database import SQLITE_PROFILES, configure_engine_options, init_database, run_maintenance, start_maintenance
+from conftest import add_users, client_for
+
+PRAGMAS = ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size', 'temp_store', 'foreign_keys')
+
+
+@pytest.fixture
+def make_app():
+    apps = []
+
+    def make(uri, profile, **config):
+        app = Flask(__name__)
+        app.config.update(SQLALCHEMY_DATABASE_URI=uri, DATABASE_PROFILE=profile, **config)
+        init_database(app)
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        with app.app_context():
+            db.engine.dispose()
+
+
+def pragmas(app):
+    with app.app_context(), db.engine.connect() as connection:
+        return {name: connection.exec_driver_sql(f'PRAGMA {name}').scalar() for name in PRAGMAS}
+
+
+def test_production_profile_on_a_file(make_app, tmp_path):
+    app = make_app(f"sqlite:///{tmp_path / 'scm.db'}", 'production')
+    assert pragmas(app) == {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000, 'cache_size': -64000,
+                            'mmap_size': 268435456, 'temp_store': 2, 'foreign_keys': 0}
+    with app.app_context():
+        assert (db.engine.pool.size(), db.engine.pool._max_overflow) == (10, 20)
+
+
+def test_default_profile_leaves_sqlite_alone(make_app, tmp_path):
+    app = make_app(f"sqlite:///{tmp_path / 'scm.db'}", 'default')
+    # busy_timeout is the sqlite3 module's own 5 second default
+    assert pragmas(app) == {'journal_mode': 'delete', 'synchronous': 2, 'busy_timeout': 5000, 'cache_size': -2000,
+                            'mmap_size': 0, 'temp_store': 0, 'foreign_keys': 0}
+    assert 'pool_size' not in app.config['SQLALCHEMY_ENGINE_OPTIONS']
+
+
+def test_in_memory_database_skips_wal_and_pooling(make_app):
+    app = make_app('sqlite://', 'production')
+    applied = pragmas(app)
+    assert (applied['journal_mode'], applied['mmap_size']) == ('memory', None)
+    assert (applied['synchronous'], applied['foreign_keys'], applied['temp_store']) == (1, 0, 2)
+    assert 'pool_size' not in app.config['SQLALCHEMY_ENGINE_OPTIONS']
+
+
+def test_explicit_engine_options_win():
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite:////tmp/scm.db', DATABASE_PROFILE='production',
+                      SQLALCHEMY_ENGINE_OPTIONS={'pool_size': 2})
+    configure_engine_options(app)
+    assert app.config['SQLALCHEMY_ENGINE_OPTIONS'] == dict(SQLITE_PROFILES['production']['pool'], pool_size=2)
+
+
+def test_maintenance_checkpoints_the_wal(make_app, tmp_path):
+    app = make_app(f"sqlite:///{tmp_path / 'scm.db'}", 'production')
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(text('CREATE TABLE readings (value INTEGER)'))
+            connection.execute(text('INSERT INTO readings VALUES (:value)'), [{'value': n} for n in range(500)])
+    busy, wal_pages, checkpointed = run_maintenance(app)
+    assert busy == 0 and wal_pages > 0 and checkpointed == wal_pages
+
+    # Disabled, or pointless for an in-memory database: no thread is started
+    start_maintenance(make_app(f"sqlite:///{tmp_path / 'scm.db'}", 'production', SQLITE_MAINTENANCE_INTERVAL=0))
+    start_maintenance(make_app('sqlite://', 'production', SQLITE_MAINTENANCE_INTERVAL=60))
+    assert 'sqlite-maintenance' not in [thread.name for thread in threading.enumerate()]
+
+
+def test_production_profile_keeps_crop_deletion_working(schema):
+    # The profile tunes reads and writes only; turning on foreign key checks would refuse
+    # to delete crops that still have inventory rows
+    assert flask_app.config['DATABASE_PROFILE'] == 'production'
+    with flask_app.app_context():
+        farmer = add_users('profile', ['farmer'])['farmer']
+        crop = Crop(farmer_id=farmer.id, name='Maize', quantity=10, unit='kg', price_per_unit=5,
+                    planting_date=datetime(2026, 1, 1), expected_harvest_date=datetime(2026, 4, 1))
+        db.session.add(crop)
+        db.session.flush()
+        db.session.add(Inventory(farmer_id=farmer.id, crop_id=crop.id, quantity=10, unit='kg'))
+        db.session.commit()
+        farmer_id, crop_id = farmer.id, crop.id
+
+    response = client_for(farmer_id).post(f'/delete_crop/{crop_id}')
+    assert response.headers['Location'].endswith('/crop-inventory')
+    with flask_app.app_context():
+        assert db.session.get(Crop, crop_id) is None
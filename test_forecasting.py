@@ -0,0 +1,109 @@
+"""Demand forecasts set reorder levels and suggest restock orders that the reorder button requests."""
+from datetime import date, datetime, timedelta
+import numpy as np
+import pytest
+from app import app as flask_app
+from extensions import db
+from models import Order, OrderItem, Product, RestockOrder
+from forecasting import fit, plan_restocks
+from conftest import add_users, client_for
+
+TODAY = date(2026, 6, 1)
+
+
+def test_fit_uses_croston_for_intermittent_demand():
+    days = 120
+    demand = np.zeros((3, days))
+    demand[0] = 5  # Every day
+    demand[1, ::5] = 10  # Every fifth day
+    demand[2, 60::3] = 9  # Listed half way through, sold every third day
+    forecast = fit(np.arange(3), demand)
+
+    assert forecast.intermittent.tolist() == [False, True, True]
+    assert forecast.daily_demand[0] == pytest.approx(5)
+    assert forecast.sigma[0] == pytest.approx(0)
+    # Croston forecasts size over interval instead of decaying between demand days
+    assert forecast.daily_demand[1] == pytest.approx(2, rel=0.05)
+    assert forecast.daily_demand[2] == pytest.approx(3, rel=0.05)
+
+    reorder_point, order_up_to = forecast.reorder_levels(lead_time=7, review_days=7, service_level=0.95)
+    assert reorder_point[0] == pytest.approx(35)
+    assert order_up_to[0] == pytest.approx(70)
+    assert reorder_point[1] > 14  # Safety stock for the lumpy product
+
+
+def test_history_starts_at_the_first_demand_day():
+    demand = np.zeros((2, 180))
+    demand[0, -20:] = 5  # A steady seller listed twenty days ago
+    demand[1, -1] = 6  # A single sale yesterday
+    forecast = fit(np.arange(2), demand)
+
+    assert forecast.intermittent.tolist() == [False, False]
+    assert forecast.daily_demand[0] == pytest.approx(5)
+    assert forecast.sigma[0] == pytest.approx(0)
+    assert forecast.daily_demand[1] == pytest.approx(6)
+
+
+@pytest.fixture
+def ids(schema):
+    with flask_app.app_context():
+        farmer, distributor, retailer = add_users('forecast', ('farmer', 'distributor', 'retailer')).values()
+        fast, slow, idle = (Product(name=name, category='Cereals', unit='kg', current_stock=stock, reorder_level=10,
+                                    price_per_unit=2, farmer_id=farmer.id)
+                            for name, stock in (('Maize meal', 30), ('Sorghum', 500), ('Millet', 0)))
+        db.session.add_all([fast, slow, idle])
+        db.session.flush()
+
+        # Sixty days of checkouts: 8 kg of maize meal a day, 2 kg of sorghum every other day.
+        # Each parent order has a farmer child repeating its lines, which must not be counted twice.
+        for day in range(1, 61):
+            completed = datetime.combine(TODAY, datetime.min.time()) - timedelta(days=day, hours=-10)
+            parent = Order(retailer_id=retailer.id, distributor_id=distributor.id, status='completed',
+                           total_amount=20, created_at=completed, completed_at=completed)
+            db.session.add(parent)
+            db.session.flush()
+            child = Order(farmer_id=farmer.id, retailer_id=retailer.id, distributor_id=distributor.id,
+                          parent_order_id=parent.id, status='completed', total_amount=20, created_at=completed,
+                          completed_at=completed)
+            db.session.add(child)
+            db.session.flush()
+            lines = [(fast.id, 8)] + ([(slow.id, 2)] if day % 2 else [])
+            db.session.add_all(OrderItem(order_id=order.id, product_id=product_id, quantity=quantity,
+                                         price_per_unit=2)
+                               for order in (parent, child) for product_id, quantity in lines)
+        cancelled = Order(retailer_id=retailer.id, distributor_id=distributor.id, status='cancelled',
+                          total_amount=999, created_at=datetime(2026, 5, 20), completed_at=datetime(2026, 5, 20))
+        db.session.add(cancelled)
+        db.session.flush()
+        db.session.add(OrderItem(order_id=cancelled.id, product_id=idle.id, quantity=999, price_per_unit=1))
+        db.session.commit()
+        result = {'distributor': distributor.id, 'fast': fast.id, 'slow': slow.id, 'idle': idle.id}
+        db.session.remove()
+    return result
+
+
+def test_plan_restocks_sets_reorder_levels_and_suggestions(ids):
+    with flask_app.app_context():
+        plan = plan_restocks(ids['distributor'], today=TODAY, days=60, lead_time=7, review_days=7,
+                             service_level=0.95)
+        assert plan.to_dict() == {'products': 2, 'intermittent': 1, 'suggestions': 1}
+        levels = {product.id: product.reorder_level for product in Product.query}
+        assert levels[ids['fast']] == pytest.approx(56, abs=0.5)  # 8 kg a day over a 7 day lead time
+        assert 7 < levels[ids['slow']] < 20  # 1 kg a day plus safety stock
+        assert levels[ids['idle']] == 10  # No demand, so the level is left alone
+
+        suggestion = RestockOrder.query.one()
+        assert (suggestion.product_id, suggestion.status) == (ids['fast'], 'suggested')
+        assert suggestion.quantity == pytest.approx(112 - 30, abs=1)  # Up to two weeks of demand
+
+        # A rerun replaces the suggestion instead of adding another
+        assert plan_restocks(ids['distributor'], today=TODAY, days=60).suggestions == 1
+        assert RestockOrder.query.count() == 1
+
+    client = client_for(ids['distributor'])
+    assert client.post(f"/distributor/reorder/{ids['fast']}").status_code == 302
+    with flask_app.app_context():
+        requested = RestockOrder.query.one()
+        assert requested.status == 'requested'
+        # Requested stock counts towards the position, so nothing is suggested again
+        assert plan_restocks(ids['distributor'], today=TODAY, days=60).suggestions == 0
@@ -0,0 +1,82 @@
+"""Offline geocoding, cached coordinates and distance matrices."""
+import os
+import numpy as np
+import pytest
+from app import app as flask_app
+from extensions import db
+from geo import cached_distance_matrix, distance_matrix, geocode, geocode_locations, haversine_km
+from models import User, Order, Delivery
+
+
+@pytest.fixture
+def app_context():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with flask_app.app_context():
+        db.create_all()
+        yield
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.mark.parametrize('location, town, province, exact', [
+    ('Kimberley, Northern Cape', 'Kimberley', 'Northern Cape', True),
+    ('12 George Street, Worcester', 'Worcester', 'Western Cape', True),
+    ('Port Elizabeth', 'Gqeberha', 'Eastern Cape', True),
+    ('Middelburg', 'Middelburg', 'Mpumalanga', True),
+    ('Middelburg, EC', 'Middelburg', 'Eastern Cape', True),
+    ('Plot 4, Bloemfontien', 'Bloemfontein', 'Free State', False),
+])
+def test_geocode_exact_alternate_and_fuzzy_names(location, town, province, exact):
+    place = geocode(location)
+    assert (place.name, place.province, place.exact) == (town, province, exact)
+
+
+def test_geocode_ignores_unknown_places():
+    assert geocode('Nowhere Farm Road') is None
+    assert geocode('') is None
+
+
+def test_distance_matrix_matches_haversine_and_disk_cache(tmp_path):
+    rng = np.random.default_rng(3)
+    points = np.column_stack((rng.uniform(-34, -22, 300), rng.uniform(17, 32, 300)))
+    matrix = distance_matrix(points)
+    assert matrix.shape == (300, 300)
+    assert np.allclose(matrix, matrix.T)
+    assert matrix[4, 250] == pytest.approx(haversine_km(points[4], points[250]), abs=1e-6)
+
+    cached = cached_distance_matrix(points, str(tmp_path))
+    files = os.listdir(tmp_path)
+    assert len(files) == 1
+    # The same locations in another order, with repeats, reuse the stored matrix
+    again = cached_distance_matrix(np.concatenate([points[::-1], points[:5]]), str(tmp_path))
+    assert os.listdir(tmp_path) == files
+    assert np.allclose(again[:300, :300], cached[::-1, ::-1])
+    assert np.allclose(again[300:, 300:], cached[:5, :5])
+    assert np.allclose(cached, matrix, atol=0.01)
+
+
+def test_coordinates_are_cached_on_save_and_backfilled(app_context):
+    user = User(username='geo', email='geo@geo.test', role='retailer', location='Paarl')
+    user.set_password('password123')
+    db.session.add(user)
+    db.session.flush()
+    order = Order(retailer_id=user.id, total_amount=1)
+    db.session.add(order)
+    db.session.flush()
+    delivery = Delivery(order_id=order.id, distributor_id=user.id, scheduled_date=order.created_at,
+                        delivery_address='5 Dorp Street, Stellenbosch')
+    db.session.add(delivery)
+    db.session.commit()
+    assert (user.latitude, user.longitude) == geocode('Paarl').point
+    assert (delivery.latitude, delivery.longitude) == geocode('Stellenbosch').point
+
+    user.location = 'Somewhere unmapped'
+    db.session.commit()
+    assert user.latitude is None
+
+    # Rows written around the ORM are filled in by the backfill
+    db.session.execute(db.update(User).values(location='Upington', latitude=None, longitude=None))
+    db.session.commit()
+    assert geocode_locations() == (1, 0)
+    db.session.refresh(user)
+    assert (user.latitude, user.longitude) == geocode('Upington').point
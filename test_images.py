@@ -0,0 +1,69 @@
+"""Derivative rendering and status tracking of the image pipeline."""
+import os
+from datetime import datetime
+import pytest
+from PIL import Image
+from app import app as flask_app
+from extensions import db
+from images import VARIANTS, derivative_name, derivative_names, image_pipeline, remove_upload, render_derivatives
+from models import User, Crop
+
+
+@pytest.fixture
+def upload_folder(tmp_path, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setitem(flask_app.config, 'IMAGE_WORKERS', 0)
+    return tmp_path
+
+
+def write_image(folder, name, size=(3000, 2000), mode='RGB'):
+    Image.new(mode, size, 'green').save(os.path.join(folder, name))
+    return name
+
+
+def test_derivatives_fit_their_bounding_boxes(upload_folder):
+    filename = write_image(upload_folder, 'maize.png', mode='RGBA')
+    render_derivatives(str(upload_folder), filename)
+    for variant, (width, height) in VARIANTS.items():
+        for ext, image_format in (('jpg', 'JPEG'), ('webp', 'WEBP')):
+            with Image.open(upload_folder / derivative_name(filename, variant, ext)) as img:
+                assert img.format == image_format
+                assert img.width <= width and img.height <= height
+    # The original upload is left as it was sent
+    with Image.open(upload_folder / filename) as img:
+        assert (img.format, img.size) == ('PNG', (3000, 2000))
+
+    remove_upload(str(upload_folder), filename)
+    assert not any(os.path.exists(upload_folder / name) for name in [filename] + derivative_names(filename))
+
+
+@pytest.mark.parametrize('valid, status', [(True, 'ready'), (False, 'failed')])
+def test_submit_records_the_outcome(upload_folder, valid, status):
+    if valid:
+        filename = write_image(upload_folder, 'wheat.jpg')
+    else:
+        filename = 'broken.jpg'
+        (upload_folder / filename).write_bytes(b'\xff\xd8\xff\xe0 not really a jpeg')
+
+    with flask_app.app_context():
+        db.create_all()
+        farmer = User(username='image_farmer', email='farmer@image.test', role='farmer')
+        farmer.set_password('password123')
+        db.session.add(farmer)
+        db.session.flush()
+        crop = Crop(farmer_id=farmer.id, name='Wheat', quantity=10, unit='kg', price_per_unit=5,
+                    planting_date=datetime(2026, 1, 1), expected_harvest_date=datetime(2026, 6, 1),
+                    image=filename, image_status='pending')
+        db.session.add(crop)
+        db.session.commit()
+        try:
+            image_pipeline.submit(Crop, crop.id, filename)
+            db.session.expire_all()
+            crop = db.session.get(Crop, crop.id)
+            assert crop.image_status == status
+            with flask_app.test_request_context():
+                expected = derivative_name(filename, 'thumb', 'webp') if valid else filename
+                assert crop.image_variant('thumb', 'webp') == f'/static/uploads/{expected}'
+        finally:
+            db.session.remove()
+            db.drop_all()
@@ -0,0 +1,126 @@
+"""Distributors bulk import and export inventory as CSV or NDJSON streams."""
+import csv
+import io
+import json
+import pytest
+from sqlalchemy import select
+from app import app as flask_app
+from extensions import db
+from models import InventoryItem, StockMovement
+from stock_ledger import stock_level
+from conftest import add_users, client_for
+
+
+@pytest.fixture
+def ids(schema):
+    with flask_app.app_context():
+        users = add_users('bulk', {'distributor': 'distributor', 'other': 'distributor'})
+        db.session.add_all([
+            InventoryItem(distributor_id=users['distributor'].id, name='Maize', category='Grains', quantity=40,
+                          unit='kg', min_quantity=10, price_per_unit=5),
+            InventoryItem(distributor_id=users['other'].id, name='Maize', category='Grains', quantity=7, unit='kg',
+                          min_quantity=1, price_per_unit=6),
+        ])
+        db.session.commit()
+        result = {name: user.id for name, user in users.items()}
+        db.session.remove()
+    return result
+
+
+def items(distributor_id):
+    return {(item.category, item.name): item.quantity for item in
+            InventoryItem.query.filter_by(distributor_id=distributor_id)}
+
+
+def test_csv_import_upserts_in_batches_and_reports_bad_rows(ids):
+    flask_app.config['INVENTORY_IMPORT_BATCH_SIZE'] = 2
+    body = '\ufeff' + '\n'.join([
+        'name,category,quantity,unit,min_quantity,price_per_unit,description',
+        'Maize,Grains,55,kg,10,5.5,Yellow',  # Existing item, new stock level
+        'Beans,Legumes,20,kg,5,12,',
+        'Rice,Grains,-1,kg,5,9,',
+        'Oats,Grains,abc,kg,5,9,',
+        'Millet,Grains,1e309,kg,5,9,',
+        'Sorghum,Grains,5,kg,5,inf,',
+        'Wheat,Grains,30,kg,5,7,',
+        ',Grains,1,kg,1,1,',
+        'Beans,Legumes,25,kg,5,12,Later row wins',
+    ]) + '\n'
+    try:
+        response = client_for(ids['distributor']).post('/api/inventory/import', data=body.encode(),
+                                                        content_type='text/csv')
+    finally:
+        flask_app.config['INVENTORY_IMPORT_BATCH_SIZE'] = 1000
+    report = response.get_json()
+    assert response.status_code == 200, report
+    # The second Beans row lands in a later batch, so it updates the row the first one inserted
+    assert (report['inserted'], report['updated'], report['error_count']) == (2, 2, 5)
+    assert [error['line'] for error in report['errors']] == [4, 5, 6, 7, 9]
+    assert 'quantity must be a positive number' == report['errors'][0]['error']
+    # Infinite quantities and prices would reach the ledger and stock alerts
+    assert [error['error'] for error in report['errors'][2:4]] == [
+        'quantity must be a positive number', 'price_per_unit must be a positive number']
+
+    with flask_app.app_context():
+        assert items(ids['distributor']) == {('Grains', 'Maize'): 55, ('Legumes', 'Beans'): 25,
+                                             ('Grains', 'Wheat'): 30}
+        assert items(ids['other']) == {('Grains', 'Maize'): 7}
+        beans = InventoryItem.query.filter_by(distributor_id=ids['distributor'], name='Beans').one()
+        assert beans.description == 'Later row wins'
+        # The ledger follows every stock level the import set
+        for item in InventoryItem.query.filter_by(distributor_id=ids['distributor']):
+            assert stock_level('inventory', item.id) == item.quantity
+        reasons = db.session.execute(select(StockMovement.reason).where(StockMovement.item_id == beans.id)).scalars()
+        assert set(reasons) == {'import'}
+
+
+def test_ndjson_import_and_bad_uploads(ids):
+    client = client_for(ids['distributor'])
+    body = '\n'.join([
+        json.dumps({'name': 'Sorghum', 'category': 'Grains', 'quantity': 3, 'unit': 'kg', 'min_quantity': 1,
+                    'price_per_unit': 4}),
+        '',
+        '{not json',
+        '[1, 2]',
+        json.dumps({'name': 'Sorghum', 'category': 'Grains', 'quantity': 3, 'unit': 'kg'}),
+    ])
+    report = client.post('/api/inventory/import', data=body, content_type='application/x-ndjson').get_json()
+    assert (report['inserted'], report['error_count']) == (1, 3)
+    assert [error['line'] for error in report['errors']] == [3, 4, 5]
+
+    missing = client.post('/api/inventory/import', data='name,quantity\nMaize,1\n', content_type='text/csv')
+    assert missing.status_code == 400
+    assert 'Missing CSV columns' in missing.get_json()['error']
+    assert client.post('/api/inventory/import', data='{}', content_type='application/json').status_code == 400
+    assert client.post('/api/inventory/import?format=xml', data='', content_type='text/csv').status_code == 400
+
+
+def test_export_streams_only_the_distributors_items(ids):
+    with flask_app.app_context():
+        db.session.add_all(InventoryItem(distributor_id=ids['distributor'], name=f'Item {n}', category='Misc',
+                                         quantity=n, unit='kg', min_quantity=1, price_per_unit=1)
+                           for n in range(2500))
+        db.session.commit()
+    client = client_for(ids['distributor'])
+    response = client.get('/api/inventory/export')
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert len(rows) == 2501
+    assert len({row['id'] for row in rows}) == 2501
+    assert rows[0]['name'] == 'Maize'
+
+    lines = client.get('/api/inventory/export?format=ndjson').get_data(as_text=True).splitlines()
+    assert len(lines) == 2501
+    assert json.loads(lines[-1])['name'] == 'Item 2499'
+
+    # Exported CSV imports back without changes
+    report = client.post('/api/inventory/import', data=response.get_data(), content_type='text/csv').get_json()
+    assert (report['inserted'], report['updated'], report['error_count']) == (0, 2501, 0)
+
+    empty = client_for(ids['other'])
+    with flask_app.app_context():
+        db.session.query(InventoryItem).filter_by(distributor_id=ids['other']).delete()
+        db.session.commit()
+    assert empty.get('/api/inventory/export').get_data(as_text=True).strip() == \
+        'id,name,category,quantity,unit,min_quantity,price_per_unit,description,updated_at'
@@ -0,0 +1,100 @@
+"""Market price ingestion, latest-price map and NumPy rollups."""
+import io
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+from app import app as flask_app
+from extensions import db
+from models import User
+from market import PriceIngestError, bucket_rollup, ingest_csv, latest_prices, rolling_mean
+from query_counter import count_queries
+
+START = datetime(2026, 1, 1, 8)
+
+
+def price_csv(rows):
+    lines = ['commodity,price,observed_at,unit']
+    lines += [f'{commodity},{price},{when.isoformat()},kg' for commodity, price, when in rows]
+    return io.StringIO('\n'.join(lines) + '\n')
+
+
+@pytest.fixture
+def app_context():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with flask_app.app_context():
+        db.create_all()
+        yield
+        db.session.remove()
+        db.drop_all()
+
+
+def test_ingest_reports_bad_rows_and_refreshes_latest_prices(app_context):
+    inserted, errors = ingest_csv(price_csv([
+        ('Maize', 150, START), ('Maize', 165, START + timedelta(days=1)), ('Wheat', 'n/a', START),
+    ]))
+    assert inserted == 2
+    assert errors == [{'line': 4, 'error': "could not convert string to float: 'n/a'"}]
+
+    with count_queries() as counter:
+        latest = latest_prices.get('Maize')
+        assert latest_prices.price('Wheat') == 0.0
+    assert counter.count == 0
+    assert (latest.price, latest.change) == (165, 10.0)
+
+    ingest_csv(price_csv([('Maize', 132, START + timedelta(days=2))]))
+    assert latest_prices.price('Maize') == 132
+
+    # Non-finite prices are bad rows, not the latest price or a failed run
+    inserted, errors = ingest_csv(price_csv([
+        ('Maize', 'inf', START + timedelta(days=3)), ('Maize', 'nan', START + timedelta(days=3)),
+        ('Wheat', 90, START),
+    ]))
+    assert inserted == 1
+    assert errors == [{'line': 2, 'error': 'Price must be a number'}, {'line': 3, 'error': 'Price must be a number'}]
+    assert (latest_prices.price('Maize'), latest_prices.price('Wheat')) == (132, 90)
+
+    with pytest.raises(PriceIngestError):
+        ingest_csv(io.StringIO('commodity,price\nMaize,150\n'))
+
+
+def test_rolling_mean_uses_a_time_window():
+    day = 86400
+    timestamps = np.array([0, day, 2 * day, 10 * day, 11 * day])
+    prices = np.array([10.0, 20.0, 30.0, 40.0, 50.0])
+    expected = []
+    for t in timestamps:
+        window = prices[(timestamps >= t - 2 * day) & (timestamps <= t)]
+        expected.append(window.mean())
+    assert np.allclose(rolling_mean(timestamps, prices, 2 * day), expected)
+
+
+def test_bucket_rollup_reduces_each_bucket():
+    timestamps = np.array([5, 6, 15, 31, 35])
+    values = np.array([4.0, 2.0, 7.0, 1.0, 3.0])
+    starts, low, mean, high = bucket_rollup(timestamps, values, np.array([0, 10, 20, 30]))
+    assert starts.tolist() == [0, 10, 30]  # The empty 20 bucket is dropped
+    assert low.tolist() == [2.0, 7.0, 1.0]
+    assert mean.tolist() == [3.0, 7.0, 2.0]
+    assert high.tolist() == [4.0, 7.0, 3.0]
+
+
+def test_series_endpoint_downsamples_long_histories(app_context):
+    now = datetime.utcnow()
+    ingest_csv(price_csv([('Maize', 100 + n % 7, now - timedelta(hours=n)) for n in range(2000)]))
+    user = User(username='price_farmer', email='farmer@price.test', role='farmer')
+    user.set_password('password123')
+    db.session.add(user)
+    db.session.commit()
+
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+    data = client.get('/api/market-prices/Maize/series?days=30&points=50').get_json()
+    assert data['downsampled'] and len(data['labels']) <= 50
+    assert len(data['datasets']['average']) == len(data['labels'])
+    assert data['summary']['min'] == 100 and data['summary']['max'] == 106
+    assert all(100 <= value <= 106 for value in data['datasets']['rolling_average'])
+
+    assert client.get('/api/market-prices/Sorghum/series').status_code == 404
+    assert client.get('/api/market-prices/Maize/series?days=abc').status_code == 400
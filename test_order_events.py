@@ -0,0 +1,85 @@
+"""The /api/order_updates feed sends each user their own order events and resumes from Last-Event-ID."""
+import pytest
+from app import app as flask_app
+from extensions import db
+from models import Order
+from order_events import record_order_event
+from conftest import add_users, client_for
+
+
+@pytest.fixture
+def ids(schema):
+    with flask_app.app_context():
+        users = add_users('events', {'farmer': 'farmer', 'retailer': 'retailer', 'other': 'retailer',
+                                     'distributor': 'distributor'})
+        ours = Order(farmer_id=users['farmer'].id, retailer_id=users['retailer'].id,
+                     distributor_id=users['distributor'].id, status='pending', total_amount=10)
+        theirs = Order(retailer_id=users['other'].id, status='pending', total_amount=20)
+        db.session.add_all([ours, theirs])
+        db.session.flush()
+        for order, status in ((ours, 'pending'), (theirs, 'pending'), (ours, 'processing'), (theirs, 'cancelled'),
+                              (ours, 'completed')):
+            order.status = status
+            record_order_event(order)
+            db.session.flush()
+        db.session.commit()
+        result = {name: user.id for name, user in users.items()}
+        result.update(ours=ours.id, theirs=theirs.id)
+        db.session.remove()
+    return result
+
+
+def poll(user_id, **headers):
+    response = client_for(user_id).get('/api/order_updates', headers=headers)
+    assert response.status_code == 200
+    data = response.get_json()
+    return [(event['id'], event['order_id'], event['status']) for event in data['events']], data['last_event_id']
+
+
+def events(user_id, last_event_id):
+    return poll(user_id, **{'Last-Event-ID': str(last_event_id)})[0]
+
+
+def record(ids, status):
+    with flask_app.app_context():
+        order = db.session.get(Order, ids['ours'])
+        order.status = status
+        record_order_event(order)
+        db.session.commit()
+        db.session.remove()
+
+
+def test_each_user_only_sees_their_orders(ids):
+    retailer = events(ids['retailer'], 0)
+    assert [(order_id, status) for _id, order_id, status in retailer] == [
+        (ids['ours'], 'pending'), (ids['ours'], 'processing'), (ids['ours'], 'completed')]
+    assert [status for _id, _order_id, status in events(ids['other'], 0)] == ['pending', 'cancelled']
+    # Farmers and distributors follow the orders they take part in
+    assert events(ids['farmer'], 0) == retailer
+    assert events(ids['distributor'], 0) == retailer
+
+
+def test_polls_resume_from_the_returned_cursor(ids):
+    backlog, cursor = poll(ids['retailer'], **{'Last-Event-ID': '0'})
+    first, second, third = backlog
+    assert cursor == third[0]
+    assert events(ids['retailer'], first[0]) == [second, third]
+    # The query param serves clients that cannot set headers
+    assert poll(ids['retailer'], **{'Last-Event-ID': ''})[1] == poll(ids['retailer'])[1]
+    assert client_for(ids['retailer']).get(f"/api/order_updates?last_event_id={first[0]}").get_json()[
+        'last_event_id'] == cursor
+
+    record(ids, 'shipped')
+    shipped, next_cursor = poll(ids['retailer'], **{'Last-Event-ID': str(cursor)})
+    assert [status for _id, _order_id, status in shipped] == ['shipped']
+    assert poll(ids['retailer'], **{'Last-Event-ID': str(next_cursor)}) == ([], next_cursor)
+
+
+def test_first_poll_hands_out_a_cursor_without_replaying_the_log(ids):
+    events_now, cursor = poll(ids['retailer'])
+    assert events_now == []
+    # An event committed between polls is delivered on the next one
+    record(ids, 'shipped')
+    assert [status for _id, _order_id, status in events(ids['retailer'], cursor)] == ['shipped']
+    # Only the poll feed is served; no long-lived stream ties up a worker thread
+    assert client_for(ids['retailer']).get('/order_updates').status_code == 404
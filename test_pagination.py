@@ -0,0 +1,84 @@
+"""Keyset pagination of the order listings."""
+from datetime import datetime, timedelta
+import pytest
+import pagination
+from app import app as flask_app
+from extensions import db
+from models import User, Order
+
+
+@pytest.fixture
+def client():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    pagination.count_cache.clear()
+    with flask_app.app_context():
+        db.create_all()
+        retailer = User(username='page_retailer', email='retailer@page.test', role='retailer')
+        distributor = User(username='page_distributor', email='distributor@page.test', role='distributor')
+        retailer.set_password('password123')
+        distributor.set_password('password123')
+        db.session.add_all([retailer, distributor])
+        db.session.flush()
+        now = datetime(2026, 6, 1)
+        # Pairs of orders share a timestamp so the id tie-breaker is exercised
+        db.session.add_all([
+            Order(retailer_id=retailer.id, distributor_id=distributor.id, status='completed',
+                  total_amount=float(n), created_at=now - timedelta(days=n // 2))
+            for n in range(57)
+        ])
+        db.session.commit()
+
+        client = flask_app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(retailer.id)
+            session['_fresh'] = True
+        yield client
+        db.session.remove()
+        db.drop_all()
+
+
+def walk(client, query=''):
+    ids, cursors, url = [], [], f'/api/orders?per_page=10{query}'
+    while url:
+        data = client.get(url).get_json()
+        ids.extend(order['id'] for order in data['orders'])
+        cursors.append(data['pagination'])
+        after = data['pagination']['next_cursor']
+        url = f'/api/orders?per_page=10{query}&after={after}' if after else None
+    return ids, cursors
+
+
+def test_pages_cover_every_order_once_newest_first(client):
+    ids, cursors = walk(client)
+    with flask_app.app_context():
+        expected = [order.id for order in Order.query.order_by(Order.created_at.desc(), Order.id.desc())]
+    assert ids == expected
+    assert len(cursors) == 6
+    assert cursors[0]['prev_cursor'] is None
+    assert cursors[0]['total_estimate'] == 57
+    assert cursors[0]['pages_estimate'] == 6
+
+
+def test_before_cursor_returns_the_previous_page(client):
+    first = client.get('/api/orders?per_page=10').get_json()
+    second = client.get(f"/api/orders?per_page=10&after={first['pagination']['next_cursor']}").get_json()
+    back = client.get(f"/api/orders?per_page=10&before={second['pagination']['prev_cursor']}").get_json()
+    assert [order['id'] for order in back['orders']] == [order['id'] for order in first['orders']]
+    assert back['pagination']['prev_cursor'] is None
+
+
+def test_filters_apply_across_pages(client):
+    ids, cursors = walk(client, '&min_price=10&max_price=39')
+    assert len(ids) == 30
+    assert cursors[0]['total_estimate'] == 30
+
+
+def test_invalid_cursor(client):
+    response = client.get('/api/orders?after=not-a-cursor')
+    assert response.status_code == 400
+    assert client.get('/orders?after=not-a-cursor').status_code == 302
+
+
+def test_html_pages_link_to_the_next_page(client):
+    body = client.get('/order-history?min_price=5').get_data(as_text=True)
+    assert 'after=' in body and 'min_price=5' in body
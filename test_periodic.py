@@ -0,0 +1,27 @@
+"""Periodic jobs start one thread per name, run in an app context and survive failing runs."""
+import threading
+from flask import current_app
+from app import app as flask_app
+from periodic import start_periodic_job
+
+
+def test_job_starts_once_and_keeps_running_after_failures():
+    runs = []
+    ran_twice = threading.Event()
+
+    def job(app):
+        if ran_twice.is_set():
+            return  # The daemon thread outlives the test; keep it quiet
+        runs.append(current_app.name == app.name)
+        if len(runs) == 1:
+            raise RuntimeError('run failed')
+        ran_twice.set()
+
+    for _ in range(3):
+        start_periodic_job(flask_app, 'test-periodic', 0.01, job, 'Test job')
+    start_periodic_job(flask_app, 'test-disabled', 0, job, 'Disabled job')
+
+    assert ran_twice.wait(5)
+    names = [thread.name for thread in threading.enumerate()]
+    assert names.count('test-periodic') == 1 and 'test-disabled' not in names
+    assert all(runs[:2])
@@ -0,0 +1,90 @@
+"""Realized price index built from order item history."""
+from datetime import datetime, timedelta
+import pytest
+from app import app as flask_app
+from extensions import db
+from models import User, Crop, Order, OrderItem, PriceIndexDay
+from price_index import ALL_REGIONS, price_position, rebuild_price_index, update_price_index
+
+TODAY = datetime.utcnow().replace(hour=12, minute=0, second=0, microsecond=0)
+
+
+@pytest.fixture
+def farm():
+    flask_app.config.update(TESTING=True)
+    with flask_app.app_context():
+        db.create_all()
+        north = User(username='north', email='north@index.test', role='farmer', location='Kimberley, Northern Cape')
+        free_state = User(username='fs', email='fs@index.test', role='farmer', location='Bloemfontein, Free State')
+        retailer = User(username='buyer', email='buyer@index.test', role='retailer')
+        db.session.add_all([north, free_state, retailer])
+        db.session.flush()
+        crops = {farmer.id: Crop(farmer_id=farmer.id, name='Maize', variety='Yellow', quantity=100, unit='kg',
+                                 price_per_unit=10, status='harvested', planting_date=TODAY, expected_harvest_date=TODAY)
+                 for farmer in (north, free_state)}
+        db.session.add_all(crops.values())
+        db.session.commit()
+        yield {'north': north.id, 'free_state': free_state.id, 'retailer': retailer.id, 'crops': crops}
+        db.session.remove()
+        db.drop_all()
+
+
+def sell(farm, farmer, lines, days_ago=0, status='completed'):
+    order = Order(farmer_id=farm[farmer], retailer_id=farm['retailer'], status=status, total_amount=0,
+                  created_at=TODAY - timedelta(days=days_ago))
+    db.session.add(order)
+    db.session.flush()
+    db.session.add_all([OrderItem(order_id=order.id, crop_id=farm['crops'][farm[farmer]].id, quantity=quantity,
+                                  price_per_unit=price) for quantity, price in lines])
+    db.session.commit()
+
+
+def index_rows():
+    return {(row.region, row.day): (row.trades, row.volume, round(row.vwap, 4), row.p10, row.p50, row.p90,
+                                    row.change_pct, row.last_item_id)
+            for row in PriceIndexDay.query.filter_by(commodity='Maize')}
+
+
+def test_rebuild_aggregates_per_region_and_day(farm):
+    sell(farm, 'north', [(10, 10.0), (30, 12.0)], days_ago=1)
+    sell(farm, 'free_state', [(20, 9.0)], days_ago=1)
+    sell(farm, 'north', [(10, 11.0)], days_ago=0)
+    sell(farm, 'north', [(100, 50.0)], days_ago=0, status='cancelled')
+
+    assert rebuild_price_index() == 4
+    yesterday = PriceIndexDay.query.filter_by(region=ALL_REGIONS, day=(TODAY - timedelta(days=1)).date()).one()
+    assert (yesterday.trades, yesterday.volume) == (3, 60)
+    assert yesterday.vwap == pytest.approx((100 + 360 + 180) / 60)
+    assert yesterday.p10 == pytest.approx(9.0, rel=0.01)
+    assert yesterday.p90 == pytest.approx(12.0, rel=0.01)
+
+    today = PriceIndexDay.query.filter_by(region='Northern Cape', day=TODAY.date()).one()
+    assert today.vwap == 11.0
+    assert today.change_pct == pytest.approx((11.0 - 11.5) / 11.5 * 100, abs=0.01)
+
+
+def test_incremental_updates_match_a_rebuild(farm):
+    sell(farm, 'north', [(10, 10.0), (5, 14.0)], days_ago=2)
+    sell(farm, 'free_state', [(20, 9.0)], days_ago=1)
+    assert update_price_index() == 3
+
+    sell(farm, 'north', [(10, 12.0)], days_ago=1)
+    sell(farm, 'free_state', [(5, 8.5), (5, 9.5)], days_ago=0)
+    assert update_price_index() == 3
+    assert update_price_index() == 0
+    incremental = index_rows()
+
+    rebuild_price_index()
+    assert index_rows() == incremental
+
+
+def test_price_position_ranks_a_price_against_recent_volume(farm):
+    sell(farm, 'north', [(10, 8.0), (10, 10.0), (20, 12.0)], days_ago=3)
+    sell(farm, 'north', [(10, 30.0)], days_ago=60)
+    rebuild_price_index()
+
+    position = price_position('Maize', 10.0, region='Northern Cape', today=TODAY.date())
+    assert position['trades'] == 3
+    assert position['vwap'] == pytest.approx(10.5)
+    assert position['rank'] == 50.0
+    assert price_position('Maize', 10.0, region='Limpopo', today=TODAY.date()) is None
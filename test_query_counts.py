@@ -0,0 +1,95 @@
+"""Statement counts of the order pages stay flat as the order count grows."""
+from datetime import datetime, timedelta
+import pytest
+import pagination
+from app import app as flask_app
+from extensions import db
+from models import User, Crop, Product, Order, OrderItem, Delivery
+from user_cache import load_cached_user, user_cache
+from dashboard_cache import dashboard_cache
+
+ROUTES = [
+    ('farmer', '/orders', 3),
+    ('distributor', '/orders', 3),
+    ('retailer', '/orders', 3),
+    ('distributor', '/order-history', 4),
+    ('retailer', '/order-history', 4),
+    ('distributor', '/distributor/dashboard', 5),
+    ('distributor', '/order/{order}', 5),
+]
+
+
+def seed(orders):
+    now = datetime.utcnow()
+    farmer = User(username='count_farmer', email='farmer@count.test', role='farmer')
+    distributor = User(username='count_distributor', email='distributor@count.test', role='distributor')
+    retailer = User(username='count_retailer', email='retailer@count.test', role='retailer')
+    for user in (farmer, distributor, retailer):
+        user.set_password('password123')
+    db.session.add_all([farmer, distributor, retailer])
+    db.session.flush()
+
+    crop = Crop(farmer_id=farmer.id, name='Maize', variety='Yellow', quantity=100, unit='kg', price_per_unit=150,
+                status='harvested', planting_date=now - timedelta(days=90), expected_harvest_date=now)
+    products = [Product(name=f'Product {i}', category='Cereals', unit='kg', current_stock=100, reorder_level=10,
+                        price_per_unit=2.5, farmer_id=farmer.id) for i in range(3)]
+    db.session.add_all([crop] + products)
+    db.session.flush()
+
+    parent = None
+    for n in range(orders):
+        order = Order(retailer_id=retailer.id, distributor_id=distributor.id, status='pending', total_amount=25,
+                      created_at=now - timedelta(hours=n))
+        child = Order(farmer_id=farmer.id, retailer_id=retailer.id, distributor_id=distributor.id, status='pending',
+                      total_amount=25, created_at=now - timedelta(hours=n), parent_order=order)
+        db.session.add_all([order, child])
+        db.session.flush()
+        for target in (order, child):
+            db.session.add_all([
+                OrderItem(order_id=target.id, product_id=products[n % 3].id, quantity=2, price_per_unit=2.5),
+                OrderItem(order_id=target.id, crop_id=crop.id, quantity=1, price_per_unit=150),
+            ])
+        db.session.add(Delivery(order_id=order.id, distributor_id=distributor.id, status='scheduled',
+                                scheduled_date=now, delivery_address='Cape Town', tracking_number=f'TRKCOUNT{n}'))
+        parent = parent or order
+    db.session.commit()
+    return {'farmer': farmer.id, 'distributor': distributor.id, 'retailer': retailer.id, 'order': parent.id}
+
+
+def statements_for(ids, role, url):
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(ids[role])
+        session['_fresh'] = True
+    response = client.get(url.format(**ids))
+    assert response.status_code == 200, response.status_code
+    return int(response.headers['X-Query-Count'])
+
+
+@pytest.fixture
+def strict_budgets():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, QUERY_BUDGET_STRICT=True)
+    yield
+    flask_app.config['QUERY_BUDGET_STRICT'] = False
+
+
+@pytest.mark.parametrize('role, url, budget', ROUTES, ids=[f'{role}-{url}' for role, url, _budget in ROUTES])
+def test_query_count_is_independent_of_row_count(strict_budgets, role, url, budget):
+    counts = []
+    for orders in (2, 20):
+        pagination.count_cache.clear()
+        user_cache.clear()
+        dashboard_cache.clear()
+        # Seed in its own app context so the request starts with an empty session
+        with flask_app.app_context():
+            db.create_all()
+            ids = seed(orders)
+            load_cached_user(ids[role])  # Measure the steady state, with the user already cached
+            db.session.remove()
+        try:
+            counts.append(statements_for(ids, role, url))
+        finally:
+            with flask_app.app_context():
+                db.drop_all()
+    assert counts[0] == counts[1]
+    assert counts[1] <= budget
@@ -0,0 +1,182 @@
+"""EXPLAIN QUERY PLAN regression suite for the route queries.
+
+Every statement a route sends to the database is captured and explained
+against a seeded in-memory database. A plan step that scans a whole table
+without an index fails the test, so a dropped or bypassed index shows up
+here before it shows up as a slow page.
+"""
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import event
+from pagination import encode_cursor
+import catalog
+from app import app as flask_app
+from extensions import db
+from models import User, Crop, Product, Order, OrderItem, Delivery, InventoryItem
+
+# Plan steps that walk an index or a constant are fine; a bare "SCAN table" is not
+INDEXED_SCAN_MARKERS = ('USING INDEX', 'USING COVERING INDEX', 'USING INTEGER PRIMARY KEY',
+                        'USING PRIMARY KEY', 'CONSTANT ROW')
+
+
+def seed():
+    now = datetime.utcnow()
+    farmer = User(username='plan_farmer', email='farmer@plan.test', role='farmer', location='Kimberley')
+    distributor = User(username='plan_distributor', email='distributor@plan.test', role='distributor',
+                       location='Bloemfontein')
+    retailer = User(username='plan_retailer', email='retailer@plan.test', role='retailer', location='Cape Town')
+    for user in (farmer, distributor, retailer):
+        user.set_password('password123')
+    db.session.add_all([farmer, distributor, retailer])
+    db.session.flush()
+
+    def crop(status, **kwargs):
+        return Crop(farmer_id=farmer.id, name='Maize', variety='Yellow', quantity=100, unit='kg',
+                    price_per_unit=150, status=status, planting_date=now - timedelta(days=60),
+                    expected_harvest_date=now + timedelta(days=30), **kwargs)
+
+    growing, ready, harvested = crop('growing'), crop('ready_for_harvest'), crop('harvested', harvest_date=now)
+    products = [Product(name=f'Product {i}', category='Cereals', unit='kg', current_stock=100,
+                        reorder_level=10, price_per_unit=2.5, farmer_id=farmer.id) for i in range(2)]
+    item = InventoryItem(distributor_id=distributor.id, name='Fresh Maize', category='Grains', quantity=50,
+                         unit='kg', min_quantity=10, price_per_unit=18)
+    db.session.add_all([growing, ready, harvested, item] + products)
+    db.session.flush()
+
+    def order(status, **kwargs):
+        placed = Order(retailer_id=retailer.id, distributor_id=distributor.id, status=status, total_amount=25,
+                       created_at=now - timedelta(days=3),
+                       completed_at=now if status == 'completed' else None, **kwargs)
+        db.session.add(placed)
+        db.session.flush()
+        db.session.add(OrderItem(order_id=placed.id, product_id=products[0].id, quantity=10, price_per_unit=2.5))
+        return placed
+
+    pending = order('pending')
+    order('pending', farmer_id=farmer.id, parent_order_id=pending.id)
+    processing = order('processing', farmer_id=farmer.id)
+    order('completed', farmer_id=farmer.id)
+    db.session.add(Delivery(order_id=pending.id, distributor_id=distributor.id, status='scheduled',
+                            scheduled_date=now + timedelta(days=1), delivery_address='Cape Town',
+                            tracking_number='TRKPLAN0001'))
+    db.session.commit()
+
+    return {
+        'farmer': farmer.id, 'distributor': distributor.id, 'retailer': retailer.id,
+        'growing_crop': growing.id, 'ready_crop': ready.id, 'product': products[0].id,
+        'item': item.id, 'pending_order': pending.id, 'processing_order': processing.id,
+        'cursor': encode_cursor(now - timedelta(days=1), processing.id),
+        'price_cursor': catalog.encode_cursor('price', 2.5, products[0].id)
+    }
+
+
+@pytest.fixture
+def ids():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with flask_app.app_context():
+        db.create_all()
+        yield seed()
+        db.session.remove()
+        db.drop_all()
+
+
+def full_scans(statements):
+    """Return (statement, plan step) pairs for steps that scan a table without an index."""
+    scans = []
+    with db.engine.connect() as connection:
+        for statement, parameters in statements:
+            plan = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+            for step in plan:
+                detail = step[-1]
+                if detail.startswith('SCAN ') and not any(marker in detail for marker in INDEXED_SCAN_MARKERS):
+                    scans.append((statement, detail))
+    return scans
+
+
+def capture_requests(ids, role, method, url, payload):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+            statements.append((statement, parameters))
+
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(ids[role])
+        session['_fresh'] = True
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        response = client.open(url.format(**ids), method=method, json=payload)
+        response.get_data()  # Drain streamed responses
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+    return response, statements
+
+
+ROUTES = [
+    ('farmer', 'GET', '/farmer/dashboard', None),
+    ('farmer', 'GET', '/crop-inventory', None),
+    ('farmer', 'GET', '/crop/{growing_crop}', None),
+    ('farmer', 'GET', '/edit_crop/{growing_crop}', None),
+    ('farmer', 'GET', '/orders', None),
+    ('farmer', 'GET', '/api/orders?after={cursor}', None),
+    ('farmer', 'GET', '/market-prices', None),
+    ('farmer', 'GET', '/api/order_updates?last_event_id=0', None),
+    ('farmer', 'POST', '/api/mark_ready_for_harvest/{growing_crop}', None),
+    ('farmer', 'POST', '/api/harvest_crop/{ready_crop}', None),
+    ('farmer', 'POST', '/delete_crop/{growing_crop}', None),
+    ('distributor', 'GET', '/distributor/dashboard', None),
+    ('distributor', 'GET', '/orders', None),
+    ('distributor', 'GET', '/order-history', None),
+    ('distributor', 'GET', '/order-history?after={cursor}&min_price=10', None),
+    ('distributor', 'GET', '/api/orders?before={cursor}&start_date=2020-01-01', None),
+    ('distributor', 'GET', '/inventory-management', None),
+    ('distributor', 'GET', '/available_crops', None),
+    ('distributor', 'GET', '/order/{processing_order}', None),
+    ('distributor', 'GET', '/api/inventory/{item}', None),
+    ('distributor', 'GET', '/api/inventory/levels', None),
+    ('distributor', 'GET', '/api/inventory/levels?as_of=2030-01-01', None),
+    ('distributor', 'GET', '/api/inventory/export', None),
+    ('distributor', 'POST', '/api/inventory/import?format=ndjson',
+     {'name': 'Fresh Maize', 'category': 'Grains', 'quantity': 60, 'unit': 'kg', 'min_quantity': 10,
+      'price_per_unit': 18}),
+    ('distributor', 'PUT', '/api/inventory/{item}/stock', {'adjustment_type': 'remove', 'quantity': 5}),
+    ('distributor', 'GET', '/api/order_updates?last_event_id=0', None),
+    ('distributor', 'PUT', '/api/inventory/{item}/stock', {'adjustment_type': 'add', 'quantity': 5}),
+    ('distributor', 'PUT', '/api/orders/{processing_order}/status', {'status': 'completed'}),
+    ('distributor', 'PUT', '/api/orders/{pending_order}/status', {'status': 'processing'}),
+    ('distributor', 'PUT', '/api/inventory/stock',
+     {'adjustments': [{'id': 1, 'adjustment_type': 'set', 'quantity': 45}, {'id': 1, 'adjustment_type': 'add',
+                                                                             'quantity': 5}]}),
+    ('distributor', 'PUT', '/api/orders/status',
+     {'transitions': [{'id': 1, 'status': 'processing'}, {'id': 3, 'status': 'completed'}]}),
+    ('distributor', 'POST', '/distributor/process_order/{pending_order}', None),
+    ('distributor', 'POST', '/distributor/reorder/{product}', None),
+    ('distributor', 'DELETE', '/api/inventory/{item}', None),
+    ('retailer', 'GET', '/retailer/dashboard', None),
+    ('retailer', 'GET', '/api/retailer/analytics', None),
+    ('retailer', 'GET', '/orders', None),
+    ('retailer', 'GET', '/order-history', None),
+    ('retailer', 'GET', '/orders?before={cursor}', None),
+    ('retailer', 'GET', '/api/orders', None),
+    ('retailer', 'GET', '/available_crops', None),
+    ('retailer', 'GET', '/crop/{ready_crop}', None),
+    ('retailer', 'GET', '/api/products/{product}', None),
+    ('retailer', 'GET', '/api/products?sort=price&after={price_cursor}', None),
+    ('retailer', 'GET', '/api/products?sort=newest&fields=name,supplier', None),
+    ('retailer', 'GET', '/api/products?ids={product}', None),
+    ('retailer', 'GET', '/place_order/{ready_crop}', None),
+    ('retailer', 'GET', '/api/order_updates?last_event_id=0', None),
+    ('retailer', 'POST', '/api/checkout', {'items': [{'id': 1, 'quantity': 2}, {'id': 2, 'quantity': 1}]}),
+    ('retailer', 'POST', '/api/orders/{pending_order}/cancel', None),
+]
+
+
+@pytest.mark.parametrize('role, method, url, payload', ROUTES,
+                         ids=[f'{role}-{method}-{url}' for role, method, url, _payload in ROUTES])
+def test_route_queries_use_indexes(ids, role, method, url, payload):
+    response, statements = capture_requests(ids, role, method, url, payload)
+    assert response.status_code < 500
+    assert statements, 'route issued no queries'
+    assert full_scans(statements) == []
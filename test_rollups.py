@@ -0,0 +1,68 @@
+"""Incremental farmer rollups agree with a rebuild from the orders and crops tables."""
+from datetime import datetime, timedelta
+import pytest
+from app import app as flask_app
+from extensions import db
+from models import Crop, FarmerMonthlyRollup
+from rollups import rebuild_farmer_rollups, record_harvest_adjusted
+from stock_ledger import move_stock
+from conftest import add_users, client_for
+
+
+@pytest.fixture
+def ids(schema):
+    with flask_app.app_context():
+        now = datetime.utcnow()
+        farmer = add_users('rollup', ('farmer',))['farmer']
+        maize, beans = (Crop(farmer_id=farmer.id, name=name, quantity=quantity, unit='kg', price_per_unit=10,
+                             status='ready_for_harvest', planting_date=now - timedelta(days=90),
+                             expected_harvest_date=now)
+                        for name, quantity in (('Maize', 100), ('Beans', 40)))
+        db.session.add_all([maize, beans])
+        db.session.commit()
+        result = {'farmer': farmer.id, 'maize': maize.id, 'beans': beans.id}
+        db.session.remove()
+    return result
+
+
+def rollups():
+    return {(row.farmer_id, row.month): (row.revenue, row.order_count, row.harvested_yield)
+            for row in FarmerMonthlyRollup.query}
+
+
+def assert_matches_rebuild():
+    incremental = rollups()
+    rebuild_farmer_rollups()
+    assert rollups() == incremental
+    return incremental
+
+
+def test_sold_harvest_is_removed_at_its_harvested_quantity(ids):
+    client = client_for(ids['farmer'])
+    for crop in ('maize', 'beans'):
+        assert client.post(f"/api/harvest_crop/{ids[crop]}").get_json() == {'success': True}
+
+    with flask_app.app_context():
+        [(_revenue, _orders, harvested)] = assert_matches_rebuild().values()
+        assert harvested == 140
+
+        # Sales lower the quantity on hand but not what was harvested
+        assert move_stock('crop', ids['maize'], -30, 'sale') == 70
+        beans = db.session.get(Crop, ids['beans'])
+        beans.quantity = 45  # A corrected harvest
+        record_harvest_adjusted(beans, 40)
+        db.session.commit()
+        [(_revenue, _orders, harvested)] = assert_matches_rebuild().values()
+        assert harvested == 145
+
+    # Harvesting again re-dates the crop without counting it twice or dropping what was sold
+    assert client.post(f"/api/harvest_crop/{ids['maize']}").get_json() == {'success': True}
+    with flask_app.app_context():
+        [(_revenue, _orders, harvested)] = assert_matches_rebuild().values()
+        assert harvested == 145
+        assert db.session.get(Crop, ids['maize']).harvested_quantity == 100
+
+    assert client.post(f"/delete_crop/{ids['maize']}").status_code == 302
+    with flask_app.app_context():
+        [(_revenue, _orders, harvested)] = assert_matches_rebuild().values()
+        assert harvested == 45
@@ -0,0 +1,125 @@
+"""Delivery route planning."""
+import random
+from datetime import date, datetime, timedelta
+from app import app as flask_app
+from extensions import db
+from checkout import checkout_cart
+from geo import distance_matrix
+from models import User, Order, OrderItem, Delivery, Product
+from routing import RouteSolver, SHIFT_END, SHIFT_START, delivery_window, plan_deliveries
+from conftest import add_users
+
+
+def random_instance(stops, seed):
+    rng = random.Random(seed)
+    points = [(-33.92, 18.42)] + [(-33.92 + rng.uniform(-0.5, 0.5), 18.42 + rng.uniform(-0.5, 0.5))
+                                  for _ in range(stops)]
+    windows = []
+    for _ in range(stops):
+        opens = rng.choice([SHIFT_START, 9 * 60, 12 * 60])
+        windows.append((opens, opens + 3 * 60) if opens != SHIFT_START else (SHIFT_START, SHIFT_END))
+    return distance_matrix(points).tolist(), [rng.choice([50, 100, 200]) for _ in range(stops)], windows
+
+
+def test_routes_respect_capacity_and_windows():
+    distances, demands, windows = random_instance(120, seed=1)
+    solver = RouteSolver(distances, demands, windows, capacity=1000)
+    plan = solver.solve()
+
+    visited = sorted(stop for route in plan.routes for stop in route.stops)
+    assert visited + sorted(stop for stop, _reason in plan.unassigned) == list(range(1, 121))
+    for route in plan.routes:
+        assert route.load <= 1000
+        assert route.finish <= SHIFT_END
+        for stop, arrival in zip(route.stops, route.arrivals):
+            earliest, latest = windows[stop - 1]
+            assert earliest <= arrival <= latest
+    assert plan.distance_km <= plan.construction_km + 1e-6
+
+
+def test_plan_reports_unroutable_deliveries():
+    flask_app.config.update(TESTING=True)
+    with flask_app.app_context():
+        db.create_all()
+        distributor = User(username='router', email='router@routes.test', role='distributor',
+                           location='Stellenbosch, Western Cape')
+        retailer = User(username='shop', email='shop@routes.test', role='retailer', location='Paarl')
+        for user in (distributor, retailer):
+            user.set_password('password123')
+        db.session.add_all([distributor, retailer])
+        db.session.flush()
+        day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        for n, (address, quantity) in enumerate([('Paarl', 200), ('12 Main Road, Worcester', 300),
+                                                 ('Cape Town', 5000), ('Nowhere Farm', 10)]):
+            order = Order(retailer_id=retailer.id, distributor_id=distributor.id, total_amount=1)
+            db.session.add(order)
+            db.session.flush()
+            db.session.add(OrderItem(order_id=order.id, quantity=quantity, price_per_unit=1))
+            db.session.add(Delivery(order_id=order.id, distributor_id=distributor.id, scheduled_date=day,
+                                    delivery_address=address, tracking_number=f'TRKROUTE{n}'))
+        db.session.commit()
+        distributor_id = distributor.id
+        db.session.remove()
+
+    try:
+        client = flask_app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(distributor_id)
+            session['_fresh'] = True
+        plan = client.get(f'/api/distributor/supply_routes?date={day.date().isoformat()}').get_json()
+        assert plan['stops'] == 4
+        assert [stop['address'] for route in plan['routes'] for stop in route['stops']] in (
+            ['Paarl', '12 Main Road, Worcester'], ['12 Main Road, Worcester', 'Paarl'])
+        assert sorted(stop['reason'] for stop in plan['unassigned']) == [
+            'Address not recognised', 'Load exceeds vehicle capacity']
+        assert client.get('/distributor/supply_routes').status_code == 200
+        assert client.get('/api/distributor/supply_routes?date=tomorrow').status_code == 400
+    finally:
+        with flask_app.app_context():
+            db.drop_all()
+
+
+def at(hour, minute):
+    return datetime(2026, 10, 19, hour, minute)
+
+
+def test_delivery_windows():
+    assert delivery_window(at(0, 0)) == (SHIFT_START, SHIFT_END)
+    assert delivery_window(at(9, 30)) == (9 * 60 + 30, 13 * 60 + 30)
+    assert delivery_window(at(4, 0)) == (SHIFT_START, 8 * 60)
+    # Times whose window misses the shift are treated as the whole day
+    assert delivery_window(at(1, 30)) == (SHIFT_START, SHIFT_END)
+    assert delivery_window(at(21, 15)) == (SHIFT_START, SHIFT_END)
+
+
+def test_late_evening_checkouts_are_routed(schema):
+    with flask_app.app_context():
+        users = add_users('late', ('retailer', 'distributor'), location='Paarl')
+        users['distributor'].location = 'Stellenbosch, Western Cape'
+        product = Product(name='Maize meal', category='Cereals', unit='kg', current_stock=100, reorder_level=1,
+                          price_per_unit=2)
+        db.session.add(product)
+        db.session.commit()
+        retailer, distributor = users['retailer'], users['distributor']
+
+        # 21:30 UTC is 23:30 in Johannesburg, so the delivery is due on the 19th; 22:30 UTC is already the 19th
+        scheduled = []
+        for now in (datetime(2026, 10, 18, 21, 30), datetime(2026, 10, 18, 22, 30)):
+            order, _failures = checkout_cart(retailer, distributor, [{'id': product.id, 'quantity': 5}], now=now)
+            scheduled.append(Delivery.query.filter_by(order_id=order.id).one().scheduled_date)
+        assert scheduled == [datetime(2026, 10, 19), datetime(2026, 10, 20)]
+
+        # Rows written with a clock time outside the shift are still routed
+        for n, hour in enumerate((1, 21)):
+            order = Order(retailer_id=retailer.id, distributor_id=distributor.id, total_amount=1)
+            db.session.add(order)
+            db.session.flush()
+            db.session.add(Delivery(order_id=order.id, distributor_id=distributor.id,
+                                    scheduled_date=datetime(2026, 10, 19, hour, 15), delivery_address='Paarl',
+                                    tracking_number=f'TRKLATE{n}'))
+        db.session.commit()
+
+        plan = plan_deliveries(distributor, date(2026, 10, 19))
+        assert plan['stops'] == 3 and plan['unassigned'] == []
+        assert sum(len(route['stops']) for route in plan['routes']) == 3
+        assert plan_deliveries(distributor, date(2026, 10, 20))['stops'] == 1
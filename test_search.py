@@ -0,0 +1,173 @@
+"""Listing search stays in step with crops and products through triggers."""
+from datetime import datetime
+import pytest
+from sqlalchemy import text
+from app import app as flask_app
+from extensions import db
+from models import User, Crop, Product, SearchListing
+from search import search, rebuild_search_index, Vocabulary, facet_cache
+from conftest import client_for
+
+
+def crop(farmer_id, name, variety, price, status='ready_for_harvest', description=None):
+    return Crop(farmer_id=farmer_id, name=name, variety=variety, quantity=100, unit='kg', price_per_unit=price,
+                status=status, description=description, planting_date=datetime(2026, 1, 1),
+                expected_harvest_date=datetime(2026, 4, 1))
+
+
+@pytest.fixture
+def ids():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with flask_app.app_context():
+        db.create_all()
+        farmer = User(username='search_farmer', email='farmer@search.test', role='farmer', location='Tzaneen')
+        retailer = User(username='search_shop', email='shop@search.test', role='retailer', location='Polokwane')
+        for user in (farmer, retailer):
+            user.set_password('password123')
+        db.session.add_all([farmer, retailer])
+        db.session.flush()
+        crops = [
+            crop(farmer.id, 'Tomatoes', 'Roma', 12, description='Firm red tomatoes for sauces'),
+            crop(farmer.id, 'Cherry Tomatoes', 'Sweet Million', 30),
+            crop(farmer.id, 'Avocados', 'Hass', 45, description='Creamy avocados from Tzaneen'),
+            crop(farmer.id, 'Avocados', 'Fuerte', 40, status='growing'),
+            crop(farmer.id, 'Potatoes', 'Mondial', 8),
+        ]
+        products = [
+            Product(name='Tomato Paste', category='Preserves', unit='tin', current_stock=50, reorder_level=10,
+                    price_per_unit=15),
+            Product(name='Avocado Oil', category='Oils', unit='bottle', current_stock=5, reorder_level=10,
+                    price_per_unit=120, description='Cold pressed'),
+            Product(name='Potato Chips', category='Snacks', unit='bag', current_stock=0, reorder_level=10,
+                    price_per_unit=20),
+        ]
+        db.session.add_all(crops + products)
+        db.session.commit()
+        result = {'farmer': farmer.id, 'retailer': retailer.id, 'crops': [c.id for c in crops],
+                  'products': [p.id for p in products]}
+        db.session.remove()
+    yield result
+    with flask_app.app_context():
+        db.drop_all()
+
+
+def names(result):
+    return [(row['kind'], row['name']) for row in result['results']]
+
+
+def facet_counts(facets):
+    return {name: {entry.get('value', entry.get('min')): entry['count'] for entry in entries}
+            for name, entries in facets.items()}
+
+
+def test_triggers_keep_listings_and_text_index_in_step(ids):
+    with flask_app.app_context():
+        assert SearchListing.query.count() == 8
+        # Product status follows stock against the reorder level
+        statuses = {listing.name: listing.status for listing in SearchListing.query.filter_by(kind='product')}
+        assert statuses == {'Tomato Paste': 'in_stock', 'Avocado Oil': 'low_stock', 'Potato Chips': 'out_of_stock'}
+
+        assert sorted(names(search('tomat'))) == [('crop', 'Cherry Tomatoes'), ('crop', 'Tomatoes'),
+                                                  ('product', 'Tomato Paste')]
+        assert names(search('potato')) == [('crop', 'Potatoes')]  # The chips are out of stock
+        assert search('potato', statuses=None)['total'] == 2
+
+        chips = db.session.get(Product, ids['products'][2])
+        chips.current_stock = 200
+        fuerte = db.session.get(Crop, ids['crops'][3])
+        fuerte.status = 'ready_for_harvest'
+        fuerte.name = 'Green Avocados'
+        db.session.delete(db.session.get(Crop, ids['crops'][4]))
+        db.session.commit()
+        assert names(search('potato')) == [('product', 'Potato Chips')]
+        assert ('crop', 'Green Avocados') in names(search('green avo'))
+        assert search('fuerte')['results'][0]['id'] == ids['crops'][3]
+
+        # A rebuild from the source tables gives the same index
+        before = db.session.execute(text('SELECT * FROM search_facets WHERE listings > 0 ORDER BY 1, 2, 3, 4, 5')).all()
+        assert rebuild_search_index() == 7
+        after = db.session.execute(text('SELECT * FROM search_facets WHERE listings > 0 ORDER BY 1, 2, 3, 4, 5')).all()
+        assert before == after
+        assert names(search('potato')) == [('product', 'Potato Chips')]
+
+
+def test_misspelt_words_are_corrected(ids):
+    with flask_app.app_context():
+        result = search('tomatos')
+        assert result['corrected_query'] == 'tomatoes'
+        assert sorted(names(result)) == [('crop', 'Cherry Tomatoes'), ('crop', 'Tomatoes')]
+        assert search('avocdos tzaneen')['corrected_query'] == 'avocados tzaneen'
+        assert search('xylophone')['total'] == 0
+        assert search('xylophone')['corrected_query'] is None
+
+    vocabulary = Vocabulary(['tomato', 'tomatoes', 'potatoes'], [1, 5, 9])
+    assert vocabulary.correct('tomat') == 'tomat'  # Known prefix
+    assert vocabulary.correct('potatos') == 'potatoes'
+    assert vocabulary.correct('2026') == '2026'
+    assert vocabulary.correct('zzz') is None
+
+
+def test_facets_from_summary_match_a_grouped_scan(ids):
+    with flask_app.app_context():
+        for kwargs in ({}, {'kind': 'crop'}, {'statuses': None}, {'kind': 'product', 'statuses': None}):
+            browsed = search(**kwargs)
+            # A price bound forces the grouped scan over the same rows
+            scanned = search(min_price=0, **kwargs)
+            assert facet_counts(browsed['facets']) == facet_counts(scanned['facets'])
+            assert browsed['total'] == scanned['total']
+
+        facets = facet_counts(search(kind='crop')['facets'])
+        assert facets['status'] == {'ready_for_harvest': 4}
+        assert facets['price'] == {0: 1, 10: 1, 25: 2}
+
+        # Text query facets are cached, so paging does not recount
+        facet_cache.clear()
+        pages = [search('avocado', per_page=1, page=page) for page in (1, 2)]
+        assert facet_cache.stats()['size'] == 1
+        assert sorted(names(pages[0]) + names(pages[1])) == [('crop', 'Avocados'), ('product', 'Avocado Oil')]
+        assert pages[1]['facets'] == pages[0]['facets']
+
+
+def test_search_api_and_available_crops(ids):
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(ids['retailer'])
+        session['_fresh'] = True
+
+    response = client.get('/api/search?q=avocado&kind=product')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['success'] and body['total'] == 1
+    assert body['results'][0]['id'] == ids['products'][1]
+    assert body['facets']['category'] == [{'value': 'Oils', 'count': 1}]
+
+    body = client.get('/api/search?max_price=20&per_page=2').get_json()
+    assert (body['total'], body['pages'], len(body['results'])) == (3, 2, 2)
+
+    for bad in ('kind=seeds', 'min_price=cheap', 'page=two'):
+        response = client.get(f'/api/search?{bad}')
+        assert response.status_code == 400
+        assert not response.get_json()['success']
+
+    page = client.get('/available_crops?q=tomatos').get_data(as_text=True)
+    assert 'Cherry Tomatoes' in page and 'Avocados' not in page
+    assert 'showing results for' in page
+
+
+def test_only_farmers_see_their_own_unavailable_listings(ids):
+    retailer = client_for(ids['retailer'])
+    for status in ('status=growing', 'status=all', 'status=harvested&status=ready_for_harvest',
+                   f"status=growing&farmer_id={ids['farmer']}"):
+        response = retailer.get(f'/api/search?q=avocado&{status}')
+        assert response.status_code == 403
+        assert not response.get_json()['success']
+    assert retailer.get('/api/search?status=rotten').status_code == 400
+    body = retailer.get('/api/search?q=avocado&kind=crop&status=ready_for_harvest').get_json()
+    assert [result['variety'] for result in body['results']] == ['Hass']
+
+    farmer = client_for(ids['farmer'])
+    assert farmer.get('/api/search?q=avocado&status=growing').status_code == 403
+    assert farmer.get(f"/api/search?q=avocado&status=growing&farmer_id={ids['retailer']}").status_code == 403
+    body = farmer.get(f"/api/search?q=avocado&kind=crop&status=all&farmer_id={ids['farmer']}").get_json()
+    assert sorted(result['variety'] for result in body['results']) == ['Fuerte', 'Hass']
+    assert body['facets']['status'] == [{'value': 'growing', 'count': 1}, {'value': 'ready_for_harvest', 'count': 1}]
@@ -0,0 +1,127 @@
+"""Triggers keep one open alert per low item across every write path, and notifications batch per distributor."""
+import io
+import pytest
+from sqlalchemy import select
+from app import app as flask_app
+from extensions import db
+from models import Product, InventoryItem, StockAlert
+from catalog import stock_summary
+from stock_alerts import alert_levels, notify_low_stock, open_alerts, rebuild_stock_alerts
+from stock_ledger import move_stock
+from conftest import add_users, client_for
+
+
+@pytest.fixture
+def ids(schema):
+    with flask_app.app_context():
+        users = add_users('alert', {'distributor': 'distributor', 'other': 'distributor'})
+        maize, beans, rice = (
+            InventoryItem(distributor_id=users[owner].id, name=name, description=f'{name} in 50 kg bags',
+                          category='Grains', quantity=quantity, unit='kg', min_quantity=10, price_per_unit=5)
+            for owner, name, quantity in (('distributor', 'Maize', 40), ('distributor', 'Beans', 8),
+                                          ('other', 'Rice', 0)))
+        products = [Product(name=f'Meal {n}', category='Cereals', unit='kg', current_stock=stock, reorder_level=10,
+                            price_per_unit=2) for n, stock in enumerate((50, 5, 0))]
+        db.session.add_all([maize, beans, rice] + products)
+        db.session.commit()
+        result = {name: user.id for name, user in users.items()}
+        result.update(maize=maize.id, beans=beans.id, rice=rice.id, products=[product.id for product in products])
+        db.session.remove()
+    return result
+
+
+def alerts():
+    return db.session.execute(select(StockAlert.item_type, StockAlert.item_id, StockAlert.level,
+                                     StockAlert.resolved_at.is_(None)).order_by(StockAlert.id)).all()
+
+
+def test_every_stock_write_keeps_alerts_current(ids):
+    with flask_app.app_context():
+        assert alert_levels(ids['distributor']) == {ids['beans']: 'low_stock'}
+        assert alert_levels(ids['other']) == {ids['rice']: 'out_of_stock'}
+        assert stock_summary() == {'in_stock': 2, 'low_stock': 1}
+
+        assert move_stock('inventory', ids['maize'], -35, 'issued') == 5  # Guarded Core UPDATE
+        db.session.commit()
+        assert alert_levels(ids['distributor']) == {ids['beans']: 'low_stock', ids['maize']: 'low_stock'}
+
+    client = client_for(ids['distributor'])
+    assert client.put('/api/inventory/stock', json={'adjustments': [
+        {'id': ids['maize'], 'adjustment_type': 'add', 'quantity': 20},
+        {'id': ids['beans'], 'adjustment_type': 'set', 'quantity': 0}]}).status_code == 200
+    imported = client.post('/api/inventory/import', data=io.BytesIO(
+        b'name,category,quantity,unit,min_quantity,price_per_unit\nPeas,Legumes,3,kg,5,9\n'), content_type='text/csv')
+    assert imported.get_json()['inserted'] == 1
+
+    with flask_app.app_context():
+        peas = InventoryItem.query.filter_by(name='Peas').one()
+        assert alert_levels(ids['distributor']) == {ids['beans']: 'out_of_stock', peas.id: 'low_stock'}
+        assert [(alert.name, alert.level) for alert in open_alerts(ids['distributor'])] == [
+            ('Beans', 'out_of_stock'), ('Peas', 'low_stock')]
+
+        db.session.delete(db.session.get(InventoryItem, ids['beans']))
+        product = db.session.get(Product, ids['products'][1])
+        product.reorder_level = 4  # The threshold moving is a stock write too
+        db.session.commit()
+        assert alert_levels(ids['distributor']) == {peas.id: 'low_stock'}
+        assert stock_summary()['low_stock'] == 0
+        # Resolved alerts stay as history; each item has at most one open alert
+        assert [row for row in alerts() if row[1] == ids['maize']] == [('inventory', ids['maize'], 'low_stock', False)]
+
+        # A rebuild finds nothing to change
+        open_before = [row for row in alerts() if row[3]]
+        assert rebuild_stock_alerts() == len(open_before)
+        assert [row for row in alerts() if row[3]] == open_before
+
+
+def test_dashboards_read_open_alerts(ids):
+    client = client_for(ids['distributor'])
+    dashboard = client.get('/distributor/dashboard').get_data(as_text=True)
+    assert 'Beans' in dashboard and 'Maize' not in dashboard
+    inventory = client.get('/inventory-management').get_data(as_text=True)
+    assert inventory.count('data-status="low_stock"') == 1
+    assert inventory.count('data-status="in_stock"') == 1
+
+
+def test_notifications_are_batched_per_distributor(ids):
+    sent = []
+    with flask_app.app_context():
+        def fail_for_other(distributor_id, batch):
+            if distributor_id == ids['other']:
+                raise RuntimeError('mail server down')
+            sent.append((distributor_id, [(alert.name, alert.level) for alert in batch]))
+
+        assert notify_low_stock(fail_for_other) == (1, 1)
+        assert sent == [(ids['distributor'], [('Beans', 'low_stock')])]
+
+        # Nothing new for the first distributor; the failed batch is retried
+        sent.clear()
+        assert notify_low_stock(lambda distributor_id, batch: sent.append(distributor_id)) == (1, 1)
+        assert sent == [ids['other']]
+
+        # Falling further queues the alert again; a change within the same level does not
+        move_stock('inventory', ids['beans'], -3, 'issued')
+        db.session.commit()
+        assert notify_low_stock(lambda distributor_id, batch: sent.append(distributor_id)) == (0, 0)
+        move_stock('inventory', ids['beans'], -5, 'issued')
+        db.session.commit()
+        assert notify_low_stock(lambda distributor_id, batch: sent.append(batch[0].level)) == (1, 1)
+        assert sent[-1] == 'out_of_stock'
+
+
+def test_concurrent_runs_never_send_an_alert_twice(ids):
+    sent, runs = [], []
+    with flask_app.app_context():
+        def record(distributor_id, batch):
+            sent.extend(alert.name for alert in batch)
+
+        def send_slowly(distributor_id, batch):
+            # Another worker runs while the first batch is being sent: it skips the claimed batch
+            if not runs:
+                runs.append(notify_low_stock(record))
+            record(distributor_id, batch)
+
+        runs.insert(0, notify_low_stock(send_slowly))
+        assert runs == [(1, 1), (1, 1)]
+        assert sorted(sent) == ['Beans', 'Rice']
+        assert notify_low_stock(record) == (0, 0)
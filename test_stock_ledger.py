@@ -0,0 +1,118 @@
+"""Stock changes are ledgered, and snapshots plus the tail answer current and as-of stock."""
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import select
+from app import app as flask_app
+from extensions import db
+from models import Crop, Product, InventoryItem, StockMovement, StockSnapshot
+from stock_ledger import compact_stock_ledger, move_stock, stock_level, stock_levels
+from conftest import add_users, client_for
+
+
+@pytest.fixture
+def ids(schema):
+    with flask_app.app_context():
+        now = datetime.utcnow()
+        users = add_users('ledger', ('farmer', 'distributor', 'retailer'), location='Durban')
+        crop = Crop(farmer_id=users['farmer'].id, name='Maize', variety='Yellow', quantity=100, unit='kg',
+                    price_per_unit=150, status='ready_for_harvest', planting_date=now - timedelta(days=30),
+                    expected_harvest_date=now)
+        product = Product(name='Maize meal', category='Cereals', unit='kg', current_stock=50, reorder_level=10,
+                          price_per_unit=2.5)
+        item = InventoryItem(distributor_id=users['distributor'].id, name='Maize', category='Cereals', quantity=40,
+                             unit='kg', min_quantity=10, price_per_unit=150)
+        db.session.add_all([crop, product, item])
+        db.session.commit()
+        result = {role: user.id for role, user in users.items()}
+        result.update(crop=crop.id, product=product.id, item=item.id)
+        db.session.remove()
+    return result
+
+
+def movements(item_type, item_id):
+    return db.session.execute(select(StockMovement.delta, StockMovement.reason, StockMovement.order_id).where(
+        StockMovement.item_type == item_type, StockMovement.item_id == item_id).order_by(StockMovement.id)).all()
+
+
+def test_orm_writes_are_ledgered(ids):
+    with flask_app.app_context():
+        crop = db.session.get(Crop, ids['crop'])
+        crop.quantity = 80
+        db.session.commit()
+        crop.quantity = 80  # Unchanged, so nothing is recorded
+        db.session.commit()
+        assert movements('crop', ids['crop']) == [(100, 'opening', None), (-20, 'adjustment', None)]
+        assert stock_level('crop', ids['crop']) == 80
+
+        db.session.delete(db.session.get(InventoryItem, ids['item']))
+        db.session.commit()
+        assert [row.reason for row in movements('inventory', ids['item'])] == ['opening', 'closing']
+        assert stock_level('inventory', ids['item']) == 0
+
+
+def test_stock_endpoint_moves_stock_through_the_ledger(ids):
+    client = client_for(ids['distributor'])
+    url = f"/api/inventory/{ids['item']}/stock"
+    assert client.put(url, json={'adjustment_type': 'add', 'quantity': 15}).get_json()['quantity'] == 55
+    assert client.put(url, json={'adjustment_type': 'remove', 'quantity': 5}).get_json()['quantity'] == 50
+    refused = client.put(url, json={'adjustment_type': 'remove', 'quantity': 51})
+    assert refused.status_code == 400
+    assert 'Only 50.0 kg available' in refused.get_json()['message']
+
+    with flask_app.app_context():
+        assert db.session.get(InventoryItem, ids['item']).quantity == 50
+        assert [(row.delta, row.reason) for row in movements('inventory', ids['item'])] == [
+            (40, 'opening'), (15, 'received'), (-5, 'issued')]
+    levels = client.get('/api/inventory/levels').get_json()
+    assert levels['items'] == [{'id': ids['item'], 'name': 'Maize', 'unit': 'kg', 'quantity': 50}]
+    assert client.get('/api/inventory/levels?as_of=soon').status_code == 400
+
+
+def test_orders_record_sales_against_the_order(ids):
+    checkout = client_for(ids['retailer']).post('/api/checkout', json={
+        'items': [{'id': ids['product'], 'quantity': 4}]})
+    assert checkout.status_code == 200, checkout.get_json()
+    with flask_app.app_context():
+        order_id = checkout.get_json()['order_id']
+        assert movements('product', ids['product'])[-1] == (-4, 'sale', order_id)
+        assert db.session.get(Product, ids['product']).current_stock == 46
+        assert stock_level('product', ids['product']) == 46
+
+        # A loaded row stays current and unchanged after a guarded move
+        crop = db.session.get(Crop, ids['crop'])
+        assert move_stock('crop', crop.id, -30, 'sale') == 70
+        assert crop.quantity == 70
+        assert move_stock('crop', crop.id, -71, 'sale') is None
+        db.session.commit()
+        assert [row.delta for row in movements('crop', ids['crop'])] == [100, -30]
+
+
+def test_snapshots_answer_current_and_as_of_stock(ids):
+    start = datetime(2026, 1, 1)
+    with flask_app.app_context():
+        # Rewrite the opening movement into a dated history: +10 on day 1, 2, ... 9
+        db.session.execute(StockMovement.__table__.delete())
+        db.session.add_all(StockMovement(item_type='inventory', item_id=ids['item'], delta=10, reason='received',
+                                         created_at=start + timedelta(days=day)) for day in range(1, 10))
+        db.session.commit()
+
+        assert compact_stock_ledger(start + timedelta(days=3, hours=12)) == 1
+        assert compact_stock_ledger(start + timedelta(days=3)) == 0  # Cutoffs only move forward
+        assert compact_stock_ledger(start + timedelta(days=6, hours=12)) == 1
+        snapshots = db.session.execute(select(StockSnapshot.quantity, StockSnapshot.last_movement_id).where(
+            StockSnapshot.item_id == ids['item']).order_by(StockSnapshot.id)).all()
+        assert [quantity for quantity, _last in snapshots] == [30, 60]
+
+        for day in range(0, 11):
+            as_of = start + timedelta(days=day, hours=1)
+            assert stock_level('inventory', ids['item'], as_of) == 10 * min(day, 9)
+        assert stock_level('inventory', ids['item']) == 90
+        assert stock_levels('inventory', [ids['item'], 9999]) == {ids['item']: 90}
+
+        # A late movement with an older timestamp still counts once it is in the ledger
+        db.session.add(StockMovement(item_type='inventory', item_id=ids['item'], delta=-5, reason='issued',
+                                     created_at=start + timedelta(days=2)))
+        db.session.commit()
+        assert stock_level('inventory', ids['item']) == 85
+        assert compact_stock_ledger(start + timedelta(days=30)) == 1
+        assert stock_level('inventory', ids['item']) == 85
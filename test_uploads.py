@@ -0,0 +1,97 @@
+"""Reference counting and sweeping of the upload store."""
+import os
+from datetime import datetime, timedelta
+import pytest
+from app import app as flask_app
+from extensions import db
+from images import derivative_name
+from models import User, Crop, InventoryItem, StoredUpload
+from uploads import rebuild_manifest, register_upload, sweep_unreferenced
+
+
+@pytest.fixture
+def store(tmp_path):
+    with flask_app.app_context():
+        db.create_all()
+        farmer = User(username='upload_farmer', email='farmer@upload.test', role='farmer')
+        distributor = User(username='upload_distributor', email='distributor@upload.test', role='distributor')
+        db.session.add_all([farmer, distributor])
+        db.session.commit()
+        yield tmp_path, farmer, distributor
+        db.session.remove()
+        db.drop_all()
+
+
+def upload(folder, filename, derivatives=False):
+    path = folder / filename
+    path.write_bytes(b'image')
+    if derivatives:
+        (folder / 'derived').mkdir(exist_ok=True)
+        (folder / derivative_name(filename, 'thumb', 'webp')).write_bytes(b'thumb')
+    register_upload(str(path), filename)
+    return filename
+
+
+def crop(farmer, image):
+    return Crop(farmer_id=farmer.id, name='Maize', quantity=10, unit='kg', price_per_unit=5,
+                planting_date=datetime(2026, 1, 1), expected_harvest_date=datetime(2026, 6, 1), image=image)
+
+
+def refcount(filename):
+    db.session.expire_all()
+    return db.session.query(StoredUpload.refcount).filter_by(filename=filename).scalar()
+
+
+def test_references_follow_the_image_columns(store):
+    folder, farmer, distributor = store
+    shared = upload(folder, 'shared.jpg')
+    replacement = upload(folder, 'replacement.jpg')
+    assert refcount(shared) == 0
+
+    first, second = crop(farmer, shared), crop(farmer, shared)
+    item = InventoryItem(distributor_id=distributor.id, name='Maize', category='Grains', quantity=1, unit='kg',
+                         min_quantity=0, price_per_unit=1, image=shared)
+    db.session.add_all([first, second, item])
+    db.session.commit()
+    assert refcount(shared) == 3
+
+    first.image = replacement
+    db.session.delete(item)
+    db.session.commit()
+    assert (refcount(shared), refcount(replacement)) == (1, 1)
+
+    db.session.delete(second)
+    db.session.commit()
+    assert refcount(shared) == 0
+    assert db.session.query(StoredUpload.released_at).filter_by(filename=shared).scalar() is not None
+
+
+def test_sweep_removes_only_expired_unreferenced_files(store):
+    folder, farmer, _distributor = store
+    names = [upload(folder, f'orphan_{n}.jpg', derivatives=True) for n in range(7)]
+    kept = upload(folder, 'kept.jpg')
+    db.session.add(crop(farmer, kept))
+    db.session.commit()
+
+    # Inside the grace period nothing goes
+    assert sweep_unreferenced(str(folder), grace_period=3600) == 0
+    later = datetime.utcnow() + timedelta(hours=2)
+    assert sweep_unreferenced(str(folder), grace_period=3600, batch_size=3, now=later) == 7
+
+    assert sorted(os.listdir(folder / 'derived')) == []
+    assert sorted(os.listdir(folder)) == ['derived', kept]
+    assert [row.filename for row in StoredUpload.query.all()] == [kept]
+    assert not any(os.path.exists(folder / name) for name in names)
+
+
+def test_rebuild_manifest_counts_existing_references(store):
+    folder, farmer, _distributor = store
+    for name in ('used.jpg', 'stray.jpg'):
+        (folder / name).write_bytes(b'image')
+    db.session.add_all([crop(farmer, 'used.jpg'), crop(farmer, 'used.jpg')])
+    db.session.commit()
+    StoredUpload.query.delete()
+    db.session.commit()
+
+    assert rebuild_manifest(str(folder)) == (2, 1)
+    assert (refcount('used.jpg'), refcount('stray.jpg')) == (2, 0)
@@ -0,0 +1,62 @@
+"""Identity cache used by the Flask-Login user loader."""
+import pytest
+from app import app as flask_app
+from extensions import db
+from models import User
+from query_counter import count_queries
+from user_cache import CachedUser, load_cached_user, user_cache
+
+
+@pytest.fixture
+def user_id():
+    flask_app.config.update(TESTING=True)
+    with flask_app.app_context():
+        db.create_all()
+        user = User(username='cache_farmer', email='farmer@cache.test', role='farmer', location='Kimberley')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+        yield user.id
+        db.session.remove()
+        db.drop_all()
+
+
+def test_second_load_is_served_from_the_cache(user_id):
+    with count_queries() as counter:
+        first = load_cached_user(user_id)
+        second = load_cached_user(user_id)
+    assert counter.count == 1
+    assert (second.id, second.role, second.location) == (user_id, 'farmer', 'Kimberley')
+    assert first is not second  # Each request gets its own object
+    assert not hasattr(second, '__dict__')
+    assert user_cache.stats()['hits'] == 1
+
+
+def test_other_attributes_load_the_orm_row_once(user_id):
+    cached = load_cached_user(user_id)
+    db.session.expunge_all()
+    with count_queries() as counter:
+        assert cached.crops == []
+        assert cached.check_password('password123')
+    assert counter.count == 2  # The user row, then its crops
+    assert cached == db.session.get(User, user_id)
+
+
+def test_committed_changes_invalidate_the_entry(user_id):
+    assert load_cached_user(user_id).role == 'farmer'
+
+    user = db.session.get(User, user_id)
+    user.role = 'retailer'
+    db.session.flush()
+    db.session.rollback()
+    assert user_cache.get(user_id) is not None  # Rolled back changes keep the entry
+
+    user = db.session.get(User, user_id)
+    user.role = 'retailer'
+    db.session.commit()
+    assert load_cached_user(user_id).role == 'retailer'
+
+
+def test_missing_user(user_id):
+    assert load_cached_user(user_id + 1) is None
+    assert isinstance(load_cached_user(user_id), CachedUser)
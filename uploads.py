@@ -0,0 +1,178 @@
+"""Reference-counted store for uploaded images.
+
+Every file in the uploads folder has a ``stored_uploads`` row whose
+refcount is the number of crops and inventory items using it. Mapper events
+keep the count in step with the ``image`` columns inside the same flush,
+so there is no separate bookkeeping for routes to forget. A file whose
+count drops to zero is stamped with ``released_at``. The sweeper then
+deletes it, with its derivatives, in batches once the grace period has
+passed. That replaces rescanning the whole folder on every crop deletion.
+"""
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import case, delete, event, func, insert, inspect, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from extensions import db
+from images import remove_upload
+from periodic import start_periodic_job
+from models import Crop, InventoryItem, StoredUpload
+
+GRACE_PERIOD = 86400  # Seconds an unreferenced file is kept before it is deleted
+SWEEP_BATCH_SIZE = 500
+SWEEP_INTERVAL = 3600
+
+REFERENCING_MODELS = (Crop, InventoryItem)
+
+
+def register_upload(path, filename):
+    """Record a freshly saved upload as unreferenced.
+
+    Committed on its own so the file is known to the sweeper even if the
+    request that saved it later rolls back. Call it before the request has
+    written anything, as SQLite only allows one writer.
+    """
+    now = datetime.utcnow()
+    with db.engine.begin() as connection:
+        connection.execute(
+            sqlite_insert(StoredUpload.__table__)
+            .values(filename=filename, refcount=0, size=os.path.getsize(path), created_at=now, released_at=now)
+            .on_conflict_do_nothing(index_elements=['filename'])
+        )
+
+
+def _acquire(connection, filename):
+    table = StoredUpload.__table__
+    stmt = sqlite_insert(table).values(filename=filename, refcount=1, created_at=datetime.utcnow(), released_at=None)
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=['filename'],
+        set_={'refcount': table.c.refcount + 1, 'released_at': None}
+    ))
+
+
+def _release(connection, filename):
+    table = StoredUpload.__table__
+    # SET expressions see the old refcount, so "<= 1" means "drops to zero"
+    connection.execute(
+        update(table)
+        .where(table.c.filename == filename)
+        .values(
+            refcount=case((table.c.refcount > 0, table.c.refcount - 1), else_=0),
+            released_at=case((table.c.refcount <= 1, datetime.utcnow()), else_=table.c.released_at)
+        )
+    )
+
+
+def _after_insert(mapper, connection, target):
+    if target.image:
+        _acquire(connection, target.image)
+
+
+def _after_update(mapper, connection, target):
+    history = inspect(target).attrs.image.history
+    if not history.has_changes():
+        return
+    for filename in history.deleted:
+        if filename:
+            _release(connection, filename)
+    for filename in history.added:
+        if filename:
+            _acquire(connection, filename)
+
+
+def _after_delete(mapper, connection, target):
+    if target.image:
+        _release(connection, target.image)
+
+
+for _model in REFERENCING_MODELS:
+    event.listen(_model, 'after_insert', _after_insert)
+    event.listen(_model, 'after_update', _after_update)
+    event.listen(_model, 'after_delete', _after_delete)
+
+
+def sweep_unreferenced(upload_folder, grace_period=GRACE_PERIOD, batch_size=SWEEP_BATCH_SIZE, now=None):
+    """Delete files unreferenced for longer than `grace_period`; returns the count.
+
+    Each batch claims its rows by deleting them first, guarded on refcount,
+    so a file picked up again in the meantime is never removed from disk.
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=grace_period)
+    removed = 0
+    while True:
+        ids = db.session.execute(
+            select(StoredUpload.id)
+            .where(StoredUpload.refcount == 0, StoredUpload.released_at < cutoff)
+            .order_by(StoredUpload.released_at)
+            .limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+
+        filenames = db.session.execute(
+            delete(StoredUpload)
+            .where(StoredUpload.id.in_(ids), StoredUpload.refcount == 0)
+            .returning(StoredUpload.filename)
+        ).scalars().all()
+        db.session.commit()
+
+        for filename in filenames:
+            try:
+                remove_upload(upload_folder, filename)
+            except OSError as e:
+                # The row is gone; rebuild_manifest picks the file up again
+                current_app.logger.error(f'Error removing upload {filename}: {str(e)}')
+        removed += len(filenames)
+        if len(ids) < batch_size:
+            break
+    return removed
+
+
+def rebuild_manifest(upload_folder, batch_size=SWEEP_BATCH_SIZE):
+    """Rebuild stored_uploads from the uploads folder and the image columns.
+
+    A one-off for existing installs and for recovering from manual file
+    changes; it is the only operation that scans the folder.
+    """
+    references = Counter()
+    for model in REFERENCING_MODELS:
+        for filename, count in db.session.query(model.image, func.count(model.id)).filter(
+            model.image.isnot(None)
+        ).group_by(model.image):
+            references[filename] += count
+
+    now = datetime.utcnow()
+    rows = {}
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name.startswith('.') or entry.name.endswith('.tmp'):
+                continue
+            stat = entry.stat()
+            rows[entry.name] = {'filename': entry.name, 'size': stat.st_size,
+                                'created_at': datetime.utcfromtimestamp(stat.st_mtime)}
+    for filename in references:
+        rows.setdefault(filename, {'filename': filename, 'size': None, 'created_at': now})
+    for row in rows.values():
+        row['refcount'] = references.get(row['filename'], 0)
+        row['released_at'] = None if row['refcount'] else now
+
+    db.session.execute(delete(StoredUpload))
+    values = list(rows.values())
+    for start in range(0, len(values), batch_size):
+        db.session.execute(insert(StoredUpload), values[start:start + batch_size])
+    db.session.commit()
+    return len(values), sum(1 for row in values if not row['refcount'])
+
+
+def _sweep(app):
+    removed = sweep_unreferenced(app.config['UPLOAD_FOLDER'],
+                                 grace_period=app.config.get('UPLOAD_GRACE_PERIOD', GRACE_PERIOD))
+    if removed:
+        app.logger.info(f'Removed {removed} unreferenced uploads')
+
+
+def start_upload_sweeper(app):
+    """Start the sweeper thread once per process."""
+    start_periodic_job(app, 'upload-sweeper', app.config.get('UPLOAD_SWEEP_INTERVAL', SWEEP_INTERVAL), _sweep,
+                       'Upload sweep')
@@ -0,0 +1,109 @@
+"""Identity cache behind Flask-Login's user loader.
+
+Authenticated requests only need a user's id, role and a few display
+fields, so ``load_user`` serves them from a process-wide TTL cache instead
+of querying ``users`` on every request. Each request gets its own
+``CachedUser``, a slotted object holding those fields. Any other attribute,
+such as a relationship, loads the full ``User`` row once for that request.
+
+Entries are dropped when a ``User`` change commits. Other worker processes
+see the change once their entry expires, after at most ``USER_CACHE_TTL``
+seconds.
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from extensions import db
+from cache import TTLCache
+from models import User
+
+USER_CACHE_TTL = 60
+USER_CACHE_SIZE = 10000
+
+# Columns copied into the cache; everything else comes from the ORM row
+IDENTITY_FIELDS = ('id', 'username', 'email', 'role', 'location', 'latitude', 'longitude', 'farm_size')
+
+user_cache = TTLCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+class CachedUser:
+    """Request-scoped stand-in for ``User`` that satisfies Flask-Login."""
+
+    __slots__ = IDENTITY_FIELDS + ('_user',)
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, fields):
+        for name, value in zip(IDENTITY_FIELDS, fields):
+            setattr(self, name, value)
+        self._user = None
+
+    def get_id(self):
+        return str(self.id)
+
+    @property
+    def user(self):
+        """The full ORM row, loaded on first use within the request."""
+        if self._user is None:
+            self._user = db.session.get(User, self.id)
+        return self._user
+
+    def __getattr__(self, name):
+        # Only reached for names that are not slots, e.g. relationships or methods
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def __eq__(self, other):
+        if isinstance(other, (CachedUser, User)):
+            return self.id == other.id
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f'<CachedUser {self.id} {self.role}>'
+
+
+def _identity(user_id):
+    row = db.session.query(*(getattr(User, name) for name in IDENTITY_FIELDS)).filter(User.id == user_id).first()
+    return tuple(row) if row else None
+
+
+def load_cached_user(user_id):
+    """Return a CachedUser for `user_id`, or None when the user does not exist."""
+    fields = user_cache.get(user_id)
+    if fields is None:
+        fields = _identity(user_id)
+        if fields is None:
+            return None
+        user_cache.set(user_id, fields)
+    return CachedUser(fields)
+
+
+def cache_user(user):
+    """Prime the cache from a loaded User, e.g. right after login."""
+    user_cache.set(user.id, tuple(getattr(user, name) for name in IDENTITY_FIELDS))
+
+
+def invalidate_user(user_id):
+    user_cache.invalidate(user_id)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _queue_invalidation(mapper, connection, target):
+    Session.object_session(target).info.setdefault('invalidated_users', set()).add(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    for user_id in session.info.pop('invalidated_users', ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidations(session):
+    session.info.pop('invalidated_users', None)